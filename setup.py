@@ -69,19 +69,30 @@ def create_ext_modules(src_dir):
                                       'screen.c']},
                 'bitmap' : {'files' : ['autopy-bitmap-module.c',
                                        'py-convenience.c', 'py-bitmap-class.c',
+                                       'py-needle-class.c',
                                        'MMBitmap.c',
-                                       'io.c', 'bmp_io.c',
-                                       'png_io.c', 'str_io.c', 'snprintf.c',
+                                       'io.c', 'bmp_io.c', 'file_map.c',
+                                       'pack_io.c',
+                                       'png_io.c', 'str_io.c', 'bytes_io.c',
+                                       'snprintf.c',
                                        'screengrab.c', 'screen.c',
                                        'pasteboard.c', 'color_find.c',
-                                       'bitmap_find.c', 'UTHashTable.c',
+                                       'bitmap_find.c', 'bitmap_diff.c',
+                                       'find_cache.c', 'UTHashTable.c',
                                        'MMPointArray.c', 'zlib_util.c',
-                                       'base64.c',
+                                       'base64.c', 'MMThread.c',
+                                       'screenstream.c',
+                                       'py-screen-stream-class.c',
+                                       'capturesession.c',
+                                       'py-capture-session-class.c',
+                                       'py-points.c',
+                                       'py-point-array-class.c',
                                        ],
                             'libraries' : ['png', 'z']},
                 'color' : {'files' : ['autopy-color-module.c', 'MMBitmap.c']},
                 'screen' : {'files' : ['autopy-screen-module.c', 'screen.c',
-                                       'screengrab.c', 'MMBitmap.c']},
+                                       'screengrab.c', 'MMBitmap.c',
+                                       'py-convenience.c', 'py-points.c']},
                 'key' : {'files' : ['autopy-key-module.c', 'keypress.c',
                                     'keycode.c', 'deadbeef_rand.c',
                                     'py-convenience.c']},
@@ -143,6 +154,10 @@ def create_ext_modules(src_dir):
             modules[module].setdefault('libraries', []).append('X11')
         for module in 'mouse', 'key':
             modules[module].setdefault('libraries', []).append('Xtst')
+        for module in 'screen', 'bitmap':
+            modules[module]['libraries'].extend(['Xext', # For MIT-SHM
+                                                 'pthread'])
+        modules['bitmap']['libraries'].extend(['Xdamage', 'Xfixes'])
 
         for dir in '/usr/X11/lib', '/usr/X1186/lib':
             if os.path.exists(dir):
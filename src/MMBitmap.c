@@ -1,11 +1,12 @@
 #include "MMBitmap.h"
 #include <assert.h>
+#include <stdlib.h>
 #include <string.h>
 
 MMBitmapRef createMMBitmap(uint8_t *buffer,
                            size_t width,
                            size_t height,
-                           size_t bytewidth,
+                           ptrdiff_t bytewidth,
                            uint8_t bitsPerPixel,
                            uint8_t bytesPerPixel)
 {
@@ -18,6 +19,8 @@ MMBitmapRef createMMBitmap(uint8_t *buffer,
 	bitmap->bytewidth = bytewidth;
 	bitmap->bitsPerPixel = bitsPerPixel;
 	bitmap->bytesPerPixel = bytesPerPixel;
+	bitmap->releaseBuffer = NULL;
+	bitmap->releaseInfo = NULL;
 
 	return bitmap;
 }
@@ -26,7 +29,10 @@ void destroyMMBitmap(MMBitmapRef bitmap)
 {
 	assert(bitmap != NULL);
 
-	if (bitmap->imageBuffer != NULL) {
+	if (bitmap->releaseBuffer != NULL) {
+		bitmap->releaseBuffer(bitmap->imageBuffer, bitmap->releaseInfo);
+		bitmap->imageBuffer = NULL;
+	} else if (bitmap->imageBuffer != NULL) {
 		free(bitmap->imageBuffer);
 		bitmap->imageBuffer = NULL;
 	}
@@ -34,25 +40,52 @@ void destroyMMBitmap(MMBitmapRef bitmap)
 	free(bitmap);
 }
 
-MMBitmapRef copyMMBitmap(MMBitmapRef bitmap)
+/* Returns a copy of the pixels of |source| inside |rect| (which must be in
+ * bounds) as a new bitmap, with its rows stored top-down, or NULL on error.
+ *
+ * The rows are copied one at a time, as the source may be a view into another
+ * bitmap or be stored bottom-up. */
+static MMBitmapRef copyMMBitmapRect(MMBitmapRef source, MMRect rect)
 {
-	uint8_t *copiedBuf = NULL;
+	const size_t rowLength = rect.size.width * source->bytesPerPixel;
+	const size_t bytewidth = ADD_PADDING(rowLength);
+	const size_t bufsize = rect.size.height * bytewidth;
+	uint8_t *copiedBuf;
+	MMBitmapRef bitmap;
+	size_t y;
+
+	copiedBuf = malloc(bufsize == 0 ? 1 : bufsize);
+	if (copiedBuf == NULL) return NULL;
+
+	for (y = 0; rowLength > 0 && y < rect.size.height; ++y) {
+		memcpy(copiedBuf + (y * bytewidth),
+		       MMRGBColorRefAtPoint(source, rect.origin.x, rect.origin.y + y),
+		       rowLength);
+	}
 
-	assert(bitmap != NULL);
-	if (bitmap->imageBuffer != NULL) {
-		const size_t bufsize = bitmap->height * bitmap->bytewidth;
-		copiedBuf = malloc(bufsize);
-		if (copiedBuf == NULL) return NULL;
+	bitmap = createMMBitmap(copiedBuf,
+	                        rect.size.width,
+	                        rect.size.height,
+	                        (ptrdiff_t)bytewidth,
+	                        source->bitsPerPixel,
+	                        source->bytesPerPixel);
+	if (bitmap == NULL) free(copiedBuf);
+	return bitmap;
+}
 
-		memcpy(copiedBuf, bitmap->imageBuffer, bufsize);
+MMBitmapRef copyMMBitmap(MMBitmapRef bitmap)
+{
+	assert(bitmap != NULL);
+	if (bitmap->imageBuffer == NULL) {
+		return createMMBitmap(NULL,
+		                      bitmap->width,
+		                      bitmap->height,
+		                      bitmap->bytewidth,
+		                      bitmap->bitsPerPixel,
+		                      bitmap->bytesPerPixel);
 	}
 
-	return createMMBitmap(copiedBuf,
-	                      bitmap->width,
-	                      bitmap->height,
-	                      bitmap->bytewidth,
-	                      bitmap->bitsPerPixel,
-	                      bitmap->bytesPerPixel);
+	return copyMMBitmapRect(bitmap, MMBitmapGetBounds(bitmap));
 }
 
 MMBitmapRef copyMMBitmapFromPortion(MMBitmapRef source, MMRect rect)
@@ -61,25 +94,7 @@ MMBitmapRef copyMMBitmapFromPortion(MMBitmapRef source, MMRect rect)
 
 	if (source->imageBuffer == NULL || !MMBitmapRectInBounds(source, rect)) {
 		return NULL;
-	} else {
-		uint8_t *copiedBuf = NULL;
-		const size_t bufsize = rect.size.height * source->bytewidth;
-		const size_t offset = (source->bytewidth * rect.origin.y) +
-		                      (rect.origin.x * source->bytesPerPixel);
-
-		/* Don't go over the bounds, programmer! */
-		assert((bufsize + offset) <= (source->bytewidth * source->height));
-
-		copiedBuf = malloc(bufsize);
-		if (copiedBuf == NULL) return NULL;
-
-		memcpy(copiedBuf, source->imageBuffer + offset, bufsize);
-
-		return createMMBitmap(copiedBuf,
-		                      rect.size.width,
-		                      rect.size.height,
-		                      source->bytewidth,
-		                      source->bitsPerPixel,
-		                      source->bytesPerPixel);
 	}
+
+	return copyMMBitmapRect(source, rect);
 }
@@ -12,14 +12,25 @@
 	#include <stdint.h>
 #endif
 
+/* Function called by destroyMMBitmap() to release an image buffer that was
+ * not allocated with malloc() (or is not owned by the bitmap), along with the
+ * |releaseInfo| of the bitmap. */
+typedef void (*MMBitmapReleaseFunc)(uint8_t *buffer, void *releaseInfo);
+
 struct _MMBitmap {
 	uint8_t *imageBuffer;  /* Pixels stored in Quad I format; i.e., origin is in
-	                        * top left. Length should be height * bytewidth. */
+	                        * top left. Points to the first pixel of the top
+	                        * row, which is followed by the others |bytewidth|
+	                        * bytes apart. */
 	size_t width;          /* Never 0, unless image is NULL. */
 	size_t height;         /* Never 0, unless image is NULL. */
-	size_t bytewidth;      /* The aligned width (width + padding). */
+	ptrdiff_t bytewidth;   /* The aligned width (width + padding). This is
+	                        * negative if the rows are stored bottom-up in
+	                        * memory, as in a mapped BMP file. */
 	uint8_t bitsPerPixel;  /* Should be either 24 or 32. */
 	uint8_t bytesPerPixel; /* For convenience; should be bitsPerPixel / 8. */
+	MMBitmapReleaseFunc releaseBuffer; /* If NULL, buffer is free()'d. */
+	void *releaseInfo;     /* Passed on to |releaseBuffer|. */
 };
 
 typedef struct _MMBitmap MMBitmap;
@@ -28,9 +39,18 @@ typedef MMBitmap *MMBitmapRef;
 /* Creates new MMBitmap with the given values.
  * Follows the Create Rule (caller is responsible for destroy()'ing object). */
 MMBitmapRef createMMBitmap(uint8_t *buffer, size_t width, size_t height,
-                           size_t bytewidth, uint8_t bitsPerPixel,
+                           ptrdiff_t bytewidth, uint8_t bitsPerPixel,
 						   uint8_t bytesPerPixel);
 
+/* Sets the function used to release the image buffer of |bitmap| when it is
+ * destroyed, in place of free(). This allows a bitmap to refer to pixels it
+ * does not own (e.g., a recycled buffer or another object's memory). */
+#define MMBitmapSetReleaseFunc(bitmap, func, info) \
+do {                                               \
+  (bitmap)->releaseBuffer = (func);                \
+  (bitmap)->releaseInfo = (info);                  \
+} while (0)
+
 /* Releases memory occupied by MMBitmap. */
 void destroyMMBitmap(MMBitmapRef bitmap);
 
@@ -52,9 +72,10 @@ MMBitmapRef copyMMBitmapFromPortion(MMBitmapRef source, MMRect rect);
 /* Get pointer to pixel of MMBitmapRef. No bounds checking is performed (check
  * yourself before calling this with MMBitmapPointInBounds(). */
 #define MMRGBColorRefAtPoint(image, x, y) \
-	(MMRGBColor *)(assert(MMBitmapPointInBounds(bitmap, MMPointMake(x, y))), \
-	               ((image)->imageBuffer) + (((image)->bytewidth * (y)) \
-	                                      + ((x) * (image)->bytesPerPixel)))
+	(MMRGBColor *)(assert(MMBitmapPointInBounds(image, MMPointMake(x, y))), \
+	               ((image)->imageBuffer) + \
+	               ((image)->bytewidth * (ptrdiff_t)(y)) + \
+	               ((ptrdiff_t)(x) * (image)->bytesPerPixel))
 
 /* Dereference pixel of MMBitmapRef. Again, no bounds checking is performed. */
 #define MMRGBColorAtPoint(image, x, y) *MMRGBColorRefAtPoint(image, x, y)
@@ -39,3 +39,15 @@ void MMPointArrayAppendPoint(MMPointArrayRef pointArray, MMPoint point)
 
 	pointArray->array[pointArray->count - 1] = point;
 }
+
+void MMPointArrayTrim(MMPointArrayRef pointArray)
+{
+	const size_t count = pointArray->count == 0 ? 1 : pointArray->count;
+	if (pointArray->_allocedCount > count) {
+		MMPoint *array = realloc(pointArray->array, sizeof(MMPoint) * count);
+		if (array != NULL) {
+			pointArray->array = array;
+			pointArray->_allocedCount = count;
+		}
+	}
+}
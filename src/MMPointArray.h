@@ -24,6 +24,9 @@ void destroyMMPointArray(MMPointArrayRef pointArray);
 /* Appends a point to an array, increasing the internal size if necessary. */
 void MMPointArrayAppendPoint(MMPointArrayRef pointArray, MMPoint point);
 
+/* Frees any memory allocated beyond the points currently in the array. */
+void MMPointArrayTrim(MMPointArrayRef pointArray);
+
 /* Retrieve point from array. */
 #define MMPointArrayGetItem(a, i) ((a)->array)[i]
 
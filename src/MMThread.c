@@ -0,0 +1,187 @@
+#include "MMThread.h"
+#include <stdlib.h>
+
+#if !defined(IS_WINDOWS)
+	#include <unistd.h> /* For sysconf() */
+	#include <time.h> /* For clock_gettime() */
+#endif
+
+/* Function and argument passed on to the platform's thread entry point. */
+struct threadStart {
+	MMThreadFunc func;
+	void *arg;
+};
+
+#if defined(IS_WINDOWS)
+static DWORD WINAPI threadEntry(LPVOID param)
+#else
+static void *threadEntry(void *param)
+#endif
+{
+	struct threadStart start = *(struct threadStart *)param;
+	free(param);
+
+	start.func(start.arg);
+
+#if defined(IS_WINDOWS)
+	return 0;
+#else
+	return NULL;
+#endif
+}
+
+int MMThreadCreate(MMThread *thread, MMThreadFunc func, void *arg)
+{
+	struct threadStart *start = malloc(sizeof(struct threadStart));
+	if (start == NULL) return -1;
+
+	start->func = func;
+	start->arg = arg;
+
+#if defined(IS_WINDOWS)
+	*thread = CreateThread(NULL, 0, &threadEntry, start, 0, NULL);
+	if (*thread == NULL) {
+		free(start);
+		return -1;
+	}
+#else
+	if (pthread_create(thread, NULL, &threadEntry, start) != 0) {
+		free(start);
+		return -1;
+	}
+#endif
+
+	return 0;
+}
+
+void MMThreadJoin(MMThread thread)
+{
+#if defined(IS_WINDOWS)
+	WaitForSingleObject(thread, INFINITE);
+	CloseHandle(thread);
+#else
+	pthread_join(thread, NULL);
+#endif
+}
+
+size_t MMProcessorCount(void)
+{
+#if defined(IS_WINDOWS)
+	SYSTEM_INFO info;
+	GetSystemInfo(&info);
+	return info.dwNumberOfProcessors > 0 ? (size_t)info.dwNumberOfProcessors : 1;
+#else
+	const long count = sysconf(_SC_NPROCESSORS_ONLN);
+	return count > 0 ? (size_t)count : 1;
+#endif
+}
+
+void MMMutexInit(MMMutex *mutex)
+{
+#if defined(IS_WINDOWS)
+	InitializeCriticalSection(mutex);
+#else
+	pthread_mutex_init(mutex, NULL);
+#endif
+}
+
+void MMMutexDestroy(MMMutex *mutex)
+{
+#if defined(IS_WINDOWS)
+	DeleteCriticalSection(mutex);
+#else
+	pthread_mutex_destroy(mutex);
+#endif
+}
+
+void MMMutexLock(MMMutex *mutex)
+{
+#if defined(IS_WINDOWS)
+	EnterCriticalSection(mutex);
+#else
+	pthread_mutex_lock(mutex);
+#endif
+}
+
+void MMMutexUnlock(MMMutex *mutex)
+{
+#if defined(IS_WINDOWS)
+	LeaveCriticalSection(mutex);
+#else
+	pthread_mutex_unlock(mutex);
+#endif
+}
+
+void MMCondInit(MMCond *cond)
+{
+#if defined(IS_WINDOWS)
+	InitializeConditionVariable(cond);
+#else
+	pthread_cond_init(cond, NULL);
+#endif
+}
+
+void MMCondDestroy(MMCond *cond)
+{
+#if !defined(IS_WINDOWS) /* Windows condition variables need no cleanup. */
+	pthread_cond_destroy(cond);
+#endif
+}
+
+void MMCondSignal(MMCond *cond)
+{
+#if defined(IS_WINDOWS)
+	WakeConditionVariable(cond);
+#else
+	pthread_cond_signal(cond);
+#endif
+}
+
+void MMCondBroadcast(MMCond *cond)
+{
+#if defined(IS_WINDOWS)
+	WakeAllConditionVariable(cond);
+#else
+	pthread_cond_broadcast(cond);
+#endif
+}
+
+void MMCondWait(MMCond *cond, MMMutex *mutex)
+{
+#if defined(IS_WINDOWS)
+	SleepConditionVariableCS(cond, mutex, INFINITE);
+#else
+	pthread_cond_wait(cond, mutex);
+#endif
+}
+
+void MMCondTimedWait(MMCond *cond, MMMutex *mutex, unsigned long milliseconds)
+{
+#if defined(IS_WINDOWS)
+	SleepConditionVariableCS(cond, mutex, (DWORD)milliseconds);
+#else
+	/* pthread_cond_timedwait() takes an absolute time on the realtime
+	 * clock. */
+	struct timespec deadline;
+	clock_gettime(CLOCK_REALTIME, &deadline);
+	deadline.tv_sec += (time_t)(milliseconds / 1000);
+	deadline.tv_nsec += (long)(milliseconds % 1000) * 1000000L;
+	if (deadline.tv_nsec >= 1000000000L) {
+		deadline.tv_nsec -= 1000000000L;
+		++deadline.tv_sec;
+	}
+
+	pthread_cond_timedwait(cond, mutex, &deadline);
+#endif
+}
+
+uint64_t MMMonotonicMilliseconds(void)
+{
+#if defined(IS_WINDOWS)
+	return (uint64_t)GetTickCount64();
+#else
+	struct timespec now;
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	return ((uint64_t)now.tv_sec * 1000) + ((uint64_t)now.tv_nsec / 1000000);
+#endif
+}
@@ -0,0 +1,63 @@
+#pragma once
+#ifndef MMTHREAD_H
+#define MMTHREAD_H
+
+#include "os.h"
+#include <stddef.h>
+
+#if defined(_MSC_VER)
+	#include "ms_stdint.h"
+#else
+	#include <stdint.h>
+#endif
+
+#if defined(IS_WINDOWS)
+	typedef HANDLE MMThread;
+	typedef CRITICAL_SECTION MMMutex;
+	typedef CONDITION_VARIABLE MMCond;
+#else
+	#include <pthread.h>
+	typedef pthread_t MMThread;
+	typedef pthread_mutex_t MMMutex;
+	typedef pthread_cond_t MMCond;
+#endif
+
+/* Function run on a new thread by MMThreadCreate(). */
+typedef void (*MMThreadFunc)(void *arg);
+
+/* Starts running |func| with |arg| on a new native thread, and sets |thread|
+ * to refer to it. Returns 0 on success, or -1 if the thread could not be
+ * created. Every thread created must be waited on with MMThreadJoin(). */
+int MMThreadCreate(MMThread *thread, MMThreadFunc func, void *arg);
+
+/* Waits for |thread| to finish and releases its resources. */
+void MMThreadJoin(MMThread thread);
+
+/* Returns the number of processors currently online (at least 1). */
+size_t MMProcessorCount(void);
+
+/* Mutexes and condition variables, initialized with MMMutexInit() and
+ * MMCondInit() and destroyed with MMMutexDestroy() and MMCondDestroy(). */
+void MMMutexInit(MMMutex *mutex);
+void MMMutexDestroy(MMMutex *mutex);
+void MMMutexLock(MMMutex *mutex);
+void MMMutexUnlock(MMMutex *mutex);
+
+void MMCondInit(MMCond *cond);
+void MMCondDestroy(MMCond *cond);
+void MMCondSignal(MMCond *cond);
+void MMCondBroadcast(MMCond *cond);
+
+/* Atomically unlocks |mutex| and waits for |cond| to be signaled, locking
+ * |mutex| again before returning. As with any condition variable, the wait
+ * may end spuriously, so the condition waited for should be checked again. */
+void MMCondWait(MMCond *cond, MMMutex *mutex);
+
+/* Identical to MMCondWait(), but gives up after |milliseconds|. */
+void MMCondTimedWait(MMCond *cond, MMMutex *mutex, unsigned long milliseconds);
+
+/* Returns a monotonic clock reading in milliseconds, for measuring intervals
+ * (its starting point is unspecified). */
+uint64_t MMMonotonicMilliseconds(void);
+
+#endif /* MMTHREAD_H */
@@ -1,8 +1,13 @@
 #include "autopy-bitmap-module.h"
 #include "py-bitmap-class.h"
+#include "py-needle-class.h"
+#include "py-point-array-class.h"
+#include "py-screen-stream-class.h"
+#include "py-capture-session-class.h"
 #include "screen.h"
 #include "screengrab.h"
 #include "py-convenience.h"
+#include "pack_io.h"
 
 /* Syntax: capture_screen(rect=None) => Bitmap object */
 /* Arguments: |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints */
@@ -12,11 +17,110 @@
            |OSError| if the screengrab was unsuccessful. */
 static PyObject *bitmap_capture_screen(PyObject *self, PyObject *args);
 
+/* Syntax: compile_needle(bmp, pyramid=False) => CompiledNeedle object */
+/* Arguments: |bmp| => Bitmap object,
+              |pyramid| => Boolean */
+/* Description: Returns |bmp| with the tables used to search for it computed
+                ahead of time. The result can be passed as the needle to any
+                of the find_* methods of Bitmap (and to count_of_bitmap()),
+                which will then skip computing them on every call; use this
+                when searching for the same bitmap many times.
+
+                If |pyramid| is True, copies of |bmp| downsampled 2x and 4x
+                are computed as well, and searches with a nonzero tolerance
+                compare those against the haystack (downsampled likewise)
+                before comparing every pixel. The matches found are the
+                same, but fuzzy searches for large needles (say, 100x100 or
+                more) in large haystacks are many times faster. Needles
+                smaller than 5x5 are too small for it. */
+/* Raises: |ValueError| if |bmp| has no image data. */
+static PyObject *bitmap_compile_needle(PyObject *self, PyObject *args,
+                                       PyObject *kwds);
+
+/* Syntax: save_pack(filepath, sprites) */
+/* Arguments: |filepath| => string,
+              |sprites| => dict mapping names (strings) to Bitmap or
+                           CompiledNeedle objects */
+/* Description: Saves the given bitmaps to a single sprite pack file at the
+                given absolute filepath, to be loaded with `load_pack()`,
+                along with the tables used to search for them (computing
+                them for any that are not already CompiledNeedles). Note that
+                if the file already exists, it WILL be overwritten.
+
+                The pixels are stored uncompressed in one format (32 bits per
+                pixel), so that they can be used in place when the file is
+                loaded. */
+/* Raises: |TypeError| if a name is not a string or a sprite is not a Bitmap
+           or CompiledNeedle,
+           |ValueError| if a sprite has no image data,
+           |IOError| if the file could not be written. */
+static PyObject *bitmap_save_pack(PyObject *self, PyObject *args);
+
+/* Syntax: load_pack(filepath) => dict {name: CompiledNeedle, ...} */
+/* Arguments: |filepath| => string */
+/* Description: Loads the sprite pack at the given absolute filepath, as
+                written by `save_pack()`, returning a dict mapping the name of
+                each sprite to a CompiledNeedle for it.
+
+                The file is mapped into memory rather than read, and the
+                search tables are taken from it rather than computed, so this
+                is much faster than opening and compiling each image in turn;
+                processes loading the same pack also share the memory holding
+                its pixels. The file must not be modified while any of its
+                sprites are in use. */
+/* Raises: |IOError| if the pack could not be loaded, or if the search tables
+           of a sprite do not match its pixels,
+           |ValueError| if a name in it is not valid UTF-8. */
+static PyObject *bitmap_load_pack(PyObject *self, PyObject *args);
+
+/* Syntax: set_find_cache(size) */
+/* Arguments: |size| => integer */
+/* Description: Turns on caching of the results of Bitmap.find_color() and
+                Bitmap.find_bitmap(), keeping those of the |size| most
+                recently used searches, or turns it off if |size| is 0 (the
+                default). Any results already cached are dropped, and the
+                counters of find_cache_info() reset.
+
+                Searches are looked up by a hash of the pixels in the rect
+                being searched, together with the needle's pixels (or the
+                color) and the tolerance, so a search of pixels that haven't
+                changed since it was last done (e.g., in a new screengrab of
+                an idle display) costs only the time to hash them. */
+/* Raises: |ValueError| if |size| is negative. */
+static PyObject *bitmap_set_find_cache(PyObject *self, PyObject *args);
+
+/* Syntax: find_cache_info() => dict */
+/* Description: Returns a dict of the number of searches found in the find
+                cache ("hits") and not ("misses"), and the number of results
+                it holds ("size") and may hold ("max_size", 0 if caching is
+                off). */
+static PyObject *bitmap_find_cache_info(PyObject *self, PyObject *args);
+
 static PyMethodDef BitmapMethods[] = {
-	{"capture_screen", bitmap_capture_screen, METH_NOARGS | METH_O,
+	{"capture_screen", bitmap_capture_screen, METH_VARARGS,
 	 "capture_screen(rect=None) -> Bitmap object\n"
 	 "Returns a screengrab of the given portion of the main display,\n"
 	 "or the entire display if rect is None."},
+	{"compile_needle", (PyCFunction)bitmap_compile_needle,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "compile_needle(bmp, pyramid=False) -> CompiledNeedle object\n"
+	 "Returns bmp with its search tables computed ahead of time, for\n"
+	 "passing as the needle to the find_* methods of Bitmap.\n"
+	 "If pyramid is True, downsampled copies are computed as well, which\n"
+	 "speed up searches for large needles with a nonzero tolerance."},
+	{"save_pack", bitmap_save_pack, METH_VARARGS,
+	 "save_pack(filepath, sprites) -> None\n"
+	 "Saves the dict of named bitmaps in sprites to a single sprite pack file."},
+	{"load_pack", bitmap_load_pack, METH_VARARGS,
+	 "load_pack(filepath) -> dict {name: CompiledNeedle, ...}\n"
+	 "Loads the sprite pack at the given absolute filepath."},
+	{"set_find_cache", bitmap_set_find_cache, METH_VARARGS,
+	 "set_find_cache(size) -> None\n"
+	 "Caches the results of up to size find_color() and find_bitmap()\n"
+	 "searches, keyed by the pixels searched (0 turns caching off)."},
+	{"find_cache_info", bitmap_find_cache_info, METH_NOARGS,
+	 "find_cache_info() -> dict\n"
+	 "Returns the hits, misses, size and max_size of the find cache."},
 	{NULL, NULL, 0, NULL} /* Sentinel */
 };
 
@@ -44,7 +148,11 @@ PyMODINIT_FUNC initbitmap(void)
 #endif
 
 	/* Instantiate new "Bitmap" class so that it is available in the module. */
-	if (Py_AddClassToModule(mod, &Bitmap_Type) < 0) {
+	if (Py_AddClassToModule(mod, &Bitmap_Type) < 0 ||
+	    Py_AddClassToModule(mod, &Needle_Type) < 0 ||
+	    Py_AddClassToModule(mod, &PointArray_Type) < 0 ||
+	    Py_AddClassToModule(mod, &ScreenStream_Type) < 0 ||
+	    Py_AddClassToModule(mod, &CaptureSession_Type) < 0) {
 #ifdef PYTHREE
 		return NULL; /* Error */
 #else
@@ -60,30 +168,15 @@ PyMODINIT_FUNC initbitmap(void)
 PyMODINIT_FUNC PyInit_bitmap(void) { return initbitmap(); }
 #endif
 
-static PyObject *bitmap_capture_screen(PyObject *self, PyObject *arg)
+static PyObject *bitmap_capture_screen(PyObject *self, PyObject *args)
 {
+	PyObject *rectObj = NULL;
 	MMRect rect;
 	MMBitmapRef bitmap = NULL;
-	MMSize displaySize = getMainDisplaySize();
-
-	if (arg == NULL || arg == Py_None) {
-		rect = MMRectMake(0, 0, displaySize.width, displaySize.height);
-	} else {
-		if (!PyArg_ParseTuple(arg, "(kk)(kk)", &rect.origin.x,
-		                                       &rect.origin.y,
-		                                       &rect.size.width,
-		                                       &rect.size.height)) {
-			PyErr_SetString(PyExc_TypeError, "Argument is not a rect");
-			return NULL;
-		}
 
-		if (rect.origin.x >= displaySize.width ||
-		    rect.origin.y >= displaySize.height ||
-		    rect.origin.x + rect.size.width > displaySize.width ||
-		    rect.origin.y + rect.size.height > displaySize.height) {
-			PyErr_SetString(PyExc_ValueError, "Rect out of bounds");
-			return NULL;
-		}
+	if (!PyArg_ParseTuple(args, "|O", &rectObj) ||
+	    !displayRectFromObject(rectObj, &rect)) {
+		return NULL;
 	}
 
 	bitmap = copyMMBitmapFromDisplayInRect(rect);
@@ -95,3 +188,269 @@ static PyObject *bitmap_capture_screen(PyObject *self, PyObject *arg)
 
 	return BitmapObject_FromMMBitmap(bitmap);
 }
+
+static PyObject *bitmap_compile_needle(PyObject *self, PyObject *args,
+                                       PyObject *kwds)
+{
+	static char *kwlist[] = {"bmp", "pyramid", NULL};
+	BitmapObject *bitmap;
+	int pyramid = 0;
+	PyObject *needleObj;
+	int ret;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!|i", kwlist,
+	                                 &Bitmap_Type, &bitmap, &pyramid) ||
+	    (needleObj = NeedleObject_FromBitmapObject(bitmap)) == NULL) {
+		return NULL;
+	}
+
+	if (pyramid) {
+		Py_BEGIN_ALLOW_THREADS
+		ret = MMNeedleAddPyramid(((NeedleObject *)needleObj)->needle);
+		Py_END_ALLOW_THREADS
+		if (ret != 0) {
+			Py_DECREF(needleObj);
+			return PyErr_NoMemory();
+		}
+	}
+
+	return needleObj;
+}
+
+static PyObject *bitmap_save_pack(PyObject *self, PyObject *args)
+{
+	char *path;
+	PyObject *sprites;
+	PyObject *items;
+	PyObject *needleObjs = NULL;
+	MMNeedleRef *needles = NULL;
+	const char **names = NULL;
+	size_t *nameLengths = NULL;
+	Py_ssize_t count, i;
+	PyObject *result = NULL;
+
+	int ret;
+	MMSpritePackError err;
+
+	if (!PyArg_ParseTuple(args, "sO!", &path, &PyDict_Type, &sprites) ||
+	    (items = PyDict_Items(sprites)) == NULL) {
+		return NULL;
+	}
+
+	count = PyList_GET_SIZE(items);
+	if ((needleObjs = PyList_New(count)) == NULL) goto cleanup;
+	needles = PyMem_New(MMNeedleRef, count == 0 ? 1 : count);
+	names = PyMem_New(const char *, count == 0 ? 1 : count);
+	nameLengths = PyMem_New(size_t, count == 0 ? 1 : count);
+	if (needles == NULL || names == NULL || nameLengths == NULL) {
+		PyErr_NoMemory();
+		goto cleanup;
+	}
+
+	/* Compile each sprite that isn't already a needle; the needles are kept
+	 * in |needleObjs| (and their names in |items|) until the pack is saved. */
+	for (i = 0; i < count; ++i) {
+		PyObject *item = PyList_GET_ITEM(items, i);
+		PyObject *name = PyTuple_GET_ITEM(item, 0);
+		PyObject *sprite = PyTuple_GET_ITEM(item, 1);
+		Py_ssize_t nameLength;
+		PyObject *needleObj;
+
+		if (!PyUnicode_Check(name)) {
+			Py_SetConvertErr("string", name);
+			goto cleanup;
+		}
+		names[i] = PyUnicode_AsUTF8AndSize(name, &nameLength);
+		if (names[i] == NULL) goto cleanup;
+		nameLengths[i] = (size_t)nameLength;
+
+		if (PyObject_TypeCheck(sprite, &Needle_Type)) {
+			Py_INCREF(sprite);
+			needleObj = sprite;
+		} else if (PyObject_TypeCheck(sprite, &Bitmap_Type)) {
+			needleObj = NeedleObject_FromBitmapObject((BitmapObject *)sprite);
+			if (needleObj == NULL) goto cleanup;
+		} else {
+			Py_SetConvertErr("Bitmap or CompiledNeedle", sprite);
+			goto cleanup;
+		}
+
+		PyList_SET_ITEM(needleObjs, i, needleObj);
+		needles[i] = ((NeedleObject *)needleObj)->needle;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	ret = saveMMSpritePack(path, needles, names, nameLengths, (size_t)count,
+	                       &err);
+	Py_END_ALLOW_THREADS
+
+	if (ret != 0) {
+		PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
+		                      "Could not save sprite pack: %s",
+		                      MMSpritePackErrorString(err));
+		goto cleanup;
+	}
+
+	Py_INCREF(Py_None);
+	result = Py_None;
+
+cleanup:
+	PyMem_Free(needles);
+	PyMem_Free(names);
+	PyMem_Free(nameLengths);
+	Py_XDECREF(needleObjs);
+	Py_DECREF(items);
+	return result;
+}
+
+/* Destructor of the capsule holding the MMSpritePack of load_pack(). */
+static void destroySpritePackCapsule(PyObject *capsule)
+{
+	destroyMMSpritePack(PyCapsule_GetPointer(capsule, NULL));
+}
+
+/* Release function for the bitmaps of a sprite pack; drops the reference
+ * to the capsule holding it, unmapping the pack after its last sprite. */
+static void releaseSpritePack(uint8_t *buffer, void *info)
+{
+	PyGILState_STATE state = PyGILState_Ensure();
+	Py_DECREF((PyObject *)info);
+	PyGILState_Release(state);
+}
+
+/* Returns a new CompiledNeedle for |sprite| of the pack held by |capsule|, or
+ * NULL and sets error on failure. */
+static PyObject *needleFromSprite(MMSprite *sprite, PyObject *capsule)
+{
+	MMBitmapRef bitmap;
+	PyObject *bitmapObj;
+	MMNeedleRef needle;
+	PyObject *needleObj;
+
+	bitmap = createMMBitmap(sprite->pixels, sprite->width, sprite->height,
+	                        (ptrdiff_t)(sprite->width * 4), 32, 4);
+	if (bitmap == NULL) return PyErr_NoMemory();
+	Py_INCREF(capsule);
+	MMBitmapSetReleaseFunc(bitmap, &releaseSpritePack, capsule);
+
+	if ((bitmapObj = BitmapObject_FromMMBitmap(bitmap)) == NULL) {
+		destroyMMBitmap(bitmap);
+		return NULL;
+	}
+
+	if ((needle = createMMNeedleWithTables(bitmap, &sprite->tables)) == NULL) {
+		if (MMNeedleTablesMatchBitmap(bitmap, &sprite->tables)) {
+			PyErr_NoMemory();
+		} else {
+			PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
+			                      "Could not load sprite pack: %s",
+			                      MMSpritePackErrorString(
+			                          kMMSpritePackInvalidDataError));
+		}
+		Py_DECREF(bitmapObj);
+		return NULL;
+	}
+
+	needleObj = NeedleObject_FromMMNeedle((BitmapObject *)bitmapObj, needle);
+	Py_DECREF(bitmapObj);
+	return needleObj;
+}
+
+static PyObject *bitmap_load_pack(PyObject *self, PyObject *args)
+{
+	char *path;
+	MMSpritePackRef pack;
+	MMSpritePackError err;
+	PyObject *capsule;
+	PyObject *result;
+	size_t i;
+
+	if (!PyArg_ParseTuple(args, "s", &path)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	pack = openMMSpritePack(path, &err);
+	Py_END_ALLOW_THREADS
+
+	if (pack == NULL) {
+		PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
+		                      "Could not load sprite pack: %s",
+		                      MMSpritePackErrorString(err));
+		return NULL;
+	}
+
+	/* Each sprite's bitmap holds a reference to the capsule, so the pack
+	 * stays mapped for as long as any of them are alive. */
+	if ((capsule = PyCapsule_New(pack, NULL,
+	                             &destroySpritePackCapsule)) == NULL) {
+		destroyMMSpritePack(pack);
+		return NULL;
+	}
+
+	if ((result = PyDict_New()) == NULL) {
+		Py_DECREF(capsule);
+		return NULL;
+	}
+
+	for (i = 0; i < pack->count; ++i) {
+		MMSprite *sprite = &pack->sprites[i];
+		PyObject *name;
+		PyObject *needleObj;
+		int ret;
+
+		name = PyUnicode_DecodeUTF8(sprite->name,
+		                            (Py_ssize_t)sprite->nameLength, NULL);
+		if (name == NULL) {
+			Py_DECREF(result);
+			result = NULL;
+			break;
+		}
+
+		if ((needleObj = needleFromSprite(sprite, capsule)) == NULL) {
+			Py_DECREF(name);
+			Py_DECREF(result);
+			result = NULL;
+			break;
+		}
+
+		ret = PyDict_SetItem(result, name, needleObj);
+		Py_DECREF(name);
+		Py_DECREF(needleObj);
+		if (ret != 0) {
+			Py_DECREF(result);
+			result = NULL;
+			break;
+		}
+	}
+
+	Py_DECREF(capsule);
+	return result;
+}
+
+static PyObject *bitmap_set_find_cache(PyObject *self, PyObject *args)
+{
+	Py_ssize_t size;
+	if (!PyArg_ParseTuple(args, "n", &size)) return NULL;
+
+	if (size < 0) {
+		PyErr_SetString(PyExc_ValueError, "Cache size must not be negative");
+		return NULL;
+	}
+
+	if (!Bitmap_SetFindCacheSize((size_t)size)) return NULL;
+	Py_RETURN_NONE;
+}
+
+static PyObject *bitmap_find_cache_info(PyObject *self, PyObject *args)
+{
+	MMFindCacheRef cache = Bitmap_GetFindCache();
+	if (cache == NULL) {
+		return Py_BuildValue("{s:k,s:k,s:k,s:k}", "hits", 0UL, "misses", 0UL,
+		                     "size", 0UL, "max_size", 0UL);
+	}
+
+	return Py_BuildValue("{s:k,s:k,s:k,s:k}",
+	                     "hits", (unsigned long)cache->hits,
+	                     "misses", (unsigned long)cache->misses,
+	                     "size", (unsigned long)cache->count,
+	                     "max_size", (unsigned long)cache->capacity);
+}
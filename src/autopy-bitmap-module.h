@@ -12,7 +12,8 @@
 /* Description: This module defines the class `Bitmap` for accessing
                 bitmaps and searching for bitmaps on-screen.
 
-                It also defines functions for taking screenshots of the screen. */
+                It also defines functions for taking screenshots of the screen,
+                and the class `ScreenStream` for taking them continuously. */
 PyMODINIT_FUNC initbitmap(void);
 
 #endif /* AUTOPY_BITMAP_MODULE_H */
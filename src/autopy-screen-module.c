@@ -1,6 +1,7 @@
 #include "autopy-screen-module.h"
 #include "screen.h"
 #include "screengrab.h"
+#include "py-points.h"
 
 /* Syntax: get_size() => tuple (width, height) */
 /* Description: Returns a tuple `(width, height)` of the size of the
@@ -30,6 +31,19 @@ static PyObject *screen_point_visible(PyObject *self, PyObject *args);
            |OSError| if the system calls were unsuccessful. */
 static PyObject *screen_get_color(PyObject *self, PyObject *args);
 
+/* Syntax: get_colors(points) => array('I') */
+/* Arguments: |points| => sequence of (|x|, |y|) tuples of ints, or buffer of
+                          ints holding x & y coordinates in pairs */
+/* Description: Returns an array of the hexadecimal values describing the RGB
+                color at each of the given points, in the same order.
+
+                The smallest rect containing all of the points is captured
+                from the screen once, rather than once per point as with
+                get_color(). */
+/* Raises: |ValueError| if any of the points are out of bounds,
+           |OSError| if the system calls were unsuccessful. */
+static PyObject *screen_get_colors(PyObject *self, PyObject *args);
+
 static PyMethodDef ScreenMethods[] = {
 	{"get_size", screen_get_size, METH_NOARGS,
 	 "get_size() -> tuple (width, height)\n"
@@ -40,6 +54,10 @@ static PyMethodDef ScreenMethods[] = {
 	{"get_color", screen_get_color, METH_VARARGS,
 	 "get_color(x, y) -> integer\n"
 	 "Returns hexadecimal value describing the RGB color at the given point."},
+	{"get_colors", screen_get_colors, METH_VARARGS,
+	 "get_colors(points) -> array('I')\n"
+	 "Returns array of hexadecimal values describing the RGB color at each of "
+	 "the given points."},
 	{NULL, NULL, 0, NULL} /* Sentinel */
 };
 
@@ -114,3 +132,57 @@ static PyObject *screen_get_color(PyObject *self, PyObject *args)
 	destroyMMBitmap(bitmap);
 	return Py_BuildValue("I", color);
 }
+
+static PyObject *screen_get_colors(PyObject *self, PyObject *args)
+{
+	PyObject *pointsObj;
+	MMPoint *points;
+	size_t count;
+	size_t i;
+
+	MMPoint minPoint, maxPoint;
+	MMBitmapRef bitmap;
+	PyObject *colors;
+
+	if (!PyArg_ParseTuple(args, "O", &pointsObj) ||
+	    (points = pointsFromObject(pointsObj, &count)) == NULL) {
+		return NULL;
+	}
+
+	if (count == 0) {
+		PyMem_Free(points);
+		return colorArrayFromPoints(NULL, NULL, 0, MMPointZero);
+	}
+
+	/* Find the bounding box of the points. */
+	minPoint = maxPoint = points[0];
+	for (i = 1; i < count; ++i) {
+		if (points[i].x < minPoint.x) minPoint.x = points[i].x;
+		if (points[i].y < minPoint.y) minPoint.y = points[i].y;
+		if (points[i].x > maxPoint.x) maxPoint.x = points[i].x;
+		if (points[i].y > maxPoint.y) maxPoint.y = points[i].y;
+	}
+
+	if (!pointVisibleOnMainDisplay(maxPoint)) {
+		PyMem_Free(points);
+		PyErr_SetString(PyExc_ValueError, "Point out of bounds");
+		return NULL;
+	}
+
+	bitmap = copyMMBitmapFromDisplayInRect(
+		MMRectMake(minPoint.x, minPoint.y,
+		           (maxPoint.x - minPoint.x) + 1,
+		           (maxPoint.y - minPoint.y) + 1));
+	if (bitmap == NULL || bitmap->imageBuffer == NULL) {
+		if (bitmap != NULL) destroyMMBitmap(bitmap);
+		PyMem_Free(points);
+		PyErr_SetString(PyExc_OSError,
+		                "Could not copy RGB data from display.");
+		return NULL;
+	}
+
+	colors = colorArrayFromPoints(bitmap, points, count, minPoint);
+	destroyMMBitmap(bitmap);
+	PyMem_Free(points);
+	return colors;
+}
@@ -65,6 +65,55 @@ uint8_t *base64decode(const uint8_t *src, const size_t buflen, size_t *retlen)
 	return decoded; /* Must be free()'d by caller */
 }
 
+void base64decoder_init(base64_decoder *decoder)
+{
+	decoder->position = 0;
+	decoder->lastdigit = 0;
+}
+
+size_t base64decoder_decode(base64_decoder *decoder,
+                            const uint8_t *src, size_t buflen,
+                            uint8_t *dest, size_t destlen, size_t *consumed)
+{
+	size_t i, j;
+
+	/* Sanity check */
+	assert(decoder != NULL);
+	assert(src != NULL);
+	assert(dest != NULL);
+
+	for (i = j = 0; i < buflen; ++i) {
+		const int8_t digit = b64_decode_table[src[i]];
+		if (digit == -1) continue;
+
+		/* Every digit but the first of a block completes a byte; stop
+		 * before one that would not fit. */
+		if (decoder->position != 0 && j == destlen) break;
+
+		/* Decode block */
+		switch (decoder->position) {
+			case 1:
+				dest[j++] = (uint8_t)((decoder->lastdigit << 2) |
+				                      ((digit & 0x30) >> 4));
+				break;
+			case 2:
+				dest[j++] = (uint8_t)(((decoder->lastdigit & 0xF) << 4) |
+				                      ((digit & 0x3C) >> 2));
+				break;
+			case 3:
+				dest[j++] = (uint8_t)(((decoder->lastdigit & 0x03) << 6) |
+				                      digit);
+				break;
+		}
+
+		decoder->lastdigit = (uint8_t)digit;
+		decoder->position = (decoder->position + 1) % 4;
+	}
+
+	if (consumed != NULL) *consumed = i;
+	return j;
+}
+
 uint8_t *base64encode(const uint8_t *src, const size_t buflen, size_t *retlen)
 {
 	size_t i, j;
@@ -19,6 +19,29 @@
  * (minus the NUL-terminator) on successful return. */
 uint8_t *base64decode(const uint8_t *buf, const size_t buflen, size_t *retlen);
 
+/* State for decoding a base64 encoded string a piece at a time, e.g. to feed
+ * it to another decoder without holding all of the decoded data at once. */
+struct _base64_decoder {
+	unsigned int position; /* Index of the next digit within its block. */
+	uint8_t lastdigit;
+};
+
+typedef struct _base64_decoder base64_decoder;
+
+/* Prepares |decoder| for decoding a new string. */
+void base64decoder_init(base64_decoder *decoder);
+
+/* Decodes from the |buflen| bytes at |buf| into |dest|, discarding line
+ * breaks and noise, until either the input is used up or |destlen| bytes have
+ * been written.
+ *
+ * Returns the number of bytes written to |dest|, and sets |consumed| to the
+ * number of bytes of |buf| that were used; the rest should be passed to the
+ * next call. */
+size_t base64decoder_decode(base64_decoder *decoder,
+                            const uint8_t *buf, size_t buflen,
+                            uint8_t *dest, size_t destlen, size_t *consumed);
+
 /* Encode a base64 encoded string without line breaks or noise.
  *
  * Returns a new string to be free()'d by caller, or NULL on error.
@@ -0,0 +1,145 @@
+#include "bitmap_diff.h"
+#include <stdlib.h>
+#include <string.h> /* memcmp() */
+#include <assert.h>
+
+/* Returns whether the |width| pixels starting at |rowA| (a row of |a|) and
+ * |rowB| (a row of |b|) are within |maxDistSquared| of each other. */
+static int rowsMatch(MMBitmapRef a, const uint8_t *rowA,
+                     MMBitmapRef b, const uint8_t *rowB,
+                     size_t width, uint32_t maxDistSquared)
+{
+	size_t x;
+
+	/* Identical bytes are always identical colors, so rows that haven't
+	 * changed are dealt with by memcmp(). With only color in each pixel,
+	 * that is all an exact comparison needs. */
+	if (a->bytesPerPixel == b->bytesPerPixel) {
+		if (memcmp(rowA, rowB, width * a->bytesPerPixel) == 0) return 1;
+		if (maxDistSquared == 0 && a->bytesPerPixel == 3) return 0;
+	}
+
+	for (x = 0; x < width; ++x) {
+		const MMRGBHex hexA = hexFromMMRGB(*(MMRGBColor *)rowA);
+		const MMRGBHex hexB = hexFromMMRGB(*(MMRGBColor *)rowB);
+		if (!MMRGBHexWithinDistance(hexA, hexB, maxDistSquared)) return 0;
+		rowA += a->bytesPerPixel;
+		rowB += b->bytesPerPixel;
+	}
+
+	return 1;
+}
+
+int diffMMBitmapRegions(MMBitmapRef a, MMBitmapRef b, size_t tileSize,
+                        float tolerance, MMRect **rects, size_t *count)
+{
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
+	size_t tilesX, tilesY, tx, ty;
+	size_t capacity = 0;
+	uint8_t *dirty;
+	ptrdiff_t *columns, *open, *nextOpen, *swap;
+
+	assert(a->width == b->width && a->height == b->height);
+	assert(tileSize > 0);
+
+	*rects = NULL;
+	*count = 0;
+	if (a->width == 0 || a->height == 0) return 0;
+
+	tilesX = (a->width / tileSize) + (a->width % tileSize != 0);
+	tilesY = (a->height / tileSize) + (a->height % tileSize != 0);
+
+	/* |open| maps each column of tiles to the rect starting there that
+	 * reaches down to the current row of tiles (or -1 if there is none), so
+	 * that a run of tiles below it can extend it. */
+	dirty = malloc(tilesX);
+	columns = malloc(2 * tilesX * sizeof(ptrdiff_t));
+	if (dirty == NULL || columns == NULL) goto error;
+	open = columns;
+	nextOpen = columns + tilesX;
+	for (tx = 0; tx < tilesX; ++tx) open[tx] = -1;
+
+	for (ty = 0; ty < tilesY; ++ty) {
+		const size_t top = ty * tileSize;
+		const size_t height = a->height - top < tileSize ? a->height - top
+		                                                 : tileSize;
+		size_t dirtyCount = 0;
+		size_t y;
+
+		/* Go through the tiles a row of pixels at a time, so that the rows
+		 * are read in order, skipping tiles already known to differ. */
+		memset(dirty, 0, tilesX);
+		for (y = top; y < top + height && dirtyCount < tilesX; ++y) {
+			const uint8_t *rowA = a->imageBuffer +
+			                      (a->bytewidth * (ptrdiff_t)y);
+			const uint8_t *rowB = b->imageBuffer +
+			                      (b->bytewidth * (ptrdiff_t)y);
+
+			for (tx = 0; tx < tilesX; ++tx) {
+				const size_t left = tx * tileSize;
+				const size_t width = a->width - left < tileSize
+				                     ? a->width - left : tileSize;
+
+				if (!dirty[tx] &&
+				    !rowsMatch(a, rowA + (left * a->bytesPerPixel),
+				               b, rowB + (left * b->bytesPerPixel),
+				               width, maxDistSquared)) {
+					dirty[tx] = 1;
+					++dirtyCount;
+				}
+			}
+		}
+
+		for (tx = 0; tx < tilesX; ++tx) nextOpen[tx] = -1;
+
+		tx = 0;
+		while (tx < tilesX) {
+			size_t end, left, right;
+			ptrdiff_t i;
+
+			if (!dirty[tx]) {
+				++tx;
+				continue;
+			}
+
+			for (end = tx + 1; end < tilesX && dirty[end]; ++end);
+			left = tx * tileSize;
+			right = end == tilesX ? a->width : end * tileSize;
+
+			i = open[tx];
+			if (i >= 0 && (*rects)[i].size.width == right - left) {
+				(*rects)[i].size.height += height;
+			} else {
+				if (*count == capacity) {
+					MMRect *grown;
+					capacity = capacity == 0 ? 16 : capacity * 2;
+					grown = realloc(*rects, capacity * sizeof(MMRect));
+					if (grown == NULL) goto error;
+					*rects = grown;
+				}
+
+				i = (ptrdiff_t)(*count)++;
+				(*rects)[i] = MMRectMake(left, top, right - left, height);
+			}
+
+			nextOpen[tx] = i;
+			tx = end;
+		}
+
+		swap = open;
+		open = nextOpen;
+		nextOpen = swap;
+	}
+
+	free(dirty);
+	free(columns);
+	return 0;
+
+error:
+	free(dirty);
+	free(columns);
+	free(*rects);
+	*rects = NULL;
+	*count = 0;
+	return -1;
+}
@@ -0,0 +1,24 @@
+#pragma once
+#ifndef BITMAP_DIFF_H
+#define BITMAP_DIFF_H
+
+#include "MMBitmap.h"
+
+/* Compares |a| and |b|, which must be the same size, in square tiles of
+ * |tileSize| pixels (the tiles along the right and bottom edges being cut
+ * short by the edges of the bitmaps), and finds those in which any pixel
+ * differs.
+ *
+ * On success, returns 0 and sets |rects| to an array (to be free()'d by the
+ * caller, and NULL if there are none) of the |count| non-overlapping rects
+ * covering the differing tiles. Horizontally adjacent tiles are merged into a
+ * single rect, as are runs of these spanning the same columns of tiles in
+ * consecutive rows of them. Returns -1 if memory could not be allocated.
+ *
+ * |tolerance| should be in the range 0.0f - 1.0f, denoting how closely the
+ * colors of the pixels need to match for them to be considered the same, with
+ * 0 being exact and 1 being any. */
+int diffMMBitmapRegions(MMBitmapRef a, MMBitmapRef b, size_t tileSize,
+                        float tolerance, MMRect **rects, size_t *count);
+
+#endif /* BITMAP_DIFF_H */
@@ -1,18 +1,104 @@
 #include "bitmap_find.h"
 #include "UTHashTable.h"
+#include "MMThread.h"
+#include <stdlib.h>
 #include <assert.h>
 
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
 /* Node to be used in hash table. */
 struct shiftNode {
 	UTHashNode_HEAD /* Make structure hashable */
 	MMRGBHex color; /* Key */
-	MMPoint offset; /* Value */
+	size_t shift; /* Value */
+};
+
+/* Node in the table of needles used by findAllBitmapsInRect(). Needles
+ * sharing a key are chained together through a separate array of indices. */
+struct prefixNode {
+	UTHashNode_HEAD
+	uint64_t hash; /* Key: hash of the first pixels of the needle's top row. */
+	size_t needle; /* Index of the first needle with this key. */
+};
+
+/* Jump table for a single row of a needle. */
+struct badShiftTable {
+	UTHashTable table;
+	size_t row; /* Row of the needle the shift values were computed for. */
+};
+
+/* Number of levels in an image pyramid; level |i| is downsampled by a factor
+ * of 2 << |i| (i.e., 2x, then 4x). */
+#define PYRAMID_LEVELS 2
+#define PYRAMID_MAX_FACTOR (2 << (PYRAMID_LEVELS - 1))
+
+/* Fewest cells across and down a needle must have at a level (whatever its
+ * phase) for the level to be used. */
+#define PYRAMID_MIN_CELLS 2
+
+/* Sums of the color components of a square block of pixels, as compared at
+ * the coarse levels of a pyramid search. At 4x, each is at most 16 * 255. */
+struct pyramidCell {
+	uint16_t red;
+	uint16_t green;
+	uint16_t blue;
+};
+
+/* A needle downsampled starting at a given pixel (its phase), which is where
+ * the first whole block of the haystack falls for some offsets. */
+struct needlePhase {
+	const struct pyramidCell *cells;
+	size_t width; /* In cells. */
+	size_t height;
+};
+
+/* A level of the pyramid of a needle: the needle downsampled by |factor| at
+ * each of the |factor| * |factor| phases, indexed by (y * factor) + x. */
+struct needleLevel {
+	size_t factor;
+	struct pyramidCell *cells; /* Those of every phase. */
+	struct needlePhase phases[PYRAMID_MAX_FACTOR * PYRAMID_MAX_FACTOR];
+};
+
+/* A level of the pyramid of the haystack, made up of the whole blocks of
+ * pixels inside the rect being searched. Rows are filled in only as the
+ * search reaches them. */
+struct haystackLevel {
+	size_t factor;
+	size_t shift; /* log2(factor) */
+	size_t originX; /* Of the first cell, in cells from the haystack's. */
+	size_t originY;
+	size_t width; /* In cells. */
+	size_t height;
+	size_t builtRows; /* Number of rows of cells filled in so far. */
+	struct pyramidCell *cells;
+};
+
+/* State of a pyramid search of a haystack for a needle. */
+struct haystackPyramid {
+	const struct needleLevel *needleLevels;
+	MMBitmapRef haystack;
+	size_t levelCount;
+	struct haystackLevel levels[PYRAMID_LEVELS];
+};
+
+/* A needle with its search tables computed ahead of time. */
+struct _MMNeedle {
+	MMBitmapRef bitmap; /* Not owned by the needle. */
+	struct badShiftTable badShiftTable; /* For Boyer-Moore-Horspool. */
+	uint64_t hash; /* For Rabin-Karp, as returned by needleHash(). */
+	size_t pyramidLevels; /* Number of |levels| in use; 0 if none. */
+	struct needleLevel levels[PYRAMID_LEVELS];
 };
 
 /* --- Hash table helper functions --- */
 
-/* Adds hex-color/offset pair to jump table. */
-static void addNodeToTable(UTHashTable *table, MMRGBHex color, MMPoint offset);
+/* Adds hex-color/shift pair to jump table. */
+static void addNodeToTable(UTHashTable *table, MMRGBHex color, size_t shift);
 
 /* Returns node associated with color in jump table, or NULL if it
  * doesn't exist. */
@@ -23,31 +109,156 @@ static struct shiftNode *nodeForColor(UTHashTable *table, MMRGBHex color);
 
 /* --- Boyer-Moore helper functions --- */
 
-/* Calculates the first table for use in a Boyer-Moore search algorithm.
- * Table is in the form [colors: shift_values], where colors are those in
- * |needle|, and the shift values are each color's distance from the rightmost
- * offset. All other colors are assumed to have a shift value equal to the
- * length of needle.
+/* Calculates the bad shift table for use in a Boyer-Moore-Horspool search.
+ *
+ * The search is done along a single row of |needle| (the one with the most
+ * distinct colors, as that gives the largest average skip). The table is in
+ * the form [colors: shift_values], where colors are those in that row
+ * (excluding the last pixel), and the shift values are each color's distance
+ * from the rightmost pixel of the row. All other colors are assumed to have a
+ * shift value equal to the width of |needle|.
  */
-static void initBadShiftTable(UTHashTable *jumpTable, MMBitmapRef needle);
+static void initBadShiftTable(struct badShiftTable *jumpTable,
+                              MMBitmapRef needle);
+
+/* Populates |jumpTable| with the shift values for row |row| of |needle|. */
+static void initBadShiftTableForRow(UTHashTable *jumpTable,
+                                    MMBitmapRef needle, size_t row);
 
-/* Frees memory occupied by calling initBadShiftTable().
- * Currently this is just an alias for destroyHashTable(). */
-#define destroyBadShiftTable(jumpTable) destroyHashTable(jumpTable)
+/* Frees memory occupied by calling initBadShiftTable(). */
+#define destroyBadShiftTable(jumpTable) destroyHashTable(&(jumpTable)->table)
 
-/* Returns true if |needle| is found in |haystack| at |offset|. */
+/* Returns true if row |row| of |needle| is found in |haystack| at |offset|.
+ * Like needleAtOffset(), this is only valid for exact matches. */
+static int needleRowAtOffset(MMBitmapRef needle, MMBitmapRef haystack,
+                             MMPoint offset, size_t row);
+
+/* Returns true if |needle| is found in |haystack| at |offset|, with each
+ * pixel within the squared distance |maxDistSquared| (as returned by
+ * MMRGBMaxDistanceSquared()) of the corresponding pixel in |needle|. */
 static int needleAtOffset(MMBitmapRef needle, MMBitmapRef haystack,
-                          MMPoint offset, float tolerance);
+                          MMPoint offset, uint32_t maxDistSquared);
+/* --- Rabin-Karp helper functions --- */
+
+/* Bases for the rolling hashes along rows and columns. Arithmetic is done
+ * modulo 2^64; both bases are odd so that no information is shifted out. */
+#define RK_ROW_BASE UINT64_C(0x100000001B3)
+#define RK_COL_BASE UINT64_C(0x9E3779B97F4A7C15)
+
+/* Returns the 2D rolling hash of |needle|, as computed by
+ * findAllBitmapExactInRect() for each offset in the haystack. */
+static uint64_t needleHash(MMBitmapRef needle);
+
+/* Finds all exact occurrences of |needle| in |haystack| inside |rect| using a
+ * 2D Rabin-Karp search: rolling row hashes are combined into rolling column
+ * hashes over the haystack in a single pass, and only offsets whose hash
+ * matches |target| (the needleHash() of |needle|) are compared pixel by
+ * pixel.
+ *
+ * Each match is appended to |pointArray| (if it is not NULL) in row-major
+ * order, and |count| is set to the number of matches.
+ *
+ * Returns 0 on success, or -1 if the hash buffers could not be allocated. */
+static int findAllBitmapExactInRect(MMBitmapRef needle, uint64_t target,
+                                    MMBitmapRef haystack, MMRect rect,
+                                    MMPointArrayRef pointArray, size_t *count);
+
+/* Returns the row hash (as used above) of the |count| pixels starting at
+ * |x|, |y| in |bitmap|. */
+static uint64_t rowPrefixHash(MMBitmapRef bitmap, size_t x, size_t y,
+                              size_t count);
+
+/* --- Pyramid search helper functions --- */
+
+/* Fills in the cells of |level| of the pyramid of |needle| (whose |factor|
+ * must be set). Returns 0 on success, or -1 if they could not be
+ * allocated. */
+static int initNeedleLevel(struct needleLevel *level, MMBitmapRef needle);
+
+/* Sets up |pyramid| for a search of |rect| in |haystack| (in which |needle|
+ * must fit) for |needle| with a nonzero tolerance, and returns it, or returns
+ * NULL if the search is to be done without a pyramid: if |needle| has none,
+ * or memory could not be allocated. Destroy it with destroyHaystackPyramid()
+ * if it is not NULL. */
+static struct haystackPyramid *initHaystackPyramid(
+	struct haystackPyramid *pyramid, MMNeedleRef needle,
+	MMBitmapRef haystack, MMRect rect);
+
+/* Frees memory occupied by calling initHaystackPyramid(), if |pyramid| is not
+ * NULL. */
+static void destroyHaystackPyramid(struct haystackPyramid *pyramid);
+
+/* Returns false if the needle of |pyramid| can be ruled out at |offset|
+ * without comparing each of its pixels, i.e. if at some level of the pyramid
+ * a block of it differs from the block of the haystack it covers by more than
+ * |maxDistSquared| (as returned by MMRGBMaxDistanceSquared()) allows. Returns
+ * true otherwise, in which case it may or may not be there.
+ *
+ * This never rules out a match: the sum of |n| colors is within n * d of
+ * another such sum if each of the colors is within d of its counterpart.
+ * Fills in the rows of the haystack levels the comparison needs. */
+static bool pyramidMatchesAtOffset(struct haystackPyramid *pyramid,
+                                   MMPoint offset, uint32_t maxDistSquared);
+
+/* --- Compiled needle helper functions --- */
+
+/* Computes the search tables for |bitmap| and stores them in |needle|. */
+static void initNeedle(MMNeedleRef needle, MMBitmapRef bitmap);
+
+/* Frees memory occupied by calling initNeedle(), and by the pyramid of
+ * |needle| if it has one. */
+static void destroyNeedleTables(MMNeedleRef needle);
+
+/* --- Multiple needle search helper functions --- */
+
+/* Number of bits in the filter used to rule out most haystack offsets before
+ * looking them up in the table of needles. */
+#define PREFIX_FILTER_BITS 65536
+
+/* Destroys the first |count| point arrays of |pointArrays|, and sets them to
+ * NULL. */
+static void destroyPointArrays(MMPointArrayRef *pointArrays, size_t count);
+
+/* Returns the index of the bit for |hash| in the prefix filter. */
+#define PREFIX_FILTER_BIT(hash) ((size_t)((hash) >> 48))
+
+/* Searches for all of |needles| in a single pass, as described in
+ * findAllBitmapsInRect(). Returns 0 on success, or -1 if memory for the table
+ * of needles or the point arrays could not be allocated (in which case no
+ * point arrays are left in |pointArrays|). */
+static int findAllBitmapsExactInRect(MMBitmapRef *needles, size_t needleCount,
+                                     MMBitmapRef haystack, MMRect rect,
+                                     MMPointArrayRef *pointArrays);
+
 /* --- --- */
 
 /* An modification of the Boyer-Moore-Horspool Algorithm, only applied to
  * bitmaps and colors instead of strings and characters.
  *
- * TODO: The Boyer-Moore algorithm (with the second jump table) would probably
- * be more efficient, but this was simpler (for now).
+ * The horizontal skip is computed from the row of |needle| the jump table was
+ * built for, and only ever moves along the current row of |haystack|. Every y
+ * coordinate is still scanned: skipping vertically based on the bad shift
+ * table fails on certain edge cases (issue#7), e.g.:
+ * Needle: [B, b
+ *          b, b,
+ *          B, b]
+ * Haystack: [w, w, w, w, w
+ *            w, w, w, w, b
+ *            w, w, w, b, b
+ *            w, w, w, w, b]
+ * Nothing in the first 3 x 3 block of the haystack is in common with the
+ * needle, but the needle is hidden in-between a jump of its height; skipping
+ * is appropriate for scanning a row but not a column. Applying Horspool to one
+ * row at a time sidesteps this while keeping the skip on x.
+ *
+ * Skipping is only possible for exact matches; when |maxDistSquared| is
+ * nonzero every offset is checked, first ruling out what it can with
+ * |pyramid| unless it is NULL (as for a needle without a pyramid).
+ * |maxDistSquared| should be computed from the tolerance once per search with
+ * MMRGBMaxDistanceSquared().
  *
  * The jump table (|badShiftTable|) is passed as a parameter to avoid being
- * recalculated each time. It should be a pointer to a UTHashTable init'd with
+ * recalculated each time. It should be a pointer to a table init'd with
  * initBadShiftTable().
  *
  * Returns 0 and sets |point| to the starting point of |needle| in |haystack|
@@ -56,17 +267,16 @@ static int findBitmapInRectAt(MMBitmapRef needle,
                                 MMBitmapRef haystack,
                                 MMPoint *point,
                                 MMRect rect,
-                                float tolerance,
+                                uint32_t maxDistSquared,
                                 MMPoint startPoint,
-                                UTHashTable *badShiftTable)
+                                struct badShiftTable *badShiftTable,
+                                struct haystackPyramid *pyramid)
 {
-	const size_t scanHeight = rect.size.height - needle->height;
-	const size_t scanWidth = rect.size.width - needle->width;
+	size_t lastX, lastY;
 	MMPoint pointOffset = startPoint;
-	/* const MMPoint lastPoint = MMPointMake(needle->width - 1, needle->height - 1); */
 
 	/* Sanity check */
-	if (needle->height > haystack->height || needle->width > haystack->width ||
+	if (needle->height > rect.size.height || needle->width > rect.size.width ||
 	    !MMBitmapRectInBounds(haystack, rect)) {
 		return -1;
 	}
@@ -78,156 +288,754 @@ static int findBitmapInRectAt(MMBitmapRef needle,
 	assert(haystack->height > 0 && haystack->width > 0);
 	assert(badShiftTable != NULL);
 
+	/* Last offsets at which |needle| still fits inside |rect|. */
+	lastX = rect.origin.x + (rect.size.width - needle->width);
+	lastY = rect.origin.y + (rect.size.height - needle->height);
+
+	if (pointOffset.y < rect.origin.y) pointOffset = rect.origin;
+	if (pointOffset.x < rect.origin.x) pointOffset.x = rect.origin.x;
+
 	/* Search |haystack|, while |needle| can still be within it. */
-	while (pointOffset.y <= scanHeight) {
-		/* struct shiftNode *node = NULL;
-		MMRGBHex lastColor; */
+	while (pointOffset.y <= lastY) {
+		while (pointOffset.x <= lastX) {
+			MMRGBHex lastColor;
+			struct shiftNode *node;
 
-		while (pointOffset.x <= scanWidth) {
-			/* Check offset in |haystack| for |needle|. */
-			if (needleAtOffset(needle, haystack, pointOffset, tolerance)) {
+			if (maxDistSquared > 0) {
+				if ((pyramid == NULL ||
+				     pyramidMatchesAtOffset(pyramid, pointOffset,
+				                            maxDistSquared)) &&
+				    needleAtOffset(needle, haystack, pointOffset,
+				                   maxDistSquared)) {
+					*point = pointOffset;
+					return 0;
+				}
 				++pointOffset.x;
-				++pointOffset.y;
+				continue;
+			}
+
+			/* Check offset in |haystack| for |needle|, starting with the row
+			 * the jump table was built for. */
+			if (needleRowAtOffset(needle, haystack, pointOffset,
+			                      badShiftTable->row) &&
+			    needleAtOffset(needle, haystack, pointOffset, 0)) {
 				*point = pointOffset;
 				return 0;
 			}
 
-			/* Otherwise, calculate next x offset to check. */
-			/*
+			/* Otherwise, calculate next x offset to check.
+			 *
 			 * Note that here we are getting the skip value based on the last
-			 * color of |needle|, no matter where we didn't match. The
-			 * alternative of pretending that the mismatched color was the previous
-			 * color is slower in the normal case.
-			 */
-			/* lastColor = MMRGBHexAtPoint(haystack, pointOffset.x + lastPoint.x,
-			                                      pointOffset.y + lastPoint.y); */
-
-			/* TODO: This fails on certain edge cases (issue#7). */
-			/* When a color is encountered that does not occur in |needle|, we can
-			 * safely skip ahead for the whole length of |needle|.
+			 * color of the row, no matter where we didn't match. The
+			 * alternative of pretending that the mismatched color was the
+			 * previous color is slower in the normal case.
+			 *
+			 * When a color is encountered that does not occur in the row, we
+			 * can safely skip ahead for the whole width of |needle|.
 			 * Otherwise, use the value stored in the jump table. */
-			/* node = nodeForColor(badShiftTable, lastColor);
-			pointOffset.x += (node == NULL) ? needle->width : (node->offset).x; */
-
-			/* For now, be naive. */
-			++pointOffset.x;
+			lastColor = MMRGBHexAtPoint(haystack,
+			                            pointOffset.x + needle->width - 1,
+			                            pointOffset.y + badShiftTable->row);
+			node = nodeForColor(&badShiftTable->table, lastColor);
+			pointOffset.x += (node == NULL) ? needle->width : node->shift;
 		}
 
 		pointOffset.x = rect.origin.x;
-
-		/* lastColor = MMRGBHexAtPoint(haystack, pointOffset.x + lastPoint.x,
-		                               pointOffset.y + lastPoint.y);
-		node = nodeForColor(badShiftTable, lastColor);
-		pointOffset.y += node == NULL ? lastPoint.y : (node->offset).y; */
-
-		/* TODO: The above commented out code fails at certain edge cases, e.g.:
-		 * Needle: [B, b
-		 *          b, b,
-		 *          B, b]
-		 * Haystack: [w, w, w, w, w
-		 *            w, w, w, w, b
-		 *            w, w, w, b, b
-		 *            w, w, w, w, b]
-		 * The previous algorithm noticed that the first 3 x 3 block had nothing
-		 * in common with the image, and thus, after scanning the first row,
-		 * skipped three blocks downward to scan the next (which didn't exist,
-		 * so the loop ended). However, the needle was hidden IN-BETWEEN this
-		 * jump -- skipping was appropriate for scanning the column but not
-		 * the row.
-		 *
-		 * I need to figure out a more optimal solution; temporarily I am just
-		 * scanning every single y coordinate, only skipping on x's. This
-		 * always works, but is probably not optimal.
-		 */
 		++pointOffset.y;
 	}
 
 	return -1;
 }
 
+/* Returns true if |needle| is found in |haystack| at |offset|, checking the
+ * row |badShiftTable| was built for first when searching exactly. */
+static int needleMatchesAtOffset(MMBitmapRef needle, MMBitmapRef haystack,
+                                 MMPoint offset, uint32_t maxDistSquared,
+                                 struct badShiftTable *badShiftTable)
+{
+	return (maxDistSquared > 0 ||
+	        needleRowAtOffset(needle, haystack, offset,
+	                          badShiftTable->row)) &&
+	       needleAtOffset(needle, haystack, offset, maxDistSquared);
+}
+
+/* Looks for |needle| at the offsets in |rect| within |radius| of |hint| (as
+ * described for findBitmapNearPointInRect()), nearest first. Returns 0 and
+ * sets |point| to the first offset it is found at, or returns -1 if it isn't
+ * found at any of them. */
+static int findBitmapNearPoint(MMBitmapRef needle, MMBitmapRef haystack,
+                               MMPoint *point, MMRect rect,
+                               uint32_t maxDistSquared, MMPoint hint,
+                               size_t radius,
+                               struct badShiftTable *badShiftTable)
+{
+	size_t lastX, lastY, r;
+
+	if (needle->height > rect.size.height || needle->width > rect.size.width ||
+	    !MMBitmapRectInBounds(haystack, rect)) {
+		return -1;
+	}
+
+	lastX = rect.origin.x + (rect.size.width - needle->width);
+	lastY = rect.origin.y + (rect.size.height - needle->height);
+
+	if (hint.x < rect.origin.x) hint.x = rect.origin.x;
+	if (hint.x > lastX) hint.x = lastX;
+	if (hint.y < rect.origin.y) hint.y = rect.origin.y;
+	if (hint.y > lastY) hint.y = lastY;
+
+	for (r = 0; r <= radius; ++r) {
+		/* Which sides of the ring are inside |rect|. */
+		const bool hasLeft = hint.x - rect.origin.x >= r;
+		const bool hasRight = lastX - hint.x >= r;
+		const bool hasTop = hint.y - rect.origin.y >= r;
+		const bool hasBottom = lastY - hint.y >= r;
+		const size_t left = hasLeft ? hint.x - r : rect.origin.x;
+		const size_t right = hasRight ? hint.x + r : lastX;
+		const size_t top = hasTop ? hint.y - r : rect.origin.y;
+		const size_t bottom = hasBottom ? hint.y + r : lastY;
+		MMPoint offset;
+
+		/* Once a ring lies entirely outside of |rect|, so do the rest. */
+		if (!hasLeft && !hasRight && !hasTop && !hasBottom) break;
+
+		for (offset.y = top; offset.y <= bottom; ++offset.y) {
+			if ((hasTop && offset.y == top) ||
+			    (hasBottom && offset.y == bottom)) {
+				for (offset.x = left; offset.x <= right; ++offset.x) {
+					if (needleMatchesAtOffset(needle, haystack, offset,
+					                          maxDistSquared, badShiftTable)) {
+						*point = offset;
+						return 0;
+					}
+				}
+				continue;
+			}
+
+			/* The rows in between only have the ends of the ring. */
+			offset.x = left;
+			if (hasLeft && needleMatchesAtOffset(needle, haystack, offset,
+			                                     maxDistSquared,
+			                                     badShiftTable)) {
+				*point = offset;
+				return 0;
+			}
+			offset.x = right;
+			if (hasRight && needleMatchesAtOffset(needle, haystack, offset,
+			                                      maxDistSquared,
+			                                      badShiftTable)) {
+				*point = offset;
+				return 0;
+			}
+		}
+	}
+
+	return -1;
+}
+
+/* --- Compiled needle functions --- */
+
+static void initNeedle(MMNeedleRef needle, MMBitmapRef bitmap)
+{
+	needle->bitmap = bitmap;
+	initBadShiftTable(&needle->badShiftTable, bitmap);
+	needle->hash = needleHash(bitmap);
+	needle->pyramidLevels = 0;
+}
+
+static void destroyNeedleTables(MMNeedleRef needle)
+{
+	size_t i;
+
+	destroyBadShiftTable(&needle->badShiftTable);
+	for (i = 0; i < needle->pyramidLevels; ++i) {
+		free(needle->levels[i].cells);
+	}
+}
+
+MMNeedleRef createMMNeedle(MMBitmapRef bitmap)
+{
+	MMNeedleRef needle;
+
+	assert(bitmap != NULL);
+	assert(bitmap->width > 0 && bitmap->height > 0);
+
+	if ((needle = malloc(sizeof(MMNeedle))) == NULL) return NULL;
+	initNeedle(needle, bitmap);
+	return needle;
+}
+
+void destroyMMNeedle(MMNeedleRef needle)
+{
+	assert(needle != NULL);
+	destroyNeedleTables(needle);
+	free(needle);
+}
+
+MMBitmapRef MMNeedleGetBitmap(MMNeedleRef needle)
+{
+	return needle->bitmap;
+}
+
+size_t MMNeedleShiftCount(MMNeedleRef needle)
+{
+	return needle->badShiftTable.table.nodeCount;
+}
+
+void MMNeedleGetTables(MMNeedleRef needle, MMNeedleTables *tables,
+                       MMNeedleShift *shifts)
+{
+	const struct shiftNode *nodes = needle->badShiftTable.table.nodes;
+	size_t i;
+
+	tables->shiftRow = needle->badShiftTable.row;
+	tables->shiftCount = MMNeedleShiftCount(needle);
+	for (i = 0; i < tables->shiftCount; ++i) {
+		shifts[i].color = nodes[i].color;
+		shifts[i].shift = (uint32_t)nodes[i].shift;
+	}
+	tables->shifts = shifts;
+	tables->hash = needle->hash;
+}
+
+int MMNeedleAddPyramid(MMNeedleRef needle)
+{
+	MMBitmapRef bitmap = needle->bitmap;
+	size_t count = 0;
+
+	/* The pyramid may only be added once. */
+	assert(needle->pyramidLevels == 0);
+
+	/* Stop at the first level at which the needle is too small to have a few
+	 * cells across and down at every phase. */
+	while (count < PYRAMID_LEVELS) {
+		const size_t factor = (size_t)2 << count;
+		const size_t minCells = PYRAMID_MIN_CELLS * factor + (factor - 1);
+		if (bitmap->width < minCells || bitmap->height < minCells) break;
+
+		needle->levels[count].factor = factor;
+		if (initNeedleLevel(&needle->levels[count], bitmap) != 0) {
+			while (count > 0) free(needle->levels[--count].cells);
+			return -1;
+		}
+		++count;
+	}
+
+	needle->pyramidLevels = count;
+	return 0;
+}
+
+size_t MMNeedlePyramidLevels(MMNeedleRef needle)
+{
+	return needle->pyramidLevels;
+}
+
+bool MMNeedleTablesMatchBitmap(MMBitmapRef bitmap,
+                               const MMNeedleTables *tables)
+{
+	UTHashTable rowTable;
+	struct shiftNode *nodes;
+	bool match;
+	size_t i;
+
+	assert(bitmap != NULL);
+	assert(bitmap->width > 0 && bitmap->height > 0);
+
+	if (tables->shiftRow >= bitmap->height) return false;
+
+	/* The shift table is compared with the one computed for the same row, in
+	 * the order MMNeedleGetTables() gives its entries; an entry that is off
+	 * (or missing) would make exact searches skip over matches. */
+	initBadShiftTableForRow(&rowTable, bitmap, tables->shiftRow);
+	nodes = rowTable.nodes;
+
+	match = rowTable.nodeCount == tables->shiftCount;
+	for (i = 0; match && i < tables->shiftCount; ++i) {
+		match = nodes[i].color == tables->shifts[i].color &&
+		        nodes[i].shift == tables->shifts[i].shift;
+	}
+	destroyHashTable(&rowTable);
+
+	/* Likewise, a stale hash would make exact searches miss every
+	 * occurrence. */
+	return match && needleHash(bitmap) == tables->hash;
+}
+
+MMNeedleRef createMMNeedleWithTables(MMBitmapRef bitmap,
+                                     const MMNeedleTables *tables)
+{
+	MMNeedleRef needle;
+	size_t i;
+
+	if (!MMNeedleTablesMatchBitmap(bitmap, tables)) return NULL;
+
+	if ((needle = malloc(sizeof(MMNeedle))) == NULL) return NULL;
+	needle->bitmap = bitmap;
+	needle->hash = tables->hash;
+	needle->pyramidLevels = 0;
+	needle->badShiftTable.row = tables->shiftRow;
+	initHashTable(&needle->badShiftTable.table, tables->shiftCount,
+	              sizeof(struct shiftNode));
+	for (i = 0; i < tables->shiftCount; ++i) {
+		addNodeToTable(&needle->badShiftTable.table, tables->shifts[i].color,
+		               tables->shifts[i].shift);
+	}
+
+	return needle;
+}
+
+int findNeedleInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                     MMPoint *point, MMRect rect, float tolerance)
+{
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
+	struct haystackPyramid storage;
+	struct haystackPyramid *pyramid = NULL;
+	int ret;
+
+	if (maxDistSquared > 0) {
+		pyramid = initHaystackPyramid(&storage, needle, haystack, rect);
+	}
+
+	ret = findBitmapInRectAt(needle->bitmap, haystack, point, rect,
+	                         maxDistSquared, rect.origin,
+	                         &needle->badShiftTable, pyramid);
+	destroyHaystackPyramid(pyramid);
+	return ret;
+}
+
+int findNeedleNearPointInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                              MMPoint *point, MMRect rect, float tolerance,
+                              MMPoint hint, size_t radius)
+{
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
+
+	if (findBitmapNearPoint(needle->bitmap, haystack, point, rect,
+	                        maxDistSquared, hint, radius,
+	                        &needle->badShiftTable) == 0) {
+		return 0;
+	}
+
+	return findNeedleInRect(needle, haystack, point, rect, tolerance);
+}
+
+MMPointArrayRef findAllNeedleInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                                    MMRect rect, float tolerance)
+{
+	MMPointArrayRef pointArray = createMMPointArray(0);
+	MMPoint point = rect.origin;
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
+	const size_t scanWidth = rect.origin.x +
+	                         (rect.size.width - needle->bitmap->width) + 1;
+	struct haystackPyramid storage;
+	struct haystackPyramid *pyramid = NULL;
+	size_t count;
+
+	if (pointArray == NULL) return NULL;
+
+	if (maxDistSquared == 0 &&
+	    findAllBitmapExactInRect(needle->bitmap, needle->hash, haystack, rect,
+	                             pointArray, &count) == 0) {
+		return pointArray;
+	}
+
+	if (maxDistSquared > 0) {
+		pyramid = initHaystackPyramid(&storage, needle, haystack, rect);
+	}
+
+	while (findBitmapInRectAt(needle->bitmap, haystack, &point, rect,
+	                          maxDistSquared, point,
+	                          &needle->badShiftTable, pyramid) == 0) {
+		MMPointArrayAppendPoint(pointArray, point);
+		ITER_NEXT_POINT(point, scanWidth, rect.origin.x);
+	}
+
+	destroyHaystackPyramid(pyramid);
+	return pointArray;
+}
+
+size_t countOfNeedleInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                           MMRect rect, float tolerance)
+{
+	size_t count = 0;
+	MMPoint point = rect.origin;
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
+	const size_t scanWidth = rect.origin.x +
+	                         (rect.size.width - needle->bitmap->width) + 1;
+	struct haystackPyramid storage;
+	struct haystackPyramid *pyramid = NULL;
+
+	if (maxDistSquared == 0 &&
+	    findAllBitmapExactInRect(needle->bitmap, needle->hash, haystack, rect,
+	                             NULL, &count) == 0) {
+		return count;
+	}
+
+	if (maxDistSquared > 0) {
+		pyramid = initHaystackPyramid(&storage, needle, haystack, rect);
+	}
+
+	while (findBitmapInRectAt(needle->bitmap, haystack, &point, rect,
+	                          maxDistSquared, point,
+	                          &needle->badShiftTable, pyramid) == 0) {
+		++count;
+		ITER_NEXT_POINT(point, scanWidth, rect.origin.x);
+	}
+
+	destroyHaystackPyramid(pyramid);
+	return count;
+}
+
+/* --- Bitmap search functions --- */
+
 int findBitmapInRect(MMBitmapRef needle,
 		             MMBitmapRef haystack,
                      MMPoint *point,
                      MMRect rect,
                      float tolerance)
 {
-	UTHashTable badShiftTable;
+	MMNeedle compiled;
 	int ret;
 
-	initBadShiftTable(&badShiftTable, needle);
-	ret = findBitmapInRectAt(needle, haystack, point, rect,
-	                         tolerance, MMPointZero, &badShiftTable);
-	destroyBadShiftTable(&badShiftTable);
+	initNeedle(&compiled, needle);
+	ret = findNeedleInRect(&compiled, haystack, point, rect, tolerance);
+	destroyNeedleTables(&compiled);
+	return ret;
+}
+
+int findBitmapNearPointInRect(MMBitmapRef needle, MMBitmapRef haystack,
+                              MMPoint *point, MMRect rect, float tolerance,
+                              MMPoint hint, size_t radius)
+{
+	MMNeedle compiled;
+	int ret;
+
+	initNeedle(&compiled, needle);
+	ret = findNeedleNearPointInRect(&compiled, haystack, point, rect,
+	                                tolerance, hint, radius);
+	destroyNeedleTables(&compiled);
 	return ret;
 }
 
 MMPointArrayRef findAllBitmapInRect(MMBitmapRef needle, MMBitmapRef haystack,
                                     MMRect rect, float tolerance)
 {
-	MMPointArrayRef pointArray = createMMPointArray(0);
-	MMPoint point = MMPointZero;
-	UTHashTable badShiftTable;
-
-	initBadShiftTable(&badShiftTable, needle);
-	while (findBitmapInRectAt(needle, haystack, &point, rect,
-	                          tolerance, point, &badShiftTable) == 0) {
-		const size_t scanWidth = (haystack->width - needle->width) + 1;
-		MMPointArrayAppendPoint(pointArray, point);
-		ITER_NEXT_POINT(point, scanWidth, 0);
-	}
-	destroyBadShiftTable(&badShiftTable);
+	MMNeedle compiled;
+	MMPointArrayRef pointArray;
 
+	initNeedle(&compiled, needle);
+	pointArray = findAllNeedleInRect(&compiled, haystack, rect, tolerance);
+	destroyNeedleTables(&compiled);
 	return pointArray;
 }
 
 size_t countOfBitmapInRect(MMBitmapRef needle, MMBitmapRef haystack,
                            MMRect rect, float tolerance)
 {
+	MMNeedle compiled;
+	size_t count;
+
+	initNeedle(&compiled, needle);
+	count = countOfNeedleInRect(&compiled, haystack, rect, tolerance);
+	destroyNeedleTables(&compiled);
+	return count;
+}
+
+int findAllBitmapsInRect(MMBitmapRef *needles, size_t needleCount,
+                         MMBitmapRef haystack, MMRect rect, float tolerance,
+                         MMPointArrayRef *pointArrays)
+{
+	size_t i;
+
+	if (MMRGBMaxDistanceSquared(tolerance) == 0 &&
+	    findAllBitmapsExactInRect(needles, needleCount, haystack,
+	                              rect, pointArrays) == 0) {
+		return 0;
+	}
+
+	for (i = 0; i < needleCount; ++i) {
+		pointArrays[i] = findAllBitmapInRect(needles[i], haystack,
+		                                     rect, tolerance);
+		if (pointArrays[i] == NULL) {
+			destroyPointArrays(pointArrays, i);
+			return -1;
+		}
+	}
+
+	return 0;
+}
+
+/* --- Threaded search helper functions --- */
+
+/* A horizontal band of the haystack to be searched on its own thread. */
+struct searchBand {
+	MMNeedleRef needle;
+	MMBitmapRef haystack;
+	MMRect rect;
+	float tolerance;
+	bool collect; /* Whether to collect the points found or only count them. */
+	MMPointArrayRef pointArray; /* Results, if |collect| is true. */
+	size_t count;
+};
+
+/* Thread entry point; searches a single band. */
+static void searchBandOnThread(void *arg)
+{
+	struct searchBand *band = arg;
+	if (band->collect) {
+		band->pointArray = findAllNeedleInRect(band->needle, band->haystack,
+		                                       band->rect, band->tolerance);
+		band->count = band->pointArray != NULL ? band->pointArray->count : 0;
+	} else {
+		band->count = countOfNeedleInRect(band->needle, band->haystack,
+		                                  band->rect, band->tolerance);
+	}
+}
+
+/* Splits |rect| into |bandCount| bands and searches them in parallel, filling
+ * in |bands| (which must have room for |bandCount| elements).
+ *
+ * The rows of needle offsets are divided evenly between the bands, so that no
+ * offset is searched twice; each band's rect additionally covers the
+ * |needle->height| - 1 rows below its last offset. The first band is searched
+ * on the calling thread. All of the bands share the tables of |needle|, which
+ * are only ever read. */
+static void searchBandsInParallel(struct searchBand *bands, size_t bandCount,
+                                  MMNeedleRef needle, MMBitmapRef haystack,
+                                  MMRect rect, float tolerance, bool collect)
+{
+	const size_t needleHeight = needle->bitmap->height;
+	const size_t offsetRows = (rect.size.height - needleHeight) + 1;
+	MMThread *threads = calloc(bandCount, sizeof(MMThread));
+	bool *started = calloc(bandCount, sizeof(bool));
+	size_t i;
+
+	for (i = 0; i < bandCount; ++i) {
+		const size_t start = (offsetRows * i) / bandCount;
+		const size_t end = (offsetRows * (i + 1)) / bandCount;
+		struct searchBand *band = bands + i;
+
+		band->needle = needle;
+		band->haystack = haystack;
+		band->rect = MMRectMake(rect.origin.x, rect.origin.y + start,
+		                        rect.size.width,
+		                        (end - start) + needleHeight - 1);
+		band->tolerance = tolerance;
+		band->collect = collect;
+		band->pointArray = NULL;
+		band->count = 0;
+	}
+
+	/* If a thread can't be created (or there was no memory to keep track of
+	 * it), its band is simply searched on this thread instead. */
+	for (i = 1; i < bandCount; ++i) {
+		if (threads != NULL && started != NULL) {
+			started[i] = MMThreadCreate(threads + i, &searchBandOnThread,
+			                            bands + i) == 0;
+		}
+	}
+
+	searchBandOnThread(bands);
+
+	for (i = 1; i < bandCount; ++i) {
+		if (threads != NULL && started != NULL && started[i]) {
+			MMThreadJoin(threads[i]);
+		} else {
+			searchBandOnThread(bands + i);
+		}
+	}
+
+	if (threads != NULL) free(threads);
+	if (started != NULL) free(started);
+}
+
+/* Returns the number of bands to split a search of |needle| in |rect| into
+ * for |threadCount| threads, or 1 if it should not be split at all.
+ *
+ * The search is bound by the processor, so there are never more bands than
+ * processors; this also keeps a huge |threadCount| from trying to start that
+ * many threads. */
+static size_t bandCountForSearch(MMBitmapRef needle, MMBitmapRef haystack,
+                                 MMRect rect, size_t threadCount)
+{
+	const size_t processorCount = MMProcessorCount();
+	size_t offsetRows;
+
+	if (needle->height > rect.size.height || needle->width > rect.size.width ||
+	    !MMBitmapRectInBounds(haystack, rect)) {
+		return 1;
+	}
+
+	if (threadCount == 0 || threadCount > processorCount) {
+		threadCount = processorCount;
+	}
+	offsetRows = (rect.size.height - needle->height) + 1;
+	return threadCount < offsetRows ? threadCount : offsetRows;
+}
+
+MMPointArrayRef findAllNeedleInRectThreaded(MMNeedleRef needle,
+                                            MMBitmapRef haystack,
+                                            MMRect rect, float tolerance,
+                                            size_t threadCount)
+{
+	const size_t bandCount = bandCountForSearch(needle->bitmap, haystack,
+	                                            rect, threadCount);
+	struct searchBand *bands;
+	MMPointArrayRef pointArray;
+	size_t i, j;
+
+	if (bandCount <= 1 ||
+	    (bands = calloc(bandCount, sizeof(struct searchBand))) == NULL) {
+		return findAllNeedleInRect(needle, haystack, rect, tolerance);
+	}
+
+	searchBandsInParallel(bands, bandCount, needle, haystack,
+	                      rect, tolerance, true);
+
+	/* A band's results are NULL if memory could not be allocated for them. */
+	pointArray = NULL;
+	for (i = 0; i < bandCount; ++i) {
+		if (bands[i].pointArray == NULL) goto cleanup;
+	}
+
+	/* The bands cover disjoint rows of offsets from top to bottom, so
+	 * concatenating them gives row-major order without any duplicates. */
+	if ((pointArray = createMMPointArray(0)) == NULL) goto cleanup;
+	for (i = 0; i < bandCount; ++i) {
+		for (j = 0; j < bands[i].pointArray->count; ++j) {
+			MMPointArrayAppendPoint(pointArray,
+			                        MMPointArrayGetItem(bands[i].pointArray, j));
+		}
+	}
+
+cleanup:
+	for (i = 0; i < bandCount; ++i) {
+		if (bands[i].pointArray != NULL) {
+			destroyMMPointArray(bands[i].pointArray);
+		}
+	}
+
+	free(bands);
+	return pointArray;
+}
+
+size_t countOfNeedleInRectThreaded(MMNeedleRef needle, MMBitmapRef haystack,
+                                   MMRect rect, float tolerance,
+                                   size_t threadCount)
+{
+	const size_t bandCount = bandCountForSearch(needle->bitmap, haystack,
+	                                            rect, threadCount);
+	struct searchBand *bands;
 	size_t count = 0;
-	MMPoint point = MMPointZero;
-	UTHashTable badShiftTable;
+	size_t i;
 
-	initBadShiftTable(&badShiftTable, needle);
-	while (findBitmapInRectAt(needle, haystack, &point, rect,
-	                          tolerance, point, &badShiftTable) == 0) {
-		const size_t scanWidth = (haystack->width - needle->width) + 1;
-		++count;
-		ITER_NEXT_POINT(point, scanWidth, 0);
+	if (bandCount <= 1 ||
+	    (bands = calloc(bandCount, sizeof(struct searchBand))) == NULL) {
+		return countOfNeedleInRect(needle, haystack, rect, tolerance);
+	}
+
+	searchBandsInParallel(bands, bandCount, needle, haystack,
+	                      rect, tolerance, false);
+	for (i = 0; i < bandCount; ++i) {
+		count += bands[i].count;
 	}
-	destroyBadShiftTable(&badShiftTable);
 
+	free(bands);
+	return count;
+}
+
+MMPointArrayRef findAllBitmapInRectThreaded(MMBitmapRef needle,
+                                            MMBitmapRef haystack,
+                                            MMRect rect, float tolerance,
+                                            size_t threadCount)
+{
+	MMNeedle compiled;
+	MMPointArrayRef pointArray;
+
+	initNeedle(&compiled, needle);
+	pointArray = findAllNeedleInRectThreaded(&compiled, haystack, rect,
+	                                         tolerance, threadCount);
+	destroyNeedleTables(&compiled);
+	return pointArray;
+}
+
+size_t countOfBitmapInRectThreaded(MMBitmapRef needle, MMBitmapRef haystack,
+                                   MMRect rect, float tolerance,
+                                   size_t threadCount)
+{
+	MMNeedle compiled;
+	size_t count;
+
+	initNeedle(&compiled, needle);
+	count = countOfNeedleInRectThreaded(&compiled, haystack, rect,
+	                                    tolerance, threadCount);
+	destroyNeedleTables(&compiled);
 	return count;
 }
 
 /* --- Boyer-Moore helper functions --- */
 
-static void initBadShiftTable(UTHashTable *jumpTable, MMBitmapRef needle)
+/* Populates |jumpTable| with the shift values for row |row| of |needle|. */
+static void initBadShiftTableForRow(UTHashTable *jumpTable,
+                                    MMBitmapRef needle, size_t row)
 {
-	const MMPoint lastPoint = MMPointMake(needle->width - 1, needle->height - 1);
-	const size_t maxColors = needle->width * needle->height;
-	MMPoint scan;
+	const size_t lastX = needle->width - 1;
+	size_t x;
 
 	/* Allocate max size initially to avoid a million calls to malloc(). */
-	initHashTable(jumpTable, maxColors, sizeof(struct shiftNode));
+	initHashTable(jumpTable, needle->width, sizeof(struct shiftNode));
 
-	/* Populate jumpTable with analysis of |needle|. */
-	for (scan.y = lastPoint.y; ; --scan.y) {
-		for (scan.x = lastPoint.x; ; --scan.x) {
-			MMRGBHex color = MMRGBHexAtPoint(needle, scan.x, scan.y);
-			if (!tableHasKey(jumpTable, color)) {
-				addNodeToTable(jumpTable, color,
-				               MMPointMake(needle->width - scan.x,
-				                           needle->height - scan.y));
-			}
+	/* The last pixel of the row is left out, as its shift would be 0. Scanning
+	 * from right to left ensures each color keeps its rightmost offset. */
+	for (x = lastX; x > 0; --x) {
+		MMRGBHex color = MMRGBHexAtPoint(needle, x - 1, row);
+		if (!tableHasKey(jumpTable, color)) {
+			addNodeToTable(jumpTable, color, lastX - (x - 1));
+		}
+	}
+}
 
-			if (scan.x == 0) break; /* Avoid infinite loop from unsigned type. */
+static void initBadShiftTable(struct badShiftTable *jumpTable,
+                              MMBitmapRef needle)
+{
+	size_t y;
+
+	assert(needle->height > 0);
+
+	/* Keep the table of whichever row has the most distinct colors. */
+	initBadShiftTableForRow(&jumpTable->table, needle, 0);
+	jumpTable->row = 0;
+	for (y = 1; y < needle->height; ++y) {
+		UTHashTable rowTable;
+		initBadShiftTableForRow(&rowTable, needle, y);
+		if (rowTable.nodeCount > jumpTable->table.nodeCount) {
+			destroyHashTable(&jumpTable->table);
+			jumpTable->table = rowTable;
+			jumpTable->row = y;
+		} else {
+			destroyHashTable(&rowTable);
 		}
-		if (scan.y == 0) break;
 	}
 }
 
+static int needleRowAtOffset(MMBitmapRef needle, MMBitmapRef haystack,
+                             MMPoint offset, size_t row)
+{
+	size_t x = needle->width;
+
+	/* Compare right to left, as the rightmost pixel was just used to find
+	 * the offset. */
+	while (x-- > 0) {
+		if (MMRGBHexAtPoint(needle, x, row) !=
+		    MMRGBHexAtPoint(haystack, offset.x + x, offset.y + row)) {
+			return 0;
+		}
+	}
+
+	return 1;
+}
+
 static int needleAtOffset(MMBitmapRef needle, MMBitmapRef haystack,
-                          MMPoint offset, float tolerance)
+                          MMPoint offset, uint32_t maxDistSquared)
 {
 	const MMPoint lastPoint = MMPointMake(needle->width - 1, needle->height - 1);
 	MMPoint scan;
@@ -239,7 +1047,9 @@ static int needleAtOffset(MMBitmapRef needle, MMBitmapRef haystack,
 			MMRGBHex ncolor = MMRGBHexAtPoint(needle, scan.x, scan.y);
 			MMRGBHex hcolor = MMRGBHexAtPoint(haystack, offset.x + scan.x,
 			                                            offset.y + scan.y);
-			if (!MMRGBHexSimilarToColor(ncolor, hcolor, tolerance)) return 0;
+			if (!MMRGBHexWithinDistance(ncolor, hcolor, maxDistSquared)) {
+				return 0;
+			}
 			if (scan.x == 0) break; /* Avoid infinite loop from unsigned type. */
 		}
 		if (scan.y == 0) break;
@@ -248,15 +1058,485 @@ static int needleAtOffset(MMBitmapRef needle, MMBitmapRef haystack,
 	return 1;
 }
 
+/* --- Pyramid search helper functions --- */
+
+/* Sets |cell| to the sums of the |factor| * |factor| block of pixels of
+ * |bitmap| starting at |x|, |y|. */
+static void sumBlock(MMBitmapRef bitmap, size_t x, size_t y, size_t factor,
+                     struct pyramidCell *cell)
+{
+	unsigned int red = 0, green = 0, blue = 0;
+	size_t i, j;
+
+	for (j = 0; j < factor; ++j) {
+		const uint8_t *pixel = (uint8_t *)MMRGBColorRefAtPoint(bitmap, x,
+		                                                       y + j);
+		for (i = 0; i < factor; ++i) {
+			const MMRGBColor *color = (const MMRGBColor *)pixel;
+			red += color->red;
+			green += color->green;
+			blue += color->blue;
+			pixel += bitmap->bytesPerPixel;
+		}
+	}
+
+	cell->red = (uint16_t)red;
+	cell->green = (uint16_t)green;
+	cell->blue = (uint16_t)blue;
+}
+
+static int initNeedleLevel(struct needleLevel *level, MMBitmapRef needle)
+{
+	const size_t factor = level->factor;
+	size_t total = 0;
+	size_t phaseX, phaseY, x, y;
+	struct pyramidCell *cell;
+
+	for (phaseY = 0; phaseY < factor; ++phaseY) {
+		for (phaseX = 0; phaseX < factor; ++phaseX) {
+			struct needlePhase *phase = &level->phases[(phaseY * factor) +
+			                                           phaseX];
+			phase->width = (needle->width - phaseX) / factor;
+			phase->height = (needle->height - phaseY) / factor;
+			total += phase->width * phase->height;
+		}
+	}
+
+	level->cells = malloc(total * sizeof(struct pyramidCell));
+	if (level->cells == NULL) return -1;
+
+	cell = level->cells;
+	for (phaseY = 0; phaseY < factor; ++phaseY) {
+		for (phaseX = 0; phaseX < factor; ++phaseX) {
+			struct needlePhase *phase = &level->phases[(phaseY * factor) +
+			                                           phaseX];
+			phase->cells = cell;
+			for (y = 0; y < phase->height; ++y) {
+				for (x = 0; x < phase->width; ++x) {
+					sumBlock(needle, phaseX + (x * factor),
+					         phaseY + (y * factor), factor, cell++);
+				}
+			}
+		}
+	}
+
+	return 0;
+}
+
+static struct haystackPyramid *initHaystackPyramid(
+	struct haystackPyramid *pyramid, MMNeedleRef needle,
+	MMBitmapRef haystack, MMRect rect)
+{
+	size_t i;
+
+	if (needle->pyramidLevels == 0 ||
+	    needle->bitmap->width > rect.size.width ||
+	    needle->bitmap->height > rect.size.height ||
+	    !MMBitmapRectInBounds(haystack, rect)) {
+		return NULL;
+	}
+
+	pyramid->needleLevels = needle->levels;
+	pyramid->haystack = haystack;
+	pyramid->levelCount = 0;
+
+	for (i = 0; i < needle->pyramidLevels; ++i) {
+		struct haystackLevel *level = &pyramid->levels[i];
+		const size_t factor = needle->levels[i].factor;
+
+		/* The needle only ever covers whole blocks inside |rect|, of which
+		 * there are some, as it has whole blocks at every phase. */
+		level->factor = factor;
+		level->shift = i + 1;
+		level->originX = (rect.origin.x + (factor - 1)) / factor;
+		level->originY = (rect.origin.y + (factor - 1)) / factor;
+		level->width = ((rect.origin.x + rect.size.width) / factor) -
+		               level->originX;
+		level->height = ((rect.origin.y + rect.size.height) / factor) -
+		                level->originY;
+		level->builtRows = 0;
+		level->cells = malloc(level->width * level->height *
+		                      sizeof(struct pyramidCell));
+		if (level->cells == NULL) {
+			destroyHaystackPyramid(pyramid);
+			return NULL;
+		}
+		++pyramid->levelCount;
+	}
+
+	return pyramid;
+}
+
+static void destroyHaystackPyramid(struct haystackPyramid *pyramid)
+{
+	size_t i;
+
+	if (pyramid == NULL) return;
+	for (i = 0; i < pyramid->levelCount; ++i) {
+		free(pyramid->levels[i].cells);
+	}
+}
+
+/* Fills in the first |rows| rows of cells of level |index| of |pyramid|, if
+ * they haven't been already. */
+static void buildHaystackRows(struct haystackPyramid *pyramid, size_t index,
+                              size_t rows)
+{
+	struct haystackLevel *level = &pyramid->levels[index];
+	const struct haystackLevel *below = NULL;
+	size_t x, y;
+
+	if (rows <= level->builtRows) return;
+	assert(rows <= level->height);
+
+	/* Each cell above the first level is the sum of four cells of the level
+	 * below it, which has twice the resolution. */
+	if (index > 0) {
+		below = &pyramid->levels[index - 1];
+		buildHaystackRows(pyramid, index - 1,
+		                  ((level->originY + rows) * 2) - below->originY);
+	}
+
+	for (y = level->builtRows; y < rows; ++y) {
+		struct pyramidCell *cell = level->cells + (y * level->width);
+
+		if (below == NULL) {
+			for (x = 0; x < level->width; ++x) {
+				sumBlock(pyramid->haystack,
+				         (level->originX + x) * level->factor,
+				         (level->originY + y) * level->factor,
+				         level->factor, cell + x);
+			}
+		} else {
+			const struct pyramidCell *top = below->cells +
+				((((level->originY + y) * 2) - below->originY) *
+				 below->width) +
+				((level->originX * 2) - below->originX);
+			const struct pyramidCell *bottom = top + below->width;
+
+			for (x = 0; x < level->width; ++x) {
+				cell[x].red = top[2 * x].red + top[(2 * x) + 1].red +
+				              bottom[2 * x].red + bottom[(2 * x) + 1].red;
+				cell[x].green = top[2 * x].green + top[(2 * x) + 1].green +
+				                bottom[2 * x].green +
+				                bottom[(2 * x) + 1].green;
+				cell[x].blue = top[2 * x].blue + top[(2 * x) + 1].blue +
+				               bottom[2 * x].blue + bottom[(2 * x) + 1].blue;
+			}
+		}
+	}
+
+	level->builtRows = rows;
+}
+
+static bool pyramidMatchesAtOffset(struct haystackPyramid *pyramid,
+                                   MMPoint offset, uint32_t maxDistSquared)
+{
+	size_t index = pyramid->levelCount;
+
+	/* Coarsest level first, as it has the fewest cells to compare. */
+	while (index-- > 0) {
+		const struct haystackLevel *level = &pyramid->levels[index];
+		const size_t factor = level->factor;
+		/* The phase is how far the offset is from the next whole block
+		 * (factor is a power of two, so this is just a mask). */
+		const size_t phaseX = (0 - offset.x) & (factor - 1);
+		const size_t phaseY = (0 - offset.y) & (factor - 1);
+		const struct needlePhase *phase =
+			&pyramid->needleLevels[index].phases[(phaseY << level->shift) +
+			                                     phaseX];
+		const size_t left = ((offset.x + phaseX) >> level->shift) -
+		                    level->originX;
+		const size_t top = ((offset.y + phaseY) >> level->shift) -
+		                   level->originY;
+
+		/* Sums of |factor| squared colors may be that many times as far
+		 * apart as the colors. (This is at most 16^2 times the greatest
+		 * squared distance, so it can't overflow.) */
+		const uint32_t maxCellDistSquared =
+			maxDistSquared * (uint32_t)(factor * factor * factor * factor);
+		const struct pyramidCell *needleCell = phase->cells;
+		size_t x, y;
+
+		buildHaystackRows(pyramid, index, top + phase->height);
+		for (y = 0; y < phase->height; ++y) {
+			const struct pyramidCell *cell = level->cells +
+			                                 ((top + y) * level->width) + left;
+			for (x = 0; x < phase->width; ++x, ++cell, ++needleCell) {
+				const int red = (int)needleCell->red - (int)cell->red;
+				const int green = (int)needleCell->green - (int)cell->green;
+				const int blue = (int)needleCell->blue - (int)cell->blue;
+				if ((uint32_t)((red * red) + (green * green) + (blue * blue)) >
+				    maxCellDistSquared) {
+					return false;
+				}
+			}
+		}
+	}
+
+	return true;
+}
+
+/* --- Rabin-Karp helper functions --- */
+
+/* Returns |base| to the power of |exp| (modulo 2^64). */
+static uint64_t rkPower(uint64_t base, size_t exp)
+{
+	uint64_t result = 1;
+	while (exp-- > 0) result *= base;
+	return result;
+}
+
+static uint64_t needleHash(MMBitmapRef needle)
+{
+	uint64_t hash = 0;
+	size_t y;
+
+	for (y = 0; y < needle->height; ++y) {
+		hash = (hash * RK_COL_BASE) +
+		       rowPrefixHash(needle, 0, y, needle->width);
+	}
+
+	return hash;
+}
+
+static int findAllBitmapExactInRect(MMBitmapRef needle, uint64_t target,
+                                    MMBitmapRef haystack, MMRect rect,
+                                    MMPointArrayRef pointArray, size_t *count)
+{
+	size_t scanWidth, i;
+	uint64_t rowPower, colPower;
+	uint64_t *rowHashes; /* Ring buffer of the row hashes for the last
+	                      * |needle->height| rows. */
+	uint64_t *colHashes; /* Column hashes for the current row of offsets. */
+
+	assert(count != NULL);
+	*count = 0;
+
+	/* Sanity check */
+	if (needle->height > rect.size.height || needle->width > rect.size.width ||
+	    !MMBitmapRectInBounds(haystack, rect)) {
+		return 0;
+	}
+
+	scanWidth = (rect.size.width - needle->width) + 1;
+	rowHashes = malloc(sizeof(uint64_t) * scanWidth * needle->height);
+	colHashes = calloc(scanWidth, sizeof(uint64_t));
+	if (rowHashes == NULL || colHashes == NULL) {
+		if (rowHashes != NULL) free(rowHashes);
+		if (colHashes != NULL) free(colHashes);
+		return -1;
+	}
+
+	rowPower = rkPower(RK_ROW_BASE, needle->width - 1);
+	colPower = rkPower(RK_COL_BASE, needle->height - 1);
+
+	for (i = 0; i < rect.size.height; ++i) {
+		const size_t y = rect.origin.y + i;
+		uint64_t *ring = rowHashes + ((i % needle->height) * scanWidth);
+		uint64_t rowHash = rowPrefixHash(haystack, rect.origin.x, y,
+		                                 needle->width);
+		size_t x;
+
+		for (x = 0; x < scanWidth; ++x) {
+			if (x > 0) { /* Roll the row hash one pixel to the right. */
+				const size_t left = rect.origin.x + x - 1;
+				rowHash = ((rowHash -
+				            (MMRGBHexAtPoint(haystack, left, y) * rowPower)) *
+				           RK_ROW_BASE) +
+				          MMRGBHexAtPoint(haystack, left + needle->width, y);
+			}
+
+			/* Roll the column hash one row down, dropping the row hash that is
+			 * about to be overwritten in the ring buffer. */
+			if (i >= needle->height) {
+				colHashes[x] -= ring[x] * colPower;
+			}
+			colHashes[x] = (colHashes[x] * RK_COL_BASE) + rowHash;
+			ring[x] = rowHash;
+		}
+
+		if (i + 1 >= needle->height) {
+			const MMPoint rowOrigin = MMPointMake(rect.origin.x,
+			                                      y + 1 - needle->height);
+			for (x = 0; x < scanWidth; ++x) {
+				MMPoint offset = rowOrigin;
+				offset.x += x;
+				if (colHashes[x] == target &&
+				    needleAtOffset(needle, haystack, offset, 0)) {
+					if (pointArray != NULL) {
+						MMPointArrayAppendPoint(pointArray, offset);
+					}
+					++*count;
+				}
+			}
+		}
+	}
+
+	free(rowHashes);
+	free(colHashes);
+	return 0;
+}
+
+static uint64_t rowPrefixHash(MMBitmapRef bitmap, size_t x, size_t y,
+                              size_t count)
+{
+	uint64_t hash = 0;
+	const size_t endX = x + count;
+
+	for (; x < endX; ++x) {
+		hash = (hash * RK_ROW_BASE) + MMRGBHexAtPoint(bitmap, x, y);
+	}
+
+	return hash;
+}
+
+/* --- Multiple needle search helper functions --- */
+
+static void destroyPointArrays(MMPointArrayRef *pointArrays, size_t count)
+{
+	size_t i;
+	for (i = 0; i < count; ++i) {
+		destroyMMPointArray(pointArrays[i]);
+		pointArrays[i] = NULL;
+	}
+}
+
+static int findAllBitmapsExactInRect(MMBitmapRef *needles, size_t needleCount,
+                                     MMBitmapRef haystack, MMRect rect,
+                                     MMPointArrayRef *pointArrays)
+{
+	UTHashTable table;
+	struct prefixNode *uttable;
+	size_t *nextNeedle; /* Next needle with the same key, or |needleCount|. */
+	uint8_t *filter;
+	size_t prefixWidth = 0; /* Width of the smallest needle that fits. */
+	uint64_t prefixPower;
+	size_t i, y;
+
+	for (i = 0; i < needleCount; ++i) {
+		if (needles[i]->width <= rect.size.width &&
+		    needles[i]->height <= rect.size.height &&
+		    (prefixWidth == 0 || needles[i]->width < prefixWidth)) {
+			prefixWidth = needles[i]->width;
+		}
+	}
+
+	nextNeedle = malloc(sizeof(size_t) * (needleCount + 1));
+	filter = calloc(PREFIX_FILTER_BITS / 8, 1);
+	if (nextNeedle == NULL || filter == NULL) {
+		if (nextNeedle != NULL) free(nextNeedle);
+		if (filter != NULL) free(filter);
+		return -1;
+	}
+
+	/* Nodes are allocated up front, as uthash keeps pointers to them. */
+	initHashTable(&table, needleCount, sizeof(struct prefixNode));
+	if (table.nodes == NULL) {
+		free(nextNeedle);
+		free(filter);
+		return -1;
+	}
+
+	for (i = 0; i < needleCount; ++i) {
+		if ((pointArrays[i] = createMMPointArray(0)) == NULL) {
+			destroyPointArrays(pointArrays, i);
+			destroyHashTable(&table);
+			free(nextNeedle);
+			free(filter);
+			return -1;
+		}
+	}
+
+	if (prefixWidth == 0 || !MMBitmapRectInBounds(haystack, rect)) {
+		/* No needle fits inside |rect|. */
+		destroyHashTable(&table);
+		free(nextNeedle);
+		free(filter);
+		return 0;
+	}
+
+	/* Chain needles onto the table in reverse, so that each chain lists them
+	 * in order. */
+	i = needleCount;
+	while (i-- > 0) {
+		struct prefixNode *node;
+		uint64_t hash;
+
+		nextNeedle[i] = needleCount;
+		if (needles[i]->width > rect.size.width ||
+		    needles[i]->height > rect.size.height) {
+			continue;
+		}
+
+		hash = rowPrefixHash(needles[i], 0, 0, prefixWidth);
+		uttable = table.uttable;
+		HASH_FIND(hh, uttable, &hash, sizeof(uint64_t), node);
+		if (node == NULL) {
+			node = getNewNode(&table);
+			node->hash = hash;
+			HASH_ADD(hh, uttable, hash, sizeof(uint64_t), node);
+			table.uttable = uttable;
+		} else {
+			nextNeedle[i] = node->needle;
+		}
+		node->needle = i;
+		filter[PREFIX_FILTER_BIT(hash) / 8] |=
+			(uint8_t)(1 << (PREFIX_FILTER_BIT(hash) % 8));
+	}
+
+	prefixPower = rkPower(RK_ROW_BASE, prefixWidth - 1);
+	uttable = table.uttable;
+
+	/* Visit each offset in row-major order, so that the points for each
+	 * needle come out in the same order as findAllBitmapInRect(). */
+	for (y = rect.origin.y; y < rect.origin.y + rect.size.height; ++y) {
+		const size_t lastX = rect.origin.x + (rect.size.width - prefixWidth);
+		uint64_t hash = rowPrefixHash(haystack, rect.origin.x, y, prefixWidth);
+		size_t x;
+
+		for (x = rect.origin.x; ; ++x) {
+			const size_t bit = PREFIX_FILTER_BIT(hash);
+			if ((filter[bit / 8] & (1 << (bit % 8))) != 0) {
+				struct prefixNode *node;
+				HASH_FIND(hh, uttable, &hash, sizeof(uint64_t), node);
+				for (i = (node == NULL) ? needleCount : node->needle;
+				     i < needleCount; i = nextNeedle[i]) {
+					const MMPoint offset = MMPointMake(x, y);
+					if (x + needles[i]->width <=
+					        rect.origin.x + rect.size.width &&
+					    y + needles[i]->height <=
+					        rect.origin.y + rect.size.height &&
+					    needleAtOffset(needles[i], haystack, offset, 0)) {
+						MMPointArrayAppendPoint(pointArrays[i], offset);
+					}
+				}
+			}
+
+			if (x == lastX) break;
+
+			/* Roll the hash one pixel to the right. */
+			hash = ((hash - (MMRGBHexAtPoint(haystack, x, y) * prefixPower)) *
+			        RK_ROW_BASE) +
+			       MMRGBHexAtPoint(haystack, x + prefixWidth, y);
+		}
+	}
+
+	destroyHashTable(&table);
+	free(nextNeedle);
+	free(filter);
+	return 0;
+}
+
 /* --- Hash table helper functions --- */
 
 static void addNodeToTable(UTHashTable *table,
                            MMRGBHex hexColor,
-                           MMPoint offset)
+                           size_t shift)
 {
 	struct shiftNode *node = getNewNode(table);
 	node->color = hexColor;
-	node->offset = offset;
+	node->shift = shift;
 	UTHASHTABLE_ADD_INT(table, color, node, struct shiftNode);
 }
 
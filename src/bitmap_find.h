@@ -6,6 +6,12 @@
 #include "MMBitmap.h"
 #include "MMPointArray.h"
 
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
 /* Convenience wrapper around findBitmapInRect(), where |rect| is the bounds
  * of |haystack|. */
 #define findBitmapInBitmap(needle, haystack, pointPtr, tol) \
@@ -20,6 +26,17 @@
 int findBitmapInRect(MMBitmapRef needle, MMBitmapRef haystack,
                      MMPoint *point, MMRect rect, float tolerance);
 
+/* Like findBitmapInRect(), but first tries the offsets within |radius|
+ * pixels of |hint| (e.g., where |needle| was found last time), nearest first:
+ * each square ring of offsets around |hint| is tried in turn, in the order
+ * they would be scanned. Only if |needle| is not among them is the rest of
+ * |rect| searched, in which case the result is that of findBitmapInRect().
+ *
+ * |hint| is clamped to the offsets at which |needle| fits inside |rect|. */
+int findBitmapNearPointInRect(MMBitmapRef needle, MMBitmapRef haystack,
+                              MMPoint *point, MMRect rect, float tolerance,
+                              MMPoint hint, size_t radius);
+
 /* Convenience wrapper around findAllBitmapInRect(), where |rect| is the bounds
  * of |haystack|. */
 #define findAllBitmapInBitmap(needle, haystack, tolerance) \
@@ -49,4 +66,149 @@ MMPointArrayRef findAllBitmapInRect(MMBitmapRef needle, MMBitmapRef haystack,
 size_t countOfBitmapInRect(MMBitmapRef needle, MMBitmapRef haystack,
                            MMRect rect, float tolerance);
 
+/* Identical to findAllBitmapInRect(), but splits |rect| into up to
+ * |threadCount| horizontal bands that are searched in parallel on native
+ * threads. Bands overlap by the height of |needle| minus one, so that
+ * occurrences spanning two bands are still found. The results are identical
+ * to (and in the same row-major order as) those of findAllBitmapInRect().
+ *
+ * If |threadCount| is 0, one thread is used per processor; no more threads
+ * than that are ever used.
+ *
+ * Returns NULL if memory could not be allocated for the results. */
+MMPointArrayRef findAllBitmapInRectThreaded(MMBitmapRef needle,
+                                            MMBitmapRef haystack,
+                                            MMRect rect, float tolerance,
+                                            size_t threadCount);
+
+/* Identical to countOfBitmapInRect(), but searches |rect| in parallel as
+ * described in findAllBitmapInRectThreaded(). */
+size_t countOfBitmapInRectThreaded(MMBitmapRef needle, MMBitmapRef haystack,
+                                   MMRect rect, float tolerance,
+                                   size_t threadCount);
+
+/* A needle bitmap with its search tables computed ahead of time, so that it
+ * can be searched for repeatedly (e.g., in every frame of a screen capture)
+ * without recomputing them each time. The functions taking an MMNeedleRef
+ * below behave exactly like their MMBitmapRef counterparts. */
+typedef struct _MMNeedle MMNeedle;
+typedef MMNeedle *MMNeedleRef;
+
+/* Returns a new needle for |bitmap| with its search tables computed, or NULL
+ * if memory could not be allocated.
+ *
+ * |bitmap| is not copied; it must not be modified or destroyed before the
+ * needle is. Responsibility for freeing the needle with destroyMMNeedle() is
+ * given to the caller. */
+MMNeedleRef createMMNeedle(MMBitmapRef bitmap);
+
+/* Frees memory occupied by |needle| (but not by its bitmap). */
+void destroyMMNeedle(MMNeedleRef needle);
+
+/* Returns the bitmap |needle| was created for. */
+MMBitmapRef MMNeedleGetBitmap(MMNeedleRef needle);
+
+/* Adds an image pyramid to |needle|: copies of it downsampled 2x and 4x (as
+ * far as it is large enough to have a few pixels at each), made of the sums
+ * of each block of pixels. Searches for it with a nonzero tolerance then
+ * compare the sums of the blocks of the haystack it would cover at each
+ * offset, coarsest first, and only compare the pixels themselves where those
+ * are close enough. This makes fuzzy searches for large needles (e.g., a
+ * dialog) much faster, at the cost of a pass over the haystack to sum its
+ * blocks as the search reaches them.
+ *
+ * An offset is only ruled out by the sums if one of its pixels would have
+ * been, so the results are exactly the same as without the pyramid. Exact
+ * searches do not use it.
+ *
+ * Returns 0 on success, or -1 if memory could not be allocated (in which case
+ * |needle| is left without one). The pyramid may only be added once. */
+int MMNeedleAddPyramid(MMNeedleRef needle);
+
+/* Returns the number of levels in the pyramid of |needle|, or 0 if it has
+ * none (or is too small for any). */
+size_t MMNeedlePyramidLevels(MMNeedleRef needle);
+
+/* An entry in the shift table of a needle: how far the search can skip ahead
+ * on seeing |color| at the end of the row the table was computed for. */
+struct _MMNeedleShift {
+	MMRGBHex color;
+	uint32_t shift;
+};
+
+typedef struct _MMNeedleShift MMNeedleShift;
+
+/* The search tables of a needle, in a form that can be stored (e.g., in a
+ * sprite pack) and later used to create the needle again without computing
+ * them. */
+struct _MMNeedleTables {
+	size_t shiftRow;              /* Row of the needle |shifts| is for. */
+	size_t shiftCount;            /* Number of entries in |shifts|. */
+	const MMNeedleShift *shifts;
+	uint64_t hash;                /* Rolling hash of the whole needle. */
+};
+
+typedef struct _MMNeedleTables MMNeedleTables;
+
+/* Returns the number of entries in the shift table of |needle|. */
+size_t MMNeedleShiftCount(MMNeedleRef needle);
+
+/* Sets |tables| to the search tables of |needle|, copying its shift table to
+ * |shifts|, which must have room for MMNeedleShiftCount() entries. */
+void MMNeedleGetTables(MMNeedleRef needle, MMNeedleTables *tables,
+                       MMNeedleShift *shifts);
+
+/* Returns true if |tables| could belong to a needle of |bitmap|: the shift
+ * table is the one computed from row |tables->shiftRow| of its pixels, and the
+ * hash is that of its pixels. */
+bool MMNeedleTablesMatchBitmap(MMBitmapRef bitmap,
+                               const MMNeedleTables *tables);
+
+/* Like createMMNeedle(), but uses |tables| (as returned by MMNeedleGetTables()
+ * for a needle of the same bitmap) rather than computing them. The tables are
+ * copied. Returns NULL if memory could not be allocated, or if the tables
+ * could not belong to |bitmap| (see MMNeedleTablesMatchBitmap()). */
+MMNeedleRef createMMNeedleWithTables(MMBitmapRef bitmap,
+                                     const MMNeedleTables *tables);
+
+int findNeedleInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                     MMPoint *point, MMRect rect, float tolerance);
+
+int findNeedleNearPointInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                              MMPoint *point, MMRect rect, float tolerance,
+                              MMPoint hint, size_t radius);
+
+MMPointArrayRef findAllNeedleInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                                    MMRect rect, float tolerance);
+
+size_t countOfNeedleInRect(MMNeedleRef needle, MMBitmapRef haystack,
+                           MMRect rect, float tolerance);
+
+MMPointArrayRef findAllNeedleInRectThreaded(MMNeedleRef needle,
+                                            MMBitmapRef haystack,
+                                            MMRect rect, float tolerance,
+                                            size_t threadCount);
+
+size_t countOfNeedleInRectThreaded(MMNeedleRef needle, MMBitmapRef haystack,
+                                   MMRect rect, float tolerance,
+                                   size_t threadCount);
+
+/* Finds all occurrences of each of the |needleCount| bitmaps in |needles| in
+ * |haystack| inside of |rect|, setting |pointArrays|[i] (which must have room
+ * for |needleCount| elements) to an MMPointArray of the occurrences of
+ * |needles|[i], in the same order findAllBitmapInRect() would give them.
+ *
+ * For exact searches (|tolerance| of 0), all needles are found in a single
+ * pass over |haystack|: each offset is looked up in a table of the needles
+ * keyed by a hash of the start of their first row, and only the needles it
+ * turns up are compared pixel by pixel. Otherwise, each needle is searched
+ * for in turn.
+ *
+ * Returns 0 on success, or -1 if memory could not be allocated (in which case
+ * no point arrays are left in |pointArrays|). Responsibility for freeing each
+ * MMPointArray with destroyMMPointArray() is given to the caller. */
+int findAllBitmapsInRect(MMBitmapRef *needles, size_t needleCount,
+                         MMBitmapRef haystack, MMRect rect, float tolerance,
+                         MMPointArrayRef *pointArrays);
+
 #endif /* BITMAP_H */
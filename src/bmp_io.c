@@ -1,8 +1,11 @@
 #include "bmp_io.h"
 #include "os.h"
 #include "endian.h"
+#include "file_map.h"
 #include <stdio.h> /* fopen() */
 #include <string.h> /* memcpy() */
+#include <stdlib.h> /* malloc() */
+
 
 #if defined(_MSC_VER)
 	#include "ms_stdbool.h"
@@ -111,10 +114,16 @@ static void convertBitmapInfoHeader(struct BITMAP_INFO_HEADER *header)
 	#define convertBitmapInfoHeader(header)
 #endif
 
-/* Returns newly alloc'd image data from bitmap file. The current position of
- * the file must be at the start of the image before calling this. */
-static uint8_t *readImageData(FILE *fp, size_t width, size_t height,
-                              uint8_t bytesPerPixel, size_t bytewidth);
+/* The parts of the headers of a BMP file needed to read its pixel data. */
+struct BMPImageInfo {
+	size_t width;
+	size_t height;
+	bool bottomUp;       /* Whether the last row is stored first. */
+	uint8_t bitsPerPixel;
+	uint8_t bytesPerPixel;
+	size_t rowLength;    /* Bytes per row in the file, including padding. */
+	size_t imageOffset;  /* Offset of the pixel data in the file. */
+};
 
 /* Copys image buffer from |bitmap| to |dest| in BGR format. */
 static void copyBGRDataFromMMBitmap(MMBitmapRef bitmap, uint8_t *dest);
@@ -136,30 +145,30 @@ const char *MMBMPReadErrorString(MMIOError error)
 			return "Unsupported file compression in BMP file";
 		case kBMPInvalidPixelDataError:
 			return "Could not read BMP pixel data";
+		case kBMPReadError:
+			return "Could not read file";
 		default:
 			return NULL;
 	}
 }
 
-MMBitmapRef newMMBitmapFromBMP(const char *path, MMBMPReadError *err)
+/* Parses the headers of the BMP file data in |data|, and checks that it is
+ * of a supported type and holds all of its pixel data. Returns false and sets
+ * |err| (if it is non-NULL) if not. */
+static bool parseBMPHeaders(const uint8_t *data, size_t len,
+                            struct BMPImageInfo *info, MMBMPReadError *err)
 {
-	FILE *fp;
-	struct BITMAP_FILE_HEADER fileHeader = {0}; /* Initialize elements to 0. */
-	struct BITMAP_INFO_HEADER dibHeader = {0};
+	struct BITMAP_FILE_HEADER fileHeader;
+	struct BITMAP_INFO_HEADER dibHeader = {0}; /* Initialize elements to 0. */
 	uint32_t headerSize = 0;
-	uint8_t bytesPerPixel;
-	size_t bytewidth;
-	uint8_t *imageBuf;
+	const size_t dibOffset = sizeof(fileHeader);
 
-	if ((fp = fopen(path, "rb")) == NULL) {
-		if (err != NULL) *err = kBMPAccessError;
-		return NULL;
+	if (len < dibOffset + sizeof(headerSize)) {
+		if (err != NULL) *err = kBMPInvalidKeyError;
+		return false;
 	}
 
-	/* Initialize error code to generic value. */
-	if (err != NULL) *err = kBMPGenericError;
-
-	if (fread(&fileHeader, sizeof(fileHeader), 1, fp) == 0) goto bail;
+	memcpy(&fileHeader, data, sizeof(fileHeader));
 
 	/* Convert from little-endian if it's not already. */
 	convertBitmapFileHeader(&fileHeader);
@@ -167,87 +176,219 @@ MMBitmapRef newMMBitmapFromBMP(const char *path, MMBMPReadError *err)
 	/* First two bytes should always be 0x4D42. */
 	if (fileHeader.magic != BMP_MAGIC) {
 		if (err != NULL) *err = kBMPInvalidKeyError;
-		goto bail;
+		return false;
 	}
 
 	/* Get header size. */
-	if (fread(&headerSize, sizeof(headerSize), 1, fp) == 0) goto bail;
+	memcpy(&headerSize, data + dibOffset, sizeof(headerSize));
 	headerSize = swapLittleAndHost32(headerSize);
 
-	/* Back up before reading header. */
-	if (fseek(fp, -(long)sizeof(headerSize), SEEK_CUR) < 0) goto bail;
-
-	if (headerSize == 12) { /* OS/2 v1 header */
-		struct BITMAP_CORE_HEADER coreHeader = {0};
-		if (fread(&coreHeader, sizeof(coreHeader), 1, fp) == 0) goto bail;
-
-		dibHeader.width = coreHeader.width;
-		dibHeader.height = coreHeader.height;
-		dibHeader.colorPlanes = coreHeader.colorPlanes;
-		dibHeader.bitsPerPixel = coreHeader.bitsPerPixel;
-	} else if (headerSize == 40 || headerSize == 108 || headerSize == 124) {
+	if (headerSize == 12 &&
+	    len >= dibOffset + sizeof(struct BITMAP_CORE_HEADER)) {
+		/* OS/2 v1 header */
+		struct BITMAP_CORE_HEADER coreHeader;
+		memcpy(&coreHeader, data + dibOffset, sizeof(coreHeader));
+
+		dibHeader.width = swapLittleAndHost16(coreHeader.width);
+		dibHeader.height = swapLittleAndHost16(coreHeader.height);
+		dibHeader.colorPlanes = swapLittleAndHost16(coreHeader.colorPlanes);
+		dibHeader.bitsPerPixel = swapLittleAndHost16(coreHeader.bitsPerPixel);
+	} else if ((headerSize == 40 || headerSize == 108 || headerSize == 124) &&
+	           len >= dibOffset + headerSize) {
 		/* Windows v3/v4/v5 header */
 		/* Read only the common part (v3) and skip over the rest. */
-		if (fread(&dibHeader, sizeof(dibHeader), 1, fp) == 0) goto bail;
+		memcpy(&dibHeader, data + dibOffset, sizeof(dibHeader));
+		convertBitmapInfoHeader(&dibHeader);
 	} else {
 		if (err != NULL) *err = kBMPUnsupportedHeaderError;
-		goto bail;
+		return false;
 	}
 
-	convertBitmapInfoHeader(&dibHeader);
-
 	if (dibHeader.colorPlanes != 1) {
 		if (err != NULL) *err = kBMPInvalidColorPanesError;
-		goto bail;
+		return false;
 	}
 
 	/* Currently only 24-bit and 32-bit are supported. */
 	if (dibHeader.bitsPerPixel != 24 && dibHeader.bitsPerPixel != 32) {
 		if (err != NULL) *err = kBMPUnsupportedColorDepthError;
-		goto bail;
+		return false;
 	}
 
 	if (dibHeader.compression != kBMP_RGB) {
 		if (err != NULL) *err = kBMPUnsupportedCompressionError;
-		goto bail;
+		return false;
 	}
 
-	/* This can happen because we don't fully parse Windows v4/v5 headers. */
-	if (ftell(fp) != (long)fileHeader.imageOffset) {
-		fseek(fp, fileHeader.imageOffset, SEEK_SET);
+	if (dibHeader.width <= 0 || dibHeader.height == 0) {
+		if (err != NULL) *err = kBMPInvalidPixelDataError;
+		return false;
+	}
+
+	/* A negative height indicates that the image is stored top-down; i.e.,
+	 * the way we store our bitmaps. Otherwise it is bottom-up. */
+	info->width = (size_t)dibHeader.width;
+	info->bottomUp = dibHeader.height > 0;
+	info->height = info->bottomUp ? (size_t)dibHeader.height
+	                              : (size_t)-(int64_t)dibHeader.height;
+	info->bitsPerPixel = (uint8_t)dibHeader.bitsPerPixel;
+	info->bytesPerPixel = info->bitsPerPixel / 8;
+
+	/* Rows of BMP files are always aligned to 4 bytes. */
+	info->rowLength = ((info->width * info->bytesPerPixel) + 3) & ~3;
+	info->imageOffset = fileHeader.imageOffset;
+
+	/* Make sure all of the pixel data is there (checking without
+	 * multiplying, so this can't overflow). */
+	if (info->imageOffset > len ||
+	    (len - info->imageOffset) / info->rowLength < info->height) {
+		if (err != NULL) *err = kBMPInvalidPixelDataError;
+		return false;
 	}
 
+	return true;
+}
+
+MMBitmapRef newMMBitmapFromBMPData(const uint8_t *data, size_t len,
+                                   MMBMPReadError *err)
+{
+	struct BMPImageInfo info;
+	size_t bytewidth;
+	uint8_t *imageBuf;
+	size_t y;
+
+	/* Initialize error code to generic value. */
+	if (err != NULL) *err = kBMPGenericError;
+
+	if (!parseBMPHeaders(data, len, &info, err)) return NULL;
+
 	/* Get bytes per row, including padding. */
-	bytesPerPixel = dibHeader.bitsPerPixel / 8;
-	bytewidth = ADD_PADDING(dibHeader.width * bytesPerPixel);
+	bytewidth = ADD_PADDING(info.width * info.bytesPerPixel);
+	imageBuf = calloc(1, bytewidth * info.height);
+	if (imageBuf == NULL) return NULL;
+
+	/* Copy the image row by row, flipping it as we go if it is bottom-up. */
+	for (y = 0; y < info.height; ++y) {
+		const size_t row = info.bottomUp ? info.height - y - 1 : y;
+		const uint8_t *src = data + info.imageOffset + (row * info.rowLength);
+		uint8_t *dest = imageBuf + (y * bytewidth);
+
+		if (MMRGB_IS_BGR) { /* No conversion needed. */
+			memcpy(dest, src, info.width * info.bytesPerPixel);
+		} else { /* Convert from BGR. */
+			size_t x;
+			for (x = 0; x < info.width; ++x) {
+				MMRGBColor *color = (MMRGBColor *)dest;
 
-	imageBuf = readImageData(fp, dibHeader.width, abs(dibHeader.height),
-	                         bytesPerPixel, bytewidth);
-	fclose(fp);
+				/* BMP files are stored in BGR format. */
+				color->blue = src[0];
+				color->green = src[1];
+				color->red = src[2];
+				src += info.bytesPerPixel;
+				dest += info.bytesPerPixel;
+			}
+		}
+	}
 
-	if (imageBuf == NULL) {
-		if (err != NULL) *err = kBMPInvalidPixelDataError;
+	return createMMBitmap(imageBuf, info.width, info.height, bytewidth,
+	                      info.bitsPerPixel, info.bytesPerPixel);
+}
+
+MMBitmapRef newMMBitmapFromBMP(const char *path, MMBMPReadError *err)
+{
+	FILE *fp;
+	long len;
+	uint8_t *data = NULL;
+	MMBitmapRef bitmap = NULL;
+
+	if ((fp = fopen(path, "rb")) == NULL) {
+		if (err != NULL) *err = kBMPAccessError;
 		return NULL;
 	}
 
-	/* A negative height indicates that the image is flipped.
-	 *
-	 * We store our bitmaps as "flipped" according to the BMP format; i.e., (0, 0)
-	 * is the top left, not bottom left. So we only need to flip the bitmap if
-	 * the height is NOT negative. */
-	if (dibHeader.height < 0) {
-		dibHeader.height = -dibHeader.height;
+	/* Read in the whole file and parse it from memory. */
+	if (fseek(fp, 0, SEEK_END) != 0 || (len = ftell(fp)) < 0 ||
+	    fseek(fp, 0, SEEK_SET) != 0 ||
+	    (data = malloc(len == 0 ? 1 : (size_t)len)) == NULL ||
+	    fread(data, 1, (size_t)len, fp) != (size_t)len) {
+		if (err != NULL) *err = kBMPReadError;
 	} else {
-		flipBitmapData(imageBuf, dibHeader.width, dibHeader.height, bytewidth);
+		bitmap = newMMBitmapFromBMPData(data, (size_t)len, err);
 	}
 
-	return createMMBitmap(imageBuf, dibHeader.width, dibHeader.height,
-	                      bytewidth, (uint8_t)dibHeader.bitsPerPixel,
-	                      bytesPerPixel);
-
-bail:
+	free(data);
 	fclose(fp);
-	return NULL;
+	return bitmap;
+}
+
+/* Release function for bitmaps created by newMMBitmapFromMappedBMP(). */
+static void releaseBMPFileMapping(uint8_t *buffer, void *info)
+{
+	MMFileMapping *mapping = info;
+	unmapFile(mapping);
+	free(mapping);
+}
+
+MMBitmapRef newMMBitmapFromMappedBMP(const char *path, MMBMPReadError *err)
+{
+	MMFileMapping *mapping;
+	struct BMPImageInfo info;
+	uint8_t *firstRow;
+	ptrdiff_t bytewidth;
+	MMBitmapRef bitmap;
+
+	/* Initialize error code to generic value. */
+	if (err != NULL) *err = kBMPGenericError;
+
+	if ((mapping = malloc(sizeof(*mapping))) == NULL) return NULL;
+	switch (mapFile(path, mapping)) {
+		case kMMFileMapNoError:
+			break;
+		case kMMFileMapAccessError:
+			if (err != NULL) *err = kBMPAccessError;
+			free(mapping);
+			return NULL;
+		case kMMFileMapEmptyError: /* Empty files aren't bitmaps. */
+			if (err != NULL) *err = kBMPInvalidKeyError;
+			free(mapping);
+			return NULL;
+		default:
+			if (err != NULL) *err = kBMPReadError;
+			free(mapping);
+			return NULL;
+	}
+
+	/* The pixels can only be used in place if they are in our byte order;
+	 * otherwise convert them as usual. */
+	if (!MMRGB_IS_BGR) {
+		bitmap = newMMBitmapFromBMPData(mapping->data, mapping->len, err);
+		releaseBMPFileMapping(NULL, mapping);
+		return bitmap;
+	}
+
+	if (!parseBMPHeaders(mapping->data, mapping->len, &info, err)) {
+		releaseBMPFileMapping(NULL, mapping);
+		return NULL;
+	}
+
+	/* Rather than flipping bottom-up images, start at their last row and
+	 * step backwards through memory. */
+	firstRow = mapping->data + info.imageOffset;
+	bytewidth = (ptrdiff_t)info.rowLength;
+	if (info.bottomUp) {
+		firstRow += (info.height - 1) * info.rowLength;
+		bytewidth = -bytewidth;
+	}
+
+	bitmap = createMMBitmap(firstRow, info.width, info.height, bytewidth,
+	                        info.bitsPerPixel, info.bytesPerPixel);
+	if (bitmap == NULL) {
+		releaseBMPFileMapping(NULL, mapping);
+		return NULL;
+	}
+
+	MMBitmapSetReleaseFunc(bitmap, &releaseBMPFileMapping, mapping);
+	return bitmap;
 }
 
 uint8_t *createBitmapData(MMBitmapRef bitmap, size_t *len)
@@ -320,61 +461,17 @@ int saveMMBitmapAsBMP(MMBitmapRef bitmap, const char *path)
 	return 0;
 }
 
-static uint8_t *readImageData(FILE *fp, size_t width, size_t height,
-                              uint8_t bytesPerPixel, size_t bytewidth)
-{
-	size_t imageSize = bytewidth * height;
-	uint8_t *imageBuf = calloc(1, imageSize);
-
-	if (MMRGB_IS_BGR && (bytewidth % 4) == 0) { /* No conversion needed. */
-		if (fread(imageBuf, imageSize, 1, fp) == 0) {
-			free(imageBuf);
-			return NULL;
-		}
-	} else { /* Convert from BGR with 4-byte alignment. */
-		uint8_t *row = malloc(bytewidth);
-		size_t y;
-		const size_t bmp_bytewidth = (width * bytesPerPixel + 3) & ~3;
-
-		if (row == NULL) return NULL;
-		assert(bmp_bytewidth <= bytewidth);
-
-		/* Read image data row by row. */
-		for (y = 0; y < height; ++y) {
-			const size_t rowOffset = y * bytewidth;
-			size_t x;
-			uint8_t *rowptr = row;
-			if (fread(row, bmp_bytewidth, 1, fp) == 0) {
-				free(imageBuf);
-				free(row);
-				return NULL;
-			}
-
-			for (x = 0; x < width; ++x) {
-				const size_t colOffset = x * bytesPerPixel;
-				MMRGBColor *color = (MMRGBColor *)(imageBuf +
-				                                   rowOffset + colOffset);
-
-				/* BMP files are stored in BGR format. */
-				color->blue = rowptr[0];
-				color->green = rowptr[1];
-				color->red = rowptr[2];
-				rowptr += bytesPerPixel;
-			}
-		}
-
-		free(row);
-	}
-
-	return imageBuf;
-}
-
 static void copyBGRDataFromMMBitmap(MMBitmapRef bitmap, uint8_t *dest)
 {
-	if (MMRGB_IS_BGR && (bitmap->bytewidth % 4) == 0) { /* No conversion needed. */
-		memcpy(dest, bitmap->imageBuffer, bitmap->bytewidth * bitmap->height);
+	const size_t bytewidth = (bitmap->width * bitmap->bytesPerPixel + 3) & ~3;
+
+	/* The rows can only be copied in one go if they are padded exactly as in
+	 * a BMP file; a view's rows, for one, have the stride of its parent, and a
+	 * mapped bitmap's may be stored bottom-up. */
+	if (MMRGB_IS_BGR && bitmap->bytewidth == (ptrdiff_t)bytewidth) {
+		/* No conversion needed. */
+		memcpy(dest, bitmap->imageBuffer, bytewidth * bitmap->height);
 	} else { /* Convert to RGB with other-than-4-byte alignment. */
-		const size_t bytewidth = (bitmap->width * bitmap->bytesPerPixel + 3) & ~3;
 		size_t y;
 
 		/* Copy image data row by row. */
@@ -13,7 +13,8 @@ enum _BMPReadError {
 	kBMPInvalidColorPanesError,
 	kBMPUnsupportedColorDepthError,
 	kBMPUnsupportedCompressionError,
-	kBMPInvalidPixelDataError
+	kBMPInvalidPixelDataError,
+	kBMPReadError
 };
 
 typedef MMIOError MMBMPReadError;
@@ -35,6 +36,23 @@ const char *MMBMPReadErrorString(MMIOError error);
  * Responsibility for destroy()'ing returned MMBitmap is left up to caller. */
 MMBitmapRef newMMBitmapFromBMP(const char *path, MMBMPReadError *error);
 
+/* Like newMMBitmapFromBMP(), but reads the BMP file data from the |len| bytes
+ * at |data| rather than from a file. */
+MMBitmapRef newMMBitmapFromBMPData(const uint8_t *data, size_t len,
+                                   MMBMPReadError *error);
+
+/* Like newMMBitmapFromBMP(), but maps the file into memory read-only and uses
+ * its pixels in place rather than copying them, so loading takes the same
+ * time regardless of the size of the image, and processes mapping the same
+ * file share its pages. Bottom-up images (the usual kind) are given a negative
+ * bytewidth rather than being flipped. The file is unmapped when the bitmap
+ * is destroyed.
+ *
+ * If the pixels in the file are not in the order we store them in, they are
+ * copied as newMMBitmapFromBMP() would. The pixels of the returned bitmap
+ * must not be modified. */
+MMBitmapRef newMMBitmapFromMappedBMP(const char *path, MMBMPReadError *error);
+
 /* Returns a buffer containing the raw BMP file data in Windows v3 BMP format,
  * ready to be saved to a file. If |len| is not NULL, it will be set to the
  * number of bytes allocated in the returned buffer.
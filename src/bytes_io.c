@@ -0,0 +1,206 @@
+#include "bytes_io.h"
+#include "zlib_util.h"
+#include <stdlib.h>
+#include <string.h>
+#include <assert.h>
+
+#define MMBITMAP_BYTES_VERSION 1
+
+static const uint8_t kMagic[4] = {'M', 'M', 'B', 'M'};
+
+const char *MMBitmapBytesErrorString(MMBitmapBytesError err)
+{
+	switch (err) {
+		case kMMBitmapBytesInvalidHeaderError:
+			return "Invalid header for bitmap data";
+		case kMMBitmapBytesUnsupportedCodecError:
+			return "Unsupported codec for bitmap data";
+		case kMMBitmapBytesDecompressError:
+			return "Error decompressing bitmap data";
+		case kMMBitmapBytesSizeError:
+			return "Bitmap data not of expected size";
+		case kMMBitmapBytesCompressError:
+			return "Error compressing bitmap data";
+		case kMMBitmapBytesTooLargeError:
+			return "Bitmap is too large to serialize";
+		default:
+			return NULL;
+	}
+}
+
+/* The header is written a byte at a time so that it is the same regardless
+ * of the host's byte order or struct packing. */
+static void writeLittleEndian32(uint8_t *dest, uint32_t value)
+{
+	dest[0] = (uint8_t)(value & 0xFF);
+	dest[1] = (uint8_t)((value >> 8) & 0xFF);
+	dest[2] = (uint8_t)((value >> 16) & 0xFF);
+	dest[3] = (uint8_t)((value >> 24) & 0xFF);
+}
+
+static uint32_t readLittleEndian32(const uint8_t *src)
+{
+	return (uint32_t)src[0] | ((uint32_t)src[1] << 8) |
+	       ((uint32_t)src[2] << 16) | ((uint32_t)src[3] << 24);
+}
+
+/* Returns the number of bytes of pixel data in |bitmap| without padding. */
+static size_t packedLength(MMBitmapRef bitmap)
+{
+	return bitmap->width * bitmap->bytesPerPixel * bitmap->height;
+}
+
+/* Copies the rows of |bitmap| into |dest| with the padding removed. */
+static void copyPackedRows(MMBitmapRef bitmap, uint8_t *dest)
+{
+	const size_t rowLength = bitmap->width * bitmap->bytesPerPixel;
+	size_t y;
+
+	if ((ptrdiff_t)rowLength == bitmap->bytewidth) {
+		memcpy(dest, bitmap->imageBuffer, rowLength * bitmap->height);
+		return;
+	}
+
+	for (y = 0; y < bitmap->height; ++y) {
+		memcpy(dest + (y * rowLength),
+		       MMRGBColorRefAtPoint(bitmap, 0, y), rowLength);
+	}
+}
+
+size_t MMBitmapBytesMaxLength(MMBitmapRef bitmap, MMBitmapBytesCodec codec)
+{
+	const size_t len = packedLength(bitmap);
+	return MMBITMAP_BYTES_HEADER_LENGTH +
+	       (codec == kMMBitmapBytesZlibCodec ? zlib_compress_bound(len) : len);
+}
+
+size_t writeMMBitmapBytes(MMBitmapRef bitmap, MMBitmapBytesCodec codec,
+                          int level, uint8_t *buffer, size_t buflen,
+                          MMBitmapBytesError *err)
+{
+	const size_t len = packedLength(bitmap);
+	uint8_t *data = buffer + MMBITMAP_BYTES_HEADER_LENGTH;
+	size_t datalen = buflen - MMBITMAP_BYTES_HEADER_LENGTH;
+
+	assert(bitmap != NULL && bitmap->imageBuffer != NULL);
+	assert(buffer != NULL);
+
+	if (codec != kMMBitmapBytesRawCodec && codec != kMMBitmapBytesZlibCodec) {
+		if (err != NULL) *err = kMMBitmapBytesUnsupportedCodecError;
+		return 0;
+	} else if (bitmap->width > UINT32_MAX || bitmap->height > UINT32_MAX) {
+		if (err != NULL) *err = kMMBitmapBytesTooLargeError;
+		return 0;
+	} else if (buflen < MMBITMAP_BYTES_HEADER_LENGTH ||
+	           (codec == kMMBitmapBytesRawCodec && datalen < len)) {
+		if (err != NULL) *err = kMMBitmapBytesSizeError;
+		return 0;
+	}
+
+	memcpy(buffer, kMagic, sizeof(kMagic));
+	buffer[4] = MMBITMAP_BYTES_VERSION;
+	buffer[5] = codec;
+	buffer[6] = bitmap->bitsPerPixel;
+	buffer[7] = bitmap->bytesPerPixel;
+	writeLittleEndian32(buffer + 8, (uint32_t)bitmap->width);
+	writeLittleEndian32(buffer + 12, (uint32_t)bitmap->height);
+
+	if (codec == kMMBitmapBytesRawCodec) {
+		copyPackedRows(bitmap, data);
+		datalen = len;
+	} else {
+		uint8_t *packed = bitmap->imageBuffer;
+
+		/* zlib needs the rows back to back; only copy them if they aren't
+		 * already. */
+		if (bitmap->bytewidth !=
+		    (ptrdiff_t)(bitmap->width * bitmap->bytesPerPixel)) {
+			if ((packed = malloc(len)) == NULL) {
+				if (err != NULL) *err = kMMBitmapBytesGenericError;
+				return 0;
+			}
+			copyPackedRows(bitmap, packed);
+		}
+
+		datalen = zlib_compress_into(packed, len, level, data, datalen);
+		if (packed != bitmap->imageBuffer) free(packed);
+
+		if (datalen == 0) {
+			if (err != NULL) *err = kMMBitmapBytesCompressError;
+			return 0;
+		}
+	}
+
+	return MMBITMAP_BYTES_HEADER_LENGTH + datalen;
+}
+
+MMBitmapRef createMMBitmapFromBytes(const uint8_t *buffer, size_t buflen,
+                                    MMBitmapBytesError *err)
+{
+	MMBitmapBytesCodec codec;
+	uint8_t bitsPerPixel, bytesPerPixel;
+	size_t width, height, bytewidth, len;
+	const uint8_t *data = buffer + MMBITMAP_BYTES_HEADER_LENGTH;
+	const size_t datalen = buflen - MMBITMAP_BYTES_HEADER_LENGTH;
+	uint8_t *imageBuffer;
+	MMBitmapRef bitmap;
+
+	if (buflen < MMBITMAP_BYTES_HEADER_LENGTH ||
+	    memcmp(buffer, kMagic, sizeof(kMagic)) != 0 ||
+	    buffer[4] != MMBITMAP_BYTES_VERSION) {
+		if (err != NULL) *err = kMMBitmapBytesInvalidHeaderError;
+		return NULL;
+	}
+
+	codec = buffer[5];
+	bitsPerPixel = buffer[6];
+	bytesPerPixel = buffer[7];
+	width = readLittleEndian32(buffer + 8);
+	height = readLittleEndian32(buffer + 12);
+
+	/* Bitmaps with pixels are never empty (see MMBitmap.h). */
+	if ((bitsPerPixel != 24 && bitsPerPixel != 32) ||
+	    bytesPerPixel != bitsPerPixel / 8 || width == 0 || height == 0) {
+		if (err != NULL) *err = kMMBitmapBytesInvalidHeaderError;
+		return NULL;
+	} else if (codec != kMMBitmapBytesRawCodec &&
+	           codec != kMMBitmapBytesZlibCodec) {
+		if (err != NULL) *err = kMMBitmapBytesUnsupportedCodecError;
+		return NULL;
+	}
+
+	/* Check the dimensions can't overflow before allocating anything. */
+	bytewidth = width * bytesPerPixel;
+	if (bytewidth > ((size_t)-1) / height) {
+		if (err != NULL) *err = kMMBitmapBytesTooLargeError;
+		return NULL;
+	}
+
+	len = bytewidth * height;
+	if (codec == kMMBitmapBytesRawCodec && datalen != len) {
+		if (err != NULL) *err = kMMBitmapBytesSizeError;
+		return NULL;
+	}
+
+	if ((imageBuffer = malloc(len)) == NULL) {
+		if (err != NULL) *err = kMMBitmapBytesGenericError;
+		return NULL;
+	}
+
+	if (codec == kMMBitmapBytesRawCodec) {
+		memcpy(imageBuffer, data, len);
+	} else if (zlib_decompress_into(data, datalen, imageBuffer, len) != 0) {
+		free(imageBuffer);
+		if (err != NULL) *err = kMMBitmapBytesDecompressError;
+		return NULL;
+	}
+
+	bitmap = createMMBitmap(imageBuffer, width, height, (ptrdiff_t)bytewidth,
+	                        bitsPerPixel, bytesPerPixel);
+	if (bitmap == NULL) {
+		free(imageBuffer);
+		if (err != NULL) *err = kMMBitmapBytesGenericError;
+	}
+
+	return bitmap;
+}
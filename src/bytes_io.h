@@ -0,0 +1,79 @@
+#pragma once
+#ifndef BYTES_IO_H
+#define BYTES_IO_H
+
+#include "MMBitmap.h"
+#include "io.h"
+#include <stddef.h>
+
+#if defined(_MSC_VER)
+	#include "ms_stdint.h"
+#else
+	#include <stdint.h>
+#endif
+
+/* Functions for (de)serializing bitmaps in a compact binary format, meant for
+ * passing them between processes quickly rather than for storage.
+ *
+ * The format is a 16-byte header:
+ *
+ *     bytes 0-3:   magic "MMBM"
+ *     byte  4:     format version (currently 1)
+ *     byte  5:     codec of the pixel data (an MMBitmapBytesCodec)
+ *     byte  6:     bits per pixel
+ *     byte  7:     bytes per pixel
+ *     bytes 8-11:  width, as a little-endian unsigned 32-bit integer
+ *     bytes 12-15: height, likewise
+ *
+ * followed by the pixel data: the rows of the bitmap, without padding, in the
+ * bitmap's own pixel format, either as-is or run through zlib. */
+
+#define MMBITMAP_BYTES_HEADER_LENGTH 16
+
+enum _MMBitmapBytesCodec {
+	kMMBitmapBytesRawCodec = 0,
+	kMMBitmapBytesZlibCodec = 1
+};
+
+typedef uint8_t MMBitmapBytesCodec;
+
+enum _MMBitmapBytesError {
+	kMMBitmapBytesGenericError = 0,
+	kMMBitmapBytesInvalidHeaderError,
+	kMMBitmapBytesUnsupportedCodecError,
+	kMMBitmapBytesDecompressError,
+	kMMBitmapBytesSizeError, /* Size does not match header. */
+	kMMBitmapBytesCompressError,
+	kMMBitmapBytesTooLargeError
+};
+
+typedef MMIOError MMBitmapBytesError;
+
+/* Returns the largest number of bytes writeMMBitmapBytes() can produce for
+ * |bitmap| with the given codec. */
+size_t MMBitmapBytesMaxLength(MMBitmapRef bitmap, MMBitmapBytesCodec codec);
+
+/* Serializes |bitmap| into |buffer|, which has room for |buflen| bytes (at
+ * least MMBitmapBytesMaxLength() to be sure it is large enough). |level| is
+ * the zlib compression level (0-9) for kMMBitmapBytesZlibCodec, and is
+ * ignored otherwise.
+ *
+ * Returns the number of bytes written, or 0 on error.
+ * If |error| is non-NULL, it will be set to the error code on return. */
+size_t writeMMBitmapBytes(MMBitmapRef bitmap, MMBitmapBytesCodec codec,
+                          int level, uint8_t *buffer, size_t buflen,
+                          MMBitmapBytesError *error);
+
+/* Inverse of writeMMBitmapBytes().
+ *
+ * Returns NULL on error; follows the Create Rule (that is, the caller is
+ * responsible for destroy'()ing object).
+ * If |error| is non-NULL, it will be set to the error code on return. */
+MMBitmapRef createMMBitmapFromBytes(const uint8_t *buffer, size_t buflen,
+                                    MMBitmapBytesError *error);
+
+/* Returns description of given error code.
+ * Returned string is constant and hence should not be freed. */
+const char *MMBitmapBytesErrorString(MMBitmapBytesError err);
+
+#endif /* BYTES_IO_H */
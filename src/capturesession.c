@@ -0,0 +1,239 @@
+#include "capturesession.h"
+#include "screengrab.h"
+#include <stdlib.h>
+#include <assert.h>
+
+#if defined(USE_X11)
+	#include <X11/Xlib.h>
+	#include <X11/extensions/Xfixes.h>
+	#include <X11/extensions/Xdamage.h>
+#endif
+
+/* Beyond this many damaged rectangles, the bounding box of them all is
+ * grabbed instead, as each screengrab is a round trip to the server. */
+#define MAX_DAMAGE_RECTS 64
+
+struct _MMCaptureSession {
+	MMRect rect;
+	MMScreenGrabberRef grabber;
+	MMRect *changed; /* Rects grabbed by the last refresh. */
+	size_t changedCapacity;
+	size_t frameCapacity; /* Size of the buffer of the frame refreshed. */
+#if defined(USE_X11)
+	/* Connection the damage is reported on; screengrabs go through the
+	 * grabber's own connection. */
+	Display *display;
+	Damage damage; /* None if the server lacks DAMAGE or XFIXES. */
+	XserverRegion region; /* Receives the damage collected on refresh. */
+	int damageEventBase;
+#endif
+};
+
+#if defined(USE_X11)
+
+/* Subscribes |session| to damage on the root window of its display. Returns
+ * false if the server doesn't support it. */
+static bool startTrackingDamage(MMCaptureSessionRef session)
+{
+	Display *display = session->display;
+	int fixesEventBase, errorBase, major, minor;
+
+	/* Regions (which the damage is fetched through) are new in XFIXES 2. */
+	if (!XDamageQueryExtension(display, &session->damageEventBase,
+	                           &errorBase) ||
+	    !XDamageQueryVersion(display, &major, &minor) ||
+	    !XFixesQueryExtension(display, &fixesEventBase, &errorBase) ||
+	    !XFixesQueryVersion(display, &major, &minor) || major < 2) {
+		return false;
+	}
+
+	/* Only one event is sent until the damage is next subtracted; we don't
+	 * need them anyway, as the damage is fetched on each refresh. */
+	session->damage = XDamageCreate(display, XDefaultRootWindow(display),
+	                                XDamageReportNonEmpty);
+	session->region = XFixesCreateRegion(display, NULL, 0);
+	return true;
+}
+
+/* Returns the rectangles damaged since the last call (to be XFree()'d by the
+ * caller), setting |count| to their number, and clears the damage. Returns
+ * NULL if there are none, or on error. */
+static XRectangle *fetchDamage(MMCaptureSessionRef session, int *count)
+{
+	Display *display = session->display;
+	XRectangle bounds;
+	XRectangle *rects;
+	XEvent event;
+
+	XDamageSubtract(display, session->damage, None, session->region);
+	rects = XFixesFetchRegionAndBounds(display, session->region, count,
+	                                   &bounds);
+
+	/* Discard the notifications, so that they don't pile up in the queue. */
+	while (XCheckTypedEvent(display, session->damageEventBase + XDamageNotify,
+	                        &event));
+
+	if (rects != NULL && *count > MAX_DAMAGE_RECTS) {
+		rects[0] = bounds;
+		*count = 1;
+	}
+
+	return rects;
+}
+
+#endif
+
+MMCaptureSessionRef createMMCaptureSession(MMRect rect)
+{
+	MMCaptureSessionRef session = calloc(1, sizeof(MMCaptureSession));
+	if (session == NULL) return NULL;
+
+	session->rect = rect;
+	if ((session->grabber = createMMScreenGrabber()) == NULL) {
+		free(session);
+		return NULL;
+	}
+
+#if defined(USE_X11)
+	if ((session->display = XOpenDisplay(NULL)) == NULL) {
+		destroyMMScreenGrabber(session->grabber);
+		free(session);
+		return NULL;
+	}
+
+	if (!startTrackingDamage(session)) session->damage = None;
+#endif
+
+	return session;
+}
+
+void destroyMMCaptureSession(MMCaptureSessionRef session)
+{
+	assert(session != NULL);
+
+#if defined(USE_X11)
+	if (session->damage != None) {
+		XDamageDestroy(session->display, session->damage);
+		XFixesDestroyRegion(session->display, session->region);
+	}
+	XCloseDisplay(session->display);
+#endif
+
+	destroyMMScreenGrabber(session->grabber);
+	free(session->changed);
+	free(session);
+}
+
+/* Makes room for |count| rects in the changed rects of |session|. Returns 0
+ * on success, or -1 if they could not be allocated. */
+static int reserveChangedRects(MMCaptureSessionRef session, size_t count)
+{
+	if (count > session->changedCapacity) {
+		MMRect *changed = realloc(session->changed, count * sizeof(MMRect));
+		if (changed == NULL) return -1;
+		session->changed = changed;
+		session->changedCapacity = count;
+	}
+	return 0;
+}
+
+int MMCaptureSessionRefresh(MMCaptureSessionRef session, MMBitmapRef frame,
+                            const MMRect **changed, size_t *count)
+{
+	const MMRect rect = session->rect;
+#if defined(USE_X11)
+	XRectangle *rects = NULL;
+	int rectCount = 0;
+	int i;
+#endif
+
+	assert(session != NULL && frame != NULL);
+
+	*changed = session->changed;
+	*count = 0;
+
+#if defined(USE_X11)
+	if (session->damage != None) {
+		/* Collect the damage before grabbing, so that anything drawn while
+		 * grabbing is picked up by the next refresh. */
+		rects = fetchDamage(session, &rectCount);
+	}
+#endif
+
+	if (frame->imageBuffer == NULL || frame->width != rect.size.width ||
+	    frame->height != rect.size.height ||
+	    !MMCaptureSessionTracksDamage(session)) {
+#if defined(USE_X11)
+		if (rects != NULL) XFree(rects);
+#endif
+		if (reserveChangedRects(session, 1) != 0 ||
+		    grabDisplayInRectToBitmap(session->grabber, rect, frame,
+		                              &session->frameCapacity) != 0) {
+			return -1;
+		}
+
+		session->changed[0] = MMRectMake(0, 0, rect.size.width,
+		                                 rect.size.height);
+		*changed = session->changed;
+		*count = 1;
+		return 0;
+	}
+
+#if defined(USE_X11)
+	if (rects == NULL) return 0;
+
+	if (reserveChangedRects(session, (size_t)rectCount) != 0) {
+		XFree(rects);
+		return -1;
+	}
+	*changed = session->changed;
+
+	for (i = 0; i < rectCount; ++i) {
+		/* Clip the damage (in root window coordinates, and possibly off
+		 * screen) to the session's rect. */
+		long left = (long)rect.origin.x;
+		long top = (long)rect.origin.y;
+		long right = (long)(rect.origin.x + rect.size.width);
+		long bottom = (long)(rect.origin.y + rect.size.height);
+		MMRect part;
+
+		if (rects[i].x > left) left = rects[i].x;
+		if (rects[i].y > top) top = rects[i].y;
+		if ((long)rects[i].x + rects[i].width < right) {
+			right = (long)rects[i].x + rects[i].width;
+		}
+		if ((long)rects[i].y + rects[i].height < bottom) {
+			bottom = (long)rects[i].y + rects[i].height;
+		}
+		if (right <= left || bottom <= top) continue;
+
+		part = MMRectMake((size_t)left, (size_t)top,
+		                  (size_t)(right - left), (size_t)(bottom - top));
+		if (grabDisplayInRectIntoBitmap(session->grabber, part, frame,
+		                                MMPointMake(part.origin.x -
+		                                            rect.origin.x,
+		                                            part.origin.y -
+		                                            rect.origin.y)) != 0) {
+			XFree(rects);
+			return -1;
+		}
+
+		part.origin.x -= rect.origin.x;
+		part.origin.y -= rect.origin.y;
+		session->changed[(*count)++] = part;
+	}
+
+	XFree(rects);
+#endif
+
+	return 0;
+}
+
+bool MMCaptureSessionTracksDamage(MMCaptureSessionRef session)
+{
+#if defined(USE_X11)
+	return session->damage != None;
+#else
+	return false;
+#endif
+}
@@ -0,0 +1,58 @@
+#pragma once
+#ifndef CAPTURESESSION_H
+#define CAPTURESESSION_H
+
+#include "types.h"
+#include "MMBitmap.h"
+
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
+/* A capture session keeps a frame of a portion of the display up to date by
+ * only re-reading the parts of it that have changed since it was last
+ * refreshed.
+ *
+ * On X11, changes are tracked with the DAMAGE extension: the server
+ * accumulates the areas of the root window drawn to, and each refresh
+ * collects and clears them, then grabs just those rectangles. Where that is
+ * not available (other platforms, or a server without the extension), every
+ * refresh grabs the whole rect and reports all of it as changed. */
+typedef struct _MMCaptureSession MMCaptureSession;
+typedef MMCaptureSession *MMCaptureSessionRef;
+
+/* Starts tracking changes to |rect| of the display.
+ *
+ * Returns NULL if the session could not be started (e.g., if the display could
+ * not be opened); follows the Create Rule (that is, the caller is responsible
+ * for destroying it with destroyMMCaptureSession()). */
+MMCaptureSessionRef createMMCaptureSession(MMRect rect);
+
+/* Stops tracking changes and releases |session|. */
+void destroyMMCaptureSession(MMCaptureSessionRef session);
+
+/* Brings |frame| up to date with the display. Its buffer is written to in
+ * place (or realloc()'d), so nothing else may be reading it; hand out copies
+ * of it instead. |frame| must not be refreshed by any other session, as the
+ * session keeps track of the size of its buffer.
+ *
+ * If |frame| has no image buffer, is not the size of the session's rect, or
+ * the session doesn't track damage, the whole rect is grabbed into it (its
+ * buffer being realloc()'d if it is too small) and reported as changed.
+ * Otherwise, it must hold an earlier refresh of this session, and only what
+ * has been drawn since the last refresh is grabbed into it.
+ *
+ * On success, returns 0 and sets |changed| to an array of the |count| rects
+ * that were grabbed, relative to the session's rect and not overlapping. The
+ * array belongs to the session and is only valid until the next refresh.
+ * Returns -1 on error, in which case |frame| may have been partly updated. */
+int MMCaptureSessionRefresh(MMCaptureSessionRef session, MMBitmapRef frame,
+                            const MMRect **changed, size_t *count);
+
+/* Returns whether |session| is able to tell which parts of the display
+ * changed, rather than grabbing all of its rect on each refresh. */
+bool MMCaptureSessionTracksDamage(MMCaptureSessionRef session);
+
+#endif /* CAPTURESESSION_H */
@@ -2,18 +2,63 @@
 #include "screen.h"
 #include <stdlib.h>
 
-/* Abstracted, general function to avoid repeated code. */
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
+/* SSE2 is part of the baseline for x86-64 (and is enabled explicitly with
+ * -msse2 or /arch:SSE2 on 32-bit x86), so it can be used without checking
+ * for it at runtime. */
+#if defined(__SSE2__) || defined(_M_X64) || \
+    (defined(_M_IX86_FP) && _M_IX86_FP >= 2)
+	#define COLOR_FIND_SSE2
+	#include <emmintrin.h>
+#endif
+
+/* --- Row scanning functions --- */
+
+/* Returns the index of the first of the |count| pixels starting at |row|
+ * that is within |maxDistSquared| of |color|, or |count| if there is none. */
+static size_t findColorInRow(const uint8_t *row, size_t count,
+                             uint8_t bytesPerPixel, MMRGBHex color,
+                             uint32_t maxDistSquared);
+
+/* Returns the number of the |count| pixels starting at |row| that are within
+ * |maxDistSquared| of |color|. */
+static size_t countColorInRow(const uint8_t *row, size_t count,
+                              uint8_t bytesPerPixel, MMRGBHex color,
+                              uint32_t maxDistSquared);
+
+/* --- --- */
+
+/* Abstracted, general function to avoid repeated code.
+ *
+ * |maxDistSquared| should be computed from the tolerance once per search with
+ * MMRGBMaxDistanceSquared(). */
 static int findColorInRectAt(MMBitmapRef image, MMRGBHex color, MMPoint *point,
-                             MMRect rect, float tolerance, MMPoint startPoint)
+                             MMRect rect, uint32_t maxDistSquared,
+                             MMPoint startPoint)
 {
+	const size_t endX = rect.origin.x + rect.size.width;
+	const size_t endY = rect.origin.y + rect.size.height;
 	MMPoint scan = startPoint;
 	if (!MMBitmapRectInBounds(image, rect)) return -1;
 
-	for (; scan.y < rect.size.height; ++scan.y) {
-		for (; scan.x < rect.size.width; ++scan.x) {
-			MMRGBHex found = MMRGBHexAtPoint(image, scan.x, scan.y);
-			if (MMRGBHexSimilarToColor(color, found, tolerance)) {
-				if (point != NULL) *point = scan;
+	if (scan.y < rect.origin.y) scan = rect.origin;
+	if (scan.x < rect.origin.x) scan.x = rect.origin.x;
+
+	for (; scan.y < endY; ++scan.y) {
+		if (scan.x < endX) {
+			const uint8_t *row = (uint8_t *)MMRGBColorRefAtPoint(image, scan.x,
+			                                                     scan.y);
+			const size_t count = endX - scan.x;
+			const size_t found = findColorInRow(row, count,
+			                                    image->bytesPerPixel,
+			                                    color, maxDistSquared);
+			if (found < count) {
+				if (point != NULL) *point = MMPointMake(scan.x + found, scan.y);
 				return 0;
 			}
 		}
@@ -26,18 +71,91 @@ static int findColorInRectAt(MMBitmapRef image, MMRGBHex color, MMPoint *point,
 int findColorInRect(MMBitmapRef image, MMRGBHex color,
                     MMPoint *point, MMRect rect, float tolerance)
 {
-	return findColorInRectAt(image, color, point, rect, tolerance, rect.origin);
+	return findColorInRectAt(image, color, point, rect,
+	                         MMRGBMaxDistanceSquared(tolerance), rect.origin);
+}
+
+/* Returns true if the pixel of |image| at |point| is within |maxDistSquared|
+ * of |color|. */
+#define colorAtPoint(image, point, color, maxDistSquared) \
+	MMRGBHexWithinDistance(MMRGBHexAtPoint(image, (point).x, (point).y), \
+	                       color, maxDistSquared)
+
+int findColorNearPointInRect(MMBitmapRef image, MMRGBHex color,
+                             MMPoint *point, MMRect rect, float tolerance,
+                             MMPoint hint, size_t radius)
+{
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
+	size_t lastX, lastY, r;
+
+	if (rect.size.width == 0 || rect.size.height == 0 ||
+	    !MMBitmapRectInBounds(image, rect)) {
+		return -1;
+	}
+
+	lastX = rect.origin.x + rect.size.width - 1;
+	lastY = rect.origin.y + rect.size.height - 1;
+
+	if (hint.x < rect.origin.x) hint.x = rect.origin.x;
+	if (hint.x > lastX) hint.x = lastX;
+	if (hint.y < rect.origin.y) hint.y = rect.origin.y;
+	if (hint.y > lastY) hint.y = lastY;
+
+	for (r = 0; r <= radius; ++r) {
+		/* Which sides of the ring are inside |rect|. */
+		const bool hasLeft = hint.x - rect.origin.x >= r;
+		const bool hasRight = lastX - hint.x >= r;
+		const bool hasTop = hint.y - rect.origin.y >= r;
+		const bool hasBottom = lastY - hint.y >= r;
+		const size_t left = hasLeft ? hint.x - r : rect.origin.x;
+		const size_t right = hasRight ? hint.x + r : lastX;
+		const size_t top = hasTop ? hint.y - r : rect.origin.y;
+		const size_t bottom = hasBottom ? hint.y + r : lastY;
+		MMPoint scan;
+
+		/* Once a ring lies entirely outside of |rect|, so do the rest. */
+		if (!hasLeft && !hasRight && !hasTop && !hasBottom) break;
+
+		for (scan.y = top; scan.y <= bottom; ++scan.y) {
+			if ((hasTop && scan.y == top) || (hasBottom && scan.y == bottom)) {
+				for (scan.x = left; scan.x <= right; ++scan.x) {
+					if (colorAtPoint(image, scan, color, maxDistSquared)) {
+						if (point != NULL) *point = scan;
+						return 0;
+					}
+				}
+				continue;
+			}
+
+			/* The rows in between only have the ends of the ring. */
+			scan.x = left;
+			if (hasLeft && colorAtPoint(image, scan, color, maxDistSquared)) {
+				if (point != NULL) *point = scan;
+				return 0;
+			}
+			scan.x = right;
+			if (hasRight && colorAtPoint(image, scan, color, maxDistSquared)) {
+				if (point != NULL) *point = scan;
+				return 0;
+			}
+		}
+	}
+
+	return findColorInRectAt(image, color, point, rect, maxDistSquared,
+	                         rect.origin);
 }
 
 MMPointArrayRef findAllColorInRect(MMBitmapRef image, MMRGBHex color,
                                    MMRect rect, float tolerance)
 {
 	MMPointArrayRef pointArray = createMMPointArray(0);
-	MMPoint point = MMPointZero;
+	MMPoint point = rect.origin;
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
 
-	while (findColorInRectAt(image, color, &point, rect, tolerance, point) == 0) {
+	while (findColorInRectAt(image, color, &point, rect,
+	                         maxDistSquared, point) == 0) {
 		MMPointArrayAppendPoint(pointArray, point);
-		ITER_NEXT_POINT(point, rect.size.width, rect.origin.x);
+		ITER_NEXT_POINT(point, rect.origin.x + rect.size.width, rect.origin.x);
 	}
 
 	return pointArray;
@@ -47,12 +165,180 @@ size_t countOfColorsInRect(MMBitmapRef image, MMRGBHex color, MMRect rect,
                            float tolerance)
 {
 	size_t count = 0;
-	MMPoint point = MMPointZero;
+	size_t y;
+	const uint32_t maxDistSquared = MMRGBMaxDistanceSquared(tolerance);
+
+	if (!MMBitmapRectInBounds(image, rect) || rect.size.width == 0) return 0;
+
+	for (y = rect.origin.y; y < rect.origin.y + rect.size.height; ++y) {
+		const uint8_t *row = (uint8_t *)MMRGBColorRefAtPoint(image,
+		                                                     rect.origin.x, y);
+		count += countColorInRow(row, rect.size.width, image->bytesPerPixel,
+		                         color, maxDistSquared);
+	}
+
+	return count;
+}
+
+/* --- Row scanning functions --- */
+
+/* Returns whether the pixel at |pixel| is within |maxDistSquared| of
+ * |color|. */
+#define PIXEL_MATCHES(pixel, color, maxDistSquared) \
+	MMRGBHexWithinDistance(hexFromMMRGB(*(MMRGBColor *)(pixel)), \
+	                       color, maxDistSquared)
+
+#if defined(COLOR_FIND_SSE2)
+
+/* Bits of _mm_movemask_epi8() set for the first byte of each of the five
+ * 24-bit pixels in a 16-byte vector. */
+#define SSE2_24BIT_PIXEL_BITS 0x1249
+
+/* Returns the index of the lowest set bit in |bits|, which must not be 0. */
+static unsigned int lowestBitIndex(unsigned int bits)
+{
+	unsigned int i = 0;
+	while ((bits & 1) == 0) {
+		bits >>= 1;
+		++i;
+	}
+	return i;
+}
 
-	while (findColorInRectAt(image, color, &point, rect, tolerance, point) == 0) {
-		ITER_NEXT_POINT(point, rect.size.width, rect.origin.x);
-		++count;
+/* Returns the number of bits set in |bits|. */
+static unsigned int bitCount(unsigned int bits)
+{
+	unsigned int count = 0;
+	for (; bits != 0; bits &= bits - 1) ++count;
+	return count;
+}
+
+/* Returns a bitmask with bit (4 * i) set for each 32-bit pixel i of the four
+ * starting at |pixels| that is within |maxDistSquared| of |color|.
+ *
+ * |color| and |limit| should be the color and |maxDistSquared| + 1 broadcast
+ * to each 32-bit lane. */
+static int sse2MatchMask32(const uint8_t *pixels, __m128i color,
+                           __m128i limit, uint32_t maxDistSquared)
+{
+	const __m128i rgbMask = _mm_set1_epi32(0x00FFFFFF);
+	const __m128i v = _mm_and_si128(_mm_loadu_si128((const __m128i *)pixels),
+	                                rgbMask);
+	__m128i zero, lo, hi, dist;
+
+	if (maxDistSquared == 0) {
+		return _mm_movemask_epi8(_mm_cmpeq_epi32(v, color)) & 0x1111;
+	}
+
+	/* Widen each channel to 16 bits, subtract, and square & add the channels
+	 * pairwise with madd, giving (b^2 + g^2, r^2) for each pixel. */
+	color = _mm_and_si128(color, rgbMask);
+	zero = _mm_setzero_si128();
+	lo = _mm_sub_epi16(_mm_unpacklo_epi8(v, zero),
+	                   _mm_unpacklo_epi8(color, zero));
+	hi = _mm_sub_epi16(_mm_unpackhi_epi8(v, zero),
+	                   _mm_unpackhi_epi8(color, zero));
+	lo = _mm_madd_epi16(lo, lo);
+	hi = _mm_madd_epi16(hi, hi);
+
+	/* Sum the pairs and gather them as one distance per pixel. */
+	lo = _mm_add_epi32(lo, _mm_srli_epi64(lo, 32));
+	hi = _mm_add_epi32(hi, _mm_srli_epi64(hi, 32));
+	dist = _mm_unpacklo_epi64(_mm_shuffle_epi32(lo, _MM_SHUFFLE(3, 3, 2, 0)),
+	                          _mm_shuffle_epi32(hi, _MM_SHUFFLE(3, 3, 2, 0)));
+
+	return _mm_movemask_epi8(_mm_cmplt_epi32(dist, limit)) & 0x1111;
+}
+
+/* Returns a bitmask with bit (3 * i) set for each 24-bit pixel i of the five
+ * starting at |pixels| that is exactly |pattern| (the color repeated in BGR
+ * order). Reads 16 bytes. */
+static int sse2MatchMask24(const uint8_t *pixels, __m128i pattern)
+{
+	const int bytes = _mm_movemask_epi8(
+		_mm_cmpeq_epi8(_mm_loadu_si128((const __m128i *)pixels), pattern));
+	return bytes & (bytes >> 1) & (bytes >> 2) & SSE2_24BIT_PIXEL_BITS;
+}
+
+/* Returns the color repeated in BGR order to fill a 16-byte vector. */
+static __m128i sse2Pattern24(MMRGBHex color)
+{
+	const char b = (char)BLUE_FROM_HEX(color);
+	const char g = (char)GREEN_FROM_HEX(color);
+	const char r = (char)RED_FROM_HEX(color);
+	return _mm_setr_epi8(b, g, r, b, g, r, b, g, r, b, g, r, b, g, r, b);
+}
+
+#endif /* COLOR_FIND_SSE2 */
+
+static size_t findColorInRow(const uint8_t *row, size_t count,
+                             uint8_t bytesPerPixel, MMRGBHex color,
+                             uint32_t maxDistSquared)
+{
+	size_t i = 0;
+
+#if defined(COLOR_FIND_SSE2)
+	if (bytesPerPixel == 4) {
+		const __m128i colorv = _mm_set1_epi32((int)color);
+		const __m128i limit = _mm_set1_epi32((int)maxDistSquared + 1);
+		for (; i + 4 <= count; i += 4) {
+			const int mask = sse2MatchMask32(row + (i * 4), colorv, limit,
+			                                 maxDistSquared);
+			if (mask != 0) return i + (lowestBitIndex((unsigned int)mask) / 4);
+		}
+	} else if (bytesPerPixel == 3 && maxDistSquared == 0 &&
+	           color <= MMRGBHEX_MAX) {
+		const __m128i pattern = sse2Pattern24(color);
+
+		/* Each load covers five pixels but reads 16 bytes, one more than
+		 * those pixels occupy; stop early enough to stay inside the row. */
+		for (; i + 6 <= count; i += 5) {
+			const int mask = sse2MatchMask24(row + (i * 3), pattern);
+			if (mask != 0) return i + (lowestBitIndex((unsigned int)mask) / 3);
+		}
+	}
+#endif
+
+	for (; i < count; ++i) {
+		if (PIXEL_MATCHES(row + (i * bytesPerPixel), color, maxDistSquared)) {
+			return i;
+		}
 	}
 
 	return count;
 }
+
+static size_t countColorInRow(const uint8_t *row, size_t count,
+                              uint8_t bytesPerPixel, MMRGBHex color,
+                              uint32_t maxDistSquared)
+{
+	size_t i = 0;
+	size_t found = 0;
+
+#if defined(COLOR_FIND_SSE2)
+	if (bytesPerPixel == 4) {
+		const __m128i colorv = _mm_set1_epi32((int)color);
+		const __m128i limit = _mm_set1_epi32((int)maxDistSquared + 1);
+		for (; i + 4 <= count; i += 4) {
+			const int mask = sse2MatchMask32(row + (i * 4), colorv, limit,
+			                                 maxDistSquared);
+			found += bitCount((unsigned int)mask);
+		}
+	} else if (bytesPerPixel == 3 && maxDistSquared == 0 &&
+	           color <= MMRGBHEX_MAX) {
+		const __m128i pattern = sse2Pattern24(color);
+		for (; i + 6 <= count; i += 5) {
+			found += bitCount((unsigned int)sse2MatchMask24(row + (i * 3),
+			                                                 pattern));
+		}
+	}
+#endif
+
+	for (; i < count; ++i) {
+		if (PIXEL_MATCHES(row + (i * bytesPerPixel), color, maxDistSquared)) {
+			++found;
+		}
+	}
+
+	return found;
+}
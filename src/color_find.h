@@ -20,6 +20,17 @@
 int findColorInRect(MMBitmapRef image, MMRGBHex color, MMPoint *point,
                     MMRect rect, float tolerance);
 
+/* Like findColorInRect(), but first tries the pixels within |radius| pixels
+ * of |hint| (e.g., where the color was found last time), nearest first: each
+ * square ring of pixels around |hint| is tried in turn, in the order they
+ * would be scanned. Only if the color is not among them is the rest of |rect|
+ * searched, in which case the result is that of findColorInRect().
+ *
+ * |hint| is clamped to |rect|. */
+int findColorNearPointInRect(MMBitmapRef image, MMRGBHex color,
+                             MMPoint *point, MMRect rect, float tolerance,
+                             MMPoint hint, size_t radius);
+
 /* Convenience wrapper around findAllRGBInRect(), where |rect| is the bounds of
  * the image. */
 #define findAllColorInImage(image, color, tolerance) \
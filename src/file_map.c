@@ -0,0 +1,77 @@
+#include "file_map.h"
+#include "os.h"
+
+#if !defined(IS_WINDOWS) /* windows.h is included by os.h. */
+	#include <fcntl.h> /* open() */
+	#include <sys/mman.h> /* mmap() */
+	#include <sys/stat.h> /* fstat() */
+	#include <unistd.h> /* close() */
+#endif
+
+MMFileMapError mapFile(const char *path, MMFileMapping *mapping)
+{
+#if defined(IS_WINDOWS)
+	HANDLE file, fileMapping;
+	LARGE_INTEGER size;
+
+	file = CreateFileA(path, GENERIC_READ, FILE_SHARE_READ, NULL,
+	                   OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+	if (file == INVALID_HANDLE_VALUE) return kMMFileMapAccessError;
+
+	if (!GetFileSizeEx(file, &size) || size.QuadPart < 0 ||
+	    (uint64_t)size.QuadPart > (size_t)-1) {
+		CloseHandle(file);
+		return kMMFileMapError;
+	} else if (size.QuadPart == 0) {
+		CloseHandle(file);
+		return kMMFileMapEmptyError;
+	}
+
+	fileMapping = CreateFileMapping(file, NULL, PAGE_READONLY, 0, 0, NULL);
+	CloseHandle(file);
+	if (fileMapping == NULL) return kMMFileMapError;
+
+	/* The view keeps the mapping open until it is unmapped. */
+	mapping->data = MapViewOfFile(fileMapping, FILE_MAP_READ, 0, 0, 0);
+	CloseHandle(fileMapping);
+	if (mapping->data == NULL) return kMMFileMapError;
+
+	mapping->len = (size_t)size.QuadPart;
+	return kMMFileMapNoError;
+#else
+	struct stat st;
+	void *data;
+	int fd;
+
+	if ((fd = open(path, O_RDONLY)) < 0) return kMMFileMapAccessError;
+
+	if (fstat(fd, &st) != 0 || st.st_size < 0 ||
+	    (uint64_t)st.st_size > (size_t)-1) {
+		close(fd);
+		return kMMFileMapError;
+	} else if (st.st_size == 0) {
+		close(fd);
+		return kMMFileMapEmptyError;
+	}
+
+	/* The mapping stays valid after the file is closed. */
+	data = mmap(NULL, (size_t)st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+	close(fd);
+	if (data == MAP_FAILED) return kMMFileMapError;
+
+	mapping->data = data;
+	mapping->len = (size_t)st.st_size;
+	return kMMFileMapNoError;
+#endif
+}
+
+void unmapFile(MMFileMapping *mapping)
+{
+#if defined(IS_WINDOWS)
+	UnmapViewOfFile(mapping->data);
+#else
+	munmap(mapping->data, mapping->len);
+#endif
+	mapping->data = NULL;
+	mapping->len = 0;
+}
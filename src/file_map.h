@@ -0,0 +1,41 @@
+#pragma once
+#ifndef FILE_MAP_H
+#define FILE_MAP_H
+
+#include <stddef.h>
+
+#if defined(_MSC_VER)
+	#include "ms_stdint.h"
+#else
+	#include <stdint.h>
+#endif
+
+/* A whole file mapped read-only into memory. */
+struct _MMFileMapping {
+	uint8_t *data;
+	size_t len;
+};
+
+typedef struct _MMFileMapping MMFileMapping;
+
+enum _MMFileMapError {
+	kMMFileMapNoError = 0,
+	kMMFileMapAccessError, /* The file could not be opened. */
+	kMMFileMapEmptyError,  /* The file is empty, and so can't be mapped. */
+	kMMFileMapError        /* The file could not be mapped. */
+};
+
+typedef int MMFileMapError;
+
+/* Maps the file at |path| into memory read-only, so that its pages are only
+ * read in when they are used and are shared with any other process mapping
+ * the same file. Returns kMMFileMapNoError and fills in |mapping| on success,
+ * or an error code on failure.
+ *
+ * The file must not be modified while it is mapped. */
+MMFileMapError mapFile(const char *path, MMFileMapping *mapping);
+
+/* Unmaps a file mapped by mapFile(). */
+void unmapFile(MMFileMapping *mapping);
+
+#endif /* FILE_MAP_H */
@@ -0,0 +1,186 @@
+#include "find_cache.h"
+#include "UTHashTable.h"
+#include <stdlib.h>
+#include <string.h> /* memcpy(), memset() */
+#include <assert.h>
+
+struct _MMFindCacheEntry {
+	UTHashNode_HEAD
+	MMFindCacheKey key;
+	int ret;
+	MMPoint point;
+};
+
+/* Primes used by the hash below (those of xxHash64, whose rounds it
+ * borrows). */
+#define HASH_PRIME1 UINT64_C(0x9E3779B185EBCA87)
+#define HASH_PRIME2 UINT64_C(0xC2B2AE3D27D4EB4F)
+#define HASH_PRIME3 UINT64_C(0x165667B19E3779F9)
+
+#define ROTL64(x, r) (((x) << (r)) | ((x) >> (64 - (r))))
+
+/* Mixes the 8 bytes at |data| into |acc|. */
+#define HASH_ROUND(acc, data)                          \
+do {                                                   \
+	uint64_t word_;                                    \
+	memcpy(&word_, (data), sizeof(uint64_t));          \
+	(acc) = ROTL64((acc) + (word_ * HASH_PRIME2), 31); \
+	(acc) *= HASH_PRIME1;                              \
+} while (0)
+
+/* Returns a hash of the |len| bytes at |data|, seeded with |seed|.
+ *
+ * Blocks of 32 bytes are mixed into four independent accumulators, so that
+ * the multiplications of each can overlap; a row of a large screengrab is
+ * hashed at several bytes per cycle. */
+static uint64_t hashBytes(uint64_t seed, const uint8_t *data, size_t len)
+{
+	uint64_t acc1 = seed + HASH_PRIME1 + HASH_PRIME2;
+	uint64_t acc2 = seed + HASH_PRIME2;
+	uint64_t acc3 = seed;
+	uint64_t acc4 = seed - HASH_PRIME1;
+	uint64_t hash;
+
+	for (; len >= 32; len -= 32, data += 32) {
+		HASH_ROUND(acc1, data);
+		HASH_ROUND(acc2, data + 8);
+		HASH_ROUND(acc3, data + 16);
+		HASH_ROUND(acc4, data + 24);
+	}
+
+	hash = ROTL64(acc1, 1) + ROTL64(acc2, 7) + ROTL64(acc3, 12) +
+	       ROTL64(acc4, 18) + (uint64_t)len;
+
+	for (; len >= 8; len -= 8, data += 8) {
+		uint64_t word = 0;
+		HASH_ROUND(word, data);
+		hash = (ROTL64(hash ^ word, 27) * HASH_PRIME1) + HASH_PRIME3;
+	}
+	for (; len > 0; --len, ++data) {
+		hash = ROTL64(hash ^ (*data * HASH_PRIME3), 11) * HASH_PRIME1;
+	}
+
+	/* Avalanche, so that every input bit affects every output bit. */
+	hash ^= hash >> 33;
+	hash *= HASH_PRIME2;
+	hash ^= hash >> 29;
+	hash *= HASH_PRIME3;
+	hash ^= hash >> 32;
+	return hash;
+}
+
+/* Returns a hash of the raw pixels of |rect| in |bitmap|, a row at a time. */
+static uint64_t hashBitmapRect(MMBitmapRef bitmap, MMRect rect)
+{
+	const size_t rowLength = rect.size.width * bitmap->bytesPerPixel;
+	uint64_t hash = 0;
+	size_t y;
+
+	for (y = rect.origin.y; y < rect.origin.y + rect.size.height; ++y) {
+		const uint8_t *row = bitmap->imageBuffer +
+		                     (bitmap->bytewidth * (ptrdiff_t)y) +
+		                     (rect.origin.x * bitmap->bytesPerPixel);
+		hash = hashBytes(hash, row, rowLength);
+	}
+
+	return hash;
+}
+
+MMFindCacheRef createMMFindCache(size_t capacity)
+{
+	MMFindCacheRef cache;
+
+	assert(capacity > 0);
+	if ((cache = calloc(1, sizeof(MMFindCache))) == NULL) return NULL;
+
+	cache->capacity = capacity;
+	return cache;
+}
+
+void destroyMMFindCache(MMFindCacheRef cache)
+{
+	assert(cache != NULL);
+
+	while (cache->entries != NULL) {
+		MMFindCacheEntry *entry = cache->entries;
+		HASH_DELETE(hh, cache->entries, entry);
+		free(entry);
+	}
+
+	free(cache);
+}
+
+void MMFindCacheKeyInit(MMFindCacheKey *key, MMFindCacheQuery query,
+                        MMBitmapRef haystack, MMRect rect,
+                        MMBitmapRef needle, MMRGBHex color, float tolerance,
+                        const MMPoint *hint)
+{
+	assert(MMBitmapRectInBounds(haystack, rect));
+
+	/* Keys are compared byte for byte, padding included. */
+	memset(key, 0, sizeof(MMFindCacheKey));
+
+	key->query = (uint8_t)query;
+	key->rect = rect;
+	key->tolerance = tolerance;
+	if (hint != NULL) {
+		key->hint = *hint;
+		key->hinted = 1;
+	}
+	key->bytesPerPixel = haystack->bytesPerPixel;
+	key->regionHash = hashBitmapRect(haystack, rect);
+
+	if (query == kMMFindCacheColorQuery) {
+		key->needleHash = color;
+	} else {
+		key->needleWidth = needle->width;
+		key->needleHeight = needle->height;
+		key->needleBytesPerPixel = needle->bytesPerPixel;
+		key->needleHash = hashBitmapRect(needle, MMBitmapGetBounds(needle));
+	}
+}
+
+bool MMFindCacheLookup(MMFindCacheRef cache, const MMFindCacheKey *key,
+                       int *ret, MMPoint *point)
+{
+	MMFindCacheEntry *entry;
+
+	HASH_FIND(hh, cache->entries, key, sizeof(MMFindCacheKey), entry);
+	if (entry == NULL) {
+		++cache->misses;
+		return false;
+	}
+
+	/* Move it to the end of the table, which is kept in order of use. */
+	HASH_DELETE(hh, cache->entries, entry);
+	HASH_ADD(hh, cache->entries, key, sizeof(MMFindCacheKey), entry);
+
+	++cache->hits;
+	*ret = entry->ret;
+	*point = entry->point;
+	return true;
+}
+
+int MMFindCacheInsert(MMFindCacheRef cache, const MMFindCacheKey *key,
+                      int ret, MMPoint point)
+{
+	MMFindCacheEntry *entry;
+
+	HASH_FIND(hh, cache->entries, key, sizeof(MMFindCacheKey), entry);
+	if (entry != NULL) {
+		HASH_DELETE(hh, cache->entries, entry);
+	} else if (cache->count == cache->capacity) {
+		/* Reuse the least recently used entry, at the start. */
+		entry = cache->entries;
+		HASH_DELETE(hh, cache->entries, entry);
+	} else {
+		if ((entry = malloc(sizeof(MMFindCacheEntry))) == NULL) return -1;
+		++cache->count;
+	}
+
+	memcpy(&entry->key, key, sizeof(MMFindCacheKey));
+	entry->ret = ret;
+	entry->point = point;
+	HASH_ADD(hh, cache->entries, key, sizeof(MMFindCacheKey), entry);
+	return 0;
+}
@@ -0,0 +1,94 @@
+#pragma once
+#ifndef FIND_CACHE_H
+#define FIND_CACHE_H
+
+#include "MMBitmap.h"
+#include "rgb.h"
+
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
+/* A find cache remembers the results of recent searches, keyed by a hash of
+ * the pixels that were searched along with what was searched for, so that
+ * repeating a search over pixels that haven't changed (e.g., in successive
+ * screengrabs of a mostly static display) needn't search again. Only the most
+ * recently used results are kept.
+ *
+ * A 64-bit hash of the pixels stands in for the pixels themselves, so a
+ * result could in principle be returned for different pixels with the same
+ * hash; the odds of that are negligible. */
+
+enum _MMFindCacheQuery {
+	kMMFindCacheColorQuery = 0, /* findColorInRect() */
+	kMMFindCacheBitmapQuery /* findBitmapInRect() */
+};
+
+typedef enum _MMFindCacheQuery MMFindCacheQuery;
+
+/* Identifies a search. Initialize with MMFindCacheKeyInit(). */
+struct _MMFindCacheKey {
+	uint64_t regionHash; /* Hash of the pixels searched. */
+	uint64_t needleHash; /* Hash of the pixels of the needle, or the color. */
+	size_t needleWidth; /* 0 when searching for a color. */
+	size_t needleHeight;
+	MMRect rect;
+	MMPoint hint; /* Where the search started, if |hinted|. */
+	float tolerance;
+	uint8_t bytesPerPixel; /* Of the haystack, as its raw pixels are hashed. */
+	uint8_t needleBytesPerPixel;
+	uint8_t query; /* An MMFindCacheQuery. */
+	uint8_t hinted; /* Whether the search started near |hint|. */
+};
+
+typedef struct _MMFindCacheKey MMFindCacheKey;
+
+typedef struct _MMFindCacheEntry MMFindCacheEntry;
+
+struct _MMFindCache {
+	size_t capacity; /* Greatest number of entries kept. */
+	size_t count;
+	size_t hits; /* Number of lookups that found an entry. */
+	size_t misses; /* Number of lookups that didn't. */
+	MMFindCacheEntry *entries; /* uthash table, least recently used first. */
+};
+
+typedef struct _MMFindCache MMFindCache;
+typedef MMFindCache *MMFindCacheRef;
+
+/* Returns a new, empty cache holding up to |capacity| (at least 1) results,
+ * or NULL if it could not be allocated. Responsibility for destroying it with
+ * destroyMMFindCache() is given to the caller. */
+MMFindCacheRef createMMFindCache(size_t capacity);
+
+/* Frees |cache| and every entry in it. */
+void destroyMMFindCache(MMFindCacheRef cache);
+
+/* Fills in |key| for a search of |rect| in |haystack| (which must be in its
+ * bounds) for |needle|, or for |color| if |query| is kMMFindCacheColorQuery
+ * (in which case |needle| is ignored), with the given |tolerance|, starting
+ * near |hint| unless it is NULL. (Which match is found depends on the hint.)
+ *
+ * This hashes every pixel in |rect| (and in |needle|), but touches no cache,
+ * so it may be done without holding whatever guards the cache. */
+void MMFindCacheKeyInit(MMFindCacheKey *key, MMFindCacheQuery query,
+                        MMBitmapRef haystack, MMRect rect,
+                        MMBitmapRef needle, MMRGBHex color, float tolerance,
+                        const MMPoint *hint);
+
+/* Looks up the result of the search identified by |key|. If it is in |cache|,
+ * returns true and sets |ret| and |point| to what the search returned and
+ * found, and marks it most recently used; otherwise returns false. Either
+ * way, the hit or miss is counted. */
+bool MMFindCacheLookup(MMFindCacheRef cache, const MMFindCacheKey *key,
+                       int *ret, MMPoint *point);
+
+/* Adds the result of the search identified by |key| to |cache| (replacing any
+ * already there), evicting the least recently used result if it is full.
+ * Returns 0 on success, or -1 if memory could not be allocated. */
+int MMFindCacheInsert(MMFindCacheRef cache, const MMFindCacheKey *key,
+                      int ret, MMPoint point);
+
+#endif /* FIND_CACHE_H */
@@ -0,0 +1,426 @@
+#include "pack_io.h"
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <assert.h>
+
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
+#define MMSPRITE_PACK_VERSION 1
+
+/* Sprites are stored in this format in a pack. */
+#define SPRITE_BYTES_PER_PIXEL 4
+#define SPRITE_BITS_PER_PIXEL 32
+
+/* Bytes to align the pixels of each sprite to in a pack. */
+#define SPRITE_PIXEL_ALIGN 16
+
+/* Bytes taken by each (color, shift) pair of a shift table in a pack. */
+#define SHIFT_ENTRY_LENGTH 8
+
+static const uint8_t kMagic[4] = {'M', 'M', 'P', 'K'};
+
+const char *MMSpritePackErrorString(MMSpritePackError err)
+{
+	switch (err) {
+		case kMMSpritePackAccessError:
+			return "Could not open file";
+		case kMMSpritePackReadError:
+			return "Could not read file";
+		case kMMSpritePackWriteError:
+			return "Could not write file";
+		case kMMSpritePackInvalidHeaderError:
+			return "Not a sprite pack";
+		case kMMSpritePackUnsupportedVersionError:
+			return "Unsupported sprite pack version";
+		case kMMSpritePackInvalidDataError:
+			return "Invalid or truncated sprite pack";
+		case kMMSpritePackTooLargeError:
+			return "Sprites are too large to pack";
+		default:
+			return NULL;
+	}
+}
+
+/* Integers are written a byte at a time so that the file is the same
+ * regardless of the host's byte order or struct packing. */
+static void writeLittleEndian32(uint8_t *dest, uint32_t value)
+{
+	dest[0] = (uint8_t)(value & 0xFF);
+	dest[1] = (uint8_t)((value >> 8) & 0xFF);
+	dest[2] = (uint8_t)((value >> 16) & 0xFF);
+	dest[3] = (uint8_t)((value >> 24) & 0xFF);
+}
+
+static void writeLittleEndian64(uint8_t *dest, uint64_t value)
+{
+	writeLittleEndian32(dest, (uint32_t)(value & 0xFFFFFFFF));
+	writeLittleEndian32(dest + 4, (uint32_t)(value >> 32));
+}
+
+static uint32_t readLittleEndian32(const uint8_t *src)
+{
+	return (uint32_t)src[0] | ((uint32_t)src[1] << 8) |
+	       ((uint32_t)src[2] << 16) | ((uint32_t)src[3] << 24);
+}
+
+static uint64_t readLittleEndian64(const uint8_t *src)
+{
+	return (uint64_t)readLittleEndian32(src) |
+	       ((uint64_t)readLittleEndian32(src + 4) << 32);
+}
+
+/* Returns |offset| rounded up to the alignment of sprite pixels. */
+#define ALIGN_PIXEL_OFFSET(offset) \
+	(((offset) + SPRITE_PIXEL_ALIGN - 1) & ~(uint64_t)(SPRITE_PIXEL_ALIGN - 1))
+
+/* Returns whether |count| items of |size| bytes starting at |offset| lie
+ * inside a file of |len| bytes (checking without multiplying, so this can't
+ * overflow). */
+static bool rangeInFile(uint64_t offset, uint64_t count, uint64_t size,
+                        size_t len)
+{
+	return offset <= len && count <= ((uint64_t)len - offset) / size;
+}
+
+/* Fills in |sprite| from the index entry at |entry| in the file of |pack|,
+ * except for the shift table itself. Returns false if the entry refers to
+ * anything outside the file or could not belong to a needle. */
+static bool readSpriteEntry(MMSpritePackRef pack, const uint8_t *entry,
+                            MMSprite *sprite)
+{
+	const uint8_t *data = pack->mapping.data;
+	const size_t len = pack->mapping.len;
+	const uint32_t width = readLittleEndian32(entry);
+	const uint32_t height = readLittleEndian32(entry + 4);
+	const uint64_t pixelOffset = readLittleEndian64(entry + 8);
+	const uint32_t nameOffset = readLittleEndian32(entry + 16);
+	const uint32_t nameLength = readLittleEndian32(entry + 20);
+	const uint32_t shiftRow = readLittleEndian32(entry + 32);
+	const uint32_t shiftCount = readLittleEndian32(entry + 36);
+	const uint64_t shiftOffset = readLittleEndian64(entry + 40);
+
+	if (width == 0 || height == 0 ||
+	    !rangeInFile(pixelOffset, height,
+	                 (uint64_t)width * SPRITE_BYTES_PER_PIXEL, len) ||
+	    !rangeInFile(nameOffset, (uint64_t)nameLength + 1, 1, len) ||
+	    data[nameOffset + nameLength] != '\0' ||
+	    !rangeInFile(shiftOffset, shiftCount, SHIFT_ENTRY_LENGTH, len) ||
+	    shiftRow >= height || shiftCount >= width) {
+		return false;
+	}
+
+	sprite->name = (const char *)data + nameOffset;
+	sprite->nameLength = nameLength;
+	sprite->pixels = pack->mapping.data + pixelOffset;
+	sprite->width = width;
+	sprite->height = height;
+	sprite->tables.shiftRow = shiftRow;
+	sprite->tables.shiftCount = shiftCount;
+	sprite->tables.shifts = NULL;
+	sprite->tables.hash = readLittleEndian64(entry + 24);
+	return true;
+}
+
+/* Decodes the shift table of the index entry at |entry| into |shifts|, which
+ * has room for the number of entries readSpriteEntry() found. Returns false
+ * if a shift is out of range. */
+static bool readSpriteShifts(MMSpritePackRef pack, const uint8_t *entry,
+                             const MMSprite *sprite, MMNeedleShift *shifts)
+{
+	const uint8_t *table = pack->mapping.data + readLittleEndian64(entry + 40);
+	size_t i;
+
+	for (i = 0; i < sprite->tables.shiftCount; ++i) {
+		shifts[i].color = readLittleEndian32(table);
+		shifts[i].shift = readLittleEndian32(table + 4);
+		if (shifts[i].shift == 0 || shifts[i].shift >= sprite->width) {
+			return false;
+		}
+		table += SHIFT_ENTRY_LENGTH;
+	}
+
+	return true;
+}
+
+MMSpritePackRef openMMSpritePack(const char *path, MMSpritePackError *err)
+{
+	MMSpritePackRef pack;
+	const uint8_t *data;
+	size_t len, i;
+	uint64_t totalShifts = 0;
+	MMSpritePackError code = kMMSpritePackGenericError;
+
+	if ((pack = calloc(1, sizeof(MMSpritePack))) == NULL) {
+		if (err != NULL) *err = kMMSpritePackGenericError;
+		return NULL;
+	}
+
+	switch (mapFile(path, &pack->mapping)) {
+		case kMMFileMapNoError:
+			break;
+		case kMMFileMapAccessError:
+			if (err != NULL) *err = kMMSpritePackAccessError;
+			free(pack);
+			return NULL;
+		case kMMFileMapEmptyError:
+			if (err != NULL) *err = kMMSpritePackInvalidHeaderError;
+			free(pack);
+			return NULL;
+		default:
+			if (err != NULL) *err = kMMSpritePackReadError;
+			free(pack);
+			return NULL;
+	}
+
+	data = pack->mapping.data;
+	len = pack->mapping.len;
+
+	if (len < MMSPRITE_PACK_HEADER_LENGTH ||
+	    memcmp(data, kMagic, sizeof(kMagic)) != 0) {
+		code = kMMSpritePackInvalidHeaderError;
+		goto error;
+	}
+
+	if (data[4] != MMSPRITE_PACK_VERSION) {
+		code = kMMSpritePackUnsupportedVersionError;
+		goto error;
+	}
+
+	pack->count = readLittleEndian32(data + 8);
+	if (!rangeInFile(MMSPRITE_PACK_HEADER_LENGTH, pack->count,
+	                 MMSPRITE_PACK_ENTRY_LENGTH, len)) {
+		code = kMMSpritePackInvalidDataError;
+		goto error;
+	}
+
+	pack->sprites = calloc(pack->count == 0 ? 1 : pack->count,
+	                       sizeof(MMSprite));
+	if (pack->sprites == NULL) goto error;
+
+	/* Read the index first to find out how much room the shift tables need,
+	 * then decode them all into one array. */
+	for (i = 0; i < pack->count; ++i) {
+		const uint8_t *entry = data + MMSPRITE_PACK_HEADER_LENGTH +
+		                       (i * MMSPRITE_PACK_ENTRY_LENGTH);
+		if (!readSpriteEntry(pack, entry, &pack->sprites[i])) {
+			code = kMMSpritePackInvalidDataError;
+			goto error;
+		}
+		totalShifts += pack->sprites[i].tables.shiftCount;
+	}
+
+	if (totalShifts > ((size_t)-1) / sizeof(MMNeedleShift) - 1 ||
+	    (pack->shifts = malloc((size_t)(totalShifts + 1) *
+	                           sizeof(MMNeedleShift))) == NULL) {
+		goto error;
+	}
+
+	totalShifts = 0;
+	for (i = 0; i < pack->count; ++i) {
+		const uint8_t *entry = data + MMSPRITE_PACK_HEADER_LENGTH +
+		                       (i * MMSPRITE_PACK_ENTRY_LENGTH);
+		MMSprite *sprite = &pack->sprites[i];
+		MMNeedleShift *shifts = pack->shifts + totalShifts;
+
+		if (!readSpriteShifts(pack, entry, sprite, shifts)) {
+			code = kMMSpritePackInvalidDataError;
+			goto error;
+		}
+		sprite->tables.shifts = shifts;
+		totalShifts += sprite->tables.shiftCount;
+	}
+
+	return pack;
+
+error:
+	if (err != NULL) *err = code;
+	destroyMMSpritePack(pack);
+	return NULL;
+}
+
+void destroyMMSpritePack(MMSpritePackRef pack)
+{
+	assert(pack != NULL);
+	if (pack->mapping.data != NULL) unmapFile(&pack->mapping);
+	free(pack->sprites);
+	free(pack->shifts);
+	free(pack);
+}
+
+/* Writes the pixels of |bitmap| to |fp| in the format of a sprite pack,
+ * using |row| (which has room for one row) as scratch space. Returns false on
+ * error. */
+static bool writeSpritePixels(FILE *fp, MMBitmapRef bitmap, uint8_t *row)
+{
+	const size_t rowLength = bitmap->width * SPRITE_BYTES_PER_PIXEL;
+	size_t x, y;
+
+	for (y = 0; y < bitmap->height; ++y) {
+		uint8_t *dest = row;
+		for (x = 0; x < bitmap->width; ++x) {
+			const MMRGBColor *color = MMRGBColorRefAtPoint(bitmap, x, y);
+			dest[0] = color->blue;
+			dest[1] = color->green;
+			dest[2] = color->red;
+			dest[3] = 0;
+			dest += SPRITE_BYTES_PER_PIXEL;
+		}
+		if (fwrite(row, 1, rowLength, fp) != rowLength) return false;
+	}
+
+	return true;
+}
+
+/* Writes |count| zero bytes to |fp|. Returns false on error. */
+static bool writePadding(FILE *fp, size_t count)
+{
+	static const uint8_t zeros[SPRITE_PIXEL_ALIGN] = {0};
+	assert(count <= sizeof(zeros));
+	return fwrite(zeros, 1, count, fp) == count;
+}
+
+int saveMMSpritePack(const char *path, MMNeedleRef *needles,
+                     const char **names, const size_t *nameLengths,
+                     size_t count, MMSpritePackError *err)
+{
+	uint8_t header[MMSPRITE_PACK_HEADER_LENGTH] = {0};
+	uint64_t shiftOffset, nameOffset, pixelOffset, end;
+	size_t maxWidth = 0, maxShifts = 0, i;
+	MMNeedleShift *shifts = NULL;
+	uint8_t *scratch = NULL;
+	FILE *fp = NULL;
+	MMSpritePackError code = kMMSpritePackGenericError;
+
+	/* Work out where each part of the file starts. */
+	shiftOffset = MMSPRITE_PACK_HEADER_LENGTH +
+	              ((uint64_t)count * MMSPRITE_PACK_ENTRY_LENGTH);
+	nameOffset = shiftOffset;
+	for (i = 0; i < count; ++i) {
+		const MMBitmapRef bitmap = MMNeedleGetBitmap(needles[i]);
+		const size_t shiftCount = MMNeedleShiftCount(needles[i]);
+		nameOffset += (uint64_t)shiftCount * SHIFT_ENTRY_LENGTH;
+		if (shiftCount > maxShifts) maxShifts = shiftCount;
+		if (bitmap->width > maxWidth) maxWidth = bitmap->width;
+		if (bitmap->width > UINT32_MAX || bitmap->height > UINT32_MAX) {
+			code = kMMSpritePackTooLargeError;
+			goto error;
+		}
+	}
+	end = nameOffset;
+	for (i = 0; i < count; ++i) end += (uint64_t)nameLengths[i] + 1;
+	pixelOffset = ALIGN_PIXEL_OFFSET(end);
+
+	/* Names are referred to with 32-bit offsets. */
+	if (count > UINT32_MAX || end > UINT32_MAX) {
+		code = kMMSpritePackTooLargeError;
+		goto error;
+	}
+
+	if ((shifts = malloc((maxShifts + 1) * sizeof(MMNeedleShift))) == NULL ||
+	    (scratch = malloc(maxWidth * SPRITE_BYTES_PER_PIXEL +
+	                      MMSPRITE_PACK_ENTRY_LENGTH)) == NULL) {
+		goto error;
+	}
+
+	if ((fp = fopen(path, "wb")) == NULL) {
+		code = kMMSpritePackAccessError;
+		goto error;
+	}
+
+	memcpy(header, kMagic, sizeof(kMagic));
+	header[4] = MMSPRITE_PACK_VERSION;
+	writeLittleEndian32(header + 8, (uint32_t)count);
+	if (fwrite(header, 1, sizeof(header), fp) != sizeof(header)) {
+		code = kMMSpritePackWriteError;
+		goto error;
+	}
+
+	/* Index */
+	for (i = 0; i < count; ++i) {
+		const MMBitmapRef bitmap = MMNeedleGetBitmap(needles[i]);
+		uint8_t *entry = scratch;
+		MMNeedleTables tables;
+
+		MMNeedleGetTables(needles[i], &tables, shifts);
+		writeLittleEndian32(entry, (uint32_t)bitmap->width);
+		writeLittleEndian32(entry + 4, (uint32_t)bitmap->height);
+		writeLittleEndian64(entry + 8, pixelOffset);
+		writeLittleEndian32(entry + 16, (uint32_t)nameOffset);
+		writeLittleEndian32(entry + 20, (uint32_t)nameLengths[i]);
+		writeLittleEndian64(entry + 24, tables.hash);
+		writeLittleEndian32(entry + 32, (uint32_t)tables.shiftRow);
+		writeLittleEndian32(entry + 36, (uint32_t)tables.shiftCount);
+		writeLittleEndian64(entry + 40, shiftOffset);
+		if (fwrite(entry, 1, MMSPRITE_PACK_ENTRY_LENGTH, fp) !=
+		    MMSPRITE_PACK_ENTRY_LENGTH) {
+			code = kMMSpritePackWriteError;
+			goto error;
+		}
+
+		shiftOffset += (uint64_t)tables.shiftCount * SHIFT_ENTRY_LENGTH;
+		nameOffset += (uint64_t)nameLengths[i] + 1;
+		pixelOffset = ALIGN_PIXEL_OFFSET(pixelOffset +
+		                                 ((uint64_t)bitmap->width *
+		                                  bitmap->height *
+		                                  SPRITE_BYTES_PER_PIXEL));
+	}
+
+	/* Shift tables */
+	for (i = 0; i < count; ++i) {
+		MMNeedleTables tables;
+		size_t j;
+
+		MMNeedleGetTables(needles[i], &tables, shifts);
+		for (j = 0; j < tables.shiftCount; ++j) {
+			uint8_t pair[SHIFT_ENTRY_LENGTH];
+			writeLittleEndian32(pair, shifts[j].color);
+			writeLittleEndian32(pair + 4, shifts[j].shift);
+			if (fwrite(pair, 1, sizeof(pair), fp) != sizeof(pair)) {
+				code = kMMSpritePackWriteError;
+				goto error;
+			}
+		}
+	}
+
+	/* Names */
+	for (i = 0; i < count; ++i) {
+		if (fwrite(names[i], 1, nameLengths[i], fp) != nameLengths[i] ||
+		    fputc('\0', fp) == EOF) {
+			code = kMMSpritePackWriteError;
+			goto error;
+		}
+	}
+
+	/* Pixels */
+	for (i = 0; i < count; ++i) {
+		const MMBitmapRef bitmap = MMNeedleGetBitmap(needles[i]);
+		if (!writePadding(fp, (size_t)(ALIGN_PIXEL_OFFSET(end) - end)) ||
+		    !writeSpritePixels(fp, bitmap, scratch)) {
+			code = kMMSpritePackWriteError;
+			goto error;
+		}
+		end = ALIGN_PIXEL_OFFSET(end) +
+		      ((uint64_t)bitmap->width * bitmap->height *
+		       SPRITE_BYTES_PER_PIXEL);
+	}
+
+	free(shifts);
+	free(scratch);
+	if (fclose(fp) != 0) {
+		if (err != NULL) *err = kMMSpritePackWriteError;
+		return -1;
+	}
+	return 0;
+
+error:
+	if (err != NULL) *err = code;
+	free(shifts);
+	free(scratch);
+	if (fp != NULL) fclose(fp);
+	return -1;
+}
@@ -0,0 +1,112 @@
+#pragma once
+#ifndef PACK_IO_H
+#define PACK_IO_H
+
+#include "MMBitmap.h"
+#include "bitmap_find.h"
+#include "file_map.h"
+#include "io.h"
+#include <stddef.h>
+
+#if defined(_MSC_VER)
+	#include "ms_stdint.h"
+#else
+	#include <stdint.h>
+#endif
+
+/* Functions for reading and writing sprite packs: single files holding many
+ * named needle bitmaps back to back, along with their search tables, so that
+ * a whole set of them can be loaded at once by mapping the file rather than
+ * decoding and compiling each image in turn.
+ *
+ * All integers are little-endian and unsigned. The file starts with a 16-byte
+ * header:
+ *
+ *     bytes 0-3:   magic "MMPK"
+ *     byte  4:     format version (currently 1)
+ *     bytes 5-7:   reserved (0)
+ *     bytes 8-11:  number of sprites, as a 32-bit integer
+ *     bytes 12-15: reserved (0)
+ *
+ * followed by a 48-byte entry for each sprite:
+ *
+ *     bytes 0-3:   width, as a 32-bit integer
+ *     bytes 4-7:   height, likewise
+ *     bytes 8-15:  offset of the pixels in the file, as a 64-bit integer
+ *     bytes 16-19: offset of the name in the file, as a 32-bit integer
+ *     bytes 20-23: length of the name in bytes, as a 32-bit integer
+ *     bytes 24-31: hash of the needle (see MMNeedleTables), 64-bit
+ *     bytes 32-35: row of the needle its shift table is for, 32-bit
+ *     bytes 36-39: number of entries in the shift table, 32-bit
+ *     bytes 40-47: offset of the shift table in the file, 64-bit
+ *
+ * The rest of the file holds the data these refer to: each shift table is an
+ * array of 32-bit (color, shift) pairs, each name is UTF-8 followed by a NUL
+ * byte, and the pixels of each sprite (which start on a 16-byte boundary) are
+ * 32-bit pixels in the order blue, green, red, unused, with rows stored
+ * top-down without padding. */
+
+#define MMSPRITE_PACK_HEADER_LENGTH 16
+#define MMSPRITE_PACK_ENTRY_LENGTH 48
+
+enum _MMSpritePackError {
+	kMMSpritePackGenericError = 0,
+	kMMSpritePackAccessError,
+	kMMSpritePackReadError,
+	kMMSpritePackWriteError,
+	kMMSpritePackInvalidHeaderError,
+	kMMSpritePackUnsupportedVersionError,
+	kMMSpritePackInvalidDataError,
+	kMMSpritePackTooLargeError
+};
+
+typedef MMIOError MMSpritePackError;
+
+/* A sprite in an open pack. */
+struct _MMSprite {
+	const char *name;      /* NUL-terminated UTF-8. */
+	size_t nameLength;     /* Not including the NUL byte. */
+	uint8_t *pixels;       /* Pixels in the mapped file, as described above;
+	                        * they must not be modified. */
+	size_t width;
+	size_t height;
+	MMNeedleTables tables; /* Search tables for a needle of the pixels. */
+};
+
+typedef struct _MMSprite MMSprite;
+
+struct _MMSpritePack {
+	MMFileMapping mapping;
+	size_t count;
+	MMSprite *sprites;
+	MMNeedleShift *shifts; /* Storage for the shift tables of the sprites. */
+};
+
+typedef struct _MMSpritePack MMSpritePack;
+typedef MMSpritePack *MMSpritePackRef;
+
+/* Maps the sprite pack at |path| into memory and reads its index, checking
+ * that everything it refers to is inside the file. Returns NULL on error.
+ * If |error| is non-NULL, it will be set to the error code on return.
+ *
+ * Responsibility for freeing the pack with destroyMMSpritePack() is given to
+ * the caller; the pixels and names of its sprites are only valid until then.
+ */
+MMSpritePackRef openMMSpritePack(const char *path, MMSpritePackError *error);
+
+/* Unmaps the file of |pack| and frees the memory it occupies. */
+void destroyMMSpritePack(MMSpritePackRef pack);
+
+/* Writes a sprite pack holding the |count| needles in |needles|, named by the
+ * corresponding UTF-8 strings in |names| (of the lengths in |nameLengths|), to
+ * |path|. Returns 0 on success, or -1 on error.
+ * If |error| is non-NULL, it will be set to the error code on return. */
+int saveMMSpritePack(const char *path, MMNeedleRef *needles,
+                     const char **names, const size_t *nameLengths,
+                     size_t count, MMSpritePackError *error);
+
+/* Returns description of given error code.
+ * Returned string is constant and hence should not be freed. */
+const char *MMSpritePackErrorString(MMSpritePackError err);
+
+#endif /* PACK_IO_H */
@@ -3,6 +3,7 @@
 #include <png.h>
 #include <stdio.h> /* fopen() */
 #include <stdlib.h> /* malloc/realloc */
+#include <string.h> /* memcpy() */
 #include <assert.h>
 
 #if defined(_MSC_VER)
@@ -22,56 +23,36 @@ const char *MMPNGReadErrorString(MMIOError error)
 			return "Could not read file";
 		case kPNGInvalidHeaderError:
 			return "Not a PNG file";
+		case kPNGInvalidDataError:
+			return "Invalid or truncated PNG data";
 		default:
 			return NULL;
 	}
 }
 
-MMBitmapRef newMMBitmapFromPNG(const char *path, MMPNGReadError *err)
+/* Decodes the PNG being read by |png_ptr|, whose input has been set up and
+ * whose signature has already been read. Returns new MMBitmap on success, or
+ * NULL on error. */
+static MMBitmapRef decodePNG(png_struct *png_ptr, png_info *info_ptr,
+                             MMPNGReadError *err)
 {
-	FILE *fp;
-	uint8_t header[8];
-	png_struct *png_ptr = NULL;
-	png_info *info_ptr = NULL;
+	/* These are volatile as they are changed after setjmp() and needed after
+	 * longjmp()'ing back to it. */
+	uint8_t *volatile bitmapData = NULL;
+	png_byte *volatile row = NULL;
 	png_byte bit_depth, color_type;
-	uint8_t *row, *bitmapData;
 	uint8_t bytesPerPixel;
 	png_uint_32 width, height, y;
-	uint32_t bytewidth;
-
-	if ((fp = fopen(path, "rb")) == NULL) {
-		if (err != NULL) *err = kPNGAccessError;
-		return NULL;
-	}
-
-	/* Initialize error code to generic value. */
-	if (err != NULL) *err = kPNGGenericError;
-
-	/* Validate the PNG. */
-	if (fread(header, 1, sizeof header, fp) == 0) {
-		if (err != NULL) *err = kPNGReadError;
-		goto bail;
-	} else if (png_sig_cmp(header, 0, sizeof(header)) != 0) {
-		if (err != NULL) *err = kPNGInvalidHeaderError;
-		goto bail;
-	}
-
-	png_ptr = png_create_read_struct(PNG_LIBPNG_VER_STRING, NULL, NULL, NULL);
-	if (png_ptr == NULL) goto bail;
-
-	info_ptr = png_create_info_struct(png_ptr);
-	if (info_ptr == NULL) goto bail;
+	size_t bytewidth;
 
 	/* Set up error handling. */
 	if (setjmp(png_jmpbuf(png_ptr))) {
-		goto bail;
+		if (err != NULL) *err = kPNGInvalidDataError;
+		png_free(png_ptr, row);
+		free(bitmapData);
+		return NULL;
 	}
 
-	png_init_io(png_ptr, fp);
-
-	/* Skip past the header. */
-	png_set_sig_bytes(png_ptr, sizeof header);
-
 	png_read_info(png_ptr, info_ptr);
 
 	/* Convert different image types to common type to be read. */
@@ -113,37 +94,135 @@ MMBitmapRef newMMBitmapFromPNG(const char *path, MMPNGReadError *err)
 	bytewidth = ADD_PADDING(width * bytesPerPixel); /* Align width. */
 
 	/* Decompress the PNG row by row. */
+	png_read_update_info(png_ptr, info_ptr);
 	bitmapData = calloc(1, bytewidth * height);
 	row = png_malloc(png_ptr, png_get_rowbytes(png_ptr, info_ptr));
-	if (bitmapData == NULL || row == NULL) goto bail;
+	if (bitmapData == NULL) png_error(png_ptr, "Out of memory");
 	for (y = 0; y < height; ++y) {
 		png_uint_32 x;
-		const uint32_t rowOffset = y * bytewidth;
+		const size_t rowOffset = y * bytewidth;
 		uint8_t *rowptr = row;
-		png_read_row(png_ptr, (png_byte *)row, NULL);
+		png_read_row(png_ptr, row, NULL);
 
 		for (x = 0; x < width; ++x) {
-			const uint32_t colOffset = x * bytesPerPixel;
+			const size_t colOffset = x * bytesPerPixel;
 			MMRGBColor *color = (MMRGBColor *)(bitmapData + rowOffset + colOffset);
 			color->red = *rowptr++;
 			color->green = *rowptr++;
 			color->blue = *rowptr++;
 		}
 	}
-	free(row);
+	png_free(png_ptr, row);
+	row = NULL;
 
 	/* Finish reading. */
 	png_read_end(png_ptr, NULL);
-	png_destroy_read_struct(&png_ptr, &info_ptr, NULL);
-	fclose(fp);
 
 	return createMMBitmap(bitmapData, width, height,
 	                      bytewidth, bytesPerPixel * 8, bytesPerPixel);
+}
+
+MMBitmapRef newMMBitmapFromPNG(const char *path, MMPNGReadError *err)
+{
+	FILE *fp;
+	uint8_t header[8];
+	png_struct *png_ptr = NULL;
+	png_info *info_ptr = NULL;
+	MMBitmapRef bitmap = NULL;
+
+	if ((fp = fopen(path, "rb")) == NULL) {
+		if (err != NULL) *err = kPNGAccessError;
+		return NULL;
+	}
+
+	/* Initialize error code to generic value. */
+	if (err != NULL) *err = kPNGGenericError;
+
+	/* Validate the PNG. */
+	if (fread(header, 1, sizeof header, fp) == 0) {
+		if (err != NULL) *err = kPNGReadError;
+		goto bail;
+	} else if (png_sig_cmp(header, 0, sizeof(header)) != 0) {
+		if (err != NULL) *err = kPNGInvalidHeaderError;
+		goto bail;
+	}
+
+	png_ptr = png_create_read_struct(PNG_LIBPNG_VER_STRING, NULL, NULL, NULL);
+	if (png_ptr == NULL) goto bail;
+
+	info_ptr = png_create_info_struct(png_ptr);
+	if (info_ptr == NULL) goto bail;
+
+	png_init_io(png_ptr, fp);
+
+	/* Skip past the header. */
+	png_set_sig_bytes(png_ptr, sizeof header);
+
+	bitmap = decodePNG(png_ptr, info_ptr, err);
 
 bail:
 	png_destroy_read_struct(&png_ptr, &info_ptr, NULL);
 	fclose(fp);
-	return NULL;
+	return bitmap;
+}
+
+/* Structure to read PNG image bytes from. */
+struct io_input
+{
+	const uint8_t *buffer; /* Pointer to raw file data. */
+	size_t size; /* Number of bytes in buffer. */
+	size_t offset; /* Number of bytes read so far. */
+};
+
+/* Called each time libpng attempts to read data in
+ * newMMBitmapFromPNGData(). */
+static void png_read_input(png_struct *png_ptr,
+                           png_byte *dest,
+                           png_size_t length)
+{
+	struct io_input *input = png_get_io_ptr(png_ptr);
+	if (length > input->size - input->offset) {
+		png_error(png_ptr, "Unexpected end of PNG data");
+	}
+
+	memcpy(dest, input->buffer + input->offset, length);
+	input->offset += length;
+}
+
+MMBitmapRef newMMBitmapFromPNGData(const uint8_t *buffer, size_t len,
+                                   MMPNGReadError *err)
+{
+	struct io_input input = {NULL, 0, 8};
+	png_struct *png_ptr = NULL;
+	png_info *info_ptr = NULL;
+	MMBitmapRef bitmap = NULL;
+
+	/* Initialize error code to generic value. */
+	if (err != NULL) *err = kPNGGenericError;
+
+	/* Validate the PNG. */
+	if (len < 8 || png_sig_cmp((png_const_bytep)buffer, 0, 8) != 0) {
+		if (err != NULL) *err = kPNGInvalidHeaderError;
+		return NULL;
+	}
+
+	png_ptr = png_create_read_struct(PNG_LIBPNG_VER_STRING, NULL, NULL, NULL);
+	if (png_ptr == NULL) return NULL;
+
+	info_ptr = png_create_info_struct(png_ptr);
+	if (info_ptr != NULL) {
+		input.buffer = buffer;
+		input.size = len;
+		png_set_read_fn(png_ptr, &input, &png_read_input);
+
+		/* Skip past the header. */
+		png_set_sig_bytes(png_ptr, 8);
+
+		bitmap = decodePNG(png_ptr, info_ptr, err);
+	}
+
+	png_destroy_read_struct(&png_ptr, &info_ptr, NULL);
+	return bitmap;
 }
 
 struct _PNGWriteInfo {
@@ -157,12 +236,26 @@ struct _PNGWriteInfo {
 typedef struct _PNGWriteInfo PNGWriteInfo;
 typedef PNGWriteInfo *PNGWriteInfoRef;
 
+/* Returns the libpng PNG_FILTER_* flags for the given MMPNGFilter flags. */
+static int pngFiltersFromMMPNGFilters(int filters)
+{
+	int pngFilters = 0;
+	if (filters & kMMPNGFilterNone) pngFilters |= PNG_FILTER_NONE;
+	if (filters & kMMPNGFilterSub) pngFilters |= PNG_FILTER_SUB;
+	if (filters & kMMPNGFilterUp) pngFilters |= PNG_FILTER_UP;
+	if (filters & kMMPNGFilterAverage) pngFilters |= PNG_FILTER_AVG;
+	if (filters & kMMPNGFilterPaeth) pngFilters |= PNG_FILTER_PAETH;
+	return pngFilters;
+}
+
 /* Returns pointer to PNGWriteInfo struct containing data ready to be used with
- * functions such as png_write_png().
+ * functions such as png_write_png(), compressed at the given zlib |level| (or
+ * the default if it is negative) with the given MMPNGFilter |filters|.
  *
  * It is the caller's responsibility to destroy() the returned structure with
  * destroyPNGWriteInfo(). */
-static PNGWriteInfoRef createPNGWriteInfo(MMBitmapRef bitmap)
+static PNGWriteInfoRef createPNGWriteInfo(MMBitmapRef bitmap, int level,
+                                          int filters)
 {
 	PNGWriteInfoRef info = malloc(sizeof(PNGWriteInfo));
 	png_uint_32 y;
@@ -203,6 +296,12 @@ static PNGWriteInfoRef createPNGWriteInfo(MMBitmapRef bitmap)
 	             PNG_COMPRESSION_TYPE_DEFAULT,
 	             PNG_FILTER_TYPE_DEFAULT);
 
+	if (level >= 0) png_set_compression_level(info->png_ptr, level);
+	if (filters != kMMPNGDefaultFilters) {
+		png_set_filter(info->png_ptr, PNG_FILTER_TYPE_BASE,
+		               pngFiltersFromMMPNGFilters(filters));
+	}
+
 	info->row_count = bitmap->height;
 	info->row_pointers = png_malloc(info->png_ptr,
 	                                sizeof(png_byte *) * info->row_count);
@@ -210,7 +309,7 @@ static PNGWriteInfoRef createPNGWriteInfo(MMBitmapRef bitmap)
 	if (bitmap->bytesPerPixel == 3) {
 		/* No alpha channel; image data can be copied directly. */
 		for (y = 0; y < info->row_count; ++y) {
-			info->row_pointers[y] = bitmap->imageBuffer + (bitmap->bytewidth * y);
+			info->row_pointers[y] = (png_byte *)MMRGBColorRefAtPoint(bitmap, 0, y);
 		}
 		info->free_row_pointers = false;
 
@@ -271,7 +370,7 @@ int saveMMBitmapAsPNG(MMBitmapRef bitmap, const char *path)
 	PNGWriteInfoRef info;
 	if (fp == NULL) return -1;
 
-	if ((info = createPNGWriteInfo(bitmap)) == NULL) {
+	if ((info = createPNGWriteInfo(bitmap, -1, kMMPNGDefaultFilters)) == NULL) {
 		fclose(fp);
 		return -1;
 	}
@@ -319,6 +418,12 @@ void png_append_data(png_struct *png_ptr,
 }
 
 uint8_t *createPNGData(MMBitmapRef bitmap, size_t *len)
+{
+	return createPNGDataWithOptions(bitmap, -1, kMMPNGDefaultFilters, len);
+}
+
+uint8_t *createPNGDataWithOptions(MMBitmapRef bitmap, int level, int filters,
+                                  size_t *len)
 {
 	PNGWriteInfoRef info = NULL;
 	struct io_data data = {NULL, 0, 0};
@@ -326,7 +431,17 @@ uint8_t *createPNGData(MMBitmapRef bitmap, size_t *len)
 	assert(bitmap != NULL);
 	assert(len != NULL);
 
-	if ((info = createPNGWriteInfo(bitmap)) == NULL) return NULL;
+	if ((info = createPNGWriteInfo(bitmap, level, filters)) == NULL) {
+		return NULL;
+	}
+
+	/* Set up error handling; |data| is only modified through a pointer, so
+	 * it is up to date after longjmp(). */
+	if (setjmp(png_jmpbuf(info->png_ptr))) {
+		destroyPNGWriteInfo(info);
+		free(data.buffer);
+		return NULL;
+	}
 
 	png_set_write_fn(info->png_ptr, &data, &png_append_data, NULL);
 	png_write_png(info->png_ptr, info->info_ptr, PNG_TRANSFORM_IDENTITY, NULL);
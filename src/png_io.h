@@ -9,11 +9,23 @@ enum _PNGReadError {
 	kPNGGenericError = 0,
 	kPNGReadError,
 	kPNGAccessError,
-	kPNGInvalidHeaderError
+	kPNGInvalidHeaderError,
+	kPNGInvalidDataError
 };
 
 typedef MMIOError MMPNGReadError;
 
+/* Row filters libpng may choose between when writing a PNG. */
+enum _MMPNGFilter {
+	kMMPNGDefaultFilters = 0, /* Let libpng decide. */
+	kMMPNGFilterNone = 1 << 0,
+	kMMPNGFilterSub = 1 << 1,
+	kMMPNGFilterUp = 1 << 2,
+	kMMPNGFilterAverage = 1 << 3,
+	kMMPNGFilterPaeth = 1 << 4,
+	kMMPNGAllFilters = (1 << 5) - 1
+};
+
 /* Returns description of given MMPNGReadError.
  * Returned string is constant and hence should not be freed. */
 const char *MMPNGReadErrorString(MMIOError error);
@@ -24,6 +36,11 @@ const char *MMPNGReadErrorString(MMIOError error);
  * Responsibility for destroy()'ing returned MMBitmap is left up to caller. */
 MMBitmapRef newMMBitmapFromPNG(const char *path, MMPNGReadError *error);
 
+/* Like newMMBitmapFromPNG(), but reads the PNG file data from the |len| bytes
+ * at |buffer| rather than from a file. */
+MMBitmapRef newMMBitmapFromPNGData(const uint8_t *buffer, size_t len,
+                                   MMPNGReadError *error);
+
 /* Attempts to write PNG at path; returns 0 on success, -1 on error. */
 int saveMMBitmapAsPNG(MMBitmapRef bitmap, const char *path);
 
@@ -34,4 +51,10 @@ int saveMMBitmapAsPNG(MMBitmapRef bitmap, const char *path);
  * Responsibility for free()'ing data is left up to the caller. */
 uint8_t *createPNGData(MMBitmapRef bitmap, size_t *len);
 
+/* Like createPNGData(), but compresses at the given zlib |level| (0-9, or -1
+ * for the default) and restricts the row filters libpng chooses between to
+ * |filters| (a combination of MMPNGFilter flags, or kMMPNGDefaultFilters). */
+uint8_t *createPNGDataWithOptions(MMBitmapRef bitmap, int level, int filters,
+                                  size_t *len);
+
 #endif /* PNG_IO_H */
@@ -1,16 +1,38 @@
 #include "py-bitmap-class.h"
+#include "py-needle-class.h"
 #include "bitmap_find.h"
 #include "color_find.h"
 #include "screen.h"
 #include "io.h"
 #include "pasteboard.h"
 #include "str_io.h"
+#include "bytes_io.h"
+#include "png_io.h"
+#include "bmp_io.h"
+#include "bitmap_diff.h"
 #include "py-convenience.h"
+#include "py-points.h"
+#include "py-point-array-class.h"
 #include <assert.h>
 #include <stdio.h>
 
 /* -- Bitmap class definition -- */
 
+/* Note on threading: the searching, encoding and file I/O methods below run
+ * their C loops with the GIL released (between Py_BEGIN_ALLOW_THREADS and
+ * Py_END_ALLOW_THREADS), so that several may run in parallel from Python
+ * threads.
+ *
+ * This is safe because the MMBitmap of a Bitmap object is never modified or
+ * replaced once it is created (nor, for Bitmap.from_buffer(), may its
+ * exporter modify it; and a CaptureSession hands out a new Bitmap on each
+ * refresh rather than modifying its frame), and is only freed by
+ * Bitmap_dealloc(). The objects being searched are kept alive for the
+ * duration of the call by the method's bound |self| and argument tuple, so
+ * the pixel buffers stay pinned while the GIL is released. Only plain C
+ * values are touched in between; Python errors are set after the GIL has
+ * been re-acquired. */
+
 static void Bitmap_dealloc(BitmapObject *self)
 {
 	if (self->bitmap != NULL) {
@@ -31,12 +53,74 @@ static void Bitmap_dealloc(BitmapObject *self)
 /* Raises: |IOError| if the image could not be opened. */
 static PyObject *Bitmap_open(PyObject *self, PyObject *args);
 
+/* Syntax: Bitmap.open_mapped(filepath) => Bitmap object */
+/* Arguments: |filepath| => string */
+/* Description: Opens the uncompressed 24-bit or 32-bit BMP file at the
+                given absolute filepath by mapping it into memory, rather than
+                reading it in. This takes the same (short) time however large
+                the image is, and processes mapping the same file share the
+                memory it uses.
+
+                The file must not be modified while the bitmap exists. */
+/* Raises: |IOError| if the image could not be opened. */
+static PyObject *Bitmap_open_mapped(PyObject *self, PyObject *args);
+
 /* Syntax: Bitmap.from_string(string) => Bitmap object */
 /* Arguments: |string| => string */
 /* Description: Creates bitmap from string created by `bmp.to_string()`. */
 /* Raises: |ValueError| if the given string was invalid. */
 static PyObject *Bitmap_from_string(PyObject *self, PyObject *args);
 
+/* Syntax: Bitmap.from_bytes(data) => Bitmap object */
+/* Arguments: |data| => bytes (or other object supporting the buffer
+                        protocol) */
+/* Description: Creates bitmap from data created by `bmp.to_bytes()`. */
+/* Raises: |ValueError| if the data is invalid. */
+static PyObject *Bitmap_from_bytes(PyObject *self, PyObject *args);
+
+/* Syntax: Bitmap.from_png_bytes(data) => Bitmap object */
+/* Arguments: |data| => bytes (or other object supporting the buffer
+                        protocol) */
+/* Description: Creates bitmap from the contents of a PNG file held in
+                memory, e.g. as returned by `bmp.to_png_bytes()` or read from
+                a socket, without writing it to disk first. */
+/* Raises: |ValueError| if the data is not a valid PNG file. */
+static PyObject *Bitmap_from_png_bytes(PyObject *self, PyObject *args);
+
+/* Syntax: Bitmap.from_bmp_bytes(data) => Bitmap object */
+/* Arguments: |data| => bytes (or other object supporting the buffer
+                        protocol) */
+/* Description: Creates bitmap from the contents of a BMP file held in
+                memory, e.g. as returned by `bmp.to_bmp_bytes()`. */
+/* Raises: |ValueError| if the data is not a valid or supported BMP file. */
+static PyObject *Bitmap_from_bmp_bytes(PyObject *self, PyObject *args);
+
+/* Syntax: Bitmap.from_buffer(obj, width, height, stride=None, bpp=32) =>
+                                                             Bitmap object */
+/* Arguments: |obj| => object supporting the buffer protocol (e.g. bytes,
+                       bytearray, memoryview, mmap or a NumPy array),
+              |width| => integer,
+              |height| => integer,
+              |stride| => integer, or None,
+              |bpp| => integer (24 or 32) */
+/* Description: Creates a bitmap that uses the pixels in the buffer of |obj|
+                directly, rather than copying them. A reference to |obj| is
+                kept for as long as the bitmap exists.
+
+                The buffer must be contiguous and hold |height| rows of
+                |width| pixels, each row starting |stride| bytes after the
+                previous one (by default, |width| * |bpp| / 8). The channels
+                of each pixel are in the order blue, green, red (followed by an
+                unused byte if |bpp| is 32).
+
+                The buffer must not be modified while the bitmap is in use. */
+/* Raises: |ValueError| if the dimensions are invalid or the buffer is too
+           small,
+           |TypeError| or |BufferError| if |obj| does not provide a
+           contiguous buffer. */
+static PyObject *Bitmap_from_buffer(PyObject *self, PyObject *args,
+                                    PyObject *kwds);
+
 /* Syntax: bmp.get_portion(origin, size) => Bitmap object */
 /* Arguments: |origin| => |x|, |y| tuple of ints,
               |size| => |width|, |height| tuple of ints */
@@ -45,6 +129,16 @@ static PyObject *Bitmap_from_string(PyObject *self, PyObject *args);
            |IOError| if portion could not be copied. */
 static PyObject *Bitmap_get_portion(BitmapObject *self, PyObject *args);
 
+/* Syntax: bmp.view(origin, size) => Bitmap object */
+/* Arguments: |origin| => |x|, |y| tuple of ints,
+              |size| => |width|, |height| tuple of ints */
+/* Description: Returns new bitmap object for a portion of another, like
+                get_portion(), but sharing its pixels rather than copying
+                them. The original bitmap is kept alive for as long as the
+                view exists. */
+/* Raises: |ValueError| if portion was out of bounds or empty. */
+static PyObject *Bitmap_view(BitmapObject *self, PyObject *args);
+
 /* -- Bitmap Instance method declarations -- */
 
 /* Syntax: bmp.point_in_bounds(x, y) => Boolean */
@@ -77,6 +171,49 @@ static PyObject *Bitmap_save(BitmapObject *self, PyObject *args);
 /* Raises: |IOError| if the string could not be created. */
 static PyObject *Bitmap_to_string(BitmapObject *self, PyObject *args);
 
+/* Syntax: bmp.to_bytes(level=0, codec=None) => bytes */
+/* Arguments: |level| => integer (0-9),
+              |codec| => "raw", "zlib", or None */
+/* Description: Returns binary data representing bitmap, to be used with
+                `Bitmap.from_bytes()`. Unlike `bmp.to_string()`, the pixels
+                are stored in the bitmap's own format, and are only compressed
+                if asked to, making this much faster.
+
+                |codec| selects how the pixels are stored: "raw" stores them
+                as they are, while "zlib" compresses them at the given zlib
+                |level|, from 1 (fastest) to 9 (smallest). If |codec| is None,
+                "raw" is used if |level| is 0, and "zlib" otherwise.
+
+                Bitmaps are pickled using this format with no compression. */
+/* Raises: |ValueError| if the codec or level is invalid,
+           |IOError| if the data could not be created. */
+static PyObject *Bitmap_to_bytes(BitmapObject *self, PyObject *args,
+                                 PyObject *kwds);
+
+/* Syntax: bmp.to_png_bytes(level=6, filter=None) => bytes */
+/* Arguments: |level| => integer (0-9),
+              |filter| => "none", "sub", "up", "average", "paeth", "all", or
+                          None */
+/* Description: Returns the contents of a PNG file of the image, as
+                `bmp.save()` would write, without going through a file.
+
+                |level| is the zlib compression level, from 0 (none, and
+                fastest) to 9 (smallest). |filter| restricts the row filter
+                used to the one given ("all" lets each row use whichever
+                works best); by default, libpng chooses. Level 0 or 1 with
+                filter "none" is much faster when the result is only going to
+                be sent somewhere and decoded again. */
+/* Raises: |ValueError| if the level or filter is invalid,
+           |IOError| if the data could not be created. */
+static PyObject *Bitmap_to_png_bytes(BitmapObject *self, PyObject *args,
+                                     PyObject *kwds);
+
+/* Syntax: bmp.to_bmp_bytes() => bytes */
+/* Description: Returns the contents of a BMP file of the image, as
+                `bmp.save()` would write, without going through a file. */
+/* Raises: |IOError| if the data could not be created. */
+static PyObject *Bitmap_to_bmp_bytes(BitmapObject *self, PyObject *args);
+
 /* Syntax: bmp.get_color(x, y) => hexadecimal integer */
 /* Arguments: |x| => integer,
               |y| => integer */
@@ -85,26 +222,56 @@ static PyObject *Bitmap_to_string(BitmapObject *self, PyObject *args);
 /* Raises: |ValueError| if the point out of bounds. */
 static PyObject *Bitmap_get_color(BitmapObject *self, PyObject *args);
 
-/* Syntax: bmp.find_color(color, tolerance=0.0, rect=None) => tuple (x, y)
-                                                              or None */
+/* Syntax: bmp.get_colors(points) => array('I') */
+/* Arguments: |points| => sequence of (|x|, |y|) tuples of ints, or buffer of
+                          ints holding x & y coordinates in pairs */
+/* Description: Returns an array of the hexadecimal values describing the RGB
+                color at each of the given points, in the same order.
+
+                Equivalent to:
+                {%
+                    array('I', [bmp.get_color(x, y) for x, y in points])
+                %}
+                only more efficient. */
+/* Raises: |ValueError| if any of the points are out of bounds. */
+static PyObject *Bitmap_get_colors(BitmapObject *self, PyObject *args);
+
+/* Syntax: bmp.find_color(color, tolerance=0.0, rect=None, hint=None) =>
+                                                    tuple (x, y) or None */
 /* Arguments: |color| => integer (0x000000 - 0xFFFFFF),
               |tolerance| => float,
               |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
-                        or None */
+                        or None,
+              |hint| => tuple (|x|, |y|) of ints, or None */
 /* Description: Attempts to find color inside |rect| in |bmp|; returns
                 coordinates if found, or None if not. If |rect| is None,
-                the entire image is searched. */
-static PyObject *Bitmap_find_color(BitmapObject *self, PyObject *args);
-
-/* Syntax: bmp.find_every_color(color, tolerance=0.0, rect=None) =>
+                the entire image is searched.
+
+                If |hint| is given (e.g., where the color was found last
+                time), the pixels around it are searched first, nearest
+                first; if the color is within 64 pixels of it, that match is
+                returned. Otherwise the result is the same as without a
+                hint. */
+static PyObject *Bitmap_find_color(BitmapObject *self, PyObject *args,
+                                   PyObject *kwds);
+
+/* Syntax: bmp.find_every_color(color, tolerance=0.0, rect=None,
+                               compact=False) =>
                                        list of tuples [(x, y), ...] */
 /* Arguments: |color| => integer (0x000000 - 0xFFFFFF),
               |tolerance| => float,
               |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
-                        or None */
+                        or None,
+              |compact| => Boolean */
 /* Description: Returns list of all coordinates inside |rect| in |bmp| matching
-                |color|. If |rect| is None, the entire image is searched. */
-static PyObject *Bitmap_find_every_color(BitmapObject *self, PyObject *args);
+                |color|. If |rect| is None, the entire image is searched.
+
+                If |compact| is True, a PointArray is returned instead of a
+                list; it holds the coordinates as machine integers, creating
+                each `(x, y)` tuple only when it is accessed, and can be passed
+                to anything accepting a buffer (e.g. numpy.asarray()). */
+static PyObject *Bitmap_find_every_color(BitmapObject *self, PyObject *args,
+                                         PyObject *kwds);
 
 /* Syntax: bmp.count_of_color(color, tolerance=0.0, rect=None) => integer */
 /* Arguments: |color| => integer (0x000000 - 0xFFFFFF),
@@ -116,36 +283,100 @@ static PyObject *Bitmap_find_every_color(BitmapObject *self, PyObject *args);
                   {% len(find_every_color(color, tolerance, rect)) %} */
 static PyObject *Bitmap_count_of_color(BitmapObject *self, PyObject *args);
 
-/* Syntax: bmp.find_bitmap(needle, tolerance=0.0, rect=None) => tuple (x, y)
-                                                                or None */
-/* Arguments: |needle| => Bitmap object,
+/* Syntax: bmp.find_bitmap(needle, tolerance=0.0, rect=None, hint=None) =>
+                                                     tuple (x, y) or None */
+/* Arguments: |needle| => Bitmap or CompiledNeedle object,
               |tolerance| => float,
               |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
-                        or None */
+                        or None,
+              |hint| => tuple (|x|, |y|) of ints, or None */
 /* Description: Searches for |needle| in |bmp|. Returns tuple `(x, y)` of
-                position if found, or None if not. */
-static PyObject *Bitmap_find_bitmap(BitmapObject *self, PyObject *args);
-
-/* Syntax: bmp.find_every_bitmap(needle, tolerance=0.0, rect=None) =>
-                                         list of tuples [(x, y), ...] */
-/* Arguments: |needle| => Bitmap object,
+                position if found, or None if not.
+
+                If |hint| is given, positions around it are tried first, as
+                for find_color(). Tracking something that moves a little
+                between screengrabs this way finds it again without scanning
+                everything before it. */
+/* Raises: |TypeError| if |needle| is not a Bitmap or CompiledNeedle. */
+static PyObject *Bitmap_find_bitmap(BitmapObject *self, PyObject *args,
+                                    PyObject *kwds);
+
+/* Syntax: bmp.find_every_bitmap(needle, tolerance=0.0, rect=None,
+                                threads=1, compact=False) =>
+                                       list of tuples [(x, y), ...] */
+/* Arguments: |needle| => Bitmap or CompiledNeedle object,
               |tolerance| => float,
               |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
-                        or None */
+                        or None,
+              |threads| => integer,
+              |compact| => Boolean */
 /* Description: Returns list of all `(x, y)` coordinates where |needle| occurs
-                in |bmp|. */
-static PyObject *Bitmap_find_every_bitmap(BitmapObject *self, PyObject *args);
-
-/* Syntax: bmp.count_of_bitmap(needle, tolerance=0.0, rect=None) =>
-                                         list of tuples [(x, y), ...] */
-/* Arguments: |needle| => Bitmap object,
+                in |bmp|, or a PointArray of them if |compact| is True (see
+                find_every_color()).
+
+                If |threads| is greater than 1, |rect| is split into that many
+                overlapping horizontal bands which are searched in parallel;
+                if it is 0, one thread is used per processor. More threads
+                than processors are never used. The result is the same
+                either way. */
+/* Raises: |TypeError| if |needle| is not a Bitmap or CompiledNeedle,
+           |ValueError| if |threads| is negative. */
+static PyObject *Bitmap_find_every_bitmap(BitmapObject *self, PyObject *args,
+                                          PyObject *kwds);
+
+/* Syntax: bmp.count_of_bitmap(needle, tolerance=0.0, rect=None, threads=1) =>
+                                         integer */
+/* Arguments: |needle| => Bitmap or CompiledNeedle object,
               |tolerance| => float,
               |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
-                        or None */
+                        or None,
+              |threads| => integer */
 /* Description: Returns count of occurrences of |needle| in |haystack|.
                 Functionally equivalent to:
-                    {% len(bmp.find_every_bitmap(needle, tolerance)) %} */
-static PyObject *Bitmap_count_of_bitmap(BitmapObject *self, PyObject *args);
+                    {% len(bmp.find_every_bitmap(needle, tolerance, rect,
+                                                 threads)) %} */
+/* Raises: |TypeError| if |needle| is not a Bitmap or CompiledNeedle,
+           |ValueError| if |threads| is negative. */
+static PyObject *Bitmap_count_of_bitmap(BitmapObject *self, PyObject *args,
+                                        PyObject *kwds);
+
+/* Syntax: bmp.find_bitmaps(needles, tolerance=0.0, rect=None) =>
+                                 dict {index: [(x, y), ...], ...} */
+/* Arguments: |needles| => sequence of Bitmap or CompiledNeedle objects,
+              |tolerance| => float,
+              |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
+                        or None */
+/* Description: Searches |bmp| for every bitmap in |needles| at once,
+                returning a dict mapping the index of each needle to the list
+                of `(x, y)` coordinates where it occurs (every index is
+                present, even if its needle was not found).
+
+                Equivalent to calling find_every_bitmap() for each needle,
+                but for exact searches the haystack is only scanned once, so
+                this is much faster when looking for many bitmaps. */
+/* Raises: |TypeError| if an item in |needles| is not a Bitmap or
+           CompiledNeedle. */
+static PyObject *Bitmap_find_bitmaps(BitmapObject *self, PyObject *args);
+
+/* Syntax: bmp.diff_regions(other, tile=32, tolerance=0.0) =>
+                            list of rects [((x, y), (width, height)), ...] */
+/* Arguments: |other| => Bitmap object,
+              |tile| => integer,
+              |tolerance| => float */
+/* Description: Compares |bmp| with |other| (e.g., the previous screengrab
+                of the same rect) in square tiles of |tile| pixels, and
+                returns the rects covering every tile in which a pixel differs
+                by more than |tolerance|. Adjacent differing tiles are merged,
+                so the rects don't overlap, and the list is empty if the
+                bitmaps match.
+
+                The rects can be passed as the |rect| argument of the find_*
+                methods to search only what changed. */
+/* Raises: |TypeError| if |other| is not a Bitmap,
+           |ValueError| if the bitmaps are not the same size, or |tile| is not
+           positive. */
+static PyObject *Bitmap_diff_regions(BitmapObject *self, PyObject *args,
+                                     PyObject *kwds);
 
 /* Methods to make pixels in bitmap iterable.
  *
@@ -161,6 +392,22 @@ static PyObject *Bitmap_iternext(BitmapObject *self);
 /* Returns a description of the Bitmap object. */
 static PyObject *Bitmap_str(BitmapObject *self);
 
+/* Buffer protocol, so that e.g. `memoryview(bmp)` or `numpy.asarray(bmp)`
+ * give a read-only view of the pixels without copying them.
+ *
+ * The buffer is a 3-dimensional array of unsigned bytes with the shape
+ * (height, width, bytes per pixel), where the channels of each pixel are in
+ * the order blue, green, red (followed by an unused byte for 32-bit bitmaps).
+ * Rows are |bytewidth| bytes apart, which may include padding (or be negative,
+ * if they are stored bottom-up), so consumers asking for a contiguous buffer
+ * are refused unless there is none. */
+static int Bitmap_getbuffer(BitmapObject *self, Py_buffer *view, int flags);
+
+static PyBufferProcs Bitmap_as_buffer = {
+	(getbufferproc)Bitmap_getbuffer, /* bf_getbuffer */
+	NULL                             /* bf_releasebuffer */
+};
+
 /* Getters/setters */
 
 static PyObject *Bitmap_get_width(BitmapObject *self, PyObject *args);
@@ -169,6 +416,9 @@ static PyObject *Bitmap_get_height(BitmapObject *self, PyObject *args);
 /* Deep copy method */
 static PyObject *Bitmap_deepcopy(BitmapObject *self, PyObject *arg);
 
+/* Pickle support; returns `(Bitmap.from_bytes, (bmp.to_bytes(),))`. */
+static PyObject *Bitmap_reduce(BitmapObject *self, PyObject *args);
+
 static PyGetSetDef Bitmap_getsetters[] = {
 	{"width", (getter)Bitmap_get_width, NULL, NULL, NULL},
 	{"height", (getter)Bitmap_get_height, NULL, NULL, NULL},
@@ -177,6 +427,7 @@ static PyGetSetDef Bitmap_getsetters[] = {
 
 static PyMethodDef Bitmap_methods[] = {
 	{"__deepcopy__", (PyCFunction)Bitmap_deepcopy, METH_O, NULL},
+	{"__reduce__", (PyCFunction)Bitmap_reduce, METH_NOARGS, NULL},
 	{"point_in_bounds", (PyCFunction)Bitmap_point_in_bounds, METH_VARARGS,
 	 "Returns true if point is in bounds."},
 	{"get_color", (PyCFunction)Bitmap_get_color, METH_VARARGS,
@@ -185,12 +436,34 @@ static PyMethodDef Bitmap_methods[] = {
 	{"open", Bitmap_open, METH_CLASS | METH_VARARGS,
 	 "Bitmap.open(filepath) -> Bitmap object\n"
 	 "Attempts to open image at the given absolute filepath."},
+	{"open_mapped", Bitmap_open_mapped, METH_CLASS | METH_VARARGS,
+	 "Bitmap.open_mapped(filepath) -> Bitmap object\n"
+	 "Opens the BMP file at the given absolute filepath by mapping it into "
+	 "memory."},
 	{"from_string", Bitmap_from_string, METH_CLASS | METH_VARARGS,
 	 "Bitmap.from_string(string) -> Bitmap object\n"
 	 "Returns a bitmap object created from the given string."},
+	{"from_bytes", Bitmap_from_bytes, METH_CLASS | METH_VARARGS,
+	 "Bitmap.from_bytes(data) -> Bitmap object\n"
+	 "Returns a bitmap object created from the given binary data."},
+	{"from_png_bytes", Bitmap_from_png_bytes, METH_CLASS | METH_VARARGS,
+	 "Bitmap.from_png_bytes(data) -> Bitmap object\n"
+	 "Returns a bitmap object created from the given PNG file data."},
+	{"from_bmp_bytes", Bitmap_from_bmp_bytes, METH_CLASS | METH_VARARGS,
+	 "Bitmap.from_bmp_bytes(data) -> Bitmap object\n"
+	 "Returns a bitmap object created from the given BMP file data."},
+	{"from_buffer", (PyCFunction)Bitmap_from_buffer,
+	 METH_CLASS | METH_VARARGS | METH_KEYWORDS,
+	 "Bitmap.from_buffer(obj, width, height, stride=None, bpp=32) -> "
+	                                                       "Bitmap object\n"
+	 "Returns a bitmap using the pixels in the buffer of obj without "
+	 "copying them."},
 	{"get_portion", (PyCFunction)Bitmap_get_portion, METH_VARARGS,
 	 "bmp.get_portion(x, y, width, height) -> Bitmap object\n"
 	 "Returns new bitmap object created from portion of another."},
+	{"view", (PyCFunction)Bitmap_view, METH_VARARGS,
+	 "bmp.view((x, y), (width, height)) -> Bitmap object\n"
+	 "Returns new bitmap object sharing the pixels of a portion of another."},
 	{"copy_to_pboard", (PyCFunction)Bitmap_copy_to_pboard, METH_NOARGS,
 	 "bmp.copy_to_pboard() -> None\n"
 	 "Copies image to pasteboard."},
@@ -201,35 +474,75 @@ static PyMethodDef Bitmap_methods[] = {
 	{"to_string", (PyCFunction)Bitmap_to_string, METH_NOARGS,
 	 "bmp.to_string() -> string\n"
 	 "Returns compressed, printable string representing bitmap."},
-	{"find_color", (PyCFunction)Bitmap_find_color, METH_VARARGS,
-	 "bmp.find_color((r, g, b), tolerance=0.0, rect=None) -> tuple (x, y) or "
-	                                                         "None\n"
+	{"to_bytes", (PyCFunction)Bitmap_to_bytes, METH_VARARGS | METH_KEYWORDS,
+	 "bmp.to_bytes(level=0, codec=None) -> bytes\n"
+	 "Returns binary data representing bitmap, optionally compressed."},
+	{"to_png_bytes", (PyCFunction)Bitmap_to_png_bytes,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "bmp.to_png_bytes(level=6, filter=None) -> bytes\n"
+	 "Returns the contents of a PNG file of bmp."},
+	{"to_bmp_bytes", (PyCFunction)Bitmap_to_bmp_bytes, METH_NOARGS,
+	 "bmp.to_bmp_bytes() -> bytes\n"
+	 "Returns the contents of a BMP file of bmp."},
+	{"get_colors", (PyCFunction)Bitmap_get_colors, METH_VARARGS,
+	 "bmp.get_colors(points) -> array('I')\n"
+	 "Returns array of hexadecimal values describing the RGB color at each of "
+	 "the given points."},
+	{"find_color", (PyCFunction)Bitmap_find_color,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "bmp.find_color((r, g, b), tolerance=0.0, rect=None, hint=None) -> "
+	                "tuple (x, y) or None\n"
 	 "Returns tuple (x, y) if color is found in given rect in bmp, or None if "
 	 "not.\n"
-	 "If rect is None, all of bmp is searched."},
-	{"find_every_color", (PyCFunction)Bitmap_find_every_color, METH_VARARGS,
-	 "bmp.find_every_color(color, tolerance=0.0, rect=None) -> "
+	 "If rect is None, all of bmp is searched.\n"
+	 "If hint is an (x, y) point, the pixels nearest it are searched first."},
+	{"find_every_color", (PyCFunction)Bitmap_find_every_color,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "bmp.find_every_color(color, tolerance=0.0, rect=None, compact=False) -> "
 	                 "list of tuples [(x, y), ...]\n"
 	 "Returns list of all coordinates inside the given rect in bmp matching\n"
 	 "the given color.\n"
-	 "If rect is None, entire image is searched."},
+	 "If rect is None, entire image is searched.\n"
+	 "If compact is True, returns a PointArray instead of a list."},
 	{"count_of_color", (PyCFunction)Bitmap_count_of_color, METH_VARARGS,
 	 "bmp.count_of_color(color, tolerance=0.0, rect=None) -> integer\n"
 	 "Returns count of color inside given rect in of bmp.\n"
 	 "If rect is None, entire image is searched."},
-	{"find_bitmap", (PyCFunction)Bitmap_find_bitmap, METH_VARARGS,
-	 "bmp.find_bitmap(needle, tolerance=0.0, rect=None) -> tuple (x, y) "
-	                                                       "or None\n"
+	{"find_bitmap", (PyCFunction)Bitmap_find_bitmap,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "bmp.find_bitmap(needle, tolerance=0.0, rect=None, hint=None) -> "
+	                 "tuple (x, y) or None\n"
 	 "Returns tuple of coordinates if needle is found in given rect in bmp, "
-	 "or None if not."},
-	{"find_every_bitmap", (PyCFunction)Bitmap_find_every_bitmap, METH_VARARGS,
-	 "bmp.find_every_bitmap(needle, tolerance=0.0, rect=None) -> "
-	                   "list of tuples [(x, y), ...]\n"
+	 "or None if not.\n"
+	 "If hint is an (x, y) point, the positions nearest it are tried first."},
+	{"find_every_bitmap", (PyCFunction)Bitmap_find_every_bitmap,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "bmp.find_every_bitmap(needle, tolerance=0.0, rect=None, threads=1, "
+	                       "compact=False) -> list of tuples [(x, y), ...]\n"
 	 "Returns list of all (x, y) coordinates where needle occurs in given "
-	 "rect inside bmp."},
-	{"count_of_bitmap", (PyCFunction)Bitmap_count_of_bitmap, METH_VARARGS,
-	 "bmp.count_of_bitmap(needle, tolerance=0.0, rect=None) -> integer\n"
-	 "Returns count of occurrences of needle in given rect inside bmp."},
+	 "rect inside bmp.\n"
+	 "If threads is not 1, the rect is searched in parallel bands (0 uses "
+	 "one thread per processor, which is also the most used).\n"
+	 "If compact is True, returns a PointArray instead of a list."},
+	{"find_bitmaps", (PyCFunction)Bitmap_find_bitmaps, METH_VARARGS,
+	 "bmp.find_bitmaps(needles, tolerance=0.0, rect=None) -> "
+	                   "dict {index: [(x, y), ...], ...}\n"
+	 "Returns dict mapping the index of each bitmap in needles to the list of "
+	 "all (x, y) coordinates where it occurs in given rect inside bmp.\n"
+	 "Exact searches find every needle in a single pass over bmp."},
+	{"count_of_bitmap", (PyCFunction)Bitmap_count_of_bitmap,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "bmp.count_of_bitmap(needle, tolerance=0.0, rect=None, threads=1) -> "
+	                                                            "integer\n"
+	 "Returns count of occurrences of needle in given rect inside bmp.\n"
+	 "If threads is not 1, the rect is searched in parallel bands (0 uses "
+	 "one thread per processor, which is also the most used)."},
+	{"diff_regions", (PyCFunction)Bitmap_diff_regions,
+	 METH_VARARGS | METH_KEYWORDS,
+	 "bmp.diff_regions(other, tile=32, tolerance=0.0) -> "
+	                  "list of rects [((x, y), (width, height)), ...]\n"
+	 "Returns rects covering every tile of the given size in which bmp and "
+	 "other differ."},
 	{NULL} /* Sentinel */
 };
 
@@ -237,7 +550,7 @@ static PyMethodDef Bitmap_methods[] = {
 PyTypeObject Bitmap_Type = {
    PyVarObject_HEAD_INIT(NULL, 0)
    //0,                             /* ob_size */
-   "Bitmap",                      /* tp_name */
+   "autopy.bitmap.Bitmap",        /* tp_name */
    sizeof(BitmapObject),          /* tp_basicsize */
    0,                             /* tp_itemsize */
    (destructor)Bitmap_dealloc,    /* tp_dealloc */
@@ -254,7 +567,7 @@ PyTypeObject Bitmap_Type = {
    (reprfunc)Bitmap_str,          /* tp_str */
    0,                             /* tp_getattro */
    0,                             /* tp_setattro */
-   0,                             /* tp_as_buffer */
+   &Bitmap_as_buffer,             /* tp_as_buffer */
    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE |
    /*Py_TPFLAGS_HAVE_ITER*/0,          /* tp_flags*/
    "Raw, uncompressed bitmap object", /* tp_doc */
@@ -299,7 +612,12 @@ static PyObject *Bitmap_open(PyObject *self, PyObject *args)
 	MMIOError err;
 
 	if (!parseImageIOArgs(args, &path, &type)) return NULL;
-	if ((bitmap = newMMBitmapFromFile(path, type, &err)) == NULL) {
+
+	Py_BEGIN_ALLOW_THREADS
+	bitmap = newMMBitmapFromFile(path, type, &err);
+	Py_END_ALLOW_THREADS
+
+	if (bitmap == NULL) {
 		PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
 		                      "Error opening image: %s",
 		                      MMIOErrorString(type, err));
@@ -309,6 +627,29 @@ static PyObject *Bitmap_open(PyObject *self, PyObject *args)
 	return BitmapObject_FromMMBitmap(bitmap);
 }
 
+static PyObject *Bitmap_open_mapped(PyObject *self, PyObject *args)
+{
+	char *path;
+
+	MMBitmapRef bitmap;
+	MMBMPReadError err;
+
+	if (!PyArg_ParseTuple(args, "s", &path)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	bitmap = newMMBitmapFromMappedBMP(path, &err);
+	Py_END_ALLOW_THREADS
+
+	if (bitmap == NULL) {
+		PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
+		                      "Error opening image: %s",
+		                      MMBMPReadErrorString(err));
+		return NULL;
+	}
+
+	return BitmapObject_FromMMBitmap(bitmap);
+}
+
 static PyObject *Bitmap_from_string(PyObject *self, PyObject *args)
 {
 	uint8_t *str;
@@ -318,7 +659,12 @@ static PyObject *Bitmap_from_string(PyObject *self, PyObject *args)
 	MMBMPStringError err;
 
 	if (!PyArg_ParseTuple(args, "s#", &str, &len)) return NULL;
-	if ((bitmap = createMMBitmapFromString(str, len, &err)) == NULL) {
+
+	Py_BEGIN_ALLOW_THREADS
+	bitmap = createMMBitmapFromString(str, len, &err);
+	Py_END_ALLOW_THREADS
+
+	if (bitmap == NULL) {
 		PyErr_SetFormatString(PyExc_ValueError, BUFSIZ,
 		                      "Could not create bitmap from string: %s",
 		                      MMBitmapStringErrorString(err));
@@ -328,6 +674,164 @@ static PyObject *Bitmap_from_string(PyObject *self, PyObject *args)
 	return BitmapObject_FromMMBitmap(bitmap);
 }
 
+static PyObject *Bitmap_from_bytes(PyObject *self, PyObject *args)
+{
+	Py_buffer data;
+
+	MMBitmapRef bitmap;
+	MMBitmapBytesError err;
+
+	if (!PyArg_ParseTuple(args, "y*", &data)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	bitmap = createMMBitmapFromBytes(data.buf, (size_t)data.len, &err);
+	Py_END_ALLOW_THREADS
+	PyBuffer_Release(&data);
+
+	if (bitmap == NULL) {
+		PyErr_SetFormatString(PyExc_ValueError, BUFSIZ,
+		                      "Could not create bitmap from bytes: %s",
+		                      MMBitmapBytesErrorString(err));
+		return NULL;
+	}
+
+	return BitmapObject_FromMMBitmap(bitmap);
+}
+
+static PyObject *Bitmap_from_png_bytes(PyObject *self, PyObject *args)
+{
+	Py_buffer data;
+
+	MMBitmapRef bitmap;
+	MMPNGReadError err;
+
+	if (!PyArg_ParseTuple(args, "y*", &data)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	bitmap = newMMBitmapFromPNGData(data.buf, (size_t)data.len, &err);
+	Py_END_ALLOW_THREADS
+	PyBuffer_Release(&data);
+
+	if (bitmap == NULL) {
+		PyErr_SetFormatString(PyExc_ValueError, BUFSIZ,
+		                      "Could not decode PNG data: %s",
+		                      MMPNGReadErrorString(err));
+		return NULL;
+	}
+
+	return BitmapObject_FromMMBitmap(bitmap);
+}
+
+static PyObject *Bitmap_from_bmp_bytes(PyObject *self, PyObject *args)
+{
+	Py_buffer data;
+
+	MMBitmapRef bitmap;
+	MMBMPReadError err;
+
+	if (!PyArg_ParseTuple(args, "y*", &data)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	bitmap = newMMBitmapFromBMPData(data.buf, (size_t)data.len, &err);
+	Py_END_ALLOW_THREADS
+	PyBuffer_Release(&data);
+
+	if (bitmap == NULL) {
+		PyErr_SetFormatString(PyExc_ValueError, BUFSIZ,
+		                      "Could not decode BMP data: %s",
+		                      MMBMPReadErrorString(err));
+		return NULL;
+	}
+
+	return BitmapObject_FromMMBitmap(bitmap);
+}
+
+/* Release function for bitmaps created by Bitmap_from_buffer(); releases the
+ * buffer view (and with it, the reference to its exporter). */
+static void releaseBufferView(uint8_t *buffer, void *info)
+{
+	Py_buffer *view = info;
+	PyGILState_STATE state = PyGILState_Ensure();
+
+	PyBuffer_Release(view);
+	PyMem_Free(view);
+
+	PyGILState_Release(state);
+}
+
+static PyObject *Bitmap_from_buffer(PyObject *self, PyObject *args,
+                                    PyObject *kwds)
+{
+	static char *kwlist[] = {"obj", "width", "height", "stride", "bpp", NULL};
+	PyObject *obj;
+	Py_ssize_t width, height;
+	PyObject *strideObj = Py_None;
+	int bitsPerPixel = 32;
+	Py_ssize_t stride, rowLength;
+
+	Py_buffer *view;
+	MMBitmapRef bitmap;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "Onn|Oi", kwlist,
+	                                 &obj, &width, &height,
+	                                 &strideObj, &bitsPerPixel)) {
+		return NULL;
+	}
+
+	if (width <= 0 || height <= 0) {
+		PyErr_SetString(PyExc_ValueError, "Width and height must be positive");
+		return NULL;
+	} else if (bitsPerPixel != 24 && bitsPerPixel != 32) {
+		PyErr_SetString(PyExc_ValueError, "Bits per pixel must be 24 or 32");
+		return NULL;
+	} else if (width > PY_SSIZE_T_MAX / (bitsPerPixel / 8)) {
+		PyErr_SetString(PyExc_ValueError, "Width is too large");
+		return NULL;
+	}
+
+	rowLength = width * (bitsPerPixel / 8);
+	if (strideObj == Py_None) {
+		stride = rowLength;
+	} else if ((stride = PyNumber_AsSsize_t(strideObj,
+	                                         PyExc_OverflowError)) == -1 &&
+	           PyErr_Occurred()) {
+		return NULL;
+	} else if (stride < rowLength) {
+		PyErr_SetString(PyExc_ValueError, "Stride is smaller than a row");
+		return NULL;
+	}
+
+	if ((view = PyMem_Malloc(sizeof(Py_buffer))) == NULL) {
+		return PyErr_NoMemory();
+	}
+	if (PyObject_GetBuffer(obj, view, PyBUF_SIMPLE) != 0) {
+		PyMem_Free(view);
+		return NULL;
+	}
+
+	/* The last row need not be padded out to the full stride. This is
+	 * view->len < (stride * (height - 1)) + rowLength, without overflowing. */
+	if (view->len < rowLength ||
+	    (height > 1 && stride > (view->len - rowLength) / (height - 1))) {
+		PyBuffer_Release(view);
+		PyMem_Free(view);
+		PyErr_SetString(PyExc_ValueError, "Buffer is too small");
+		return NULL;
+	}
+
+	bitmap = createMMBitmap(view->buf, (size_t)width, (size_t)height,
+	                        (size_t)stride, (uint8_t)bitsPerPixel,
+	                        (uint8_t)(bitsPerPixel / 8));
+	if (bitmap == NULL) {
+		PyBuffer_Release(view);
+		PyMem_Free(view);
+		return PyErr_NoMemory();
+	}
+
+	MMBitmapSetReleaseFunc(bitmap, &releaseBufferView, view);
+	return BitmapObject_FromMMBitmap(bitmap);
+}
+
 /* -- Bitmap instance method definitions -- */
 
 /* Returns false and sets error if |bitmap| is NULL. */
@@ -347,6 +851,15 @@ static bool rectFromTupleOrBitmap(MMBitmapRef bitmap,
                                   PyObject *rectTuple,
                                   MMRect *rect);
 
+/* Distance in pixels around a hint searched before the rest of the rect. */
+#define HINT_RADIUS 64
+
+/* Sets |hint| to NULL if |hintTuple| is NULL or None, or otherwise extracts
+ * the point from it into |point| and sets |hint| to that. Returns false and
+ * sets error if the point could not be extracted. */
+static bool hintFromTuple(PyObject *hintTuple, MMPoint *point,
+                          const MMPoint **hint);
+
 static PyObject *Bitmap_str(BitmapObject *self)
 {
 	if (!Bitmap_Ready(self)) return NULL;
@@ -361,13 +874,51 @@ static PyObject *Bitmap_str(BitmapObject *self)
 
 static PyObject *Bitmap_deepcopy(BitmapObject *self, PyObject *arg)
 {
-	MMBitmapRef copy = self->bitmap == NULL ? NULL : copyMMBitmap(self->bitmap);
+	MMBitmapRef copy = NULL;
+	if (self->bitmap != NULL) {
+		Py_BEGIN_ALLOW_THREADS
+		copy = copyMMBitmap(self->bitmap);
+		Py_END_ALLOW_THREADS
+	}
 	return BitmapObject_FromMMBitmap(copy);
 }
 
 /* Creates new PyList from MMPointArray. */
 static PyObject *PyList_FromPointArray(MMPointArrayRef pointArray);
 
+/* Returns the result of a find_every_* method for |pointArray|: a PointArray
+ * wrapping it if |compact| is true, or otherwise a list. Either way,
+ * |pointArray| is consumed. */
+static PyObject *pointArrayResult(MMPointArrayRef pointArray, int compact);
+
+/* Sets |bitmap| to the bitmap of |obj|, which may be either a Bitmap or a
+ * CompiledNeedle, and |needle| to its compiled needle (or NULL if it is a
+ * plain Bitmap). Returns false and sets error if |obj| is neither, or has no
+ * image data. */
+static bool needleFromObject(PyObject *obj, MMBitmapRef *bitmap,
+                             MMNeedleRef *needle);
+
+/* Cache of results consulted by find_color() and find_bitmap(), or NULL if
+ * caching is off. It is only touched with the GIL held. */
+static MMFindCacheRef findCache = NULL;
+
+/* Looks up the result of the search described by the arguments (as for
+ * MMFindCacheKeyInit()) in the find cache. If it is there, returns true and
+ * sets |ret| and |point| as the search would.
+ *
+ * Otherwise returns false, setting |keyed| to true if |key| has been filled
+ * in and the result should be passed to cacheFindResult() once the search has
+ * been done. The GIL is released while the pixels are hashed. */
+static bool lookUpFindResult(MMFindCacheKey *key, bool *keyed,
+                             MMFindCacheQuery query, MMBitmapRef haystack,
+                             MMRect rect, MMBitmapRef needle, MMRGBHex color,
+                             float tolerance, const MMPoint *hint, int *ret,
+                             MMPoint *point);
+
+/* Adds the result of the search identified by |key| to the find cache (if
+ * caching is still on). */
+static void cacheFindResult(const MMFindCacheKey *key, int ret, MMPoint point);
+
 /* -- Iterator methods -- */
 
 static PyObject *Bitmap_iter(BitmapObject *self)
@@ -397,6 +948,62 @@ static PyObject *Bitmap_iternext(BitmapObject *self)
 
 /* -- End of iterator methods -- */
 
+/* -- Buffer protocol -- */
+
+static int Bitmap_getbuffer(BitmapObject *self, Py_buffer *view, int flags)
+{
+	MMBitmapRef bitmap = self->bitmap;
+	size_t rowLength;
+
+	if (view == NULL) {
+		PyErr_SetString(PyExc_BufferError, "NULL view in getbuffer");
+		return -1;
+	}
+	view->obj = NULL;
+
+	if (!Bitmap_Ready(self)) return -1;
+	if ((flags & PyBUF_WRITABLE) == PyBUF_WRITABLE) {
+		PyErr_SetString(PyExc_BufferError, "Bitmap buffers are read-only");
+		return -1;
+	}
+
+	rowLength = bitmap->width * bitmap->bytesPerPixel;
+	if ((flags & PyBUF_STRIDES) != PyBUF_STRIDES &&
+	    bitmap->bytewidth != (ptrdiff_t)rowLength && bitmap->height > 1) {
+		PyErr_SetString(PyExc_BufferError,
+		                "Bitmap rows are padded; a strided buffer is required");
+		return -1;
+	}
+
+	self->shape[0] = (Py_ssize_t)bitmap->height;
+	self->shape[1] = (Py_ssize_t)bitmap->width;
+	self->shape[2] = (Py_ssize_t)bitmap->bytesPerPixel;
+	self->strides[0] = (Py_ssize_t)bitmap->bytewidth;
+	self->strides[1] = (Py_ssize_t)bitmap->bytesPerPixel;
+	self->strides[2] = 1;
+
+	view->buf = bitmap->imageBuffer;
+	view->len = (Py_ssize_t)(rowLength * bitmap->height);
+	view->readonly = 1;
+	view->itemsize = 1;
+	view->format = ((flags & PyBUF_FORMAT) == PyBUF_FORMAT) ? "B" : NULL;
+	view->ndim = 3;
+	view->shape = ((flags & PyBUF_ND) == PyBUF_ND) ? self->shape : NULL;
+	view->strides = ((flags & PyBUF_STRIDES) == PyBUF_STRIDES) ? self->strides
+	                                                           : NULL;
+	view->suboffsets = NULL;
+	view->internal = NULL;
+
+	/* Without a shape, the buffer is only a flat run of bytes. */
+	if (view->shape == NULL) view->ndim = 1;
+
+	Py_INCREF(self);
+	view->obj = (PyObject *)self;
+	return 0;
+}
+
+/* -- End of buffer protocol -- */
+
 /* -- Getters/setters -- */
 
 static PyObject *Bitmap_get_width(BitmapObject *self, PyObject *args)
@@ -427,7 +1034,9 @@ static PyObject *Bitmap_get_portion(BitmapObject *self, PyObject *args)
 		return NULL;
 	}
 
+	Py_BEGIN_ALLOW_THREADS
 	portion = copyMMBitmapFromPortion(self->bitmap, rect);
+	Py_END_ALLOW_THREADS
 
 	if (portion == NULL) {
 		PyErr_SetString(PyExc_IOError, "Error grabbing bitmap portion");
@@ -436,6 +1045,57 @@ static PyObject *Bitmap_get_portion(BitmapObject *self, PyObject *args)
 	return BitmapObject_FromMMBitmap(portion);
 }
 
+/* Release function for bitmaps created by Bitmap_view(); drops the reference
+ * to the bitmap object that owns the pixels. */
+static void releaseParentBitmap(uint8_t *buffer, void *info)
+{
+	PyGILState_STATE state = PyGILState_Ensure();
+	Py_DECREF((PyObject *)info);
+	PyGILState_Release(state);
+}
+
+static PyObject *Bitmap_view(BitmapObject *self, PyObject *args)
+{
+	MMRect rect;
+	MMBitmapRef parent = self->bitmap;
+	MMBitmapRef view;
+	if (!PyArg_ParseTuple(args, "(kk)(kk)", &(rect.origin.x),
+	                                        &(rect.origin.y),
+	                                        &(rect.size.width),
+	                                        &(rect.size.height)) ||
+	    !Bitmap_Ready(self)) {
+		return NULL;
+	}
+
+	/* Not MMBitmapRectInBounds(), as |origin| + |size| may wrap around. */
+	if (rect.origin.x > parent->width ||
+	    rect.size.width > parent->width - rect.origin.x ||
+	    rect.origin.y > parent->height ||
+	    rect.size.height > parent->height - rect.origin.y) {
+		PyErr_SetString(PyExc_ValueError, "Portion out of bounds");
+		return NULL;
+	} else if (rect.size.width == 0 || rect.size.height == 0) {
+		PyErr_SetString(PyExc_ValueError, "Portion is empty");
+		return NULL;
+	}
+
+	/* The view starts at the first pixel of the portion and keeps the
+	 * parent's stride, so each of its rows is a slice of the parent's. */
+	view = createMMBitmap(parent->imageBuffer +
+	                      (parent->bytewidth * (ptrdiff_t)rect.origin.y) +
+	                      (parent->bytesPerPixel * rect.origin.x),
+	                      rect.size.width,
+	                      rect.size.height,
+	                      parent->bytewidth,
+	                      parent->bitsPerPixel,
+	                      parent->bytesPerPixel);
+	if (view == NULL) return PyErr_NoMemory();
+
+	Py_INCREF(self);
+	MMBitmapSetReleaseFunc(view, &releaseParentBitmap, self);
+	return BitmapObject_FromMMBitmap(view);
+}
+
 static PyObject *Bitmap_point_in_bounds(BitmapObject *self, PyObject *args)
 {
 	MMPoint point;
@@ -471,12 +1131,17 @@ static PyObject *Bitmap_save(BitmapObject *self, PyObject *args)
 {
 	char *path;
 	MMImageType type;
+	int ret;
 
 	if (!parseImageIOArgs(args, &path, &type) || !Bitmap_Ready(self)) {
 		return NULL;
 	}
 
-	if (saveMMBitmapToFile(self->bitmap, path, type) != 0) {
+	Py_BEGIN_ALLOW_THREADS
+	ret = saveMMBitmapToFile(self->bitmap, path, type);
+	Py_END_ALLOW_THREADS
+
+	if (ret != 0) {
 		PyErr_SetString(PyExc_IOError, "Could not save image to file");
 		return NULL;
 	}
@@ -488,16 +1153,194 @@ static PyObject *Bitmap_to_string(BitmapObject *self, PyObject *args)
 {
 	char *buf = NULL;
 	MMBMPStringError err;
+	PyObject *str;
 
 	if (!Bitmap_Ready(self)) return NULL;
 
-	if ((buf = (char *)createStringFromMMBitmap(self->bitmap, &err)) == NULL) {
+	Py_BEGIN_ALLOW_THREADS
+	buf = (char *)createStringFromMMBitmap(self->bitmap, &err);
+	Py_END_ALLOW_THREADS
+
+	if (buf == NULL) {
 		PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
 		                      "Could not create string from bitmap: %s",
 		                      MMBitmapStringErrorString(err));
 		return NULL;
 	}
-	return /*PyString_FromString*/PyUnicode_FromString(buf);
+
+	str = /*PyString_FromString*/PyUnicode_FromString(buf);
+	free(buf);
+	return str;
+}
+
+/* Returns the serialized form of |bitmap| as a new bytes object, or NULL and
+ * sets error on failure. */
+static PyObject *bytesFromMMBitmap(MMBitmapRef bitmap, MMBitmapBytesCodec codec,
+                                   int level)
+{
+	PyObject *bytes;
+	size_t len;
+	MMBitmapBytesError err;
+
+	/* Serialize straight into the bytes object, then trim it to size. */
+	bytes = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)
+	                                  MMBitmapBytesMaxLength(bitmap, codec));
+	if (bytes == NULL) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	len = writeMMBitmapBytes(bitmap, codec, level,
+	                         (uint8_t *)PyBytes_AS_STRING(bytes),
+	                         (size_t)PyBytes_GET_SIZE(bytes), &err);
+	Py_END_ALLOW_THREADS
+
+	if (len == 0) {
+		Py_DECREF(bytes);
+		PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
+		                      "Could not create bytes from bitmap: %s",
+		                      MMBitmapBytesErrorString(err));
+		return NULL;
+	}
+
+	if (_PyBytes_Resize(&bytes, (Py_ssize_t)len) != 0) return NULL;
+	return bytes;
+}
+
+static PyObject *Bitmap_to_bytes(BitmapObject *self, PyObject *args,
+                                 PyObject *kwds)
+{
+	static char *kwlist[] = {"level", "codec", NULL};
+	int level = 0;
+	char *codecName = NULL;
+	MMBitmapBytesCodec codec;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "|iz", kwlist,
+	                                 &level, &codecName) ||
+	    !Bitmap_Ready(self)) {
+		return NULL;
+	}
+
+	if (level < 0 || level > 9) {
+		PyErr_SetString(PyExc_ValueError, "Level must be between 0 and 9");
+		return NULL;
+	}
+
+	if (codecName == NULL) {
+		codec = level == 0 ? kMMBitmapBytesRawCodec : kMMBitmapBytesZlibCodec;
+	} else if (strcmp(codecName, "raw") == 0) {
+		if (level != 0) {
+			PyErr_SetString(PyExc_ValueError,
+			                "The raw codec does not support compression");
+			return NULL;
+		}
+		codec = kMMBitmapBytesRawCodec;
+	} else if (strcmp(codecName, "zlib") == 0) {
+		codec = kMMBitmapBytesZlibCodec;
+	} else {
+		PyErr_SetFormatString(PyExc_ValueError, BUFSIZ,
+		                      "Unknown codec \"%.50s\"", codecName);
+		return NULL;
+	}
+
+	return bytesFromMMBitmap(self->bitmap, codec, level);
+}
+
+/* Returns a new bytes object holding a copy of the |len| bytes at |buf|, which
+ * is then free()'d, or NULL and sets error on failure. |buf| may be NULL if
+ * the data could not be created, in which case |desc| describes what. */
+static PyObject *bytesFromFileData(uint8_t *buf, size_t len, const char *desc)
+{
+	PyObject *bytes;
+
+	if (buf == NULL) {
+		PyErr_SetFormatString(PyExc_IOError, BUFSIZ,
+		                      "Could not create %s data from bitmap", desc);
+		return NULL;
+	}
+
+	bytes = PyBytes_FromStringAndSize((char *)buf, (Py_ssize_t)len);
+	free(buf);
+	return bytes;
+}
+
+/* Returns the MMPNGFilter flags named by |name|, or -1 if it is invalid. */
+static int pngFiltersFromName(const char *name)
+{
+	if (name == NULL) return kMMPNGDefaultFilters;
+	if (strcmp(name, "none") == 0) return kMMPNGFilterNone;
+	if (strcmp(name, "sub") == 0) return kMMPNGFilterSub;
+	if (strcmp(name, "up") == 0) return kMMPNGFilterUp;
+	if (strcmp(name, "average") == 0) return kMMPNGFilterAverage;
+	if (strcmp(name, "paeth") == 0) return kMMPNGFilterPaeth;
+	if (strcmp(name, "all") == 0) return kMMPNGAllFilters;
+	return -1;
+}
+
+static PyObject *Bitmap_to_png_bytes(BitmapObject *self, PyObject *args,
+                                     PyObject *kwds)
+{
+	static char *kwlist[] = {"level", "filter", NULL};
+	int level = 6;
+	char *filterName = NULL;
+	int filters;
+	uint8_t *buf;
+	size_t len = 0;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "|iz", kwlist,
+	                                 &level, &filterName) ||
+	    !Bitmap_Ready(self)) {
+		return NULL;
+	}
+
+	if (level < 0 || level > 9) {
+		PyErr_SetString(PyExc_ValueError, "Level must be between 0 and 9");
+		return NULL;
+	}
+
+	if ((filters = pngFiltersFromName(filterName)) < 0) {
+		PyErr_SetFormatString(PyExc_ValueError, BUFSIZ,
+		                      "Unknown filter \"%.50s\"", filterName);
+		return NULL;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	buf = createPNGDataWithOptions(self->bitmap, level, filters, &len);
+	Py_END_ALLOW_THREADS
+
+	return bytesFromFileData(buf, len, "PNG");
+}
+
+static PyObject *Bitmap_to_bmp_bytes(BitmapObject *self, PyObject *args)
+{
+	uint8_t *buf;
+	size_t len = 0;
+
+	if (!Bitmap_Ready(self)) return NULL;
+
+	Py_BEGIN_ALLOW_THREADS
+	buf = createBitmapData(self->bitmap, &len);
+	Py_END_ALLOW_THREADS
+
+	return bytesFromFileData(buf, len, "BMP");
+}
+
+static PyObject *Bitmap_reduce(BitmapObject *self, PyObject *args)
+{
+	PyObject *constructor;
+	PyObject *bytes;
+
+	if (!Bitmap_Ready(self)) return NULL;
+
+	constructor = PyObject_GetAttrString((PyObject *)Py_TYPE(self),
+	                                     "from_bytes");
+	if (constructor == NULL) return NULL;
+
+	bytes = bytesFromMMBitmap(self->bitmap, kMMBitmapBytesRawCodec, 0);
+	if (bytes == NULL) {
+		Py_DECREF(constructor);
+		return NULL;
+	}
+
+	return Py_BuildValue("(N(N))", constructor, bytes);
 }
 
 static PyObject *Bitmap_get_color(BitmapObject *self, PyObject *args)
@@ -515,52 +1358,104 @@ static PyObject *Bitmap_get_color(BitmapObject *self, PyObject *args)
 	return Py_BuildValue("I", MMRGBHexAtPoint(self->bitmap, point.x, point.y));
 }
 
-static PyObject *Bitmap_find_color(BitmapObject *self, PyObject *args)
+static PyObject *Bitmap_get_colors(BitmapObject *self, PyObject *args)
+{
+	PyObject *pointsObj;
+	MMPoint *points;
+	size_t count;
+	size_t i;
+	PyObject *colors;
+
+	if (!PyArg_ParseTuple(args, "O", &pointsObj) || !Bitmap_Ready(self) ||
+	    (points = pointsFromObject(pointsObj, &count)) == NULL) {
+		return NULL;
+	}
+
+	for (i = 0; i < count; ++i) {
+		if (!MMBitmapPointInBounds(self->bitmap, points[i])) {
+			PyMem_Free(points);
+			PyErr_SetString(PyExc_ValueError, "Point out of bounds");
+			return NULL;
+		}
+	}
+
+	colors = colorArrayFromPoints(self->bitmap, points, count, MMPointZero);
+	PyMem_Free(points);
+	return colors;
+}
+
+static PyObject *Bitmap_find_color(BitmapObject *self, PyObject *args,
+                                   PyObject *kwds)
 {
+	static char *kwlist[] = {"color", "tolerance", "rect", "hint", NULL};
 	MMRGBHex color;
 	float tolerance = 0.0f;
 	PyObject *rectTuple = NULL;
+	PyObject *hintTuple = NULL;
 
 	MMRect rect;
 	MMPoint point;
-
-	if (!PyArg_ParseTuple(args, "k|fO", &color, &tolerance, &rectTuple) ||
+	MMPoint hintPoint;
+	const MMPoint *hint;
+	int ret;
+	MMFindCacheKey key;
+	bool keyed;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "k|fOO", kwlist, &color,
+	                                 &tolerance, &rectTuple, &hintTuple) ||
 	    !Bitmap_Ready(self) ||
-		!rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect)) {
+	    !rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect) ||
+	    !hintFromTuple(hintTuple, &hintPoint, &hint)) {
 		return NULL;
 	}
 
-	if (findColorInRect(self->bitmap, color, &point, rect, tolerance) == 0) {
+	if (!lookUpFindResult(&key, &keyed, kMMFindCacheColorQuery, self->bitmap,
+	                      rect, NULL, color, tolerance, hint, &ret, &point)) {
+		Py_BEGIN_ALLOW_THREADS
+		if (hint != NULL) {
+			ret = findColorNearPointInRect(self->bitmap, color, &point, rect,
+			                               tolerance, *hint, HINT_RADIUS);
+		} else {
+			ret = findColorInRect(self->bitmap, color, &point, rect,
+			                      tolerance);
+		}
+		Py_END_ALLOW_THREADS
+
+		if (keyed) cacheFindResult(&key, ret, point);
+	}
+
+	if (ret == 0) {
 		return Py_BuildValue("(kk)", point.x, point.y);
 	}
 
 	Py_RETURN_NONE;
 }
 
-static PyObject *Bitmap_find_every_color(BitmapObject *self, PyObject *args)
+static PyObject *Bitmap_find_every_color(BitmapObject *self, PyObject *args,
+                                         PyObject *kwds)
 {
+	static char *kwlist[] = {"color", "tolerance", "rect", "compact", NULL};
 	MMRGBHex color;
 	float tolerance = 0.0f;
 	PyObject *rectTuple = NULL;
+	int compact = 0;
 
 	MMRect rect;
 	MMPointArrayRef pointArray;
-	PyObject *list;
 
-	if (!PyArg_ParseTuple(args, "k|fO", &color, &tolerance, &rectTuple) ||
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "k|fOi", kwlist, &color,
+	                                 &tolerance, &rectTuple, &compact) ||
 	    !Bitmap_Ready(self) ||
 	    !rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect)) {
 		return NULL;
 	}
 
+	Py_BEGIN_ALLOW_THREADS
 	pointArray = findAllColorInRect(self->bitmap, color, rect, tolerance);
+	Py_END_ALLOW_THREADS
 	if (pointArray == NULL) return NULL;
 
-	list = PyList_FromPointArray(pointArray);
-	destroyMMPointArray(pointArray);
-	if (list == NULL) return NULL;
-
-	return list;
+	return pointArrayResult(pointArray, compact);
 }
 
 static PyObject *Bitmap_count_of_color(BitmapObject *self, PyObject *args)
@@ -570,6 +1465,7 @@ static PyObject *Bitmap_count_of_color(BitmapObject *self, PyObject *args)
 	PyObject *rectTuple = NULL;
 
 	MMRect rect;
+	size_t count;
 
 	if (!PyArg_ParseTuple(args, "k|fO", &color, &tolerance, &rectTuple) ||
 	    !Bitmap_Ready(self) ||
@@ -577,77 +1473,323 @@ static PyObject *Bitmap_count_of_color(BitmapObject *self, PyObject *args)
 		return NULL;
 	}
 
-	return Py_BuildValue("k", countOfColorsInRect(self->bitmap, color,
-	                                              rect, tolerance));
+	Py_BEGIN_ALLOW_THREADS
+	count = countOfColorsInRect(self->bitmap, color, rect, tolerance);
+	Py_END_ALLOW_THREADS
+
+	return Py_BuildValue("k", count);
 }
 
-static PyObject *Bitmap_find_bitmap(BitmapObject *self, PyObject *args)
+static PyObject *Bitmap_find_bitmap(BitmapObject *self, PyObject *args,
+                                    PyObject *kwds)
 {
-	BitmapObject *needle;
+	static char *kwlist[] = {"needle", "tolerance", "rect", "hint", NULL};
+	PyObject *needleObj;
+	MMBitmapRef needleBitmap;
+	MMNeedleRef needle;
 	float tolerance = 0.0f;
 	MMPoint point;
 	PyObject *rectTuple = NULL;
+	PyObject *hintTuple = NULL;
 	MMRect rect;
-
-	if (!PyArg_ParseTuple(args, "O!|fO", &Bitmap_Type, &needle,
-	                                     &tolerance, &rectTuple) ||
-	    !Bitmap_Ready(self) || !Bitmap_Ready(needle) ||
-	    !rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect)) {
+	MMPoint hintPoint;
+	const MMPoint *hint;
+	int ret;
+	MMFindCacheKey key;
+	bool keyed;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|fOO", kwlist, &needleObj,
+	                                 &tolerance, &rectTuple, &hintTuple) ||
+	    !Bitmap_Ready(self) ||
+	    !needleFromObject(needleObj, &needleBitmap, &needle) ||
+	    !rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect) ||
+	    !hintFromTuple(hintTuple, &hintPoint, &hint)) {
 		return NULL;
 	}
 
-	if (findBitmapInRect(needle->bitmap, self->bitmap, &point,
-	                     rect, tolerance) == 0) {
+	if (!lookUpFindResult(&key, &keyed, kMMFindCacheBitmapQuery, self->bitmap,
+	                      rect, needleBitmap, 0, tolerance, hint, &ret,
+	                      &point)) {
+		Py_BEGIN_ALLOW_THREADS
+		if (hint != NULL && needle != NULL) {
+			ret = findNeedleNearPointInRect(needle, self->bitmap, &point,
+			                                rect, tolerance, *hint,
+			                                HINT_RADIUS);
+		} else if (hint != NULL) {
+			ret = findBitmapNearPointInRect(needleBitmap, self->bitmap,
+			                                &point, rect, tolerance, *hint,
+			                                HINT_RADIUS);
+		} else if (needle != NULL) {
+			ret = findNeedleInRect(needle, self->bitmap, &point, rect,
+			                       tolerance);
+		} else {
+			ret = findBitmapInRect(needleBitmap, self->bitmap, &point,
+			                       rect, tolerance);
+		}
+		Py_END_ALLOW_THREADS
+
+		if (keyed) cacheFindResult(&key, ret, point);
+	}
+
+	if (ret == 0) {
 		return Py_BuildValue("(kk)", point.x, point.y);
 	}
 
 	Py_RETURN_NONE;
 }
 
-static PyObject *Bitmap_find_every_bitmap(BitmapObject *self, PyObject *args)
+/* Keyword arguments accepted by count_of_bitmap(), and (followed by
+ * "compact") find_every_bitmap(). */
+static char *bitmapSearchKeywords[] = {"needle", "tolerance", "rect",
+                                       "threads", NULL};
+
+/* Returns false and sets error if |threads| is not a valid thread count. */
+static bool threadCountValid(Py_ssize_t threads)
+{
+	if (threads < 0) {
+		PyErr_SetString(PyExc_ValueError, "Thread count must not be negative");
+		return false;
+	}
+	return true;
+}
+
+static PyObject *Bitmap_find_every_bitmap(BitmapObject *self, PyObject *args,
+                                          PyObject *kwds)
 {
-	BitmapObject *needle;
+	static char *kwlist[] = {"needle", "tolerance", "rect", "threads",
+	                         "compact", NULL};
+	PyObject *needleObj;
+	MMBitmapRef needleBitmap;
+	MMNeedleRef needle;
 	float tolerance = 0.0f;
 	PyObject *rectTuple = NULL;
+	Py_ssize_t threads = 1;
+	int compact = 0;
 	MMRect rect;
 
 	MMPointArrayRef pointArray;
-	PyObject *list;
 
-	if (!PyArg_ParseTuple(args, "O!|fO", &Bitmap_Type, &needle,
-	                                     &tolerance, &rectTuple) ||
-	    !Bitmap_Ready(self) || !Bitmap_Ready(needle) ||
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|fOni", kwlist,
+	                                 &needleObj, &tolerance,
+	                                 &rectTuple, &threads, &compact) ||
+	    !threadCountValid(threads) || !Bitmap_Ready(self) ||
+	    !needleFromObject(needleObj, &needleBitmap, &needle) ||
 	    !rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect)) {
 		return NULL;
 	}
 
-	pointArray = findAllBitmapInRect(needle->bitmap, self->bitmap,
-	                                 rect, tolerance);
-	if (pointArray == NULL) return NULL;
+	Py_BEGIN_ALLOW_THREADS
+	if (needle != NULL) {
+		pointArray = findAllNeedleInRectThreaded(needle, self->bitmap, rect,
+		                                         tolerance, (size_t)threads);
+	} else {
+		pointArray = findAllBitmapInRectThreaded(needleBitmap, self->bitmap,
+		                                         rect, tolerance,
+		                                         (size_t)threads);
+	}
+	Py_END_ALLOW_THREADS
+	if (pointArray == NULL) return PyErr_NoMemory();
 
-	list = PyList_FromPointArray(pointArray);
-	destroyMMPointArray(pointArray);
-	if (list == NULL) return NULL;
+	return pointArrayResult(pointArray, compact);
+}
 
-	return list;
+static PyObject *Bitmap_count_of_bitmap(BitmapObject *self, PyObject *args,
+                                        PyObject *kwds)
+{
+	PyObject *needleObj;
+	MMBitmapRef needleBitmap;
+	MMNeedleRef needle;
+	float tolerance = 0.0f;
+	PyObject *rectTuple = NULL;
+	Py_ssize_t threads = 1;
+	MMRect rect;
+	size_t count;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|fOn", bitmapSearchKeywords,
+	                                 &needleObj, &tolerance,
+	                                 &rectTuple, &threads) ||
+	    !threadCountValid(threads) || !Bitmap_Ready(self) ||
+	    !needleFromObject(needleObj, &needleBitmap, &needle) ||
+	    !rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect)) {
+		return NULL;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	if (needle != NULL) {
+		count = countOfNeedleInRectThreaded(needle, self->bitmap, rect,
+		                                    tolerance, (size_t)threads);
+	} else {
+		count = countOfBitmapInRectThreaded(needleBitmap, self->bitmap, rect,
+		                                    tolerance, (size_t)threads);
+	}
+	Py_END_ALLOW_THREADS
+
+	return Py_BuildValue("k", count);
 }
 
-static PyObject *Bitmap_count_of_bitmap(BitmapObject *self, PyObject *args)
+static PyObject *Bitmap_find_bitmaps(BitmapObject *self, PyObject *args)
 {
-	BitmapObject *needle;
+	PyObject *needlesObj;
 	float tolerance = 0.0f;
 	PyObject *rectTuple = NULL;
 	MMRect rect;
 
-	if (!PyArg_ParseTuple(args, "O!|fO", &Bitmap_Type, &needle,
-	                                     &tolerance, &rectTuple) ||
-	    !Bitmap_Ready(self) || !Bitmap_Ready(needle) ||
+	PyObject *needleTuple;
+	MMBitmapRef *needles;
+	MMPointArrayRef *pointArrays;
+	Py_ssize_t needleCount, i;
+	PyObject *dict;
+	int ret;
+
+	if (!PyArg_ParseTuple(args, "O|fO", &needlesObj, &tolerance, &rectTuple) ||
+	    !Bitmap_Ready(self) ||
 	    !rectFromTupleOrBitmap(self->bitmap, rectTuple, &rect)) {
 		return NULL;
 	}
 
-	return Py_BuildValue("k", countOfBitmapInRect(needle->bitmap, self->bitmap,
-	                                              rect, tolerance));
+	/* Copy |needles| into a tuple, so that it holds on to each bitmap while
+	 * the GIL is released. */
+	if ((needleTuple = PySequence_Tuple(needlesObj)) == NULL) return NULL;
+	needleCount = PyTuple_GET_SIZE(needleTuple);
+
+	needles = PyMem_Malloc(sizeof(MMBitmapRef) * (needleCount + 1));
+	pointArrays = PyMem_Malloc(sizeof(MMPointArrayRef) * (needleCount + 1));
+	if (needles == NULL || pointArrays == NULL) {
+		PyMem_Free(needles);
+		PyMem_Free(pointArrays);
+		Py_DECREF(needleTuple);
+		return PyErr_NoMemory();
+	}
+
+	for (i = 0; i < needleCount; ++i) {
+		MMNeedleRef needle;
+		if (!needleFromObject(PyTuple_GET_ITEM(needleTuple, i),
+		                      needles + i, &needle)) {
+			break;
+		}
+	}
+
+	if (i < needleCount) {
+		PyMem_Free(needles);
+		PyMem_Free(pointArrays);
+		Py_DECREF(needleTuple);
+		return NULL;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	ret = findAllBitmapsInRect(needles, (size_t)needleCount, self->bitmap,
+	                           rect, tolerance, pointArrays);
+	Py_END_ALLOW_THREADS
+
+	if (ret != 0) {
+		PyMem_Free(needles);
+		PyMem_Free(pointArrays);
+		Py_DECREF(needleTuple);
+		return PyErr_NoMemory();
+	}
+
+	dict = PyDict_New();
+	for (i = 0; i < needleCount; ++i) {
+		if (pointArrays[i] == NULL) {
+			if (dict != NULL) {
+				Py_CLEAR(dict);
+				PyErr_NoMemory();
+			}
+			continue;
+		}
+		if (dict != NULL) {
+			PyObject *key = Py_BuildValue("n", i);
+			PyObject *list = PyList_FromPointArray(pointArrays[i]);
+			if (key == NULL || list == NULL ||
+			    PyDict_SetItem(dict, key, list) != 0) {
+				Py_CLEAR(dict);
+			}
+			Py_XDECREF(key);
+			Py_XDECREF(list);
+		}
+		destroyMMPointArray(pointArrays[i]);
+	}
+
+	PyMem_Free(needles);
+	PyMem_Free(pointArrays);
+	Py_DECREF(needleTuple);
+	return dict;
+}
+
+static PyObject *Bitmap_diff_regions(BitmapObject *self, PyObject *args,
+                                     PyObject *kwds)
+{
+	static char *kwlist[] = {"other", "tile", "tolerance", NULL};
+	BitmapObject *other;
+	Py_ssize_t tile = 32;
+	float tolerance = 0.0f;
+
+	MMRect *rects;
+	size_t count, i;
+	int ret;
+	PyObject *list;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!|nf", kwlist,
+	                                 &Bitmap_Type, &other, &tile,
+	                                 &tolerance) ||
+	    !Bitmap_Ready(self) || !Bitmap_Ready(other)) {
+		return NULL;
+	}
+
+	if (self->bitmap->width != other->bitmap->width ||
+	    self->bitmap->height != other->bitmap->height) {
+		PyErr_SetString(PyExc_ValueError, "Bitmaps are not the same size");
+		return NULL;
+	} else if (tile < 1) {
+		PyErr_SetString(PyExc_ValueError, "Tile size must be positive");
+		return NULL;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	ret = diffMMBitmapRegions(self->bitmap, other->bitmap, (size_t)tile,
+	                          tolerance, &rects, &count);
+	Py_END_ALLOW_THREADS
+
+	if (ret != 0) return PyErr_NoMemory();
+
+	if ((list = PyList_New((Py_ssize_t)count)) != NULL) {
+		for (i = 0; i < count; ++i) {
+			PyObject *rectObj = Py_BuildValue("((kk)(kk))",
+			                                  rects[i].origin.x,
+			                                  rects[i].origin.y,
+			                                  rects[i].size.width,
+			                                  rects[i].size.height);
+			if (rectObj == NULL) {
+				Py_CLEAR(list);
+				break;
+			}
+			PyList_SET_ITEM(list, (Py_ssize_t)i, rectObj);
+		}
+	}
+
+	free(rects);
+	return list;
+}
+
+static bool needleFromObject(PyObject *obj, MMBitmapRef *bitmap,
+                             MMNeedleRef *needle)
+{
+	BitmapObject *bitmapObj;
+
+	if (PyObject_TypeCheck(obj, &Needle_Type)) {
+		*needle = ((NeedleObject *)obj)->needle;
+		bitmapObj = ((NeedleObject *)obj)->bitmap;
+	} else if (PyObject_TypeCheck(obj, &Bitmap_Type)) {
+		*needle = NULL;
+		bitmapObj = (BitmapObject *)obj;
+	} else {
+		Py_SetConvertErr("Bitmap or CompiledNeedle", obj);
+		return false;
+	}
+
+	if (!Bitmap_Ready(bitmapObj)) return false;
+	*bitmap = bitmapObj->bitmap;
+	return true;
 }
 
 static bool rectFromTupleOrBitmap(MMBitmapRef bitmap,
@@ -672,6 +1814,23 @@ static bool rectFromTupleOrBitmap(MMBitmapRef bitmap,
 	return true;
 }
 
+static bool hintFromTuple(PyObject *hintTuple, MMPoint *point,
+                          const MMPoint **hint)
+{
+	if (hintTuple == NULL || hintTuple == Py_None) {
+		*hint = NULL;
+		return true;
+	}
+
+	if (!PyArg_ParseTuple(hintTuple, "kk", &(point->x), &(point->y))) {
+		PyErr_SetString(PyExc_TypeError, "Hint is not a point");
+		return false;
+	}
+
+	*hint = point;
+	return true;
+}
+
 static PyObject *PyList_FromPointArray(MMPointArrayRef pointArray)
 {
 	PyObject *list;
@@ -690,6 +1849,65 @@ static PyObject *PyList_FromPointArray(MMPointArrayRef pointArray)
 	return list;
 }
 
+static PyObject *pointArrayResult(MMPointArrayRef pointArray, int compact)
+{
+	PyObject *list;
+
+	if (compact) return PointArrayObject_FromMMPointArray(pointArray);
+
+	list = PyList_FromPointArray(pointArray);
+	destroyMMPointArray(pointArray);
+	return list;
+}
+
+static bool lookUpFindResult(MMFindCacheKey *key, bool *keyed,
+                             MMFindCacheQuery query, MMBitmapRef haystack,
+                             MMRect rect, MMBitmapRef needle, MMRGBHex color,
+                             float tolerance, const MMPoint *hint, int *ret,
+                             MMPoint *point)
+{
+	*keyed = false;
+
+	/* Searches of rects out of bounds are left to fail as they would. */
+	if (findCache == NULL || !MMBitmapRectInBounds(haystack, rect)) {
+		return false;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	MMFindCacheKeyInit(key, query, haystack, rect, needle, color, tolerance,
+	                   hint);
+	Py_END_ALLOW_THREADS
+	*keyed = true;
+
+	/* Caching may have been turned off in the meantime. */
+	return findCache != NULL && MMFindCacheLookup(findCache, key, ret, point);
+}
+
+static void cacheFindResult(const MMFindCacheKey *key, int ret, MMPoint point)
+{
+	/* If there is no memory for it, the result simply isn't cached. */
+	if (findCache != NULL) MMFindCacheInsert(findCache, key, ret, point);
+}
+
+bool Bitmap_SetFindCacheSize(size_t size)
+{
+	MMFindCacheRef cache = NULL;
+
+	if (size > 0 && (cache = createMMFindCache(size)) == NULL) {
+		PyErr_NoMemory();
+		return false;
+	}
+
+	if (findCache != NULL) destroyMMFindCache(findCache);
+	findCache = cache;
+	return true;
+}
+
+MMFindCacheRef Bitmap_GetFindCache(void)
+{
+	return findCache;
+}
+
 static bool parseImageIOArgs(PyObject *args, char **path, MMImageType *type)
 {
 	int pathLen;
@@ -5,12 +5,15 @@
 #include <Python.h>
 #include <structmember.h> /* For PyObject_HEAD, etc. */
 #include "MMBitmap.h"
+#include "find_cache.h"
 
 /* This file defines the class "Bitmap" for dealing with raw bitmaps. */
 struct _BitmapObject {
 	PyObject_HEAD
 	MMBitmapRef bitmap;
 	MMPoint point; /* For iterator */
+	Py_ssize_t shape[3]; /* For buffer protocol */
+	Py_ssize_t strides[3];
 };
 
 typedef struct _BitmapObject BitmapObject;
@@ -24,4 +27,14 @@ extern PyTypeObject Bitmap_Type;
  * Remember to call PyType_Ready() before using this for the first time! */
 PyObject *BitmapObject_FromMMBitmap(MMBitmapRef bitmap);
 
+/* Replaces the cache of results consulted by Bitmap.find_color() and
+ * Bitmap.find_bitmap() with an empty one holding up to |size| results, or
+ * turns caching off if |size| is 0 (as it is to begin with). Returns false and
+ * sets error if the cache could not be allocated. */
+bool Bitmap_SetFindCacheSize(size_t size);
+
+/* Returns the cache of results in use, or NULL if caching is off. It must only
+ * be used with the GIL held. */
+MMFindCacheRef Bitmap_GetFindCache(void);
+
 #endif /* PY_BITMAP_CLASS_H */
@@ -0,0 +1,388 @@
+#include "py-capture-session-class.h"
+#include "py-bitmap-class.h"
+#include "py-screen-stream-class.h" /* For displayRectFromObject() */
+
+/* -- CaptureSession class definition -- */
+
+/* Acquires the lock of |self|, waiting for it with the GIL released if
+ * another thread holds it (e.g., while refreshing). */
+static void CaptureSession_lock(CaptureSessionObject *self)
+{
+	if (!PyThread_acquire_lock(self->lock, NOWAIT_LOCK)) {
+		Py_BEGIN_ALLOW_THREADS
+		PyThread_acquire_lock(self->lock, WAIT_LOCK);
+		Py_END_ALLOW_THREADS
+	}
+}
+
+/* Stops tracking changes (if the session is open), waiting for a refresh in
+ * progress on another thread to finish first. The frame stays valid. */
+static void CaptureSession_stop(CaptureSessionObject *self)
+{
+	MMCaptureSessionRef session;
+
+	if (self->lock == NULL) return; /* Never initialized. */
+
+	CaptureSession_lock(self);
+	session = self->session;
+	self->session = NULL;
+	PyThread_release_lock(self->lock);
+
+	if (session != NULL) destroyMMCaptureSession(session);
+}
+
+static void CaptureSession_dealloc(CaptureSessionObject *self)
+{
+	CaptureSession_stop(self);
+	if (self->buffer != NULL) destroyMMBitmap(self->buffer);
+	Py_XDECREF(self->frame);
+	if (self->lock != NULL) PyThread_free_lock(self->lock);
+	((PyObject*)self)->ob_type->tp_free((PyObject *)self);
+}
+
+/* -- CaptureSession class method declarations -- */
+
+/* Syntax: CaptureSession(rect=None) => CaptureSession object */
+/* Arguments: |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
+                        or None */
+/* Description: Grabs the given portion of the main display (or the entire
+                display if |rect| is None) into |frame|, and starts tracking
+                which parts of it are drawn to so that refresh() can bring a
+                copy of it up to date by grabbing only those.
+
+                On X11 the changes are tracked with the DAMAGE extension. If
+                it is not available (see |tracks_damage|), every refresh grabs
+                the whole rect instead.
+
+                Tracking is stopped by close(), by leaving a `with` block, or
+                when the session is deleted. */
+/* Raises: |ValueError| if the rect is out of bounds,
+           |OSError| if the session could not be started or the screengrab
+           failed. */
+static int CaptureSession_init(CaptureSessionObject *self, PyObject *args,
+                               PyObject *kwds);
+
+/* Syntax: session.refresh() => list of ((x, y), (width, height)) rects */
+/* Description: Grabs the parts of the display that changed since the last
+                refresh (or since the session was started), and returns them
+                as a list of non-overlapping rects relative to the session's
+                rect. The list is empty if nothing changed.
+
+                If anything changed, |frame| is replaced by a new Bitmap;
+                like any other, the previous one is never modified, so it
+                (and needles compiled from it, or views of it) can still be
+                used. */
+/* Raises: |ValueError| if the session is closed,
+           |OSError| if a screengrab failed. */
+static PyObject *CaptureSession_refresh(CaptureSessionObject *self,
+                                        PyObject *args);
+
+/* Syntax: session.close() */
+/* Description: Stops tracking changes. |frame| stays valid, but is no longer
+                replaced. If another thread is refreshing the session, this
+                waits for it to finish. */
+static PyObject *CaptureSession_close(CaptureSessionObject *self,
+                                      PyObject *args);
+
+/* Syntax: with session: ... */
+/* Description: Closes the session when the block is left. */
+static PyObject *CaptureSession_enter(CaptureSessionObject *self,
+                                      PyObject *args);
+static PyObject *CaptureSession_exit(CaptureSessionObject *self,
+                                     PyObject *args);
+
+/* Bitmap holding the display as of the last refresh. */
+static PyObject *CaptureSession_get_frame(CaptureSessionObject *self,
+                                          PyObject *args);
+
+/* Whether refreshes grab only what changed. */
+static PyObject *CaptureSession_get_tracks_damage(CaptureSessionObject *self,
+                                                  PyObject *args);
+
+static PyGetSetDef CaptureSession_getsetters[] = {
+	{"frame", (getter)CaptureSession_get_frame, NULL,
+	 "Bitmap holding the display as of the last refresh. Each refresh that "
+	 "changes anything replaces it with a new Bitmap, leaving the previous "
+	 "one as it was.", NULL},
+	{"tracks_damage", (getter)CaptureSession_get_tracks_damage, NULL,
+	 "Whether refresh() grabs only what changed, rather than the whole "
+	 "rect.", NULL},
+	{NULL} /* Sentinel */
+};
+
+static PyMethodDef CaptureSession_methods[] = {
+	{"refresh", (PyCFunction)CaptureSession_refresh, METH_NOARGS,
+	 "session.refresh() -> list of ((x, y), (width, height)) rects\n"
+	 "Grabs the parts of the display that changed since the last refresh "
+	 "into a new frame, and returns them relative to the session's rect."},
+	{"close", (PyCFunction)CaptureSession_close, METH_NOARGS,
+	 "session.close()\n"
+	 "Stops tracking changes. The frame stays valid."},
+	{"__enter__", (PyCFunction)CaptureSession_enter, METH_NOARGS, NULL},
+	{"__exit__", (PyCFunction)CaptureSession_exit, METH_VARARGS, NULL},
+	{NULL} /* Sentinel */
+};
+
+PyTypeObject CaptureSession_Type = {
+   PyVarObject_HEAD_INIT(NULL, 0)
+   "autopy.bitmap.CaptureSession", /* tp_name */
+   sizeof(CaptureSessionObject),  /* tp_basicsize */
+   0,                             /* tp_itemsize */
+   (destructor)CaptureSession_dealloc, /* tp_dealloc */
+   0,                             /* tp_print */
+   0,                             /* tp_getattr */
+   0,                             /* tp_setattr */
+   0,                             /* tp_compare */
+   0,                             /* tp_repr */
+   0,                             /* tp_as_number */
+   0,                             /* tp_as_sequence */
+   0,                             /* tp_as_mapping */
+   0,                             /* tp_hash */
+   0,                             /* tp_call */
+   0,                             /* tp_str */
+   0,                             /* tp_getattro */
+   0,                             /* tp_setattro */
+   0,                             /* tp_as_buffer */
+   Py_TPFLAGS_DEFAULT,            /* tp_flags*/
+   "CaptureSession(rect=None)\n"
+   "Screengrab of the display kept up to date by re-reading only the parts "
+   "of it that changed.", /* tp_doc */
+   0,                             /* tp_traverse */
+   0,                             /* tp_clear */
+   0,                             /* tp_richcompare */
+   0,                             /* tp_weaklistoffset */
+   0,                             /* tp_iter */
+   0,                             /* tp_iternext */
+   CaptureSession_methods,        /* tp_methods */
+   0,                             /* tp_members */
+   CaptureSession_getsetters,     /* tp_getset */
+   0,                             /* tp_base */
+   0,                             /* tp_dict */
+   0,                             /* tp_descr_get */
+   0,                             /* tp_descr_set */
+   0,                             /* tp_dictoffset */
+   (initproc)CaptureSession_init, /* tp_init */
+   0,                             /* tp_alloc */
+   PyType_GenericNew,             /* tp_new */
+};
+
+/* -- End of CaptureSession class definition -- */
+
+/* -- CaptureSession class method definitions -- */
+
+static int CaptureSession_init(CaptureSessionObject *self, PyObject *args,
+                               PyObject *kwds)
+{
+	static char *kwlist[] = {"rect", NULL};
+	PyObject *rectObj = NULL;
+	PyObject *frameObj;
+	PyObject *oldFrame;
+	MMCaptureSessionRef oldSession;
+	MMBitmapRef oldBuffer;
+	MMRect rect;
+	MMBitmapRef buffer;
+	MMBitmapRef frame = NULL;
+	MMCaptureSessionRef session;
+	const MMRect *changed;
+	size_t count;
+	int ret;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "|O", kwlist, &rectObj) ||
+	    !displayRectFromObject(rectObj, &rect)) {
+		return -1;
+	}
+
+	if (self->lock == NULL && (self->lock = PyThread_allocate_lock()) == NULL) {
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	/* The buffer starts out empty, so the first refresh grabs all of it. */
+	buffer = createMMBitmap(NULL, 0, 0, 0, 0, 0);
+	if (buffer == NULL) {
+		PyErr_NoMemory();
+		return -1;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	session = createMMCaptureSession(rect);
+	ret = session == NULL ? -1 : MMCaptureSessionRefresh(session, buffer,
+	                                                     &changed, &count);
+	if (ret == 0) frame = copyMMBitmap(buffer);
+	Py_END_ALLOW_THREADS
+
+	if (ret != 0 || frame == NULL) {
+		if (session != NULL) destroyMMCaptureSession(session);
+		destroyMMBitmap(buffer);
+		if (ret == 0) {
+			PyErr_NoMemory();
+		} else {
+			PyErr_SetString(PyExc_OSError, session == NULL
+			                    ? "Could not start capture session"
+			                    : "Could not copy RGB data from display");
+		}
+		return -1;
+	}
+
+	if ((frameObj = BitmapObject_FromMMBitmap(frame)) == NULL) {
+		destroyMMBitmap(frame);
+		destroyMMCaptureSession(session);
+		destroyMMBitmap(buffer);
+		return -1;
+	}
+
+	/* In case __init__() is called again. */
+	CaptureSession_lock(self);
+	oldSession = self->session;
+	oldBuffer = self->buffer;
+	oldFrame = self->frame;
+	self->session = session;
+	self->buffer = buffer;
+	self->frame = frameObj;
+	self->stale = false;
+	PyThread_release_lock(self->lock);
+
+	if (oldSession != NULL) destroyMMCaptureSession(oldSession);
+	if (oldBuffer != NULL) destroyMMBitmap(oldBuffer);
+	Py_XDECREF(oldFrame);
+	return 0;
+}
+
+static PyObject *CaptureSession_refresh(CaptureSessionObject *self,
+                                        PyObject *args)
+{
+	MMCaptureSessionRef session;
+	MMBitmapRef buffer;
+	MMBitmapRef frame = NULL;
+	PyObject *frameObj;
+	PyObject *oldFrame = NULL;
+	const MMRect *changed;
+	MMRect whole;
+	size_t count, i;
+	PyObject *list = NULL;
+	int ret;
+
+	if (self->lock == NULL) {
+		PyErr_SetString(PyExc_ValueError,
+		                "Capture session has not been initialized");
+		return NULL;
+	}
+
+	/* Held until the changed rects (which belong to the session) have been
+	 * copied, so that the session can't be closed or refreshed by another
+	 * thread in the meantime. */
+	CaptureSession_lock(self);
+	if ((session = self->session) == NULL) {
+		PyErr_SetString(PyExc_ValueError,
+		                "Refresh of a closed capture session");
+		goto done;
+	}
+
+	/* The buffer is never exposed, so it can be written to in place; each
+	 * refresh that changes it hands out a copy as a new frame instead, as a
+	 * Bitmap must never be modified once it is created. */
+	buffer = self->buffer;
+	Py_BEGIN_ALLOW_THREADS
+	ret = MMCaptureSessionRefresh(session, buffer, &changed, &count);
+	if (ret == 0 && (count > 0 || self->stale)) frame = copyMMBitmap(buffer);
+	Py_END_ALLOW_THREADS
+
+	if (ret != 0) {
+		PyErr_SetString(PyExc_OSError, "Could not copy RGB data from display");
+		goto done;
+	}
+
+	if (count > 0 || self->stale) {
+		/* If the frame was behind, the changes reported since are lost, so
+		 * all of it is reported as changed. */
+		if (self->stale) {
+			whole = MMRectMake(0, 0, buffer->width, buffer->height);
+			changed = &whole;
+			count = 1;
+		}
+
+		/* Until the new frame and the changes have been handed out. */
+		self->stale = true;
+		if (frame == NULL) {
+			PyErr_NoMemory();
+			goto done;
+		} else if ((frameObj = BitmapObject_FromMMBitmap(frame)) == NULL) {
+			destroyMMBitmap(frame);
+			goto done;
+		}
+
+		oldFrame = self->frame;
+		self->frame = frameObj;
+	}
+
+	if ((list = PyList_New((Py_ssize_t)count)) == NULL) goto done;
+	for (i = 0; i < count; ++i) {
+		PyObject *rectObj = Py_BuildValue("((kk)(kk))",
+		                                  changed[i].origin.x,
+		                                  changed[i].origin.y,
+		                                  changed[i].size.width,
+		                                  changed[i].size.height);
+		if (rectObj == NULL) {
+			Py_CLEAR(list);
+			goto done;
+		}
+		PyList_SET_ITEM(list, (Py_ssize_t)i, rectObj);
+	}
+	self->stale = false;
+
+done:
+	PyThread_release_lock(self->lock);
+	Py_XDECREF(oldFrame);
+	return list;
+}
+
+static PyObject *CaptureSession_close(CaptureSessionObject *self,
+                                      PyObject *args)
+{
+	CaptureSession_stop(self);
+	Py_RETURN_NONE;
+}
+
+static PyObject *CaptureSession_enter(CaptureSessionObject *self,
+                                      PyObject *args)
+{
+	Py_INCREF(self);
+	return (PyObject *)self;
+}
+
+static PyObject *CaptureSession_exit(CaptureSessionObject *self,
+                                     PyObject *args)
+{
+	CaptureSession_stop(self);
+	Py_RETURN_FALSE; /* Don't suppress exceptions. */
+}
+
+static PyObject *CaptureSession_get_frame(CaptureSessionObject *self,
+                                          PyObject *args)
+{
+	if (self->frame == NULL) {
+		PyErr_SetString(PyExc_ValueError,
+		                "Capture session has not been initialized");
+		return NULL;
+	}
+
+	Py_INCREF(self->frame);
+	return self->frame;
+}
+
+static PyObject *CaptureSession_get_tracks_damage(CaptureSessionObject *self,
+                                                  PyObject *args)
+{
+	bool tracksDamage = false;
+
+	if (self->lock != NULL) {
+		CaptureSession_lock(self);
+		tracksDamage = self->session != NULL &&
+		               MMCaptureSessionTracksDamage(self->session);
+		PyThread_release_lock(self->lock);
+	}
+
+	return PyBool_FromLong(tracksDamage);
+}
+
+/* -- End of CaptureSession class method definitions -- */
@@ -0,0 +1,29 @@
+#pragma once
+#ifndef PY_CAPTURE_SESSION_CLASS_H
+#define PY_CAPTURE_SESSION_CLASS_H
+
+#include <Python.h>
+#include <structmember.h> /* For PyObject_HEAD, etc. */
+#include "capturesession.h"
+
+/* This file defines the class "CaptureSession" for keeping a screengrab up to
+ * date by re-reading only the parts of the display that changed. */
+struct _CaptureSessionObject {
+	PyObject_HEAD
+	MMCaptureSessionRef session; /* NULL once closed. */
+	MMBitmapRef buffer; /* Refreshed in place by |session|; never exposed. */
+	PyObject *frame; /* Bitmap object copied from |buffer|, or NULL. */
+	bool stale; /* Set if changes to |buffer| have not all been handed out
+	             * (in |frame| and the rects refresh() returns). */
+
+	/* Guards the fields above; held for the whole of a refresh, so that
+	 * closing the session (or another refresh) waits for it. NULL until the
+	 * session is first initialized. */
+	PyThread_type_lock lock;
+};
+
+typedef struct _CaptureSessionObject CaptureSessionObject;
+
+extern PyTypeObject CaptureSession_Type;
+
+#endif /* PY_CAPTURE_SESSION_CLASS_H */
@@ -2,10 +2,15 @@
 
 int Py_AddClassToModule(PyObject *mod, PyTypeObject *classType)
 {
+	/* tp_name includes the module (e.g. "autopy.bitmap.Bitmap") so that
+	 * pickle can find the class; the module attribute is the last part. */
+	const char *name = strrchr(classType->tp_name, '.');
+	name = (name == NULL) ? classType->tp_name : name + 1;
+
 	if (PyType_Ready(classType) < 0) return -1;
 
 	Py_INCREF(classType);
-	return PyModule_AddObject(mod, classType->tp_name, (PyObject *)classType);
+	return PyModule_AddObject(mod, name, (PyObject *)classType);
 }
 
 void PyErr_SetFormatString(PyObject *type, size_t size,
@@ -4,7 +4,8 @@
 
 #include <Python.h>
 
-/* Checks class is ready and adds it to module.
+/* Checks class is ready and adds it to module, under the part of its tp_name
+ * after the last dot.
  * 0 is returned on success, -1 on failure. */
 int Py_AddClassToModule(PyObject *mod, PyTypeObject *classType);
 
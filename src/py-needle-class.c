@@ -0,0 +1,135 @@
+#include "py-needle-class.h"
+
+/* -- CompiledNeedle class definition -- */
+
+/* The search tables of a CompiledNeedle are computed once when it is created
+ * and only ever read afterwards, so a single needle may be searched for from
+ * several threads at once. Its Bitmap is never modified either (see the note
+ * in py-bitmap-class.c). */
+
+static void Needle_dealloc(NeedleObject *self)
+{
+	if (self->needle != NULL) {
+		destroyMMNeedle(self->needle);
+		self->needle = NULL;
+	}
+	Py_XDECREF(self->bitmap);
+	((PyObject*)self)->ob_type->tp_free((PyObject *)self);
+}
+
+/* -- CompiledNeedle getters/setters -- */
+
+static PyObject *Needle_get_bitmap(NeedleObject *self, PyObject *args)
+{
+	Py_INCREF(self->bitmap);
+	return (PyObject *)self->bitmap;
+}
+
+static PyObject *Needle_get_width(NeedleObject *self, PyObject *args)
+{
+	return Py_BuildValue("k", self->bitmap->bitmap->width);
+}
+
+static PyObject *Needle_get_height(NeedleObject *self, PyObject *args)
+{
+	return Py_BuildValue("k", self->bitmap->bitmap->height);
+}
+
+static PyObject *Needle_get_pyramid(NeedleObject *self, PyObject *args)
+{
+	return PyBool_FromLong(MMNeedlePyramidLevels(self->needle) > 0);
+}
+
+/* -- End of getters/setters -- */
+
+static PyGetSetDef Needle_getsetters[] = {
+	{"bitmap", (getter)Needle_get_bitmap, NULL,
+	 "The Bitmap the needle was compiled from.", NULL},
+	{"width", (getter)Needle_get_width, NULL, NULL, NULL},
+	{"height", (getter)Needle_get_height, NULL, NULL, NULL},
+	{"pyramid", (getter)Needle_get_pyramid, NULL,
+	 "Whether fuzzy searches for the needle use a downsampled copy of it "
+	 "(see compile_needle()).", NULL},
+	{NULL} /* Sentinel */
+};
+
+PyTypeObject Needle_Type = {
+   PyVarObject_HEAD_INIT(NULL, 0)
+   "autopy.bitmap.CompiledNeedle", /* tp_name */
+   sizeof(NeedleObject),          /* tp_basicsize */
+   0,                             /* tp_itemsize */
+   (destructor)Needle_dealloc,    /* tp_dealloc */
+   0,                             /* tp_print */
+   0,                             /* tp_getattr */
+   0,                             /* tp_setattr */
+   0,                             /* tp_compare */
+   0,                             /* tp_repr */
+   0,                             /* tp_as_number */
+   0,                             /* tp_as_sequence */
+   0,                             /* tp_as_mapping */
+   0,                             /* tp_hash */
+   0,                             /* tp_call */
+   0,                             /* tp_str */
+   0,                             /* tp_getattro */
+   0,                             /* tp_setattro */
+   0,                             /* tp_as_buffer */
+   Py_TPFLAGS_DEFAULT,            /* tp_flags*/
+   "Bitmap with its search tables computed ahead of time, as returned by "
+   "compile_needle()",            /* tp_doc */
+   0,                             /* tp_traverse */
+   0,                             /* tp_clear */
+   0,                             /* tp_richcompare */
+   0,                             /* tp_weaklistoffset */
+   0,                             /* tp_iter */
+   0,                             /* tp_iternext */
+   0,                             /* tp_methods */
+   0,                             /* tp_members */
+   Needle_getsetters,             /* tp_getset */
+   0,                             /* tp_base */
+   0,                             /* tp_dict */
+   0,                             /* tp_descr_get */
+   0,                             /* tp_descr_set */
+   0,                             /* tp_dictoffset */
+   0,                             /* tp_init */
+   0,                             /* tp_alloc */
+   0,                             /* tp_new */
+};
+
+/* -- End of CompiledNeedle class definition -- */
+
+PyObject *NeedleObject_FromBitmapObject(BitmapObject *bitmap)
+{
+	MMNeedleRef needle;
+
+	if (bitmap->bitmap == NULL || bitmap->bitmap->imageBuffer == NULL ||
+	    bitmap->bitmap->width == 0 || bitmap->bitmap->height == 0) {
+		PyErr_SetString(PyExc_ValueError, "No image data set");
+		return NULL;
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	needle = createMMNeedle(bitmap->bitmap);
+	Py_END_ALLOW_THREADS
+	if (needle == NULL) return PyErr_NoMemory();
+
+	return NeedleObject_FromMMNeedle(bitmap, needle);
+}
+
+PyObject *NeedleObject_FromMMNeedle(BitmapObject *bitmap, MMNeedleRef needle)
+{
+	NeedleObject *newNeedle;
+
+	assert(MMNeedleGetBitmap(needle) == bitmap->bitmap);
+
+	newNeedle = (NeedleObject *)_PyObject_New(&Needle_Type);
+	if (newNeedle == NULL) {
+		destroyMMNeedle(needle);
+		return NULL;
+	}
+
+	newNeedle->needle = needle;
+	Py_INCREF(bitmap);
+	newNeedle->bitmap = bitmap;
+
+	return (PyObject *)newNeedle;
+}
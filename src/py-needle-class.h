@@ -0,0 +1,34 @@
+#pragma once
+#ifndef PY_NEEDLE_CLASS_H
+#define PY_NEEDLE_CLASS_H
+
+#include <Python.h>
+#include <structmember.h> /* For PyObject_HEAD, etc. */
+#include "bitmap_find.h"
+#include "py-bitmap-class.h"
+
+/* This file defines the class "CompiledNeedle", a Bitmap prepared ahead of
+ * time for being searched for with the find_* methods of Bitmap. */
+struct _NeedleObject {
+	PyObject_HEAD
+	MMNeedleRef needle;
+	BitmapObject *bitmap; /* Owns the pixels |needle| refers to. */
+};
+
+typedef struct _NeedleObject NeedleObject;
+
+extern PyTypeObject Needle_Type;
+
+/* Returns a new NeedleObject compiled from the given BitmapObject, which is
+ * kept alive for as long as the needle is. Returns NULL and sets error if the
+ * bitmap has no image data or memory could not be allocated.
+ *
+ * Remember to call PyType_Ready() before using this for the first time! */
+PyObject *NeedleObject_FromBitmapObject(BitmapObject *bitmap);
+
+/* Returns a new NeedleObject for |needle|, which must have been created for
+ * the MMBitmap of |bitmap|, taking ownership of it (it is destroyed on error).
+ * |bitmap| is kept alive for as long as the needle is. */
+PyObject *NeedleObject_FromMMNeedle(BitmapObject *bitmap, MMNeedleRef needle);
+
+#endif /* PY_NEEDLE_CLASS_H */
@@ -0,0 +1,170 @@
+#include "py-point-array-class.h"
+
+/* -- PointArray class definition -- */
+
+static void PointArray_dealloc(PointArrayObject *self)
+{
+	if (self->pointArray != NULL) {
+		destroyMMPointArray(self->pointArray);
+		self->pointArray = NULL;
+	}
+	((PyObject*)self)->ob_type->tp_free((PyObject *)self);
+}
+
+static PyObject *PointArray_repr(PointArrayObject *self)
+{
+	return PyUnicode_FromFormat("<PointArray of %zd points>",
+	                            (Py_ssize_t)self->pointArray->count);
+}
+
+/* -- Sequence protocol -- */
+
+static Py_ssize_t PointArray_length(PointArrayObject *self)
+{
+	return (Py_ssize_t)self->pointArray->count;
+}
+
+/* Negative indices have already been adjusted by the time this is called. */
+static PyObject *PointArray_item(PointArrayObject *self, Py_ssize_t i)
+{
+	MMPoint point;
+	if (i < 0 || (size_t)i >= self->pointArray->count) {
+		PyErr_SetString(PyExc_IndexError, "PointArray index out of range");
+		return NULL;
+	}
+
+	point = MMPointArrayGetItem(self->pointArray, i);
+	return Py_BuildValue("(kk)", point.x, point.y);
+}
+
+static PySequenceMethods PointArray_as_sequence = {
+	(lenfunc)PointArray_length,     /* sq_length */
+	0,                              /* sq_concat */
+	0,                              /* sq_repeat */
+	(ssizeargfunc)PointArray_item,  /* sq_item */
+	0,                              /* sq_slice */
+	0,                              /* sq_ass_item */
+	0,                              /* sq_ass_slice */
+	0,                              /* sq_contains */
+	0,                              /* sq_inplace_concat */
+	0                               /* sq_inplace_repeat */
+};
+
+/* -- Buffer protocol -- */
+
+/* The points are exported as a read-only, C-contiguous array of shape
+ * (count, 2) holding the x & y coordinates of each point as size_t's. */
+static int PointArray_getbuffer(PointArrayObject *self, Py_buffer *view,
+                                int flags)
+{
+	MMPointArrayRef pointArray = self->pointArray;
+
+	if (view == NULL) {
+		PyErr_SetString(PyExc_BufferError, "NULL view in getbuffer");
+		return -1;
+	}
+	view->obj = NULL;
+
+	if ((flags & PyBUF_WRITABLE) == PyBUF_WRITABLE) {
+		PyErr_SetString(PyExc_BufferError, "PointArray buffers are read-only");
+		return -1;
+	}
+
+	self->shape[0] = (Py_ssize_t)pointArray->count;
+	self->shape[1] = 2;
+
+	view->buf = pointArray->array;
+	view->len = (Py_ssize_t)(pointArray->count * sizeof(MMPoint));
+	view->readonly = 1;
+	/* The item size is that of the format even when no format is asked for,
+	 * which implies unsigned bytes only when there is no shape either. */
+	view->itemsize = sizeof(size_t);
+	if ((flags & PyBUF_FORMAT) == PyBUF_FORMAT) {
+		/* size_t is unsigned long everywhere but 64-bit Windows. */
+		view->format = sizeof(size_t) == sizeof(unsigned long) ? "L" : "Q";
+	} else {
+		view->format = NULL;
+	}
+	view->ndim = 2;
+	view->shape = ((flags & PyBUF_ND) == PyBUF_ND) ? self->shape : NULL;
+	view->strides = NULL; /* Always C-contiguous. */
+	view->suboffsets = NULL;
+	view->internal = NULL;
+
+	/* Without a shape, the buffer is only a flat run of items. */
+	if (view->shape == NULL) view->ndim = 1;
+
+	Py_INCREF(self);
+	view->obj = (PyObject *)self;
+	return 0;
+}
+
+static PyBufferProcs PointArray_as_buffer = {
+	(getbufferproc)PointArray_getbuffer, /* bf_getbuffer */
+	NULL                                 /* bf_releasebuffer */
+};
+
+/* -- End of buffer protocol -- */
+
+PyTypeObject PointArray_Type = {
+   PyVarObject_HEAD_INIT(NULL, 0)
+   "autopy.bitmap.PointArray",    /* tp_name */
+   sizeof(PointArrayObject),      /* tp_basicsize */
+   0,                             /* tp_itemsize */
+   (destructor)PointArray_dealloc, /* tp_dealloc */
+   0,                             /* tp_print */
+   0,                             /* tp_getattr */
+   0,                             /* tp_setattr */
+   0,                             /* tp_compare */
+   (reprfunc)PointArray_repr,     /* tp_repr */
+   0,                             /* tp_as_number */
+   &PointArray_as_sequence,       /* tp_as_sequence */
+   0,                             /* tp_as_mapping */
+   0,                             /* tp_hash */
+   0,                             /* tp_call */
+   0,                             /* tp_str */
+   0,                             /* tp_getattro */
+   0,                             /* tp_setattro */
+   &PointArray_as_buffer,         /* tp_as_buffer */
+   Py_TPFLAGS_DEFAULT,            /* tp_flags*/
+   "Immutable sequence of (x, y) points, as returned by the find_every_* "
+   "methods of Bitmap with compact=True. Also exports its points through the "
+   "buffer protocol as an array of shape (count, 2).", /* tp_doc */
+   0,                             /* tp_traverse */
+   0,                             /* tp_clear */
+   0,                             /* tp_richcompare */
+   0,                             /* tp_weaklistoffset */
+   0,                             /* tp_iter */
+   0,                             /* tp_iternext */
+   0,                             /* tp_methods */
+   0,                             /* tp_members */
+   0,                             /* tp_getset */
+   0,                             /* tp_base */
+   0,                             /* tp_dict */
+   0,                             /* tp_descr_get */
+   0,                             /* tp_descr_set */
+   0,                             /* tp_dictoffset */
+   0,                             /* tp_init */
+   0,                             /* tp_alloc */
+   0,                             /* tp_new */
+};
+
+/* -- End of PointArray class definition -- */
+
+PyObject *PointArrayObject_FromMMPointArray(MMPointArrayRef pointArray)
+{
+	PointArrayObject *newArray;
+
+	/* Give back the room left over for appending; the array is immutable from
+	 * here on. */
+	MMPointArrayTrim(pointArray);
+
+	newArray = (PointArrayObject *)_PyObject_New(&PointArray_Type);
+	if (newArray == NULL) {
+		destroyMMPointArray(pointArray);
+		return NULL;
+	}
+
+	newArray->pointArray = pointArray;
+	return (PyObject *)newArray;
+}
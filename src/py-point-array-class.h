@@ -0,0 +1,30 @@
+#pragma once
+#ifndef PY_POINT_ARRAY_CLASS_H
+#define PY_POINT_ARRAY_CLASS_H
+
+#include <Python.h>
+#include <structmember.h> /* For PyObject_HEAD, etc. */
+#include "MMPointArray.h"
+
+/* This file defines the class "PointArray", an immutable sequence of (x, y)
+ * points stored as a flat array of machine integers rather than as Python
+ * tuples. */
+struct _PointArrayObject {
+	PyObject_HEAD
+	MMPointArrayRef pointArray;
+	Py_ssize_t shape[2]; /* For buffer protocol */
+};
+
+typedef struct _PointArrayObject PointArrayObject;
+
+extern PyTypeObject PointArray_Type;
+
+/* Returns a new PointArrayObject wrapping the given MMPointArray.
+ * The reference to |pointArray| is "stolen", just as with
+ * BitmapObject_FromMMBitmap(); it is destroyed along with the object (or
+ * immediately, if NULL is returned).
+ *
+ * Remember to call PyType_Ready() before using this for the first time! */
+PyObject *PointArrayObject_FromMMPointArray(MMPointArrayRef pointArray);
+
+#endif /* PY_POINT_ARRAY_CLASS_H */
@@ -0,0 +1,204 @@
+#include "py-points.h"
+#include "py-convenience.h"
+#include <string.h>
+
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
+/* Returns whether the host stores integers little-endian. */
+static int hostIsLittleEndian(void)
+{
+	const uint16_t one = 1;
+	return *(const uint8_t *)&one == 1;
+}
+
+/* Reads the integer of |size| bytes at |item| into |value|. Returns false if
+ * the size is not supported. */
+static bool readBufferInteger(const char *item, Py_ssize_t size, int isSigned,
+                              int64_t *value)
+{
+	switch (size) {
+		case 1:
+			*value = isSigned ? (int64_t)*(const int8_t *)item
+			                  : (int64_t)*(const uint8_t *)item;
+			return true;
+		case 2: {
+			uint16_t v;
+			memcpy(&v, item, sizeof(v));
+			*value = isSigned ? (int64_t)(int16_t)v : (int64_t)v;
+			return true;
+		}
+		case 4: {
+			uint32_t v;
+			memcpy(&v, item, sizeof(v));
+			*value = isSigned ? (int64_t)(int32_t)v : (int64_t)v;
+			return true;
+		}
+		case 8: {
+			uint64_t v;
+			memcpy(&v, item, sizeof(v));
+
+			/* Unsigned values this large can't be on any bitmap anyway. */
+			*value = (!isSigned && v > INT64_MAX) ? INT64_MAX : (int64_t)v;
+			return true;
+		}
+	}
+
+	return false;
+}
+
+/* Implementation of pointsFromObject() for objects supporting the buffer
+ * protocol. */
+static MMPoint *pointsFromBuffer(PyObject *obj, size_t *count)
+{
+	Py_buffer view;
+	const char *format;
+	MMPoint *points = NULL;
+	Py_ssize_t itemCount;
+	Py_ssize_t i;
+	int isSigned;
+
+	if (PyObject_GetBuffer(obj, &view,
+	                       PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) != 0) {
+		return NULL;
+	}
+
+	/* Only integers in native byte order are accepted; their size is taken
+	 * from the item size rather than the format, which covers both native
+	 * ('@') and standard ('=', '<' or '>') sizes. */
+	format = view.format == NULL ? "B" : view.format;
+	if (*format == '@' || *format == '=' ||
+	    (*format == '<' && hostIsLittleEndian()) ||
+	    (*format == '>' && !hostIsLittleEndian())) {
+		++format;
+	}
+
+	if (format[0] == '\0' || format[1] != '\0' ||
+	    strchr("bBhHiIlLqQnN", format[0]) == NULL) {
+		PyErr_SetFormatString(PyExc_TypeError, BUFSIZ,
+		                      "Points buffer must hold native integers, "
+		                      "not format '%.20s'", view.format);
+		goto error;
+	}
+	isSigned = strchr("bhilqn", format[0]) != NULL;
+
+	itemCount = view.len / view.itemsize;
+	if (itemCount % 2 != 0) {
+		PyErr_SetString(PyExc_ValueError,
+		                "Points buffer must hold pairs of coordinates");
+		goto error;
+	}
+
+	/* Allocate at least one point so that NULL is only returned on error. */
+	*count = (size_t)(itemCount / 2);
+	points = PyMem_Malloc(sizeof(MMPoint) * (*count == 0 ? 1 : *count));
+	if (points == NULL) {
+		PyErr_NoMemory();
+		goto error;
+	}
+
+	for (i = 0; i < itemCount; ++i) {
+		const char *item = (const char *)view.buf + (i * view.itemsize);
+		int64_t value;
+		if (!readBufferInteger(item, view.itemsize, isSigned, &value)) {
+			PyErr_SetString(PyExc_TypeError,
+			                "Points buffer has an unsupported item size");
+			goto error;
+		} else if (value < 0) {
+			PyErr_SetString(PyExc_ValueError, "Point out of bounds");
+			goto error;
+		}
+
+		if (i % 2 == 0) {
+			points[i / 2].x = (size_t)value;
+		} else {
+			points[i / 2].y = (size_t)value;
+		}
+	}
+
+	PyBuffer_Release(&view);
+	return points;
+
+error:
+	PyMem_Free(points);
+	PyBuffer_Release(&view);
+	return NULL;
+}
+
+MMPoint *pointsFromObject(PyObject *obj, size_t *count)
+{
+	PyObject *seq;
+	MMPoint *points;
+	Py_ssize_t i;
+
+	if (PyObject_CheckBuffer(obj)) return pointsFromBuffer(obj, count);
+
+	seq = PySequence_Fast(obj, "Points must be a sequence or buffer of "
+	                           "coordinates");
+	if (seq == NULL) return NULL;
+
+	*count = (size_t)PySequence_Fast_GET_SIZE(seq);
+	points = PyMem_Malloc(sizeof(MMPoint) * (*count == 0 ? 1 : *count));
+	if (points == NULL) {
+		Py_DECREF(seq);
+		return (MMPoint *)PyErr_NoMemory();
+	}
+
+	for (i = 0; i < (Py_ssize_t)*count; ++i) {
+		PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+		if (!PyTuple_Check(item)) {
+			PyErr_SetString(PyExc_TypeError,
+			                "Points must be (x, y) tuples of ints");
+			break;
+		} else if (!PyArg_ParseTuple(item, "kk;Points must be (x, y) tuples "
+		                                   "of ints",
+		                             &(points[i].x), &(points[i].y))) {
+			break;
+		}
+	}
+
+	Py_DECREF(seq);
+	if (PyErr_Occurred()) {
+		PyMem_Free(points);
+		return NULL;
+	}
+
+	return points;
+}
+
+PyObject *colorArrayFromPoints(MMBitmapRef bitmap, const MMPoint *points,
+                               size_t count, MMPoint origin)
+{
+	PyObject *arrayModule;
+	PyObject *bytes;
+	PyObject *array;
+	char *colors;
+	size_t i;
+
+	bytes = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)(count *
+	                                                     sizeof(unsigned int)));
+	if (bytes == NULL) return NULL;
+
+	colors = PyBytes_AS_STRING(bytes);
+	for (i = 0; i < count; ++i) {
+		const unsigned int color = MMRGBHexAtPoint(bitmap,
+		                                           points[i].x - origin.x,
+		                                           points[i].y - origin.y);
+		memcpy(colors + (i * sizeof(color)), &color, sizeof(color));
+	}
+
+	/* array('I', bytes) fills the array with the machine values in bytes. */
+	arrayModule = PyImport_ImportModule("array");
+	if (arrayModule == NULL) {
+		Py_DECREF(bytes);
+		return NULL;
+	}
+
+	array = PyObject_CallMethod(arrayModule, "array", "sO", "I", bytes);
+	Py_DECREF(arrayModule);
+	Py_DECREF(bytes);
+	return array;
+}
@@ -0,0 +1,27 @@
+#pragma once
+#ifndef PY_POINTS_H
+#define PY_POINTS_H
+
+#include <Python.h>
+#include "MMBitmap.h"
+
+/* Functions for sampling many points of a bitmap at once from Python. */
+
+/* Returns an array (allocated with PyMem_Malloc()) of the points described by
+ * |obj|, and sets |count| to their number. |obj| may be either a sequence of
+ * (|x|, |y|) tuples, or an object supporting the buffer protocol holding
+ * integers, taken in pairs as x & y coordinates (e.g. array('I', [x1, y1, x2,
+ * y2, ...]) or a NumPy array of shape (n, 2)).
+ *
+ * Returns NULL and sets an error if |obj| is neither, or holds a negative
+ * coordinate. */
+MMPoint *pointsFromObject(PyObject *obj, size_t *count);
+
+/* Returns a new array('I') of the colors at the |count| points in |points|,
+ * each offset by -|origin| (i.e. relative to |origin| in |bitmap|). The
+ * caller must ensure that they are in the bounds of |bitmap|, which may be
+ * NULL if |count| is 0. */
+PyObject *colorArrayFromPoints(MMBitmapRef bitmap, const MMPoint *points,
+                               size_t count, MMPoint origin);
+
+#endif /* PY_POINTS_H */
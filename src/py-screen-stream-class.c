@@ -0,0 +1,293 @@
+#include "py-screen-stream-class.h"
+#include "py-bitmap-class.h"
+#include "screen.h"
+
+/* -- ScreenStream class definition -- */
+
+/* Releases the stream, with the GIL released as this waits for the grab in
+ * progress to finish. Must only be called once it has been stopped and
+ * nothing is waiting on it anymore. */
+static void ScreenStream_release(ScreenStreamObject *self)
+{
+	MMScreenStreamRef stream = self->stream;
+	self->stream = NULL;
+	Py_BEGIN_ALLOW_THREADS
+	destroyMMScreenStream(stream);
+	Py_END_ALLOW_THREADS
+}
+
+/* Stops the stream (if it is running), waking any thread waiting for a
+ * frame. The stream is released here if nothing is waiting on it, or else by
+ * the last waiter. */
+static void ScreenStream_stop(ScreenStreamObject *self)
+{
+	if (self->stream == NULL || self->closed) return;
+
+	/* This only holds the stream's lock briefly, so the GIL is kept. */
+	self->closed = true;
+	MMScreenStreamStop(self->stream);
+
+	if (self->waiters == 0) ScreenStream_release(self);
+}
+
+static void ScreenStream_dealloc(ScreenStreamObject *self)
+{
+	ScreenStream_stop(self);
+	((PyObject*)self)->ob_type->tp_free((PyObject *)self);
+}
+
+/* -- ScreenStream class method declarations -- */
+
+/* Syntax: ScreenStream(rect=None, fps=30.0, buffers=3) => ScreenStream
+                                                            object */
+/* Arguments: |rect| => ((|x|, |y|), (|width|, |height|)) rect of ints,
+                        or None,
+              |fps| => float,
+              |buffers| => integer */
+/* Description: Starts grabbing the given portion of the main display (or the
+                entire display if |rect| is None) about |fps| times a second on
+                a background thread. Iterating over the stream yields each
+                frame as a Bitmap, oldest first, waiting for the next one if
+                necessary.
+
+                Frames are read into a ring of |buffers| pixel buffers that
+                are reused rather than allocated for every frame; a yielded
+                Bitmap holds on to its buffer until it is deleted. If frames
+                are not consumed as fast as they are grabbed, the oldest one
+                not yet yielded is overwritten (see |dropped|).
+
+                The stream is stopped by close(), by leaving a `with` block, or
+                when it is deleted. */
+/* Raises: |ValueError| if the rect is out of bounds, or |fps| or |buffers|
+           is not positive,
+           |OSError| if the stream could not be started. */
+static int ScreenStream_init(ScreenStreamObject *self, PyObject *args,
+                             PyObject *kwds);
+
+/* Syntax: stream.close() */
+/* Description: Stops grabbing frames. Bitmaps already yielded stay valid.
+                Iterating over a closed stream raises StopIteration, as does
+                a next() that is waiting for a frame (in another thread) when
+                the stream is closed. */
+static PyObject *ScreenStream_close(ScreenStreamObject *self, PyObject *args);
+
+/* Syntax: with stream: ... */
+/* Description: Closes the stream when the block is left. */
+static PyObject *ScreenStream_enter(ScreenStreamObject *self, PyObject *args);
+static PyObject *ScreenStream_exit(ScreenStreamObject *self, PyObject *args);
+
+/* Returns the next frame as a Bitmap object.
+ * Raises: |OSError| if a screengrab failed,
+           |RuntimeError| if every buffer is held by a Bitmap still alive. */
+static PyObject *ScreenStream_iter(ScreenStreamObject *self);
+static PyObject *ScreenStream_iternext(ScreenStreamObject *self);
+
+/* Number of frames that were overwritten before being yielded. */
+static PyObject *ScreenStream_get_dropped(ScreenStreamObject *self,
+                                          PyObject *args);
+
+static PyGetSetDef ScreenStream_getsetters[] = {
+	{"dropped", (getter)ScreenStream_get_dropped, NULL,
+	 "Number of frames that were overwritten before being yielded.", NULL},
+	{NULL} /* Sentinel */
+};
+
+static PyMethodDef ScreenStream_methods[] = {
+	{"close", (PyCFunction)ScreenStream_close, METH_NOARGS,
+	 "stream.close()\n"
+	 "Stops grabbing frames. Bitmaps already yielded stay valid."},
+	{"__enter__", (PyCFunction)ScreenStream_enter, METH_NOARGS, NULL},
+	{"__exit__", (PyCFunction)ScreenStream_exit, METH_VARARGS, NULL},
+	{NULL} /* Sentinel */
+};
+
+PyTypeObject ScreenStream_Type = {
+   PyVarObject_HEAD_INIT(NULL, 0)
+   "autopy.bitmap.ScreenStream",  /* tp_name */
+   sizeof(ScreenStreamObject),    /* tp_basicsize */
+   0,                             /* tp_itemsize */
+   (destructor)ScreenStream_dealloc, /* tp_dealloc */
+   0,                             /* tp_print */
+   0,                             /* tp_getattr */
+   0,                             /* tp_setattr */
+   0,                             /* tp_compare */
+   0,                             /* tp_repr */
+   0,                             /* tp_as_number */
+   0,                             /* tp_as_sequence */
+   0,                             /* tp_as_mapping */
+   0,                             /* tp_hash */
+   0,                             /* tp_call */
+   0,                             /* tp_str */
+   0,                             /* tp_getattro */
+   0,                             /* tp_setattro */
+   0,                             /* tp_as_buffer */
+   Py_TPFLAGS_DEFAULT,            /* tp_flags*/
+   "ScreenStream(rect=None, fps=30.0, buffers=3)\n"
+   "Iterator over frames of the display grabbed on a background thread, "
+   "read into a recycled ring of buffers.", /* tp_doc */
+   0,                             /* tp_traverse */
+   0,                             /* tp_clear */
+   0,                             /* tp_richcompare */
+   0,                             /* tp_weaklistoffset */
+   (getiterfunc)ScreenStream_iter, /* tp_iter */
+   (iternextfunc)ScreenStream_iternext, /* tp_iternext */
+   ScreenStream_methods,          /* tp_methods */
+   0,                             /* tp_members */
+   ScreenStream_getsetters,       /* tp_getset */
+   0,                             /* tp_base */
+   0,                             /* tp_dict */
+   0,                             /* tp_descr_get */
+   0,                             /* tp_descr_set */
+   0,                             /* tp_dictoffset */
+   (initproc)ScreenStream_init,   /* tp_init */
+   0,                             /* tp_alloc */
+   PyType_GenericNew,             /* tp_new */
+};
+
+/* -- End of ScreenStream class definition -- */
+
+/* -- ScreenStream class method definitions -- */
+
+static int ScreenStream_init(ScreenStreamObject *self, PyObject *args,
+                             PyObject *kwds)
+{
+	static char *kwlist[] = {"rect", "fps", "buffers", NULL};
+	PyObject *rectObj = NULL;
+	double fps = 30.0;
+	Py_ssize_t buffers = 3;
+	MMRect rect;
+	MMScreenStreamRef stream;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwds, "|Odn", kwlist,
+	                                 &rectObj, &fps, &buffers) ||
+	    !displayRectFromObject(rectObj, &rect)) {
+		return -1;
+	}
+
+	if (!(fps > 0.0)) {
+		PyErr_SetString(PyExc_ValueError, "fps must be positive");
+		return -1;
+	} else if (buffers < 1) {
+		PyErr_SetString(PyExc_ValueError, "Buffer count must be positive");
+		return -1;
+	}
+
+	/* In case __init__() is called again. */
+	if (self->waiters > 0) {
+		PyErr_SetString(PyExc_RuntimeError,
+		                "Cannot reinitialize a screen stream being iterated");
+		return -1;
+	}
+	ScreenStream_stop(self);
+
+	Py_BEGIN_ALLOW_THREADS
+	stream = createMMScreenStream(rect, fps, (size_t)buffers);
+	Py_END_ALLOW_THREADS
+
+	if (stream == NULL) {
+		PyErr_SetString(PyExc_OSError, "Could not start screen stream");
+		return -1;
+	}
+
+	self->stream = stream;
+	self->closed = false;
+	return 0;
+}
+
+static PyObject *ScreenStream_close(ScreenStreamObject *self, PyObject *args)
+{
+	ScreenStream_stop(self);
+	Py_RETURN_NONE;
+}
+
+static PyObject *ScreenStream_enter(ScreenStreamObject *self, PyObject *args)
+{
+	Py_INCREF(self);
+	return (PyObject *)self;
+}
+
+static PyObject *ScreenStream_exit(ScreenStreamObject *self, PyObject *args)
+{
+	ScreenStream_stop(self);
+	Py_RETURN_FALSE; /* Don't suppress exceptions. */
+}
+
+static PyObject *ScreenStream_iter(ScreenStreamObject *self)
+{
+	Py_INCREF(self);
+	return (PyObject *)self;
+}
+
+static PyObject *ScreenStream_iternext(ScreenStreamObject *self)
+{
+	MMScreenStreamRef stream = self->stream;
+	MMScreenStreamError err;
+	MMBitmapRef frame;
+
+	if (stream == NULL || self->closed) {
+		/* Raise standard StopIteration exception with empty value. */
+		PyErr_SetNone(PyExc_StopIteration);
+		return NULL;
+	}
+
+	/* close() (from another thread) stops the stream, which wakes this up,
+	 * but leaves releasing it to the last waiter. */
+	++self->waiters;
+	Py_BEGIN_ALLOW_THREADS
+	frame = MMScreenStreamNextFrame(stream, &err);
+	Py_END_ALLOW_THREADS
+	if (--self->waiters == 0 && self->closed && self->stream != NULL) {
+		ScreenStream_release(self);
+	}
+
+	if (frame == NULL) {
+		if (err == kMMScreenStreamStoppedError) {
+			PyErr_SetNone(PyExc_StopIteration);
+		} else {
+			PyErr_SetString(err == kMMScreenStreamBuffersInUseError
+			                    ? PyExc_RuntimeError : PyExc_OSError,
+			                MMScreenStreamErrorString(err));
+		}
+		return NULL;
+	}
+
+	return BitmapObject_FromMMBitmap(frame);
+}
+
+static PyObject *ScreenStream_get_dropped(ScreenStreamObject *self,
+                                          PyObject *args)
+{
+	if (self->stream == NULL || self->closed) return Py_BuildValue("k", 0UL);
+	return Py_BuildValue("k",
+	                     (unsigned long)MMScreenStreamDroppedCount(self->stream));
+}
+
+/* -- End of ScreenStream class method definitions -- */
+
+bool displayRectFromObject(PyObject *rectObj, MMRect *rect)
+{
+	MMSize displaySize = getMainDisplaySize();
+
+	if (rectObj == NULL || rectObj == Py_None) {
+		*rect = MMRectMake(0, 0, displaySize.width, displaySize.height);
+		return true;
+	}
+
+	if (!PyArg_ParseTuple(rectObj, "(kk)(kk)", &rect->origin.x,
+	                                           &rect->origin.y,
+	                                           &rect->size.width,
+	                                           &rect->size.height)) {
+		PyErr_SetString(PyExc_TypeError, "Argument is not a rect");
+		return false;
+	}
+
+	if (rect->origin.x >= displaySize.width ||
+	    rect->origin.y >= displaySize.height ||
+	    rect->origin.x + rect->size.width > displaySize.width ||
+	    rect->origin.y + rect->size.height > displaySize.height) {
+		PyErr_SetString(PyExc_ValueError, "Rect out of bounds");
+		return false;
+	}
+
+	return true;
+}
@@ -0,0 +1,34 @@
+#pragma once
+#ifndef PY_SCREEN_STREAM_CLASS_H
+#define PY_SCREEN_STREAM_CLASS_H
+
+#include <Python.h>
+#include <structmember.h> /* For PyObject_HEAD, etc. */
+#include "screenstream.h"
+
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
+/* This file defines the class "ScreenStream" for grabbing frames from the
+ * display continuously. */
+struct _ScreenStreamObject {
+	PyObject_HEAD
+	MMScreenStreamRef stream; /* NULL once closed and no longer waited on. */
+	bool closed; /* Set by close(); |stream| is then stopped. */
+	Py_ssize_t waiters; /* Number of threads waiting for a frame. */
+};
+
+typedef struct _ScreenStreamObject ScreenStreamObject;
+
+extern PyTypeObject ScreenStream_Type;
+
+/* Sets |rect| to the rect described by |rectObj|, a
+ * ((|x|, |y|), (|width|, |height|)) tuple, or to the bounds of the main display
+ * if |rectObj| is NULL or None. Returns false and sets error if |rectObj| is
+ * not a rect or is out of the bounds of the display. */
+bool displayRectFromObject(PyObject *rectObj, MMRect *rect);
+
+#endif /* PY_SCREEN_STREAM_CLASS_H */
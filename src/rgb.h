@@ -3,7 +3,6 @@
 #define RGB_H
 
 #include <stdlib.h> /* For abs() */
-#include <math.h>
 #include "inline_keywords.h" /* For H_INLINE */
 
 #if defined(_MSC_VER)
@@ -69,9 +68,64 @@ H_INLINE MMRGBColor MMRGBFromHex(MMRGBHex hex)
                                         (c1).blue == (c2).blue && \
                                         (c1).green == (c2).green)
 
+/* The maximum Euclidean distance between two colors in RGB space, rounded up
+ * (sqrt(3 * 255^2) ~= 441.7). */
+#define MMRGB_MAX_DISTANCE 442.0f
+
+/* Converts |tolerance| (in the range 0.0f - 1.0f, where 0 denotes the exact
+ * color and 1 denotes any color) to the greatest squared Euclidean distance
+ * allowed between two similar colors.
+ *
+ * This is meant to be computed once per search and passed on to
+ * MMRGBHexWithinDistance(), so that comparing pixels needs neither floating
+ * point math nor sqrt(). A tolerance that is too small to allow any distance
+ * returns 0, i.e. an exact match. */
+H_INLINE uint32_t MMRGBMaxDistanceSquared(float tolerance)
+{
+	float distance;
+
+	if (tolerance <= 0.0f) return 0;
+	if (tolerance > 1.0f) tolerance = 1.0f;
+
+	distance = tolerance * MMRGB_MAX_DISTANCE;
+	return (uint32_t)((double)distance * distance);
+}
+
+/* Returns the squared Euclidean distance between two RGB colors. */
+H_INLINE uint32_t MMRGBColorDistanceSquared(MMRGBColor c1, MMRGBColor c2)
+{
+	const int d1 = (int)c1.red - (int)c2.red;
+	const int d2 = (int)c1.green - (int)c2.green;
+	const int d3 = (int)c1.blue - (int)c2.blue;
+	return (uint32_t)((d1 * d1) + (d2 * d2) + (d3 * d3));
+}
+
+/* Identical to MMRGBColorDistanceSquared, only for hex values. */
+H_INLINE uint32_t MMRGBHexDistanceSquared(MMRGBHex h1, MMRGBHex h2)
+{
+	const int d1 = (int)RED_FROM_HEX(h1) - (int)RED_FROM_HEX(h2);
+	const int d2 = (int)GREEN_FROM_HEX(h1) - (int)GREEN_FROM_HEX(h2);
+	const int d3 = (int)BLUE_FROM_HEX(h1) - (int)BLUE_FROM_HEX(h2);
+	return (uint32_t)((d1 * d1) + (d2 * d2) + (d3 * d3));
+}
+
+/* Returns whether two colors are within the squared distance |maxDistSquared|
+ * of each other, as returned by MMRGBMaxDistanceSquared(). */
+H_INLINE int MMRGBHexWithinDistance(MMRGBHex h1, MMRGBHex h2,
+                                    uint32_t maxDistSquared)
+{
+	/* Speedy case */
+	if (h1 == h2) return 1;
+	return maxDistSquared > 0 &&
+	       MMRGBHexDistanceSquared(h1, h2) <= maxDistSquared;
+}
+
 /* Returns whether two colors are similar within the given range, |tolerance|.
  * Tolerance can be in the range 0.0f - 1.0f, where 0 denotes the exact
- * color and 1 denotes any color. */
+ * color and 1 denotes any color.
+ *
+ * When comparing many colors with the same tolerance, prefer converting it
+ * once with MMRGBMaxDistanceSquared() and using MMRGBHexWithinDistance(). */
 H_INLINE int MMRGBColorSimilarToColor(MMRGBColor c1, MMRGBColor c2,
                                       float tolerance)
 {
@@ -79,29 +133,15 @@ H_INLINE int MMRGBColorSimilarToColor(MMRGBColor c1, MMRGBColor c2,
 	if (tolerance <= 0.0f) {
 		return MMRGBColorEqualToColor(c1, c2);
 	} else { /* Otherwise, use a Euclidean space to determine similarity */
-		uint8_t d1 = c1.red - c2.red;
-		uint8_t d2 = c1.green - c2.green;
-		uint8_t d3 = c1.blue - c2.blue;
-		return sqrt((d1 * d1) +
-		            (d2 * d2) +
-		            (d3 * d3)) <= (tolerance * 442.0f);
+		return MMRGBColorDistanceSquared(c1, c2) <=
+		       MMRGBMaxDistanceSquared(tolerance);
 	}
-
 }
 
 /* Identical to MMRGBColorSimilarToColor, only for hex values. */
 H_INLINE int MMRGBHexSimilarToColor(MMRGBHex h1, MMRGBHex h2, float tolerance)
 {
-	if (tolerance <= 0.0f) {
-		return h1 == h2;
-	} else {
-		uint8_t d1 = RED_FROM_HEX(h1) - RED_FROM_HEX(h2);
-		uint8_t d2 = GREEN_FROM_HEX(h1) - GREEN_FROM_HEX(h2);
-		uint8_t d3 = BLUE_FROM_HEX(h1) - BLUE_FROM_HEX(h2);
-		return sqrt((d1 * d1) +
-		            (d2 * d2) +
-		            (d3 * d3)) <= (tolerance * 442.0f);
-	}
+	return MMRGBHexWithinDistance(h1, h2, MMRGBMaxDistanceSquared(tolerance));
 }
 
 #endif /* RGB_H */
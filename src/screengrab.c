@@ -2,6 +2,7 @@
 #include "bmp_io.h"
 #include "endian.h"
 #include <stdlib.h> /* malloc() */
+#include <assert.h>
 
 #if defined(IS_MACOSX)
 	#include <OpenGL/OpenGL.h>
@@ -10,10 +11,13 @@
 #elif defined(USE_X11)
 	#include <X11/Xlib.h>
 	#include <X11/Xutil.h>
+	#include <X11/extensions/XShm.h>
+	#include <sys/ipc.h>
+	#include <sys/shm.h>
+	#include <pthread.h>
 	#include "xdisplay.h"
-#elif defined(IS_WINDOWS)
-	#include <string.h>
 #endif
+#include <string.h> /* memcpy() */
 
 #if defined(IS_MACOSX)
 
@@ -27,6 +31,37 @@ static uint8_t *createBufferFromCurrentCGLContext(GLint x,
                                                   GLsizei height,
                                                   size_t bytewidth);
 
+#elif defined(USE_X11)
+
+/* On X11, a grabber has a shared memory segment that screengrabs are read
+ * into with the MIT-SHM extension. It is kept between calls and only replaced
+ * when a larger one is needed, so that repeated screengrabs don't have to set
+ * up a new segment (or copy every pixel through the X socket, as XGetImage()
+ * does). */
+struct _MMScreenGrabber {
+	Display *display; /* Display the segment is attached to, or NULL. */
+	Display *ownDisplay; /* Connection opened for this grabber, or NULL for
+	                      * the main display. */
+	XShmSegmentInfo info;
+	size_t capacity; /* Size of the segment in bytes (0 if there is none). */
+	XImage *image; /* Image header for the most recent screengrab size. */
+	int unavailable; /* Set once the server can't do MIT-SHM on |display|. */
+};
+
+/* Grabber used by copyMMBitmapFromDisplayInRect(), on the main display. */
+static MMScreenGrabber mainGrabber;
+
+/* Helper functions (documented below). */
+static XImage *grabXImage(MMScreenGrabberRef grabber, Display *display,
+                          MMRect rect, int *shared);
+static void releaseShmSegment(MMScreenGrabberRef grabber, Display *display);
+
+#else
+
+struct _MMScreenGrabber {
+	int unused; /* Screengrabs need no state kept between them here. */
+};
+
 #endif
 
 MMBitmapRef copyMMBitmapFromDisplayInRect(MMRect rect)
@@ -73,27 +108,37 @@ MMBitmapRef copyMMBitmapFromDisplayInRect(MMRect rect)
 	                      bitsPerPixel, bytesPerPixel);
 #elif defined(USE_X11)
 	MMBitmapRef bitmap;
+	uint8_t *buffer;
+	size_t bufsize;
+	int shared;
 
-	Display *display = XOpenDisplay(NULL);
-	XImage *image = XGetImage(display,
-	                          XDefaultRootWindow(display),
-	                          (int)rect.origin.x,
-	                          (int)rect.origin.y,
-	                          (unsigned int)rect.size.width,
-	                          (unsigned int)rect.size.height,
-	                          AllPlanes, ZPixmap);
-	XCloseDisplay(display);
+	Display *display = XGetMainDisplay();
+	XImage *image;
+	if (display == NULL) return NULL;
+
+	image = grabXImage(&mainGrabber, display, rect, &shared);
 	if (image == NULL) return NULL;
 
-	bitmap = createMMBitmap((uint8_t *)image->data,
+	/* The shared memory segment is reused by the next screengrab, so the
+	 * pixels are copied out of it; otherwise, ownership of them is stolen
+	 * from the image so we don't have to. */
+	bufsize = (size_t)image->bytes_per_line * rect.size.height;
+	if (shared) {
+		buffer = malloc(bufsize);
+		if (buffer == NULL) return NULL;
+		memcpy(buffer, image->data, bufsize);
+	} else {
+		buffer = (uint8_t *)image->data;
+		image->data = NULL;
+	}
+
+	bitmap = createMMBitmap(buffer,
 	                        rect.size.width,
 	                        rect.size.height,
 	                        (size_t)image->bytes_per_line,
 	                        (uint8_t)image->bits_per_pixel,
 	                        (uint8_t)image->bits_per_pixel / 8);
-	image->data = NULL; /* Steal ownership of bitmap data so we don't have to
-	                     * copy it. */
-	XDestroyImage(image);
+	if (!shared) XDestroyImage(image);
 
 	return bitmap;
 #elif defined(IS_WINDOWS)
@@ -159,6 +204,150 @@ MMBitmapRef copyMMBitmapFromDisplayInRect(MMRect rect)
 #endif
 }
 
+/* Copies |height| rows of |bytewidth| bytes from |pixels| into the buffer of
+ * |bitmap| (which has room for |*capacity| bytes, and is realloc()'d if that
+ * isn't enough), and sets the rest of its fields to match. Returns 0 on
+ * success, or -1 if the buffer could not be grown. */
+static int copyPixelsToBitmap(MMBitmapRef bitmap, size_t *capacity,
+                              const uint8_t *pixels, size_t width,
+                              size_t height, size_t bytewidth,
+                              uint8_t bitsPerPixel)
+{
+	const size_t bufsize = bytewidth * height;
+
+	if (bufsize > *capacity) {
+		uint8_t *buffer = realloc(bitmap->imageBuffer, bufsize);
+		if (buffer == NULL) return -1;
+		bitmap->imageBuffer = buffer;
+		*capacity = bufsize;
+	}
+
+	memcpy(bitmap->imageBuffer, pixels, bufsize);
+	bitmap->width = width;
+	bitmap->height = height;
+	bitmap->bytewidth = bytewidth;
+	bitmap->bitsPerPixel = bitsPerPixel;
+	bitmap->bytesPerPixel = bitsPerPixel / 8;
+	return 0;
+}
+
+/* Copies |height| rows of |width| pixels from |pixels| (rows of |bytewidth|
+ * bytes) into the buffer of |bitmap| at |dest|. Returns 0 on success, or -1
+ * if they are not in the format of |bitmap| or don't fit in it. */
+static int copyPixelsIntoBitmap(MMBitmapRef bitmap, MMPoint dest,
+                                const uint8_t *pixels, size_t width,
+                                size_t height, size_t bytewidth,
+                                uint8_t bitsPerPixel)
+{
+	uint8_t *row;
+	size_t y;
+
+	if (bitmap->imageBuffer == NULL || bitsPerPixel != bitmap->bitsPerPixel ||
+	    dest.x > bitmap->width || width > bitmap->width - dest.x ||
+	    dest.y > bitmap->height || height > bitmap->height - dest.y) {
+		return -1;
+	}
+
+	row = bitmap->imageBuffer + (bitmap->bytewidth * (ptrdiff_t)dest.y) +
+	      (bitmap->bytesPerPixel * dest.x);
+	for (y = 0; y < height; ++y) {
+		memcpy(row, pixels, width * bitmap->bytesPerPixel);
+		row += bitmap->bytewidth;
+		pixels += bytewidth;
+	}
+
+	return 0;
+}
+
+MMScreenGrabberRef createMMScreenGrabber(void)
+{
+	MMScreenGrabberRef grabber = calloc(1, sizeof(MMScreenGrabber));
+	if (grabber == NULL) return NULL;
+
+#if defined(USE_X11)
+	/* Xlib connections may not be shared between threads, so each grabber
+	 * gets its own. */
+	if ((grabber->ownDisplay = XOpenDisplay(NULL)) == NULL) {
+		free(grabber);
+		return NULL;
+	}
+#endif
+
+	return grabber;
+}
+
+void destroyMMScreenGrabber(MMScreenGrabberRef grabber)
+{
+	assert(grabber != NULL);
+
+#if defined(USE_X11)
+	releaseShmSegment(grabber, grabber->ownDisplay);
+	XCloseDisplay(grabber->ownDisplay);
+#endif
+
+	free(grabber);
+}
+
+int grabDisplayInRectToBitmap(MMScreenGrabberRef grabber, MMRect rect,
+                              MMBitmapRef bitmap, size_t *capacity)
+{
+#if defined(USE_X11)
+	int shared, ret;
+	XImage *image = grabXImage(grabber, grabber->ownDisplay, rect, &shared);
+	if (image == NULL) return -1;
+
+	ret = copyPixelsToBitmap(bitmap, capacity, (uint8_t *)image->data,
+	                         rect.size.width, rect.size.height,
+	                         (size_t)image->bytes_per_line,
+	                         (uint8_t)image->bits_per_pixel);
+	if (!shared) XDestroyImage(image);
+
+	return ret;
+#else
+	/* There is no state worth keeping between screengrabs here, so this is
+	 * simply a screengrab copied into the existing buffer. */
+	int ret;
+	MMBitmapRef grab = copyMMBitmapFromDisplayInRect(rect);
+	if (grab == NULL) return -1;
+
+	ret = copyPixelsToBitmap(bitmap, capacity, grab->imageBuffer,
+	                         grab->width, grab->height, grab->bytewidth,
+	                         grab->bitsPerPixel);
+	destroyMMBitmap(grab);
+
+	return ret;
+#endif
+}
+
+int grabDisplayInRectIntoBitmap(MMScreenGrabberRef grabber, MMRect rect,
+                                MMBitmapRef bitmap, MMPoint dest)
+{
+#if defined(USE_X11)
+	int shared, ret;
+	XImage *image = grabXImage(grabber, grabber->ownDisplay, rect, &shared);
+	if (image == NULL) return -1;
+
+	ret = copyPixelsIntoBitmap(bitmap, dest, (uint8_t *)image->data,
+	                           rect.size.width, rect.size.height,
+	                           (size_t)image->bytes_per_line,
+	                           (uint8_t)image->bits_per_pixel);
+	if (!shared) XDestroyImage(image);
+
+	return ret;
+#else
+	int ret;
+	MMBitmapRef grab = copyMMBitmapFromDisplayInRect(rect);
+	if (grab == NULL) return -1;
+
+	ret = copyPixelsIntoBitmap(bitmap, dest, grab->imageBuffer,
+	                           grab->width, grab->height, grab->bytewidth,
+	                           grab->bitsPerPixel);
+	destroyMMBitmap(grab);
+
+	return ret;
+#endif
+}
+
 #if defined(IS_MACOSX)
 
 /* Creates and returns a full-screen OpenGL graphics context (to be
@@ -246,3 +435,191 @@ static uint8_t *createBufferFromCurrentCGLContext(GLint x,
 }
 
 #endif
+
+#if defined(USE_X11)
+
+/* Error code of the last X error caught by trapXError(), or 0. */
+static int trappedXError = 0;
+
+/* Held while trapXError() is installed, as X error handlers are per-process
+ * and grabbers may be used on several threads. */
+static pthread_mutex_t trapXErrorLock = PTHREAD_MUTEX_INITIALIZER;
+
+/* X error handler used while making MIT-SHM requests, which fail with an
+ * error (rather than a return value) when shared memory is unavailable. The
+ * default handler would exit the process.
+ *
+ * Note that the handler is process-wide; see the note on threads in
+ * screengrab.h. */
+static int trapXError(Display *display, XErrorEvent *event)
+{
+	trappedXError = event->error_code;
+	return 0;
+}
+
+/* Detaches and forgets the shared memory segment of |grabber|, if any. The
+ * server is only told to detach it if |display| is still the one it was
+ * attached to. */
+static void releaseShmSegment(MMScreenGrabberRef grabber, Display *display)
+{
+	if (grabber->image != NULL) {
+		grabber->image->data = NULL; /* Not owned by the image. */
+		XDestroyImage(grabber->image);
+		grabber->image = NULL;
+	}
+
+	if (grabber->capacity > 0) {
+		if (grabber->display == display) XShmDetach(display, &grabber->info);
+		shmdt(grabber->info.shmaddr);
+		grabber->capacity = 0;
+	}
+}
+
+/* Creates a shared memory segment of |size| bytes for |grabber| and attaches
+ * it to |display|. Returns 0 on success, -1 if it could not be created (e.g.,
+ * for lack of memory or being over the system's limits), or -2 if the server
+ * could not attach to it. */
+static int createShmSegment(MMScreenGrabberRef grabber, Display *display,
+                            size_t size)
+{
+	int (*oldHandler)(Display *, XErrorEvent *);
+	Bool attached;
+
+	grabber->info.shmid = shmget(IPC_PRIVATE, size, IPC_CREAT | 0600);
+	if (grabber->info.shmid < 0) return -1;
+
+	grabber->info.shmaddr = shmat(grabber->info.shmid, NULL, 0);
+	if (grabber->info.shmaddr == (char *)-1) {
+		shmctl(grabber->info.shmid, IPC_RMID, NULL);
+		return -1;
+	}
+	grabber->info.readOnly = False;
+
+	pthread_mutex_lock(&trapXErrorLock);
+	trappedXError = 0;
+	oldHandler = XSetErrorHandler(&trapXError);
+	attached = XShmAttach(display, &grabber->info);
+	XSync(display, False);
+	XSetErrorHandler(oldHandler);
+	attached = attached && trappedXError == 0;
+	pthread_mutex_unlock(&trapXErrorLock);
+
+	/* Mark the segment for removal now that both sides have attached to it,
+	 * so that it is freed once they detach (or exit). */
+	shmctl(grabber->info.shmid, IPC_RMID, NULL);
+
+	if (!attached) {
+		shmdt(grabber->info.shmaddr);
+		return -2;
+	}
+
+	grabber->capacity = size;
+	return 0;
+}
+
+/* Sets up |grabber->image| for a screengrab of |rect| on |display|,
+ * replacing the segment if it is too small. Returns 0 on success, or -1 if
+ * MIT-SHM can't be used. */
+static int prepareShmImage(MMScreenGrabberRef grabber, Display *display,
+                           MMRect rect)
+{
+	const int screen = DefaultScreen(display);
+	XImage *image;
+	size_t size;
+
+	if (grabber->display != display) {
+		/* First screengrab, or the main display has been reopened. */
+		releaseShmSegment(grabber, display);
+		grabber->display = display;
+		grabber->unavailable = !XShmQueryExtension(display);
+	}
+
+	if (grabber->unavailable) return -1;
+
+	if (grabber->image != NULL &&
+	    (size_t)grabber->image->width == rect.size.width &&
+	    (size_t)grabber->image->height == rect.size.height) {
+		return 0;
+	}
+
+	if (grabber->image != NULL) {
+		grabber->image->data = NULL;
+		XDestroyImage(grabber->image);
+		grabber->image = NULL;
+	}
+
+	image = XShmCreateImage(display,
+	                        DefaultVisual(display, screen),
+	                        (unsigned int)DefaultDepth(display, screen),
+	                        ZPixmap, NULL, &grabber->info,
+	                        (unsigned int)rect.size.width,
+	                        (unsigned int)rect.size.height);
+	if (image == NULL) return -1;
+
+	size = (size_t)image->bytes_per_line * rect.size.height;
+	if (size > grabber->capacity) {
+		int ret;
+
+		releaseShmSegment(grabber, display);
+		if ((ret = createShmSegment(grabber, display, size)) != 0) {
+			image->data = NULL;
+			XDestroyImage(image);
+
+			/* Only give up on MIT-SHM if the server refused the segment; a
+			 * segment that could not be created here (e.g., one too large
+			 * for the system's limits) only rules out this screengrab. */
+			if (ret == -2) grabber->unavailable = 1;
+			return -1;
+		}
+	}
+
+	image->data = grabber->info.shmaddr;
+	grabber->image = image;
+	return 0;
+}
+
+/* Returns an image of |rect| on |display|, or NULL on error.
+ *
+ * The image is read through the shared memory segment of |grabber| if
+ * possible, in which case |shared| is set to 1 and the image must not be
+ * destroyed (it is only valid until the next screengrab). Otherwise (e.g., on
+ * a remote display), it falls back to XGetImage(), sets |shared| to 0, and the
+ * image must be destroyed by the caller. */
+static XImage *grabXImage(MMScreenGrabberRef grabber, Display *display,
+                          MMRect rect, int *shared)
+{
+	if (rect.size.width > 0 && rect.size.height > 0 &&
+	    prepareShmImage(grabber, display, rect) == 0) {
+		int (*oldHandler)(Display *, XErrorEvent *);
+		Bool grabbed;
+
+		/* XShmGetImage() waits for its reply, so any error has been trapped
+		 * by the time it returns. */
+		pthread_mutex_lock(&trapXErrorLock);
+		trappedXError = 0;
+		oldHandler = XSetErrorHandler(&trapXError);
+		grabbed = XShmGetImage(display, XDefaultRootWindow(display),
+		                       grabber->image,
+		                       (int)rect.origin.x, (int)rect.origin.y,
+		                       AllPlanes);
+		XSetErrorHandler(oldHandler);
+		grabbed = grabbed && trappedXError == 0;
+		pthread_mutex_unlock(&trapXErrorLock);
+
+		if (grabbed) {
+			*shared = 1;
+			return grabber->image;
+		}
+	}
+
+	*shared = 0;
+	return XGetImage(display,
+	                 XDefaultRootWindow(display),
+	                 (int)rect.origin.x,
+	                 (int)rect.origin.y,
+	                 (unsigned int)rect.size.width,
+	                 (unsigned int)rect.size.height,
+	                 AllPlanes, ZPixmap);
+}
+
+#endif
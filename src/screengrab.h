@@ -6,7 +6,44 @@
 #include "MMBitmap.h"
 
 /* Returns a raw bitmap of screengrab of the display (to be destroyed()'d by
- * caller), or NULL on error. */
+ * caller), or NULL on error.
+ *
+ * On X11 this uses the main display connection, so (like the rest of the
+ * functions using it) it must only be called from one thread at a time. */
 MMBitmapRef copyMMBitmapFromDisplayInRect(MMRect rect);
 
+/* A screen grabber keeps the resources used for taking screengrabs between
+ * calls (on X11, its own display connection and MIT-SHM segment), so that
+ * grabbing repeatedly is cheap. Different grabbers may be used on different
+ * threads at the same time. */
+typedef struct _MMScreenGrabber MMScreenGrabber;
+typedef MMScreenGrabber *MMScreenGrabberRef;
+
+/* Returns a new screen grabber, or NULL if one could not be created (e.g., if
+ * the display could not be opened). Responsibility for destroying it with
+ * destroyMMScreenGrabber() is given to the caller. */
+MMScreenGrabberRef createMMScreenGrabber(void);
+
+/* Releases the resources held by |grabber|. */
+void destroyMMScreenGrabber(MMScreenGrabberRef grabber);
+
+/* Reads a screengrab of |rect| into the existing image buffer of |bitmap|,
+ * which has room for |*capacity| bytes. If that is not enough, the buffer is
+ * realloc()'d and |*capacity| updated. The other fields of |bitmap| are set
+ * to describe the screengrab.
+ *
+ * Returns 0 on success, or -1 on error. */
+int grabDisplayInRectToBitmap(MMScreenGrabberRef grabber, MMRect rect,
+                              MMBitmapRef bitmap, size_t *capacity);
+
+/* Reads a screengrab of |rect| into the existing image buffer of |bitmap|,
+ * with its top-left corner at |dest|, leaving the rest of the buffer as it
+ * was. |bitmap| must already be in the pixel format of the display (e.g., a
+ * previous screengrab), and |rect| must fit inside it at |dest|.
+ *
+ * Returns 0 on success, or -1 on error (including if the screengrab is not in
+ * the format of |bitmap|). */
+int grabDisplayInRectIntoBitmap(MMScreenGrabberRef grabber, MMRect rect,
+                                MMBitmapRef bitmap, MMPoint dest);
+
 #endif /* SCREENGRAB_H */
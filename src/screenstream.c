@@ -0,0 +1,311 @@
+#include "screenstream.h"
+#include "screengrab.h"
+#include "MMThread.h"
+#include <stdlib.h>
+#include <assert.h>
+
+#if defined(_MSC_VER)
+	#include "ms_stdbool.h"
+#else
+	#include <stdbool.h>
+#endif
+
+enum slotState {
+	kSlotFree = 0, /* Available to be grabbed into. */
+	kSlotGrabbing, /* Being grabbed into by the stream's thread. */
+	kSlotReady, /* Holds a frame that hasn't been collected yet. */
+	kSlotInUse /* Held by a frame returned by MMScreenStreamNextFrame(). */
+};
+
+/* One buffer of the ring. */
+struct frameSlot {
+	MMScreenStreamRef stream;
+	MMBitmapRef frame; /* Owns the buffer, and describes the last grab. */
+	size_t capacity; /* Size of the buffer in bytes. */
+	enum slotState state;
+	uint64_t sequence; /* Order in which the frame was grabbed. */
+};
+
+struct _MMScreenStream {
+	MMRect rect;
+	unsigned long interval; /* Milliseconds between screengrabs. */
+	MMScreenGrabberRef grabber;
+	MMThread thread;
+
+	/* Everything below is guarded by |mutex|; |cond| is broadcast whenever a
+	 * slot changes state or the stream is stopped. */
+	MMMutex mutex;
+	MMCond cond;
+	struct frameSlot *slots;
+	size_t slotCount;
+	uint64_t nextSequence;
+	size_t droppedCount;
+	bool stopping;
+	bool failed; /* Set if a screengrab failed; the thread then exits. */
+	size_t refCount; /* One for the stream, plus one per slot in use. */
+};
+
+/* Frees |stream| and its buffers, once nothing refers to it anymore. */
+static void freeMMScreenStream(MMScreenStreamRef stream)
+{
+	size_t i;
+
+	for (i = 0; i < stream->slotCount; ++i) {
+		destroyMMBitmap(stream->slots[i].frame);
+	}
+
+	MMCondDestroy(&stream->cond);
+	MMMutexDestroy(&stream->mutex);
+	free(stream->slots);
+	free(stream);
+}
+
+/* Drops a reference to |stream|, which must be locked, and unlocks it;
+ * frees it if that was the last reference. */
+static void releaseAndUnlockStream(MMScreenStreamRef stream)
+{
+	const bool last = --stream->refCount == 0;
+	MMMutexUnlock(&stream->mutex);
+	if (last) freeMMScreenStream(stream);
+}
+
+/* Returns the slot that the next screengrab should be read into: a free one
+ * if there is one, or else the oldest uncollected frame (which is dropped).
+ * Returns NULL if every slot is in use. |stream| must be locked. */
+static struct frameSlot *slotForNextGrab(MMScreenStreamRef stream)
+{
+	struct frameSlot *oldest = NULL;
+	size_t i;
+
+	for (i = 0; i < stream->slotCount; ++i) {
+		struct frameSlot *slot = stream->slots + i;
+		if (slot->state == kSlotFree) {
+			return slot;
+		} else if (slot->state == kSlotReady &&
+		           (oldest == NULL || slot->sequence < oldest->sequence)) {
+			oldest = slot;
+		}
+	}
+
+	if (oldest != NULL) ++stream->droppedCount;
+	return oldest;
+}
+
+/* Entry point of the stream's thread. */
+static void grabFrames(void *arg)
+{
+	MMScreenStreamRef stream = arg;
+	uint64_t deadline = MMMonotonicMilliseconds();
+
+	MMMutexLock(&stream->mutex);
+	while (!stream->stopping) {
+		const uint64_t now = MMMonotonicMilliseconds();
+		struct frameSlot *slot;
+		int ret;
+
+		if (now < deadline) {
+			MMCondTimedWait(&stream->cond, &stream->mutex,
+			                (unsigned long)(deadline - now));
+			continue;
+		}
+
+		if ((slot = slotForNextGrab(stream)) == NULL) {
+			/* Wait for a frame to be destroyed. */
+			MMCondWait(&stream->cond, &stream->mutex);
+			continue;
+		}
+
+		/* The slot is marked so nothing else touches it while the lock is
+		 * let go for the screengrab. */
+		slot->state = kSlotGrabbing;
+		MMMutexUnlock(&stream->mutex);
+		ret = grabDisplayInRectToBitmap(stream->grabber, stream->rect,
+		                                slot->frame, &slot->capacity);
+		MMMutexLock(&stream->mutex);
+
+		if (ret != 0) {
+			slot->state = kSlotFree;
+			stream->failed = true;
+			MMCondBroadcast(&stream->cond);
+			break;
+		}
+
+		slot->state = kSlotReady;
+		slot->sequence = stream->nextSequence++;
+		MMCondBroadcast(&stream->cond);
+
+		/* Keep a steady rate, but don't try to catch up on grabs that were
+		 * missed (e.g., because the screengrab took too long). */
+		deadline += stream->interval;
+		if (deadline < now) deadline = now;
+	}
+	MMMutexUnlock(&stream->mutex);
+}
+
+MMScreenStreamRef createMMScreenStream(MMRect rect, double fps,
+                                       size_t bufferCount)
+{
+	MMScreenStreamRef stream;
+	size_t i;
+
+	assert(fps > 0.0);
+	if (bufferCount < 2) bufferCount = 2;
+
+	if ((stream = calloc(1, sizeof(MMScreenStream))) == NULL) return NULL;
+	if ((stream->slots = calloc(bufferCount,
+	                            sizeof(struct frameSlot))) == NULL) {
+		free(stream);
+		return NULL;
+	}
+
+	stream->rect = rect;
+	stream->interval = (unsigned long)(1000.0 / fps);
+	stream->slotCount = bufferCount;
+	stream->refCount = 1;
+	MMMutexInit(&stream->mutex);
+	MMCondInit(&stream->cond);
+
+	for (i = 0; i < bufferCount; ++i) {
+		struct frameSlot *slot = stream->slots + i;
+		slot->stream = stream;
+		slot->frame = createMMBitmap(NULL, 0, 0, 0, 0, 0);
+		if (slot->frame == NULL) {
+			stream->slotCount = i;
+			freeMMScreenStream(stream);
+			return NULL;
+		}
+	}
+
+	if ((stream->grabber = createMMScreenGrabber()) == NULL) {
+		freeMMScreenStream(stream);
+		return NULL;
+	}
+
+	if (MMThreadCreate(&stream->thread, &grabFrames, stream) != 0) {
+		destroyMMScreenGrabber(stream->grabber);
+		freeMMScreenStream(stream);
+		return NULL;
+	}
+
+	return stream;
+}
+
+void MMScreenStreamStop(MMScreenStreamRef stream)
+{
+	assert(stream != NULL);
+
+	MMMutexLock(&stream->mutex);
+	stream->stopping = true;
+	MMCondBroadcast(&stream->cond);
+	MMMutexUnlock(&stream->mutex);
+}
+
+void destroyMMScreenStream(MMScreenStreamRef stream)
+{
+	MMScreenStreamStop(stream);
+
+	MMThreadJoin(stream->thread);
+	destroyMMScreenGrabber(stream->grabber);
+	stream->grabber = NULL;
+
+	MMMutexLock(&stream->mutex);
+	releaseAndUnlockStream(stream);
+}
+
+/* Release function of the frames returned by MMScreenStreamNextFrame();
+ * hands the buffer back to the stream. */
+static void releaseFrameSlot(uint8_t *buffer, void *info)
+{
+	struct frameSlot *slot = info;
+	MMScreenStreamRef stream = slot->stream;
+
+	MMMutexLock(&stream->mutex);
+	slot->state = kSlotFree;
+	MMCondBroadcast(&stream->cond);
+	releaseAndUnlockStream(stream);
+}
+
+MMBitmapRef MMScreenStreamNextFrame(MMScreenStreamRef stream,
+                                    MMScreenStreamError *error)
+{
+	struct frameSlot *slot;
+	MMBitmapRef bitmap;
+	MMScreenStreamError err;
+
+	MMMutexLock(&stream->mutex);
+	for (;;) {
+		size_t i, inUse = 0;
+
+		slot = NULL;
+		for (i = 0; i < stream->slotCount; ++i) {
+			struct frameSlot *candidate = stream->slots + i;
+			if (candidate->state == kSlotReady &&
+			    (slot == NULL || candidate->sequence < slot->sequence)) {
+				slot = candidate;
+			} else if (candidate->state == kSlotInUse) {
+				++inUse;
+			}
+		}
+
+		if (stream->stopping) {
+			err = kMMScreenStreamStoppedError;
+		} else if (slot != NULL) {
+			break;
+		} else if (stream->failed) {
+			err = kMMScreenStreamGrabError;
+		} else if (inUse == stream->slotCount) {
+			err = kMMScreenStreamBuffersInUseError;
+		} else {
+			MMCondWait(&stream->cond, &stream->mutex);
+			continue;
+		}
+
+		MMMutexUnlock(&stream->mutex);
+		if (error != NULL) *error = err;
+		return NULL;
+	}
+
+	slot->state = kSlotInUse;
+	++stream->refCount;
+	MMMutexUnlock(&stream->mutex);
+
+	bitmap = createMMBitmap(slot->frame->imageBuffer,
+	                        slot->frame->width,
+	                        slot->frame->height,
+	                        slot->frame->bytewidth,
+	                        slot->frame->bitsPerPixel,
+	                        slot->frame->bytesPerPixel);
+	if (bitmap == NULL) {
+		releaseFrameSlot(NULL, slot);
+		if (error != NULL) *error = kMMScreenStreamGrabError;
+		return NULL;
+	}
+
+	MMBitmapSetReleaseFunc(bitmap, &releaseFrameSlot, slot);
+	return bitmap;
+}
+
+size_t MMScreenStreamDroppedCount(MMScreenStreamRef stream)
+{
+	size_t count;
+
+	MMMutexLock(&stream->mutex);
+	count = stream->droppedCount;
+	MMMutexUnlock(&stream->mutex);
+
+	return count;
+}
+
+const char *MMScreenStreamErrorString(MMScreenStreamError err)
+{
+	switch (err) {
+		case kMMScreenStreamGrabError:
+			return "Could not copy RGB data from display";
+		case kMMScreenStreamBuffersInUseError:
+			return "Every frame buffer is held by a frame that is still alive";
+		case kMMScreenStreamStoppedError:
+			return "Screen stream was stopped";
+		default:
+			return NULL;
+	}
+}
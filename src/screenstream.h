@@ -0,0 +1,63 @@
+#pragma once
+#ifndef SCREENSTREAM_H
+#define SCREENSTREAM_H
+
+#include "types.h"
+#include "MMBitmap.h"
+
+enum _MMScreenStreamError {
+	kMMScreenStreamGrabError = 0, /* The screengrab failed. */
+	kMMScreenStreamBuffersInUseError, /* Every buffer is held by a frame. */
+	kMMScreenStreamStoppedError /* The stream was stopped. */
+};
+
+typedef enum _MMScreenStreamError MMScreenStreamError;
+
+/* A screen stream takes screengrabs of a portion of the display at a steady
+ * rate on a background thread, reading them into a fixed ring of pixel buffers
+ * that are recycled from frame to frame rather than allocated for each. */
+typedef struct _MMScreenStream MMScreenStream;
+typedef MMScreenStream *MMScreenStreamRef;
+
+/* Starts grabbing |rect| of the display about |fps| times a second into a ring
+ * of |bufferCount| buffers (at least 2).
+ *
+ * Returns NULL if the stream could not be started; follows the Create Rule
+ * (that is, the caller is responsible for destroying it with
+ * destroyMMScreenStream()). */
+MMScreenStreamRef createMMScreenStream(MMRect rect, double fps,
+                                       size_t bufferCount);
+
+/* Stops grabbing and releases |stream|. Frames already returned by
+ * MMScreenStreamNextFrame() stay valid; the buffers are freed once the last
+ * of them has been destroyed. */
+void destroyMMScreenStream(MMScreenStreamRef stream);
+
+/* Stops grabbing without releasing |stream|, waking any thread waiting in
+ * MMScreenStreamNextFrame(); from then on MMScreenStreamNextFrame() fails
+ * with kMMScreenStreamStoppedError. |stream| must still be destroyed with
+ * destroyMMScreenStream(), but only once nothing is waiting on it. */
+void MMScreenStreamStop(MMScreenStreamRef stream);
+
+/* Waits for the next screengrab and returns it as a new MMBitmap (to be
+ * destroy()'d by the caller) whose image buffer is one of the ring's;
+ * destroying the bitmap hands the buffer back to the stream.
+ *
+ * Frames are returned in the order they were grabbed. If they are not
+ * collected as fast as they are grabbed, the oldest uncollected frame is
+ * overwritten (see MMScreenStreamDroppedCount()).
+ *
+ * Returns NULL on error, and sets |error| to the error code if it is non-NULL.
+ * In particular, this fails rather than blocking forever if every buffer is
+ * held by a frame that has not been destroyed. */
+MMBitmapRef MMScreenStreamNextFrame(MMScreenStreamRef stream,
+                                    MMScreenStreamError *error);
+
+/* Returns the number of frames that were overwritten before being
+ * collected. */
+size_t MMScreenStreamDroppedCount(MMScreenStreamRef stream);
+
+/* Returns description of given MMScreenStreamError. */
+const char *MMScreenStreamErrorString(MMScreenStreamError err);
+
+#endif /* SCREENSTREAM_H */
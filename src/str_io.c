@@ -50,12 +50,34 @@ static bool getSizeFromString(const uint8_t *buf, size_t buflen,
                               size_t *width, size_t *height,
                               size_t *len);
 
+/* Input for zlib_decompress_stream_into(): the base64 encoded data following
+ * the header, decoded a chunk at a time. */
+struct encodedInput {
+	const uint8_t *buffer;
+	size_t buflen;
+	base64_decoder decoder;
+};
+
+static size_t readEncodedInput(void *info, uint8_t *buf, size_t buflen)
+{
+	struct encodedInput *input = info;
+	size_t consumed;
+	const size_t len = base64decoder_decode(&(input->decoder),
+	                                        input->buffer, input->buflen,
+	                                        buf, buflen, &consumed);
+	input->buffer += consumed;
+	input->buflen -= consumed;
+	return len;
+}
+
 MMBitmapRef createMMBitmapFromString(const uint8_t *buffer, size_t buflen,
                                      MMBMPStringError *err)
 {
-	uint8_t *decoded, *decompressed;
+	uint8_t *imageBuffer;
+	struct encodedInput input;
 	size_t width, height;
 	size_t len, bytewidth;
+	MMBitmapRef bitmap;
 
 	if (*buffer++ != 'b' || !getSizeFromString(buffer, --buflen,
 	                                           &width, &height, &len)) {
@@ -65,29 +87,36 @@ MMBitmapRef createMMBitmapFromString(const uint8_t *buffer, size_t buflen,
 	buffer += len;
 	buflen -= len;
 
-	decoded = base64decode(buffer, buflen, NULL);
-	if (decoded == NULL) {
-		if (err != NULL) *err = kMMBMPStringDecodeError;
+	bytewidth = width * STR_BYTES_PER_PIXEL; /* Note that bytewidth is NOT
+	                                          * aligned to a padding. */
+
+	/* The header gives the exact size of the pixel data, so it can be
+	 * allocated once and inflated into directly, decoding the base64 as the
+	 * inflater asks for it. */
+	imageBuffer = malloc(height * bytewidth);
+	if (imageBuffer == NULL) {
+		if (err != NULL) *err = kMMBMPStringGenericError;
 		return NULL;
 	}
 
-	decompressed = zlib_decompress(decoded, &len);
-	free(decoded);
-
-	if (decompressed == NULL) {
+	input.buffer = buffer;
+	input.buflen = buflen;
+	base64decoder_init(&(input.decoder));
+	if (zlib_decompress_stream_into(&readEncodedInput, &input,
+	                                imageBuffer, height * bytewidth) != 0) {
+		free(imageBuffer);
 		if (err != NULL) *err = kMMBMPStringDecompressError;
 		return NULL;
 	}
 
-	bytewidth = width * STR_BYTES_PER_PIXEL; /* Note that bytewidth is NOT
-	                                          * aligned to a padding. */
-	if (height * bytewidth != len) {
-		if (err != NULL) *err = kMMBMPStringSizeError;
-		return NULL;
+	bitmap = createMMBitmap(imageBuffer, width, height,
+	                        bytewidth, STR_BITS_PER_PIXEL, STR_BYTES_PER_PIXEL);
+	if (bitmap == NULL) {
+		free(imageBuffer);
+		if (err != NULL) *err = kMMBMPStringGenericError;
 	}
 
-	return createMMBitmap(decompressed, width, height,
-	                      bytewidth, STR_BITS_PER_PIXEL, STR_BYTES_PER_PIXEL);
+	return bitmap;
 }
 
 /* Returns bitmap data suitable for encoding to a string; that is, 24-bit BGR
@@ -97,3 +97,82 @@ error:
 	if (output != NULL) free(output);
 	return NULL;
 }
+
+size_t zlib_compress_bound(size_t buflen)
+{
+	return (size_t)compressBound((uLong)buflen);
+}
+
+size_t zlib_compress_into(const uint8_t *buf, size_t buflen, int level,
+                          uint8_t *output, size_t outlen)
+{
+	uLongf len = (uLongf)outlen;
+
+	/* Sanity check */
+	assert(buf != NULL);
+	assert(output != NULL);
+	assert(level <= 9 && level >= 0);
+
+	if (compress2((Bytef *)output, &len, (const Bytef *)buf, (uLong)buflen,
+	              level) != Z_OK) {
+		return 0;
+	}
+
+	return (size_t)len;
+}
+
+int zlib_decompress_into(const uint8_t *buf, size_t buflen,
+                         uint8_t *output, size_t outlen)
+{
+	uLongf len = (uLongf)outlen;
+
+	/* Sanity check */
+	assert(buf != NULL);
+	assert(output != NULL);
+
+	/* uncompress() fails with Z_BUF_ERROR if the output is too small. */
+	if (uncompress((Bytef *)output, &len, (const Bytef *)buf,
+	               (uLong)buflen) != Z_OK || len != (uLongf)outlen) {
+		return -1;
+	}
+
+	return 0;
+}
+
+int zlib_decompress_stream_into(zlib_read_func read, void *info,
+                                uint8_t *output, size_t outlen)
+{
+	uint8_t input[ZLIB_CHUNK];
+	int err = Z_OK;
+	z_stream zst;
+
+	/* Sanity check */
+	assert(read != NULL);
+	assert(output != NULL);
+
+	/* Set inflate state */
+	zst.zalloc = Z_NULL;
+	zst.zfree = Z_NULL;
+	zst.opaque = Z_NULL;
+	zst.next_in = Z_NULL;
+	zst.avail_in = 0;
+	zst.next_out = (Byte *)output;
+	zst.avail_out = (uInt)outlen;
+
+	if (inflateInit(&zst) != Z_OK) return -1;
+
+	/* Decompress straight into the output buffer, reading more input
+	 * whenever it runs out. */
+	do {
+		if (zst.avail_in == 0) {
+			zst.avail_in = (uInt)read(info, input, sizeof(input));
+			zst.next_in = (Byte *)input;
+			if (zst.avail_in == 0) break; /* Input ended early. */
+		}
+
+		err = inflate(&zst, Z_NO_FLUSH);
+	} while (err == Z_OK);
+
+	inflateEnd(&zst);
+	return (err == Z_STREAM_END && zst.total_out == outlen) ? 0 : -1;
+}
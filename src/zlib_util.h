@@ -29,4 +29,40 @@ uint8_t *zlib_decompress(const uint8_t *buf, size_t *len);
 uint8_t *zlib_compress(const uint8_t *buf, const size_t buflen, int level,
                        size_t *len);
 
+/* Returns the largest number of bytes zlib_compress_into() can produce from a
+ * buffer of |buflen| bytes. */
+size_t zlib_compress_bound(size_t buflen);
+
+/* Like zlib_compress(), but compresses into |output|, which has room for
+ * |outlen| bytes (at least zlib_compress_bound(|buflen|) to be sure it is
+ * large enough).
+ *
+ * Returns the number of bytes written to |output|, or 0 on error. */
+size_t zlib_compress_into(const uint8_t *buf, size_t buflen, int level,
+                          uint8_t *output, size_t outlen);
+
+/* Decompresses the |buflen| bytes at |buf| into |output|, which must be
+ * exactly the size of the decompressed data, |outlen|. This avoids any
+ * reallocation when that size is known ahead of time.
+ *
+ * Returns 0 on success, or -1 on error or if the decompressed data is not
+ * |outlen| bytes long. */
+int zlib_decompress_into(const uint8_t *buf, size_t buflen,
+                         uint8_t *output, size_t outlen);
+
+/* Callback supplying compressed input to zlib_decompress_stream_into().
+ * Should copy up to |buflen| bytes into |buf| and return how many were
+ * copied, or 0 if there is no more input. */
+typedef size_t (*zlib_read_func)(void *info, uint8_t *buf, size_t buflen);
+
+/* Like zlib_decompress_into(), but reads the compressed data a piece at a
+ * time by calling |read| with |info|, so that it never needs to be held in
+ * memory all at once. Any input after the end of the compressed data is
+ * ignored.
+ *
+ * Returns 0 on success, or -1 on error or if the decompressed data is not
+ * |outlen| bytes long. */
+int zlib_decompress_stream_into(zlib_read_func read, void *info,
+                                uint8_t *output, size_t outlen);
+
 #endif /* ZLIB_UTIL_H */